@@ -9,19 +9,23 @@ import datetime
 import shutil
 import time
 import ConfigParser
+import cPickle
 import traceback
 import select
 import signal
 import socket
 import logging
 import threading
-import urllib
-import urlparse
-import saliweb.web_service
 import saliweb.backend.events
 import saliweb.backend.sge
+import saliweb.backend.cluster
+import saliweb.backend.slurm
+import saliweb.backend.joblog
+import saliweb.backend.resultcache
+import saliweb.backend.submitter
+import saliweb.backend.stats
 from saliweb.backend.events import _JobThread
-from email.MIMEText import MIMEText
+from saliweb.backend.cluster import _CellRegistry
 
 # Version check; we need 2.4 for subprocess, decorators, generator expressions
 if sys.version_info[0:2] < [2, 4]:
@@ -38,6 +42,13 @@ class RunnerError(Exception):
     pass
 
 
+class TransientRunnerError(RunnerError):
+    """Exception raised if the runner failed to run a job for a reason that
+       is probably temporary (e.g. the cluster could not be contacted, or a
+       node went down), so that the job may well succeed if run again."""
+    pass
+
+
 class StateFileError(Exception):
     "Exception raised if a previous run is still running or crashed."""
     pass
@@ -97,6 +108,65 @@ def _make_daemon():
     os.dup2(0, 2)
 
 
+# DRMAA exceptions that mean the cluster could not be contacted, rather
+# than that something is wrong with the job
+_TRANSIENT_DRMAA_ERRORS = ('DrmCommunicationException', 'TryLaterException')
+
+
+def _is_transient_error(detail):
+    """Return True if the exception `detail` means that a job failed to run
+       because of a temporary problem with the cluster, rather than with
+       the job itself, so that it is worth running it again."""
+    return isinstance(detail, TransientRunnerError) \
+           or type(detail).__name__ in _TRANSIENT_DRMAA_ERRORS
+
+
+def _is_status_error(detail):
+    """Return True if the exception `detail` means that the status of a
+       running job could not be queried (e.g. qstat failed), so that it is
+       worth checking again later."""
+    return not isinstance(detail, TransientRunnerError) \
+           and (isinstance(detail, (OSError, IOError))
+                or type(detail).__name__ in _TRANSIENT_DRMAA_ERRORS)
+
+
+# Job states in which a job may go on to produce reusable results
+_IN_FLIGHT_STATES = ('PREPROCESSING', 'RUNNING', 'POSTPROCESSING',
+                     'FINALIZING')
+
+
+def _get_directory_usage(directory):
+    """Get the disk usage of the given directory and everything under it,
+       as a (bytes, files) tuple. Symbolic links are not followed."""
+    size = nfiles = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for f in filenames:
+            try:
+                s = os.lstat(os.path.join(dirpath, f))
+            except OSError:
+                continue  # file was removed while we were walking
+            # Count allocated blocks if we can, since that is what counts
+            # towards the disk quota
+            if hasattr(s, 'st_blocks'):
+                size += s.st_blocks * 512
+            else:
+                size += s.st_size
+            nfiles += 1
+    return size, nfiles
+
+
+def _notify_incoming(config, name):
+    """Wake up the web service and let it know a new incoming job
+       is present."""
+    try:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(config.socket)
+        s.send("INCOMING %s" % name)
+        s.close()
+    except socket.error:
+        pass
+
+
 class _JobState(object):
     """Simple state machine for jobs."""
     # Only add new states to the *end* of this list, since the ordering
@@ -202,22 +272,187 @@ class _DelayFileStream(object):
             self.stream.flush()
 
 
+_log_formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+
+# Job context of the hook currently running in each thread
+_current_job_context = threading.local()
+
+# Serialize use of the process-wide working directory by hooks that need it
+_chdir_lock = threading.RLock()
+
+
+# Held while adding the _JobLogHandler to a service logger
+_job_log_lock = threading.Lock()
+
+
+class _JobContext(object):
+    """Information needed to run a job method (hook) without relying on
+       the process-wide working directory, so that hooks for different jobs
+       can safely run in different threads. It holds the job `directory`,
+       the `log_handler` for the job, and a file descriptor for the
+       directory, `dirfd`, which is opened on first use."""
+
+    def __init__(self, directory, log_handler):
+        self.directory = directory
+        self.log_handler = log_handler
+        self._dirfd = None
+
+    def _get_dirfd(self):
+        if self._dirfd is None:
+            self._dirfd = os.open(self.directory, os.O_RDONLY)
+        return self._dirfd
+    dirfd = property(_get_dirfd, doc="File descriptor for the job directory")
+
+    def path(self, *names):
+        """Get the full path to a file in the job directory"""
+        return os.path.join(self.directory, *names)
+
+    def close(self):
+        if self._dirfd is not None:
+            os.close(self._dirfd)
+            self._dirfd = None
+
+
+def _get_job_context():
+    """Get the context of the job method running in this thread, or None"""
+    return getattr(_current_job_context, 'context', None)
+
+
+class _JobLogHandler(logging.Handler):
+    """Log handler that passes each record to the log handler of the job
+       method running in the current thread, if any. A single instance is
+       added to each service's shared logger, so that job methods for
+       different jobs can log at the same time."""
+
+    def emit(self, record):
+        context = _get_job_context()
+        if context is not None:
+            hdlr = context.log_handler
+            if record.levelno >= hdlr.level:
+                hdlr.handle(record)
+
+
+def _get_service_logger(service_name):
+    """Get the shared logger for the given service, which sends messages
+       logged by job methods to their own job's log handler"""
+    logger = logging.getLogger(service_name)
+    _job_log_lock.acquire()
+    try:
+        if not [h for h in logger.handlers if isinstance(h, _JobLogHandler)]:
+            logger.addHandler(_JobLogHandler())
+    finally:
+        _job_log_lock.release()
+    return logger
+
+
+def _get_job_directory():
+    """Get the directory of the job method running in this thread, falling
+       back to the current working directory if there is none (e.g. when
+       a :class:`Runner` is created outside of a job method)."""
+    context = _get_job_context()
+    if context is None:
+        return os.getcwd()
+    else:
+        return context.directory
+
+
 class Config(object):
     """This class holds configuration information such as directory
        locations, etc. `fh` is either a filename or a file handle from which
        the configuration is read."""
     _mailer = '/usr/sbin/sendmail'
+    _mail_queue = None
+    # If set, a directory in which to cache configuration read from files.
+    # This is set only for the installed web service (see the webservice.py
+    # script generated by the build system), never for configuration read
+    # from a source tree.
+    _cache_dir = None
 
     def __init__(self, fh):
         config = ConfigParser.SafeConfigParser()
         if not hasattr(fh, 'read'):
             self._config_dir = os.path.dirname(os.path.abspath(fh))
+            if self._cache_dir and self._load_cache(fh):
+                return
             config.readfp(open(fh), fh)
-            fh = open(fh)
+            self.populate(config)
+            if self._cache_dir:
+                self._save_cache(fh)
         else:
             self._config_dir = None
             config.readfp(fh)
-        self.populate(config)
+            self.populate(config)
+
+    def _get_cache_file(self, filename):
+        """Get the name of the file used to cache the configuration
+           read from `filename`."""
+        return os.path.join(self._cache_dir,
+                            '%s.cache' % os.path.basename(filename))
+
+    def _get_cache_key(self, filename):
+        """Get a key which changes whenever a cached copy of the
+           configuration read from `filename` may be out of date; i.e. if
+           the file itself, or the code used to parse it, changes."""
+        def get_file_key(f):
+            st = os.stat(f)
+            return (os.path.abspath(f), st.st_mtime, st.st_size)
+        cls = type(self)
+        key = [cls.__module__, cls.__name__, get_file_key(filename)]
+        for f in (__file__,
+                  getattr(sys.modules.get(cls.__module__), '__file__', None)):
+            # Module paths may be relative to a directory we are no longer in
+            try:
+                key.append(get_file_key(f))
+            except (OSError, TypeError):
+                key.append(None)
+        return key
+
+    def _load_cache(self, filename):
+        """Try to populate this object from a previously cached copy of
+           the configuration read from `filename`, to save parsing the
+           file again. Return True on success."""
+        try:
+            fh = open(self._get_cache_file(filename), 'rb')
+        except IOError:
+            return False
+        try:
+            # Don't trust a cache written by somebody else
+            if os.fstat(fh.fileno()).st_uid != os.getuid():
+                return False
+            try:
+                key, state = cPickle.load(fh)
+            except Exception:
+                return False
+        finally:
+            fh.close()
+        try:
+            if key != self._get_cache_key(filename):
+                return False
+        except OSError:
+            return False
+        self.__dict__.update(state)
+        return True
+
+    def _save_cache(self, filename):
+        """Cache the configuration read from `filename`, if possible, so
+           that it can be quickly reloaded (e.g. by admin tools)."""
+        cache = self._get_cache_file(filename)
+        tmp = '%s.%d' % (cache, os.getpid())
+        try:
+            data = cPickle.dumps((self._get_cache_key(filename),
+                                  self.__dict__), cPickle.HIGHEST_PROTOCOL)
+            fh = open(tmp, 'wb')
+            try:
+                fh.write(data)
+            finally:
+                fh.close()
+            os.rename(tmp, cache)
+        except (EnvironmentError, cPickle.PicklingError, TypeError):
+            # Not being able to cache the configuration is not fatal
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
 
     def populate(self, config):
         """Populate data structures using the passed `config`, which is a
@@ -229,6 +464,8 @@ class Config(object):
         self._populate_oldjobs(config)
         self._populate_backend(config)
         self._populate_limits(config)
+        self._populate_pool(config)
+        self._populate_retry(config)
         self._populate_frontends(config)
         self.socket = config.get('general', 'socket')
         self.admin_email = config.get('general', 'admin_email')
@@ -247,18 +484,17 @@ class Config(object):
         """Send an email to the given user or list of users (`to`), with
            the given `subject` and `body`. `body` can either be the text
            itself, or an object from the Python email module (e.g. MIMEText,
-           MIMEMultipart)."""
+           MIMEMultipart).
+           While the backend is running, email is queued and sent in
+           the background."""
         if not isinstance(to, (list, tuple)):
             to = [to]
         elif not isinstance(to, list):
             to = list(to)
-        if hasattr(body, 'as_string'):
-            msg = body
-        else:
-            msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = self.admin_email
-        msg['To'] = ", ".join(to)
+        msg = self._make_email(to, subject, body)
+        if self._mail_queue is not None:
+            self._mail_queue.put(to, msg)
+            return
 
         # Send email via sendmail binary
         p = subprocess.Popen([self._mailer, '-oi'] + to,
@@ -267,6 +503,42 @@ class Config(object):
         p.stdin.close()
         p.wait()  # ignore return code for now
 
+    def _make_email(self, to, subject, body):
+        if not isinstance(to, (list, tuple)):
+            to = [to]
+        if hasattr(body, 'as_string'):
+            msg = body
+        else:
+            from email.MIMEText import MIMEText
+            msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.admin_email
+        msg['To'] = ", ".join(to)
+        return msg
+
+    def _send_job_failure_email(self, jobname, subject, body, error):
+        """Notify the admin that a job failed with the given `error`. While
+           the backend is running, multiple failures in a short period are
+           grouped into a single digest email."""
+        if self._mail_queue is not None:
+            self._mail_queue.add_failure(jobname, subject, body, error)
+        else:
+            self.send_admin_email(subject, body)
+
+    def _start_mail_queue(self):
+        """Start sending email in the background"""
+        import saliweb.backend.mailer
+        self._mail_queue = saliweb.backend.mailer._MailQueue(self,
+                                 self.backend['failure_digest_minutes'] * 60)
+        self._mail_queue.start()
+
+    def _stop_mail_queue(self):
+        """Send any queued email, and go back to sending email immediately"""
+        if self._mail_queue is not None:
+            q = self._mail_queue
+            self._mail_queue = None
+            q.stop()
+
     def _populate_database(self, config):
         self.database = {}
         self.database['db'] = config.get('database', 'db')
@@ -290,6 +562,44 @@ class Config(object):
             self.limits['concurrent_tasks'] = config.getint('limits',
                                                             'concurrent_tasks')
 
+    def _populate_pool(self, config):
+        self.pool = {'workers': None, 'max_tasks_per_worker': 100,
+                     'memory_limit': None, 'preload': []}
+        if config.has_option('pool', 'workers'):
+            self.pool['workers'] = config.getint('pool', 'workers')
+        if config.has_option('pool', 'max_tasks_per_worker'):
+            self.pool['max_tasks_per_worker'] = config.getint('pool',
+                                                      'max_tasks_per_worker')
+            if self.pool['max_tasks_per_worker'] <= 0:
+                self.pool['max_tasks_per_worker'] = None
+        if config.has_option('pool', 'memory_limit'):
+            self.pool['memory_limit'] = self._get_size(config, 'pool',
+                                                       'memory_limit')
+        if config.has_option('pool', 'preload'):
+            self.pool['preload'] = [x.strip() for x in
+                                    config.get('pool', 'preload').split(',')
+                                    if x.strip()]
+
+    def _populate_retry(self, config):
+        self.retry = {'max_attempts': 0, 'backoff_seconds': 60.,
+                      'max_backoff_seconds': 3600.}
+        if config.has_option('retry', 'max_attempts'):
+            self.retry['max_attempts'] = config.getint('retry',
+                                                       'max_attempts')
+        for key in ('backoff_seconds', 'max_backoff_seconds'):
+            if config.has_option('retry', key):
+                self.retry[key] = config.getfloat('retry', key)
+
+    def _get_notify_address(self):
+        """Get the address that running jobs should use to tell the backend
+           that they finished: a (host, port) tuple if notify_port is set,
+           otherwise the path to the service socket (which only works for
+           jobs that run on the same machine as the backend)."""
+        if self.backend['notify_port'] is not None:
+            return (self.backend['notify_host'], self.backend['notify_port'])
+        else:
+            return self.socket
+
     def _read_db_auth(self, end='back'):
         filename = self.database[end + 'end_config']
         config = ConfigParser.SafeConfigParser()
@@ -331,6 +641,68 @@ class Config(object):
         self.backend['check_minutes'] = config.getint('backend',
                                                       'check_minutes')
         self.backend['user'] = config.get('backend', 'user')
+        if config.has_option('backend', 'watch_job_state'):
+            self.backend['watch_job_state'] = config.getboolean('backend',
+                                                           'watch_job_state')
+        else:
+            self.backend['watch_job_state'] = False
+        if config.has_option('backend', 'watch_poll_seconds'):
+            self.backend['watch_poll_seconds'] = config.getfloat('backend',
+                                                         'watch_poll_seconds')
+        else:
+            self.backend['watch_poll_seconds'] = 5.
+        if config.has_option('backend', 'notify_port'):
+            self.backend['notify_port'] = config.getint('backend',
+                                                        'notify_port')
+        else:
+            self.backend['notify_port'] = None
+        if config.has_option('backend', 'notify_host'):
+            self.backend['notify_host'] = config.get('backend', 'notify_host')
+        else:
+            self.backend['notify_host'] = socket.getfqdn()
+        if config.has_option('backend', 'failure_digest_minutes'):
+            self.backend['failure_digest_minutes'] = config.getint('backend',
+                                                    'failure_digest_minutes')
+        else:
+            self.backend['failure_digest_minutes'] = 5
+        if config.has_option('backend', 'submit_threads'):
+            self.backend['submit_threads'] = config.getint('backend',
+                                                           'submit_threads')
+        else:
+            self.backend['submit_threads'] = 0
+        if config.has_option('backend', 'submit_window'):
+            self.backend['submit_window'] = config.getint('backend',
+                                                          'submit_window')
+        else:
+            self.backend['submit_window'] = 10
+        if config.has_option('backend', 'batch_size'):
+            self.backend['batch_size'] = config.getint('backend', 'batch_size')
+        else:
+            self.backend['batch_size'] = 0
+        if config.has_option('backend', 'track_disk_usage'):
+            self.backend['track_disk_usage'] = config.getboolean('backend',
+                                                          'track_disk_usage')
+        else:
+            self.backend['track_disk_usage'] = False
+        if self.oldjobs.get('archive_size') is not None \
+           and not self.backend['track_disk_usage']:
+            raise ConfigError("archive_size can only be used if "
+                              "track_disk_usage is also turned on")
+        if config.has_option('backend', 'result_cache'):
+            self.backend['result_cache'] = config.getboolean('backend',
+                                                             'result_cache')
+        else:
+            self.backend['result_cache'] = False
+        if config.has_option('backend', 'result_cache_size'):
+            self.backend['result_cache_size'] = self._get_size(config,
+                                                'backend', 'result_cache_size')
+        else:
+            self.backend['result_cache_size'] = None
+        if config.has_option('backend', 'result_cache_age'):
+            self.backend['result_cache_age'] = self._get_time_delta(config,
+                                                'backend', 'result_cache_age')
+        else:
+            self.backend['result_cache_age'] = None
 
     def _populate_frontends(self, config):
         self.frontends = {}
@@ -352,6 +724,28 @@ class Config(object):
                               "expire time (%s)" \
                               % (config.get('oldjobs', 'archive'),
                                  config.get('oldjobs', 'expire')))
+        if config.has_option('oldjobs', 'archive_size'):
+            self.oldjobs['archive_size'] = self._get_size(config, 'oldjobs',
+                                                          'archive_size')
+        else:
+            self.oldjobs['archive_size'] = None
+
+    def _get_size(self, config, section, option):
+        raw = config.get(section, option)
+        multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+                       'T': 1024 ** 4}
+        try:
+            if raw.upper() == 'NEVER':
+                return None
+            elif raw[-1:].upper() in multipliers:
+                return int(float(raw[:-1]) * multipliers[raw[-1:].upper()])
+            else:
+                return int(raw)
+        except ValueError:
+            raise ValueError("Sizes must be 'NEVER' or numbers optionally "
+                             "followed by K, M, G or T (for kilobytes, "
+                             "megabytes, gigabytes or terabytes), e.g. "
+                             "500M, 2G; got " + raw)
 
     def _get_time_delta(self, config, section, option):
         raw = config.get(section, option)
@@ -441,10 +835,26 @@ class Database(object):
     """
     _jobtable = 'jobs'
     _dependtable = 'dependencies'
+    _cachetable = 'result_cache'
 
     def __init__(self, jobcls):
         self._jobcls = jobcls
+        self._conn = None
+        self._in_batch = False
+        self._streaming_cursor = None
+        # Daemon statistics to update as jobs change, if any
+        self._stats = None
         self._fields = []
+        self._result_cache = False
+        # Set up fields for result cache table
+        self._cachefields = [MySQLField('input_hash', 'CHAR(40)',
+                                        key='PRIMARY', null=False),
+                             MySQLField('name', 'VARCHAR(40)', null=False),
+                             MySQLField('disk_usage', 'BIGINT'),
+                             MySQLField('created', 'DATETIME', null=False),
+                             MySQLField('last_used', 'DATETIME', null=False),
+                             MySQLField('hits', 'INTEGER', null=False,
+                                        default='0')]
         # Set up fields for dependencies table
         self._dependfields = [MySQLField('child', 'VARCHAR(40)', index=True,
                                          null=False),
@@ -482,26 +892,97 @@ class Database(object):
         """Add extra fields to support tracking the user's hostname"""
         self.add_field(MySQLField('hostname', 'VARCHAR(400)'))
 
+    def set_track_disk_usage(self):
+        """Add extra fields to support tracking the disk usage (total size
+           in bytes, and number of files) of each job directory"""
+        self.add_field(MySQLField('disk_usage', 'BIGINT'))
+        self.add_field(MySQLField('disk_files', 'INTEGER'))
+
+    def set_retry(self):
+        """Add extra fields to support retrying jobs that fail because of
+           a temporary problem with the cluster"""
+        self.add_field(MySQLField('retry_count', 'INTEGER', null=False,
+                                  default=0))
+
+    def set_result_cache(self):
+        """Add extra fields, and a table of cached results, to support
+           reusing the results of earlier jobs with identical inputs
+           (see :meth:`Job.get_cache_inputs`)"""
+        self.add_field(MySQLField('input_hash', 'CHAR(40)', index=True))
+        self._result_cache = True
+
+    def _add_optional_fields(self, config):
+        """Add any extra fields requested by the configuration file."""
+        if config.track_hostname:
+            self.set_track_hostname()
+        if config.backend.get('track_disk_usage', False):
+            self.set_track_disk_usage()
+        if config.backend.get('result_cache', False):
+            self.set_result_cache()
+        if config.retry['max_attempts'] > 0:
+            self.set_retry()
+
     def _connect(self, config):
         """Set up the connection to the database. Usually called from the
-           :class:`WebService` object."""
-        import MySQLdb
-        self._OperationalError = MySQLdb.OperationalError
+           :class:`WebService` object. The connection is not actually made
+           until it is first used, so that tools that never query the
+           database do not pay for it."""
         self._placeholder = '%s'
         self.config = config
-        self.conn = MySQLdb.connect(user=config.database['user'],
-                                    db=config.database['db'],
-                                    unix_socket=config.database['socket'],
-                                    passwd=config.database['passwd'])
-        c = self.conn.cursor()
+        self._conn = None
+
+    def _open_connection(self):
+        """Connect to the MySQL server. Called on first use of the
+           `conn` attribute."""
+        import MySQLdb
+        self._OperationalError = MySQLdb.OperationalError
+        try:
+            import MySQLdb.cursors
+            self._streaming_cursor = MySQLdb.cursors.SSCursor
+        except (ImportError, AttributeError):
+            self._streaming_cursor = None
+        config = self.config
+        conn = MySQLdb.connect(user=config.database['user'],
+                               db=config.database['db'],
+                               unix_socket=config.database['socket'],
+                               passwd=config.database['passwd'])
+        c = conn.cursor()
         # Make sure that our SELECTs see jobs added by the frontend
         c.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        return conn
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = self._open_connection()
+        return self._conn
+    def _set_conn(self, conn):
+        self._conn = conn
+    conn = property(_get_conn, _set_conn,
+                    doc="Connection to the database, opened on first use")
+
+    def _commit(self):
+        """Commit the current transaction, unless a batch is in progress
+           (see :meth:`_begin_batch`)."""
+        if not self._in_batch:
+            self.conn.commit()
+
+    def _begin_batch(self):
+        """Start a batch of job updates. Until :meth:`_end_batch` is called,
+           changes are not committed, so that many jobs can be updated
+           (e.g. by the admin tools) in a single transaction."""
+        self._in_batch = True
+
+    def _end_batch(self):
+        """Finish a batch of job updates, and commit all of them."""
+        self._in_batch = False
+        self.conn.commit()
 
     def _drop_tables(self):
         """Drop all tables in the database used to hold job state."""
         c = self.conn.cursor()
         c.execute('DROP TABLE IF EXISTS ' + self._jobtable)
         c.execute('DROP TABLE IF EXISTS ' + self._dependtable)
+        c.execute('DROP TABLE IF EXISTS ' + self._cachetable)
         self.conn.commit()
 
     def _delete_tables(self):
@@ -509,6 +990,8 @@ class Database(object):
         c = self.conn.cursor()
         c.execute('DELETE FROM ' + self._jobtable)
         c.execute('DELETE FROM ' + self._dependtable)
+        if self._result_cache:
+            c.execute('DELETE FROM ' + self._cachetable)
         self.conn.commit()
 
     def _create_tables(self):
@@ -523,13 +1006,26 @@ class Database(object):
 
         schema = ', '.join(x.get_schema() for x in self._dependfields)
         c.execute('CREATE TABLE %s (%s)' % (self._dependtable, schema))
+
+        if self._result_cache:
+            schema = ', '.join(x.get_schema() for x in self._cachefields)
+            c.execute('CREATE TABLE %s (%s)' % (self._cachetable, schema))
         self.conn.commit()
 
-    def _execute(self, query, args=()):
+    def _get_cursor(self, stream):
+        if stream and self._streaming_cursor is not None:
+            return self.conn.cursor(self._streaming_cursor)
+        else:
+            return self.conn.cursor()
+
+    def _execute(self, query, args=(), stream=False):
         """Open a database cursor and execute the given query. The cursor
            object is returned. If the connection to the database has been
-           lost, try to restablish it."""
-        c = self.conn.cursor()
+           lost, try to restablish it.
+           If `stream` is True, a server-side cursor is used if possible,
+           so that rows are not all read into memory at once; all rows must
+           then be read before the next query is made."""
+        c = self._get_cursor(stream)
         try:
             c.execute(query, args)
         except self._OperationalError as err:
@@ -539,7 +1035,7 @@ class Database(object):
             if hasattr(err, 'args') and isinstance(err.args, tuple) \
                and len(err.args) >= 1 and err.args[0] == 2006:
                 self._connect(self.config)
-                c = self.conn.cursor()
+                c = self._get_cursor(stream)
                 c.execute(query, args)
             else:
                 raise
@@ -551,6 +1047,105 @@ class Database(object):
                           % (self._jobtable, self._placeholder), (state,))
         return c.fetchone()[0]
 
+    def _get_disk_usage_by_state(self):
+        """Get the total disk usage of all jobs in each job state.
+           This is returned as a dict of state:(bytes, files) pairs.
+           Disk usage tracking must be turned on for this to work."""
+        usage = {}
+        c = self._execute('SELECT state, SUM(disk_usage), SUM(disk_files) '
+                          'FROM %s GROUP BY state' % self._jobtable)
+        for state, size, nfiles in c:
+            usage[state] = (int(size or 0), int(nfiles or 0))
+        return usage
+
+    def _get_top_disk_usage(self, limit, state=None):
+        """Get the `limit` jobs that use the most disk space (optionally
+           only those in the given job state), as a list of
+           (name, state, bytes, files) tuples, largest first.
+           Disk usage tracking must be turned on for this to work."""
+        query = 'SELECT name, state, disk_usage, disk_files FROM ' \
+                + self._jobtable + ' WHERE disk_usage IS NOT NULL'
+        params = []
+        if state is not None:
+            query += ' AND state=' + self._placeholder
+            params.append(state)
+        query += ' ORDER BY disk_usage DESC LIMIT %d' % limit
+        c = self._execute(query, params)
+        return [(name, s, int(size), int(nfiles or 0))
+                for name, s, size, nfiles in c]
+
+    def _count_jobs_with_input_hash(self, input_hash, states):
+        """Return a count of all the jobs in any of the given job states
+           that have the given input hash."""
+        query = 'SELECT COUNT(*) FROM %s WHERE input_hash=%s AND state IN ' \
+                '(%s)' % (self._jobtable, self._placeholder,
+                          ', '.join([self._placeholder] * len(states)))
+        c = self._execute(query, [input_hash] + list(states))
+        return c.fetchone()[0]
+
+    def _get_cached_result(self, input_hash):
+        """Look up a COMPLETED job whose results can be reused for a job
+           with the given input hash. If one is found, its (name, directory)
+           is returned and the cache entry is marked as used; otherwise,
+           None is returned."""
+        query = 'SELECT j.name, j.directory FROM %s c, %s j WHERE ' \
+                'c.input_hash=%s AND j.name=c.name AND j.state=%s' \
+                % (self._cachetable, self._jobtable, self._placeholder,
+                   self._placeholder)
+        c = self._execute(query, (input_hash, 'COMPLETED'))
+        row = c.fetchone()
+        if row is None:
+            return None
+        query = 'UPDATE %s SET last_used=UTC_TIMESTAMP(), hits=hits+1 ' \
+                'WHERE input_hash=%s' % (self._cachetable, self._placeholder)
+        self._execute(query, (input_hash,))
+        self._commit()
+        return tuple(row)
+
+    def _add_cached_result(self, input_hash, name, disk_usage):
+        """Make the results of the named job available for reuse by later
+           jobs with the given input hash, replacing any existing entry."""
+        query = 'REPLACE INTO %s (input_hash, name, disk_usage, created, ' \
+                'last_used, hits) VALUES (%s, %s, %s, UTC_TIMESTAMP(), ' \
+                'UTC_TIMESTAMP(), 0)' \
+                % ((self._cachetable,) + (self._placeholder,) * 3)
+        self._execute(query, (input_hash, name, disk_usage))
+        self._commit()
+
+    def _evict_cached_results(self, max_size=None, max_age=None):
+        """Remove entries from the result cache whose jobs are no longer
+           COMPLETED (e.g. because they were archived), entries older than
+           `max_age` (a timedelta) and, if the total size of the cached
+           results exceeds `max_size` bytes, the least recently used entries.
+           Return the number of entries removed."""
+        c = self._execute('DELETE FROM %s WHERE name NOT IN (SELECT name '
+                          'FROM %s WHERE state=%s)'
+                          % (self._cachetable, self._jobtable,
+                             self._placeholder), ('COMPLETED',))
+        removed = c.rowcount
+        if max_age is not None:
+            cutoff = datetime.datetime.utcnow() - max_age
+            c = self._execute('DELETE FROM %s WHERE created < %s'
+                              % (self._cachetable, self._placeholder),
+                              (cutoff,))
+            removed += c.rowcount
+        if max_size is not None:
+            c = self._execute('SELECT input_hash, disk_usage FROM %s '
+                              'ORDER BY last_used DESC' % self._cachetable)
+            total = 0
+            evict = []
+            for input_hash, size in c.fetchall():
+                total += size or 0
+                if total > max_size:
+                    evict.append(input_hash)
+            for input_hash in evict:
+                self._execute('DELETE FROM %s WHERE input_hash=%s'
+                              % (self._cachetable, self._placeholder),
+                              (input_hash,))
+            removed += len(evict)
+        self._commit()
+        return removed
+
     def _get_job_dependencies(self):
         """Get all job dependencies.
            This is returned as a dict of child:[parent,...] pairs,
@@ -567,7 +1162,8 @@ class Database(object):
         return depends
 
     def _get_all_jobs_in_state(self, state, name=None, after_time=None,
-                               runner_id=None, order_by=None):
+                               runner_id=None, runner_id_prefix=None,
+                               order_by=None):
         """Get all the jobs in the given job state, as a generator of
            :class:`Job` objects (or a subclass, as given by the `jobcls`
            argument to the :class:`Database` constructor).
@@ -578,6 +1174,8 @@ class Database(object):
            system time are returned.
            If `runner_id` is specified, only jobs which match the given
            runner ID are returned.
+           If `runner_id_prefix` is specified, only jobs whose runner ID
+           starts with the given string are returned.
            If `order_by` is specified, the jobs are returned sorted by the
            given column.
         """
@@ -591,6 +1189,9 @@ class Database(object):
         if runner_id is not None:
             wheres.append('runner_id=' + self._placeholder)
             params.append(runner_id)
+        if runner_id_prefix is not None:
+            wheres.append("runner_id LIKE %s ESCAPE '!'" % self._placeholder)
+            params.append(re.sub('([!%_])', r'!\1', runner_id_prefix) + '%')
         if after_time is not None:
             wheres.append(after_time + ' IS NOT NULL')
             wheres.append(after_time + ' < UTC_TIMESTAMP()')
@@ -606,6 +1207,125 @@ class Database(object):
             metadata = _JobMetadata(fields, row)
             yield self._jobcls(self, metadata, _JobState(state))
 
+    def _get_job_filter(self, states=None, names=None, user=None,
+                        submitted_after=None, submitted_before=None,
+                        name_like=None):
+        """Get SQL WHERE clauses and their parameters that select jobs
+           matching all of the given criteria (see :meth:`_get_jobs`).
+           If `name_like` is given, only jobs whose name matches the given
+           SQL LIKE pattern (using '!' as the escape character)
+           are selected."""
+        wheres = []
+        params = []
+        for col, values in (('state', states), ('name', names)):
+            if values is not None:
+                wheres.append('%s IN (%s)'
+                              % (col, ', '.join([self._placeholder]
+                                                * len(values))))
+                params.extend(values)
+        if user is not None:
+            wheres.append('user=' + self._placeholder)
+            params.append(user)
+        if submitted_after is not None:
+            wheres.append('submit_time >= ' + self._placeholder)
+            params.append(submitted_after)
+        if submitted_before is not None:
+            wheres.append('submit_time < ' + self._placeholder)
+            params.append(submitted_before)
+        if name_like is not None:
+            wheres.append("name LIKE %s ESCAPE '!'" % self._placeholder)
+            params.append(name_like)
+        return wheres, params
+
+    def _list_jobs(self, fields, states, after_name=None, limit=None,
+                   **keys):
+        """Get the given `fields` (a list of column names) of all jobs in
+           any of the given `states` that match the given criteria (see
+           :meth:`_get_job_filter`), as a generator of tuples. Unlike
+           :meth:`_get_jobs`, no :class:`Job` objects are created, and rows
+           are streamed from the database, so this is suitable for listing
+           large numbers of jobs.
+           Jobs are sorted by submit time (and then by name). If
+           `after_name` is given, only jobs that come after the named job
+           in this order are returned. At most `limit` jobs are returned,
+           if given."""
+        if len(states) == 0:
+            return
+        query = 'SELECT ' + ', '.join(fields) + ' FROM ' + self._jobtable
+        wheres, params = self._get_job_filter(states=states, **keys)
+        if after_name is not None:
+            sub = '(SELECT submit_time FROM %s WHERE name=%s)' \
+                  % (self._jobtable, self._placeholder)
+            wheres.append('(submit_time > %s OR (submit_time = %s AND '
+                          'name > %s))' % (sub, sub, self._placeholder))
+            params.extend([after_name] * 3)
+        query += ' WHERE ' + ' AND '.join(wheres) \
+                 + ' ORDER BY submit_time, name'
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        c = self._execute(query, params, stream=True)
+        for row in c:
+            yield row
+
+    def _count_jobs(self, states, **keys):
+        """Get the number of jobs in each of the given `states` that match
+           the given criteria (see :meth:`_get_job_filter`), as a dict
+           keyed by state."""
+        counts = dict.fromkeys(states, 0)
+        if len(states) == 0:
+            return counts
+        wheres, params = self._get_job_filter(states=states, **keys)
+        c = self._execute('SELECT state, COUNT(*) FROM %s WHERE %s '
+                          'GROUP BY state' % (self._jobtable,
+                                              ' AND '.join(wheres)), params)
+        for state, count in c:
+            counts[state] = count
+        return counts
+
+    def _get_jobs(self, states=None, names=None, user=None,
+                  submitted_after=None, submitted_before=None, order_by=None):
+        """Get all jobs that match all of the given criteria, as a generator
+           of :class:`Job` objects. Unlike :meth:`_get_all_jobs_in_state`,
+           this can match jobs in several states at once.
+           If `states` or `names` (lists of strings) are given, only jobs in
+           one of those states, or with one of those names, are returned.
+           If `user` is given, only jobs submitted by that user are returned.
+           If `submitted_after` or `submitted_before` (datetime objects,
+           in UTC) are given, only jobs submitted in that time range are
+           returned.
+           If `order_by` is specified, the jobs are returned sorted by the
+           given column."""
+        if names is not None:
+            # Avoid exceeding the database's limit on query parameters
+            names = list(names)
+            chunk = 500
+            if len(names) > chunk:
+                for i in range(0, len(names), chunk):
+                    for job in self._get_jobs(states, names[i:i + chunk],
+                                              user, submitted_after,
+                                              submitted_before, order_by):
+                        yield job
+                return
+            if len(names) == 0:
+                return
+        if states is not None and len(states) == 0:
+            return
+        fields = [x.name for x in self._fields]
+        state_index = fields.index('state')
+        query = 'SELECT ' + ', '.join(fields) + ' FROM ' + self._jobtable
+        wheres, params = self._get_job_filter(states=states, names=names,
+                                              user=user,
+                                              submitted_after=submitted_after,
+                                              submitted_before=submitted_before)
+        if wheres:
+            query += ' WHERE ' + ' AND '.join(wheres)
+        if order_by:
+            query += ' ORDER BY ' + order_by
+        c = self._execute(query, params)
+        for row in c.fetchall():
+            metadata = _JobMetadata(fields, row)
+            yield self._jobcls(self, metadata, _JobState(row[state_index]))
+
     def _delete_job(self, metadata, state):
         """Delete a job from the job state table."""
         c = self.conn.cursor()
@@ -615,8 +1335,10 @@ class Database(object):
         query = 'DELETE FROM %s WHERE parent=%s OR child=%s' \
                 % (self._dependtable, self._placeholder, self._placeholder)
         c.execute(query, [metadata['name']]*2)
-        self.conn.commit()
+        self._commit()
         metadata.mark_synced()
+        if self._stats:
+            self._stats.job_deleted(metadata['name'], state)
 
     def _update_job(self, metadata, state):
         """Update a job in the job state table."""
@@ -627,7 +1349,7 @@ class Database(object):
         self._execute(query, metadata.values() + [metadata['name']])
         if state == 'COMPLETED':
             self._remove_dependency_on(metadata['name'])
-        self.conn.commit()
+        self._commit()
         metadata.mark_synced()
 
     def _remove_dependency_on(self, jobname):
@@ -645,8 +1367,13 @@ class Database(object):
                 + ' WHERE name=' + self._placeholder
         c = self._execute(query,
                           metadata.values() + [newstate, metadata['name']])
-        self.conn.commit()
+        if newstate == 'COMPLETED':
+            self._remove_dependency_on(metadata['name'])
+        self._commit()
         metadata.mark_synced()
+        if self._stats:
+            self._stats.job_state_changed(metadata['name'], metadata['user'],
+                                          oldstate, newstate)
 
 
 class WebService(object):
@@ -656,6 +1383,10 @@ class WebService(object):
     """
 
     _system_socket_file = '/var/run/webservices.socket'
+    _watcher = None
+    _event_queue = None
+    _submitter = None
+    _stats = None
 
     #: Version number of the service, or None.
     version = None
@@ -665,9 +1396,16 @@ class WebService(object):
         self.config._read_db_auth('back')
         self.__state_file_handle = None
         self.db = db
-        if self.config.track_hostname:
-            self.db.set_track_hostname()
+        self.db._add_optional_fields(self.config)
         self.db._connect(config)
+        # Names of running jobs that told us they finished
+        self._notified_jobs = {}
+        # Number of times we rechecked the job-state file for each job
+        self._state_file_rechecks = {}
+        # Number of times we retried a failed status check for each job
+        self._status_rechecks = {}
+        # Network socket that jobs use to tell us they finished, if any
+        self._notify_socket = None
 
     def get_running_pid(self):
         """Return the process ID of a currently running web service, by
@@ -766,6 +1504,153 @@ have done this, delete the state file (%s) to reenable runs.
         if len(jobs) == 1:
             return jobs[0]
 
+    def _schedule_event(self, event, delay):
+        """Add an event to the event queue after `delay` seconds, without
+           blocking the event loop."""
+        t = threading.Timer(delay, self._event_queue.put, [event])
+        t.setDaemon(True)
+        t.start()
+
+    def _recheck_incoming_jobs(self):
+        """Have incoming jobs checked again soon, e.g. because some may
+           have been waiting for an identical job that has now finished."""
+        if self._event_queue is not None:
+            self._event_queue.put(
+                     saliweb.backend.events._IncomingJobsEvent(self))
+
+    def _job_done(self, runner_id):
+        """Handle a running job telling us that it has finished. The full
+           runner ID is usually given, but for SGE array jobs the job only
+           knows the job ID, not the task range (and every task tells us
+           when it finishes)."""
+        jobs = list(self.db._get_all_jobs_in_state('RUNNING',
+                                                   runner_id=runner_id))
+        if len(jobs) == 0:
+            jobs = self.db._get_all_jobs_in_state('RUNNING',
+                                       runner_id_prefix=runner_id + '.')
+        for job in jobs:
+            # If we were already told, the job will be checked again anyway
+            # (when it is rechecked, or by the periodic check), so don't
+            # query the runner again for every task of an array job
+            if job.name in self._notified_jobs:
+                continue
+            self._notified_jobs[job.name] = None
+            job._try_complete(self)
+
+    def _job_state_done(self, name):
+        """Handle the watcher seeing a job's job-state file say DONE"""
+        job = self.get_job_by_name('RUNNING', name)
+        if job:
+            self._notified_jobs[job.name] = None
+            job._try_complete(self)
+
+    def _start_watcher(self):
+        """Start watching running job directories, if requested"""
+        if not self.config.backend['watch_job_state']:
+            return
+        import saliweb.backend.watcher
+        self._watcher = saliweb.backend.watcher._get_watcher(self,
+                              self.config.directories['RUNNING'],
+                              self.config.backend['watch_poll_seconds'])
+        self._watcher.start()
+        for job in self.db._get_all_jobs_in_state('RUNNING'):
+            self._watch_job(job)
+
+    def _start_notifications(self):
+        """Start listening for finished jobs on the network, if requested"""
+        if self._notify_socket is not None:
+            saliweb.backend.events._JobNotifications(self,
+                                             self._notify_socket).start()
+
+    def _watch_job(self, job):
+        """Watch the directory of a newly started job, if requested"""
+        if self._watcher is not None:
+            try:
+                self._watcher.watch(job.name, job.directory)
+            except OSError as detail:
+                # Not fatal; we'll still find the job in the periodic check
+                self._log("Could not watch job %s: %s" % (job.name, detail))
+
+    def _start_submitter(self):
+        """Start the background submission threads, if requested"""
+        threads = self.config.backend['submit_threads']
+        if threads > 0:
+            self._submitter = saliweb.backend.submitter._Submitter(self,
+                                 threads, self.config.backend['submit_window'])
+
+    def _start_stats(self):
+        """Start keeping statistics for the monitor admin tool"""
+        self._stats = saliweb.backend.stats._DaemonStats()
+        self.db._stats = self._stats
+        self._reset_stats()
+
+    def _reset_stats(self):
+        """Read the current job counts, and the running and incoming jobs,
+           from the database into the statistics"""
+        if self._stats is None:
+            return
+        counts = self.db._count_jobs(_JobState.get_valid_states())
+        running = list(self.db._list_jobs(['name', 'user'], ['RUNNING']))
+        incoming = list(self.db._list_jobs(['name', 'submit_time'],
+                                           ['INCOMING']))
+        self._stats.reset(counts, running, incoming)
+
+    def _add_latency(self, kind, start):
+        """Record, in the statistics, the time since `start` taken to
+           submit a job or check on its status"""
+        if self._stats is not None:
+            self._stats.add_latency(kind, time.time() - start)
+
+    def _job_submitted(self, name, runner, runid, exception):
+        """Handle a job's runner having been submitted in the background
+           (see :class:`_Submitter`)"""
+        job = self.get_job_by_name('RUNNING', name)
+        if job:
+            job._runner_started(runner, runid, self, exception)
+        early = self._submitter.submitted(runner, runid)
+        if early is not None:
+            early.process()
+        if self._submitter.throttled:
+            # There is now room to submit jobs we held back earlier
+            self._submitter.throttled = False
+            self._process_incoming_jobs()
+
+    def _retry_job(self, name):
+        """Run again a job that was waiting to be retried after a
+           transient error"""
+        job = self.get_job_by_name('RUNNING', name)
+        if job and _RetryRunner._get_due_time(job._metadata['runner_id']) \
+                   is not None:
+            job._try_retry(self)
+
+    def _schedule_retries(self):
+        """Schedule retries of any jobs that were waiting to be retried
+           when the service was last stopped"""
+        now = time.time()
+        for job in self.db._get_all_jobs_in_state('RUNNING'):
+            if _SubmittingRunner._get_runner_name(
+                                  job._metadata['runner_id']) is not None:
+                # The service stopped while the job was being submitted, so
+                # we don't know if it got to the cluster; run it again
+                job._metadata['runner_id'] = '%s:%d' \
+                                             % (_RetryRunner._runner_name, now)
+                job._sync_metadata()
+            due = _RetryRunner._get_due_time(job._metadata['runner_id'])
+            if due is not None:
+                self._schedule_event(
+                     saliweb.backend.events._RetryJobEvent(self, job.name),
+                     max(due - now, 0.))
+
+    def _recheck_job(self, name):
+        """Check again whether a running job has finished"""
+        job = self.get_job_by_name('RUNNING', name)
+        if job:
+            job._try_complete(self)
+        else:
+            self._state_file_rechecks.pop(name, None)
+            self._status_rechecks.pop(name, None)
+            self._notified_jobs.pop(name, None)
+
     def drop_database_tables(self):
         """Drop all tables in the database used to hold job state."""
         self.db._drop_tables()
@@ -800,6 +1685,7 @@ have done this, delete the state file (%s) to reenable runs.
         try:
             self._sanity_check()
             s = self._make_socket()
+            self._notify_socket = self._make_notify_socket()
             # Note that at this point startup is *likely* successful; we
             # checked the state file, socket etc. and did a sanity check.
             # However, it is possible that future operations might fail. But
@@ -817,16 +1703,21 @@ have done this, delete the state file (%s) to reenable runs.
                 # reacquire lock
                 self._write_state_file()
             self._register(up=True)
+            self.config._start_mail_queue()
             try:
                 try:
                     self._do_periodic_actions(s)
                 except _SigTermError:
                     pass # Expected, so just swallow it
             finally:
+                self.config._stop_mail_queue()
+                PoolRunner._close_pool(wait=False)
                 if self.__state_file_handle:
                     del self.__state_file_handle # close and unlock the file
                     os.unlink(self.config.backend['state_file'])
                 self._close_socket(s)
+                if self._notify_socket is not None:
+                    self._notify_socket.close()
                 self._register(up=False)
         except Exception as detail:
             self._handle_fatal_error(detail)
@@ -934,6 +1825,18 @@ have done this, delete the state file (%s) to reenable runs.
                           % (ret, err))
         return s
 
+    def _make_notify_socket(self):
+        """Create the network socket that running jobs use to tell us that
+           they finished, if requested (see notify_port)."""
+        port = self.config.backend['notify_port']
+        if port is None:
+            return None
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('', port))
+        s.listen(50)
+        return s
+
     def _close_socket(self, sock):
         sockfile = self.config.socket
         sock.close()
@@ -970,6 +1873,11 @@ have done this, delete the state file (%s) to reenable runs.
         saliweb.backend.events._IncomingJobs(self, sock).start()
         saliweb.backend.events._OldJobs(self).start()
         saliweb.backend.events._CleanupIncomingJobs(self).start()
+        self._start_watcher()
+        self._start_notifications()
+        self._start_submitter()
+        self._start_stats()
+        self._schedule_retries()
 
         while True:
             # During the get, SIGTERM should cleanly terminate the daemon
@@ -982,6 +1890,8 @@ have done this, delete the state file (%s) to reenable runs.
             self._log("Got event %s" % str(event))
             if event is not None:
                 event.process()
+                if self._stats is not None:
+                    self._stats.event_processed()
 
     def _process_incoming_jobs(self):
         """Check for any incoming jobs, and run each one."""
@@ -993,20 +1903,38 @@ have done this, delete the state file (%s) to reenable runs.
         if numrunning >= maxrunning:
             return
         depends = self.db._get_job_dependencies()
-        for job in self.db._get_all_jobs_in_state('INCOMING',
-                                                  order_by='submit_time'):
-            if job.name not in depends:
-                self._log("_process_incoming_jobs; trying to run job %s"
-                          % job.name)
-                job._try_run(self)
-                numrunning += 1
-                if numrunning >= maxrunning:
-                    self._log("_process_incoming_jobs; job limit reached")
+        batcher = None
+        if self.config.backend['batch_size'] > 1:
+            batcher = _JobBatcher(self.config.backend['batch_size'])
+        try:
+            for job in self.db._get_all_jobs_in_state('INCOMING',
+                                                      order_by='submit_time'):
+                if self._stats is not None:
+                    self._stats.job_incoming(job.name,
+                                             job._metadata['submit_time'])
+                if self._submitter is not None and self._submitter.is_full():
+                    self._log("_process_incoming_jobs; submission window "
+                              "full")
+                    self._submitter.throttled = True
                     return
+                if job.name not in depends:
+                    self._log("_process_incoming_jobs; trying to run job %s"
+                              % job.name)
+                    if job._try_run(self, batcher) is False:
+                        continue
+                    numrunning += 1
+                    if numrunning >= maxrunning:
+                        self._log("_process_incoming_jobs; job limit reached")
+                        return
+        finally:
+            if batcher:
+                batcher.submit(self)
         self._log("_process_incoming_jobs done")
 
     def _cleanup_incoming_jobs(self):
         """Clean up any incoming job directories that have been abandoned."""
+        # Correct for any changes made by admin tools since we last looked
+        self._reset_stats()
         incoming_dir = self.config.directories['INCOMING']
         incoming_dirs = dict.fromkeys(os.listdir(incoming_dir))
         if len(incoming_dirs) == 0:
@@ -1052,14 +1980,26 @@ have done this, delete the state file (%s) to reenable runs.
         for job in self.db._get_all_jobs_in_state('ARCHIVED',
                                                   after_time='expire_time'):
             job._try_expire()
+        if self.db._result_cache:
+            self.db._evict_cached_results(
+                               self.config.backend['result_cache_size'],
+                               self.config.backend['result_cache_age'])
 
 
 class Job(object):
     """Class that encapsulates a single job in the system. Jobs are not
        created by the user directly, but by querying a :class:`WebService`
        object.
+
+       Job methods such as :meth:`run` are normally run with the current
+       working directory set to the job directory. A subclass that only
+       uses absolute paths (e.g. via :attr:`directory`) can set
+       `chdir_hooks` to False to avoid this; since the working directory
+       is shared by the entire process, only these methods can safely
+       be run for several jobs at once in different threads.
     """
 
+    chdir_hooks = True
     _state_file_wait_time = 8.0
     _runners = {}
 
@@ -1073,6 +2013,7 @@ class Job(object):
         self._db = db
         self._metadata = metadata
         self.__state = state
+        self.__cache_hit = False
 
     @classmethod
     def register_runner_class(cls, runnercls):
@@ -1097,29 +2038,68 @@ class Job(object):
            e.g. in an email. Do not call this method directly; instead use
            :attr:`logger` to access the logger object."""
         filename = os.path.join(self.directory, 'framework.log')
-        hdlr = logging.StreamHandler(_DelayFileStream(filename))
-        formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-        hdlr.setFormatter(formatter)
-        return hdlr
+        # Handlers are cached, and the log file is written to in a
+        # background thread, so this is cheap to call repeatedly
+        return saliweb.backend.joblog._writer.get_handler(filename,
+                                                         _log_formatter)
+
+    def _release_log_handler(self, wait=False):
+        """Close the default log file in the job directory once all pending
+           log messages have been written. This must be done with `wait`
+           True before the job directory is moved or removed."""
+        if self._metadata['directory']:
+            saliweb.backend.joblog._writer.release(
+                   os.path.join(self._metadata['directory'], 'framework.log'),
+                   wait)
 
     def _run_in_job_directory(self, meth, *args, **keys):
-        """Run a method with the working directory set to the job directory.
-           The method can also log by accessing :attr:`logger`.
-           Restore the cwd after the method completes."""
-        cwd = os.getcwd()
+        """Run a method with a context for the job directory. Runners
+           created by the method use the job directory, and the method can
+           log by accessing :attr:`logger`. If :attr:`chdir_hooks` is set,
+           the working directory is also set to the job directory while
+           the method runs (and other threads are prevented from doing the
+           same until the method completes)."""
         hdlr = self.get_log_handler()
-        self.logger = logging.getLogger(self.service_name)
-        self.logger.addHandler(hdlr)
+        # Messages logged to the shared service logger (either via
+        # self.logger, or by getting the logger by name) are passed to the
+        # handler in this thread's job context
+        context = _JobContext(self.directory, hdlr)
+        oldcontext = _get_job_context()
+        _current_job_context.context = context
+        self.logger = _get_service_logger(self.service_name)
+        stats = self._db._stats
+        if stats:
+            hook = stats.hook_started(self.name, getattr(meth, '__name__',
+                                                         str(meth)))
         try:
-            os.chdir(self.directory)
-            return meth(*args, **keys)
+            if self.chdir_hooks:
+                return self._run_with_chdir(context, meth, args, keys)
+            else:
+                return meth(*args, **keys)
         finally:
+            # Closing a handler returned by the default get_log_handler()
+            # does not close its file, so it can be reused
             hdlr.flush()
             hdlr.close()
             if hasattr(self, 'logger'):
-                self.logger.removeHandler(hdlr)
                 del self.logger
-            os.chdir(cwd)
+            _current_job_context.context = oldcontext
+            context.close()
+            if stats:
+                stats.hook_finished(hook)
+
+    def _run_with_chdir(self, context, meth, args, keys):
+        _chdir_lock.acquire()
+        try:
+            cwd = os.open('.', os.O_RDONLY)
+            try:
+                os.fchdir(context.dirfd)
+                return meth(*args, **keys)
+            finally:
+                os.fchdir(cwd)
+                os.close(cwd)
+        finally:
+            _chdir_lock.release()
 
     def _frontend_sanity_check(self):
         """Make sure that the frontend set up the job correctly."""
@@ -1139,15 +2119,78 @@ class Job(object):
                               % (self.name, dir))
 
     def _start_runner(self, runner, webservice):
-        """Start up a job using a :class:`Runner` and store the ID."""
-        runner_id = runner._runner_name + ':' + runner._run(webservice)
-        self._metadata['runner_id'] = runner_id
+        """Start up a job using a :class:`Runner` and store the ID. If
+           background submission is turned on, the runner is instead started
+           in another thread, and the ID is stored once that is done (see
+           :meth:`_runner_started`); until then, the runner ID just says
+           that the job is being submitted."""
+        submitter = webservice._submitter
+        if submitter is None:
+            start = time.time()
+            runid = runner._run(webservice)
+            webservice._add_latency('submit', start)
+            self._set_runner_id(runner, runid, webservice)
+        else:
+            self._metadata['runner_id'] = '%s:%s' \
+                       % (_SubmittingRunner._runner_name, runner._runner_name)
+            self._sync_metadata()
+            submitter.submit(self.name, runner)
+
+    def _set_runner_id(self, runner, runid, webservice):
+        self._metadata['runner_id'] = runner._runner_name + ':' + runid
         self._sync_metadata()
+        webservice._watch_job(self)
 
-    def _try_run(self, webservice):
-        """Take an incoming job and try to start running it."""
+    def _runner_started(self, runner, runid, webservice, exception=None):
+        """Handle the job's runner having been started as part of a batch
+           (see :class:`_JobBatcher`) or in the background (see
+           :class:`_Submitter`)"""
+        try:
+            if exception is not None:
+                raise exception
+            self._set_runner_id(runner, runid, webservice)
+        except Exception as detail:
+            self._fail_or_retry(detail, webservice)
+        self._release_log_handler()
+
+    def _get_input_hash(self):
+        """Get the hash of the job's inputs, or None if its results
+           cannot be cached."""
+        inputs = self.get_cache_inputs()
+        if inputs is not None:
+            return saliweb.backend.resultcache._hash_inputs(self.directory,
+                                                            inputs)
+
+    def _use_cached_result(self, name, directory):
+        """Reuse the results of an earlier job with identical inputs,
+           instead of running this one."""
+        saliweb.backend.resultcache._copy_results(directory, self.directory)
+        self.logger.info("Reusing results of job %s, which had identical "
+                         "inputs" % name)
+        self.__cache_hit = True
+        self.skip_run()
+
+    def _try_run(self, webservice, batcher=None):
+        """Take an incoming job and try to start running it. If a
+           :class:`_JobBatcher` is given, the job's runner may be passed
+           to it to be started later, together with other similar jobs.
+           Return False if the job was left INCOMING to wait for an
+           identical job to finish (see :meth:`get_cache_inputs`)."""
         try:
             self._frontend_sanity_check()
+            cached = None
+            if self._db._result_cache:
+                input_hash = self._run_in_job_directory(self._get_input_hash)
+                self._metadata['input_hash'] = input_hash
+                if input_hash is not None:
+                    if self._db._count_jobs_with_input_hash(input_hash,
+                                                   _IN_FLIGHT_STATES) > 0:
+                        # Wait for the identical job to finish, then reuse
+                        # its results; stay INCOMING until then
+                        self._sync_metadata()
+                        self._release_log_handler()
+                        return False
+                    cached = self._db._get_cached_result(input_hash)
             self._metadata['preprocess_time'] = datetime.datetime.utcnow()
             self.__set_state('PREPROCESSING')
             # Delete job-state file, if present from a previous run
@@ -1156,7 +2199,10 @@ class Job(object):
             except OSError:
                 pass
             self.__skip_run = False
-            self._run_in_job_directory(self.preprocess)
+            if cached is not None:
+                self._run_in_job_directory(self._use_cached_result, *cached)
+            else:
+                self._run_in_job_directory(self.preprocess)
             if self.__skip_run:
                 self._sync_metadata()
                 self._mark_job_completed()
@@ -1164,10 +2210,82 @@ class Job(object):
                 self._metadata['run_time'] = datetime.datetime.utcnow()
                 self.__set_state('RUNNING')
                 runner = self._run_in_job_directory(self.run)
+                if batcher is not None and batcher.add(self, runner):
+                    return
                 self._start_runner(runner, webservice)
         except Exception as detail:
+            self._fail_or_retry(detail, webservice)
+        # Don't keep the log file open while the job runs
+        self._release_log_handler()
+
+    def _try_retry(self, webservice):
+        """Run a job again after a transient error"""
+        try:
+            self._assert_state('RUNNING')
+            # Delete job-state file, if present from the failed run
+            try:
+                os.unlink(self._get_job_state_file())
+            except OSError:
+                pass
+            runner = self._run_in_job_directory(self.rerun, None)
+            self._start_runner(runner, webservice)
+        except Exception as detail:
+            self._fail_or_retry(detail, webservice)
+        self._release_log_handler()
+
+    def _fail_or_retry(self, detail, webservice):
+        """Handle an exception `detail` that occurred while processing the
+           job. If it is a transient runner error and the job has not
+           already been retried too many times, run the job again later;
+           otherwise, mark the job as FAILED."""
+        if not (self._get_state() == 'RUNNING'
+                and _is_transient_error(detail)
+                and self._retry(webservice, detail, rerun=True)):
             self._fail(detail)
 
+    def _retry(self, webservice, detail, rerun):
+        """Try the job again later, after the transient error `detail`, by
+           running it again via :meth:`rerun` or (if `rerun` is False)
+           just by checking its status again. The delay doubles with each
+           attempt. Return False if the job has already been tried the
+           maximum number of times. Reruns and status checks each have
+           their own budget; reruns are counted in the database (so that
+           they survive a restart) while status checks are only counted
+           in memory, until one succeeds."""
+        retry = self._db.config.retry
+        if rerun:
+            attempt = (self._metadata.get('retry_count') or 0) + 1
+        else:
+            attempt = webservice._status_rechecks.get(self.name, 0) + 1
+        if attempt > retry['max_attempts']:
+            webservice._status_rechecks.pop(self.name, None)
+            return False
+        delay = min(retry['backoff_seconds'] * 2 ** (attempt - 1),
+                    retry['max_backoff_seconds'])
+        if rerun:
+            self._metadata['retry_count'] = attempt
+            self._metadata['runner_id'] = '%s:%d' % (_RetryRunner._runner_name,
+                                                     time.time() + delay)
+            self._sync_metadata()
+            event = saliweb.backend.events._RetryJobEvent(webservice,
+                                                          self.name)
+            action = 'running it again'
+        else:
+            webservice._status_rechecks[self.name] = attempt
+            event = saliweb.backend.events._RecheckJobEvent(webservice,
+                                                            self.name)
+            action = 'checking it again'
+        self._run_in_job_directory(self.__log_retry,
+                                   "Transient error (%s); %s in %d seconds "
+                                   "(attempt %d of %d)"
+                                   % (detail, action, delay, attempt,
+                                      retry['max_attempts']))
+        webservice._schedule_event(event, delay)
+        return True
+
+    def __log_retry(self, msg):
+        self.logger.warning(msg)
+
     def _sanity_check(self):
         """Check for obvious problems with any job"""
         try:
@@ -1198,28 +2316,39 @@ class Job(object):
         runnercls = self._runners[runner_name]
         return runnercls._check_completed(jobid, self.directory)
 
-    def _get_job_results(self):
+    def _get_job_results(self, webservice):
         """Return job results (or True if no explicit results) only if the
            job has just finished running. This is not the case until the
            :class:`Runner` reports the job has finished (if it is able to)
-           and the state file has been updated, since the state file is
+           and either the job told us it finished (via the service socket)
+           or the state file has been updated, since the state file is
            created when the first task in a multi-task SGE job finishes,
            so other SGE tasks may still be running."""
-        batch_done = self._get_runner_results()
-        state_file_done = self._job_state_file_done()
+        start = time.time()
+        try:
+            batch_done = self._get_runner_results()
+        finally:
+            webservice._add_latency('poll', start)
+        state_file_done = self.name in webservice._notified_jobs \
+                          or self._job_state_file_done()
         if state_file_done and batch_done is not False:
+            self._clear_recheck(webservice)
             return batch_done or True
         elif batch_done and not state_file_done:
-            # This usually means the batch job failed; check state file again,
-            # since the batch job may have just finished, after the first
-            # check above; we may have to wait a little while for
-            # NFS caching, etc.
-            for tries in range(8):
-                state_file_done = self._job_state_file_done()
-                if state_file_done:
-                    return batch_done or True
-                time.sleep(self._state_file_wait_time)
-            raise RunnerError(
+            # This usually means the batch job failed; but the batch job may
+            # have just finished, after the first check above, or we may
+            # have to wait a little while for NFS caching, etc. So check the
+            # state file again later, without holding up other jobs.
+            tries = webservice._state_file_rechecks.get(self.name, 0)
+            if tries < 8:
+                webservice._state_file_rechecks[self.name] = tries + 1
+                webservice._schedule_event(
+                     saliweb.backend.events._RecheckJobEvent(webservice,
+                                                             self.name),
+                     self._state_file_wait_time)
+                return False
+            self._clear_recheck(webservice)
+            raise TransientRunnerError(
                  "Runner claims job %s is complete, but "
                  "job-state file in job directory (%s) claims it "
                  "is not. This usually means the underlying batch system "
@@ -1228,18 +2357,40 @@ class Job(object):
                  % (self._metadata['runner_id'], self._metadata['directory']))
         return False
 
+    def _clear_recheck(self, webservice):
+        webservice._state_file_rechecks.pop(self.name, None)
+        webservice._notified_jobs.pop(self.name, None)
+
     def _try_complete(self, webservice, run_exception=None):
         """Take a running job, see if it completed, and if so, process it."""
         try:
             self._assert_state('RUNNING')
-            results = self._get_job_results()
+            try:
+                results = self._get_job_results(webservice)
+            except Exception as detail:
+                # If we could not query the job's status, try again later
+                if _is_status_error(detail) \
+                   and self._retry(webservice, detail, rerun=False):
+                    self._release_log_handler()
+                    return
+                raise
+            webservice._status_rechecks.pop(self.name, None)
             if not results:
                 return
             # If the Runner caught an exception, raise it here
             if run_exception is not None:
+                # If the Runner lost track of the job, check it again later
+                # (the job may not have finished cleanly)
+                if _is_status_error(run_exception) \
+                   and self._retry(webservice, run_exception, rerun=False):
+                    self._release_log_handler()
+                    return
                 raise run_exception
             # Delete job-state file; no longer needed
             os.unlink(self._get_job_state_file())
+            # The job ran, so any earlier reruns no longer count
+            if self._metadata.get('retry_count'):
+                self._metadata['retry_count'] = 0
             self._metadata['postprocess_time'] = datetime.datetime.utcnow()
             self.__set_state('POSTPROCESSING')
             self.__reschedule_run = False
@@ -1258,7 +2409,12 @@ class Job(object):
                 self._run_in_job_directory(self.finalize)
                 self._mark_job_completed()
         except Exception as detail:
-            self._fail(detail)
+            self._fail_or_retry(detail, webservice)
+        if self._metadata.get('input_hash') is not None \
+           and self._get_state() != 'RUNNING':
+            # Identical jobs may be waiting for this one to finish
+            webservice._recheck_incoming_jobs()
+        self._release_log_handler()
 
     def _mark_job_completed(self):
         endtime = datetime.datetime.utcnow()
@@ -1271,18 +2427,48 @@ class Job(object):
             expire_time = endtime + expire_time
         self._metadata['archive_time'] = archive_time
         self._metadata['expire_time'] = expire_time
-        self.__set_state('COMPLETED')
+        # Measure the job only once the complete method has run
+        self.__set_state('COMPLETED', update_disk_usage=False)
         self._run_in_job_directory(self.complete)
+        self._update_disk_usage()
+        archive_now = self._exceeds_archive_size()
+        if archive_now:
+            self._metadata['archive_time'] = endtime
         self._sync_metadata()
+        self._add_to_result_cache()
         self._run_in_job_directory(self.send_job_completed_email)
+        if archive_now:
+            self._try_archive()
+
+    def _add_to_result_cache(self):
+        """Let later jobs with identical inputs reuse this job's results.
+           Jobs that themselves reused cached results are not added, so
+           that results never outlive the job that produced them."""
+        input_hash = self._metadata.get('input_hash')
+        if input_hash is None or self.__cache_hit:
+            return
+        disk_usage = self._metadata.get('disk_usage')
+        if disk_usage is None:
+            disk_usage = _get_directory_usage(self.directory)[0]
+        self._db._add_cached_result(input_hash, self.name, disk_usage)
+
+    def _exceeds_archive_size(self):
+        """Return True iff the job directory is bigger than the configured
+           archive_size, so that the job should be archived early."""
+        archive_size = self._db.config.oldjobs.get('archive_size')
+        return archive_size is not None \
+               and self._metadata['disk_usage'] > archive_size
 
     def _try_archive(self):
         try:
             self.__set_state('ARCHIVED')
             self._run_in_job_directory(self.archive)
+            # The archive method typically compresses or deletes files
+            self._update_disk_usage()
             self._sync_metadata()
         except Exception as detail:
             self._fail(detail)
+        self._release_log_handler()
 
     def _try_expire(self):
         try:
@@ -1297,12 +2483,26 @@ class Job(object):
         if self._metadata.needs_sync():
             self._db._update_job(self._metadata, self._get_state())
 
-    def __set_state(self, state):
+    def _update_disk_usage(self):
+        """Measure the size of the job directory and store it in the job
+           metadata, if disk usage tracking is turned on."""
+        if not self._db.config.backend.get('track_disk_usage', False):
+            return
+        directory = self._metadata['directory']
+        if directory is None or not os.path.isdir(directory):
+            size, nfiles = 0, 0
+        else:
+            size, nfiles = _get_directory_usage(directory)
+        self._metadata['disk_usage'] = size
+        self._metadata['disk_files'] = nfiles
+
+    def __set_state(self, state, update_disk_usage=True):
         """Change the job state to `state`. It is the caller's responsibility
            to catch exceptions from this method and call :meth:`_fail`."""
         oldstate = self._get_state()
         self.__state.transition(state)
         if state == 'EXPIRED':
+            self._release_log_handler(wait=True)
             shutil.rmtree(self._metadata['directory'])
             self._metadata['directory'] = None
         elif self._metadata['directory'] is not None:
@@ -1323,8 +2523,11 @@ class Job(object):
                                          self.name)
             directory = os.path.normpath(directory)
             if directory != self._metadata['directory']:
+                self._release_log_handler(wait=True)
                 shutil.move(self._metadata['directory'], directory)
                 self._metadata['directory'] = directory
+        if update_disk_usage:
+            self._update_disk_usage()
         self._db._change_job_state(self._metadata, oldstate, state)
 
     def _get_state(self):
@@ -1362,6 +2565,7 @@ class Job(object):
         reason = "Python exception:\n" + err
         try:
             self._metadata['failure'] = reason
+            self._release_log_handler(wait=True)
             self._close_open_files()
             self.__set_state('FAILED')
             if email:
@@ -1369,7 +2573,8 @@ class Job(object):
                           % (self.service_name, self.name)
                 body = 'Job %s failed with the following error:\n' \
                        % self.name + reason
-                self._db.config.send_admin_email(subject, body)
+                self._db.config._send_job_failure_email(self.name, subject,
+                                                        body, reason)
         except Exception as detail:
             # Ensure we can extract the original error
             detail.original_error = reason
@@ -1384,20 +2589,18 @@ class Job(object):
                                      "but it is actually in %s state") \
                                     % (state, current_state))
 
-    def resubmit(self):
-        """Make a FAILED job eligible for running again."""
+    def resubmit(self, notify=True):
+        """Make a FAILED job eligible for running again.
+           If `notify` is False, the backend is not told about the new
+           incoming job; this is useful when resubmitting many jobs at
+           once, so that the backend need only be woken up once."""
         self._assert_state('FAILED')
         try:
+            if self._metadata.get('retry_count'):
+                self._metadata['retry_count'] = 0
             self.__set_state('INCOMING')
-            # Wake up the web service and let it know a new incoming
-            # job is present
-            try:
-                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                s.connect(self._db.config.socket)
-                s.send("INCOMING %s" % self.name)
-                s.close()
-            except socket.error:
-                pass
+            if notify:
+                _notify_incoming(self._db.config, self.name)
         except Exception as detail:
             self._fail(detail)
 
@@ -1410,6 +2613,7 @@ class Job(object):
     def delete(self):
         """Delete the job directory and database row."""
         if self._metadata['directory']:
+            self._release_log_handler(wait=True)
             shutil.rmtree(self._metadata['directory'])
         self._db._delete_job(self._metadata, self._get_state())
         self._metadata = None
@@ -1432,6 +2636,10 @@ class Job(object):
            Like :meth:`run`, this should create and return a suitable
            :class:`Runner` instance.
 
+           This method is also called (with `data` None) to run the job
+           again if it failed because of a temporary problem with the
+           cluster; see the [retry] section of the configuration file.
+
            By default, this method simply discards `data` and calls the regular
            :meth:`run` method. You can redefine this method if you want to do
            something different for rescheduled runs.
@@ -1476,6 +2684,23 @@ class Job(object):
            the admin, etc.
            This method should not be called directly."""
 
+    def get_cache_inputs(self):
+        """Return a list of the names of the files (relative to the job
+           directory) that together hold all of the job's inputs, or None
+           (the default) if the job's results should never be reused.
+           If result caching is turned on (see the result_cache option in
+           the configuration file), a job whose input files are identical
+           to those of an earlier job that is still COMPLETED gets a copy of
+           that job's results (all files except the job-state file and the
+           framework log) and skips both :meth:`preprocess` and the run.
+           Result files are hard linked where possible, so methods such as
+           :meth:`complete` and :meth:`archive` should replace files rather
+           than modify them in place.
+           A job whose inputs are identical to those of a job that is
+           still being processed waits for that job to finish first.
+           This method should not be called directly."""
+        return None
+
     def preprocess(self):
         """Do any necessary preprocessing before the job is actually run.
            Does nothing by default. Note that a user-defined preprocess method
@@ -1570,13 +2795,111 @@ class _LockedJobDict(object):
             self._lock.release()
 
 
+class _JobBatcher(object):
+    """Collect the runners of jobs started in a single pass of
+       :meth:`WebService._process_incoming_jobs` and, where several of them
+       are compatible (see :meth:`Runner._get_batch_key`), start them
+       together as a single batch job (e.g. an SGE array job) of up to
+       `max_size` tasks."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._groups = {}
+        self._order = []
+
+    def add(self, job, runner):
+        """Add a job's runner to the batch. Return False if the runner
+           cannot be batched, in which case it should be started as usual."""
+        key = runner._get_batch_key()
+        if key is None:
+            return False
+        if key not in self._groups:
+            self._groups[key] = []
+            self._order.append(key)
+        self._groups[key].append((job, runner))
+        return True
+
+    def submit(self, webservice):
+        """Start all collected jobs"""
+        for key in self._order:
+            group = self._groups[key]
+            for i in range(0, len(group), self.max_size):
+                self._submit_batch(group[i:i + self.max_size], webservice)
+        self._groups = {}
+        self._order = []
+
+    def _submit_batch(self, batch, webservice):
+        if len(batch) == 1:
+            job, runner = batch[0]
+            start = time.time()
+            try:
+                runid = runner._run(webservice)
+            except Exception as detail:
+                webservice._add_latency('submit', start)
+                job._runner_started(runner, None, webservice, detail)
+            else:
+                webservice._add_latency('submit', start)
+                job._runner_started(runner, runid, webservice)
+            return
+        runners = [b[1] for b in batch]
+        start = time.time()
+        try:
+            runids = runners[0].__class__._run_batch(runners, webservice)
+        except Exception as detail:
+            webservice._add_latency('submit', start)
+            for job, runner in batch:
+                job._runner_started(runner, None, webservice, detail)
+        else:
+            webservice._add_latency('submit', start)
+            for (job, runner), runid in zip(batch, runids):
+                job._runner_started(runner, runid, webservice)
+
+
+def _write_job_notify(fh, interpreter, notify_socket, runner_id):
+    """Add a command to the job script `fh` (run by the shell `interpreter`)
+       that tells the backend that the job with the given `runner_id` has
+       finished, so that it doesn't have to wait for the job-state file to
+       show up over NFS. `notify_socket` is the address returned by
+       :meth:`Config._get_notify_address`: either a (host, port) tuple or
+       the path to the service socket (which compute nodes generally
+       cannot connect to). This is best effort only and the job-state file
+       is used if it doesn't work."""
+    if interpreter in ('/bin/csh', '/bin/tcsh'):
+        redirect = '>& /dev/null'
+    else:
+        redirect = '> /dev/null 2>&1'
+    if isinstance(notify_socket, tuple):
+        print("python -c 'import socket, sys; "
+              "s = socket.create_connection((sys.argv[1], int(sys.argv[2])), "
+              "10); s.sendall(sys.argv[3].encode())' "
+              '%s %d "DONE %s" %s || true'
+              % (notify_socket[0], notify_socket[1], runner_id, redirect),
+              file=fh)
+    else:
+        print("python -c 'import socket, sys; "
+              "s = socket.socket(socket.AF_UNIX); s.settimeout(10); "
+              "s.connect(sys.argv[1]); s.sendall(sys.argv[2].encode())' "
+              '%s "DONE %s" %s || true'
+              % (notify_socket, runner_id, redirect), file=fh)
+
+
 class Runner(object):
     """Base class for runners, which handle the actual running of a job,
        usually on an SGE cluster (see the :class:`SGERunner` and
        :class:`SaliSGERunner` subclasses). To create a subclass, you must
        implement both a _run method and a _check_completed class method,
        set the _runner_name attribute to a unique name for this class,
-       and call :meth:`Job.register_runner_class` passing this class."""
+       and call :meth:`Job.register_runner_class` passing this class.
+
+       Runners can optionally support starting several similar jobs as a
+       single batch; see :meth:`_get_batch_key`."""
+
+    def _get_batch_key(self):
+        """Return a hashable key if this runner can be started in a batch
+           with other runners with the same key (by calling the _run_batch
+           class method with a list of runners, which should return a list
+           of their job IDs), or None if it must be started by itself."""
+        return None
 
 
 class SGERunner(Runner):
@@ -1599,6 +2922,9 @@ class SGERunner(Runner):
 
     _runner_name = 'qb3ogs'
     _drmaa = None
+    # Held while starting up DRMAA, since jobs may be submitted from several
+    # threads at once (see the submit_threads backend option)
+    _drmaa_lock = threading.Lock()
     _env = {'SGE_CELL': 'qb3cell',
             'SGE_ROOT': '/usr/local/sge',
             'SGE_QMASTER_PORT': '6444',
@@ -1608,14 +2934,16 @@ class SGERunner(Runner):
     _qstat = '/usr/local/sge/bin/linux-x64/qstat'
 
     _waited_jobs = _LockedJobDict()
+    _batchable = True
 
     def __init__(self, script, interpreter='/bin/sh'):
         Runner.__init__(self)
         self._opts = ''
         self._name = None
+        self._batch_task = False
         self._script = script
         self._interpreter = interpreter
-        self._directory = os.getcwd()
+        self._directory = _get_job_directory()
 
     def set_sge_options(self, opts):
         """Set the SGE options to use, as a string,
@@ -1638,7 +2966,12 @@ class SGERunner(Runner):
     @classmethod
     def _get_drmaa(cls):
         if cls._drmaa is None:
-            cls._drmaa = saliweb.backend.sge._DRMAAWrapper(cls._env)
+            cls._drmaa_lock.acquire()
+            try:
+                if cls._drmaa is None:
+                    cls._drmaa = saliweb.backend.sge._DRMAAWrapper(cls._env)
+            finally:
+                cls._drmaa_lock.release()
         return cls._drmaa.module, cls._drmaa.session
 
     def _run(self, webservice):
@@ -1646,11 +2979,11 @@ class SGERunner(Runner):
            Return the SGE job ID."""
         script = os.path.join(self._directory, 'sge-script.sh')
         fh = open(script, 'w')
-        self._write_sge_script(fh)
+        self._write_sge_script(fh, webservice.config._get_notify_address())
         fh.close()
         return self._qsub(script, webservice)
 
-    def _write_sge_script(self, fh):
+    def _write_sge_script(self, fh, notify_socket=None):
         print("#!" + self._interpreter, file=fh)
         print("#$ -S " + self._interpreter, file=fh)
         print("#$ -cwd", file=fh)
@@ -1670,6 +3003,97 @@ class SGERunner(Runner):
         if self._interpreter in ('/bin/sh', '/bin/bash', '/bin/csh',
                                  '/bin/tcsh'):
             print('echo "DONE" > ${_SALI_JOB_DIR}/job-state', file=fh)
+            if notify_socket:
+                _write_job_notify(fh, self._interpreter, notify_socket,
+                                  self._get_notify_id())
+
+    def _get_notify_id(self):
+        """Get the runner ID the job reports when it finishes (SGE sets
+           JOB_ID in the job's environment)"""
+        if self._batch_task:
+            return self._runner_name \
+                   + ':${JOB_ID}.${SGE_TASK_ID}-${SGE_TASK_ID}:1'
+        else:
+            return self._runner_name + ':${JOB_ID}'
+
+    def _get_batch_key(self):
+        # Jobs can be batched only if they are simple scripts that update the
+        # job-state file, are not already array jobs, and have the same
+        # SGE options
+        if self._batchable and '-t ' not in self._opts \
+           and self._interpreter in ('/bin/sh', '/bin/bash', '/bin/csh',
+                                     '/bin/tcsh'):
+            return (self.__class__, self._interpreter, self._opts)
+
+    @classmethod
+    def _run_batch(cls, runners, webservice):
+        """Run several jobs as a single SGE array job, with one task per job.
+           Each task runs the job's own script in its job directory. Return
+           the runner ID of each job, which identifies its task.
+
+           The array job itself runs in its own batch directory (a hidden
+           directory in the RUNNING directory) rather than in any one job's
+           directory, since each job's directory is moved once that job
+           completes, possibly before other tasks have even started. The
+           last task to finish removes the batch directory."""
+        for r in runners:
+            r._batch_task = True
+            fh = open(os.path.join(r._directory, 'sge-script.sh'), 'w')
+            r._write_sge_script(fh, webservice.config._get_notify_address())
+            fh.close()
+        import pipes
+        import tempfile
+        first = runners[0]
+        running = webservice.config.directories['RUNNING']
+        batchdir = tempfile.mkdtemp(prefix='.sge-batch-', dir=running)
+        # One marker file per task that has not yet finished
+        os.mkdir(os.path.join(batchdir, 'tasks'))
+        for task in range(len(runners)):
+            open(os.path.join(batchdir, 'tasks', str(task + 1)), 'w').close()
+        script = os.path.join(batchdir, 'sge-batch.sh')
+        fh = open(script, 'w')
+        print("#!/bin/sh", file=fh)
+        print("#$ -S /bin/sh", file=fh)
+        print("#$ -cwd", file=fh)
+        print("#$ -o /dev/null", file=fh)
+        print("#$ -e /dev/null", file=fh)
+        if first._name:
+            print('#$ -N ' + first._name, file=fh)
+        print('case "$SGE_TASK_ID" in', file=fh)
+        for task, r in enumerate(runners):
+            out = pipes.quote(r._name or 'sge-script.sh')
+            print("%d) (cd %s && %s sge-script.sh > %s.o$JOB_ID "
+                  "2> %s.e$JOB_ID) ;;" % (task + 1, pipes.quote(r._directory),
+                                          r._interpreter, out, out), file=fh)
+        print("esac", file=fh)
+        qbatch = pipes.quote(batchdir)
+        print('rm -f %s/tasks/"$SGE_TASK_ID"' % qbatch, file=fh)
+        print("if rmdir %s/tasks 2> /dev/null; then rm -rf %s; fi"
+              % (qbatch, qbatch), file=fh)
+        fh.close()
+
+        drmaa, s = cls._get_drmaa()
+        jt = s.createJobTemplate()
+        jt.nativeSpecification = first._opts + ' -w n -b no'
+        jt.remoteCommand = script
+        jt.workingDirectory = batchdir
+        try:
+            jobids = s.runBulkJobs(jt, 1, len(runners), 1)
+        except Exception:
+            shutil.rmtree(batchdir, ignore_errors=True)
+            raise
+        s.deleteJobTemplate(jt)
+        if len(jobids) != len(runners):
+            raise RunnerError("Unexpected bulk jobs return: %s; was expecting "
+                              "%d jobs" % (str(jobids), len(runners)))
+        runids = []
+        for r, jobid in zip(runners, jobids):
+            job, task = jobid.split('.')
+            runid = '%s.%s-%s:1' % (job, task, task)
+            saliweb.backend.sge._DRMAAJobWaiter(webservice, [jobid],
+                                                r, runid).start()
+            runids.append(runid)
+        return runids
 
     def _qsub(self, script, webservice):
         """Submit a job script to the cluster using DRMAA."""
@@ -1701,14 +3125,19 @@ class SGERunner(Runner):
         if jobid in cls._waited_jobs:
             return False
         elif '.' in jobid:
-            return cls._check_bulk_completed(jobid)
-        else:
-            drmaa, s = cls._get_drmaa()
-            try:
-                x = s.jobStatus(jobid)
-                return False
-            except drmaa.InvalidJobException:
-                return True
+            m = re.match('(\S+)\.(\d+)\-(\d+):\d+$', jobid)
+            if m and m.group(2) == m.group(3):
+                # A single task (e.g. a job that was run in a batch) can be
+                # queried directly
+                jobid = m.group(1) + '.' + m.group(2)
+            else:
+                return cls._check_bulk_completed(jobid)
+        drmaa, s = cls._get_drmaa()
+        try:
+            x = s.jobStatus(jobid)
+            return False
+        except drmaa.InvalidJobException:
+            return True
 
     @classmethod
     def _check_bulk_completed(cls, jobid):
@@ -1716,21 +3145,8 @@ class SGERunner(Runner):
            False if it is still running, or None if the status cannot be
            determined.
         """
-        # Unfortunately DRMAA1 only allows us to query individual tasks, and
-        # looping over all tasks in a large parallel job is very inefficient,
-        # so use qstat instead and parse the output.
-        m = re.match('(\S+)\.(\d+)\-(\d+):(\d+)$', jobid)
-        jobid = m.group(1)
-        p = subprocess.Popen([cls._qstat, '-j', jobid], stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT, env=cls._env)
-        out = p.stdout.readlines()
-        ret = p.wait()
-        if ret == 0:
-            return False
-        elif len(out) > 0 and out[0].startswith('Following jobs do not exist'):
-            return True
-        else:
-            raise OSError("qstat returned %d (%s)" % (ret, "\n".join(out)))
+        return saliweb.backend.sge._check_bulk_completed(cls._qstat,
+                                                         cls._env, jobid)
 Job.register_runner_class(SGERunner)
 
 
@@ -1748,6 +3164,278 @@ class SaliSGERunner(SGERunner):
 Job.register_runner_class(SaliSGERunner)
 
 
+class _CellJobWaiter(_JobThread):
+    """Wait for a job started by :class:`SGERouterRunner` to finish"""
+    def __init__(self, webservice, cell, jobids, runner, runid):
+        _JobThread.__init__(self, webservice)
+        self._cell = cell
+        self._jobids = jobids
+        self._runner = runner
+        self._runid = runid
+
+    def run(self):
+        self._runner._waited_jobs.add(self._runid)
+        try:
+            try:
+                reply = self._cell.helper.call('wait', jobids=self._jobids)
+                if reply['failed']:
+                    failure = TransientRunnerError(
+                                  "SGE jobs failed on cell %s: %s. Please "
+                                  "contact the cluster sysadmin."
+                                  % (self._cell.name,
+                                     ', '.join(reply['failed'])))
+                else:
+                    failure = None
+            except saliweb.backend.cluster._HelperError as detail:
+                # The job may still be running; see _DRMAAJobWaiter.run
+                failure = OSError("Could not wait for SGE jobs on cell %s: %s"
+                                  % (self._cell.name, detail))
+            e = saliweb.backend.events._CompletedJobEvent(self._webservice,
+                                                          self._runner,
+                                                          self._runid, failure)
+            self._webservice._event_queue.put(e)
+        finally:
+            self._runner._waited_jobs.remove(self._runid)
+
+
+class SGERouterRunner(SGERunner):
+    """Run a set of commands on whichever SGE cluster is least loaded.
+
+       This is used in the same way as :class:`SGERunner`, but each job is
+       submitted to one of the SGE cells added with :meth:`add_cell` (by
+       default, the QB3 and Sali clusters). The cell is chosen by looking
+       at how many jobs are waiting in each cell's queue, and how long they
+       have been waiting so far, so that bursts of jobs are spread across
+       all of the clusters. Note that the job script (and SGE options) must
+       work on any of the cells.
+    """
+    _runner_name = 'sgeroute'
+    _cells = _CellRegistry()
+    _batchable = False
+
+    _waited_jobs = _LockedJobDict()
+
+    @classmethod
+    def add_cell(cls, name, env, qstat):
+        """Add an SGE cell that jobs can be routed to. `env` is a dict of
+           environment variables needed to talk to the cell (such as
+           SGE_CELL, SGE_ROOT and DRMAA_LIBRARY_PATH) and `qstat` is the
+           full path to the cell's qstat binary. Any existing cell with the
+           same name is replaced."""
+        cls._cells.add(name, env, qstat)
+
+    def _run(self, webservice):
+        """Pick an SGE cell, generate an SGE script in the job directory
+           and run it. Return the cell name and SGE job ID."""
+        try:
+            self._cell = self._cells.choose()
+        except OSError as detail:
+            raise TransientRunnerError(str(detail))
+        return SGERunner._run(self, webservice)
+
+    def _get_notify_id(self):
+        return '%s:%s/${JOB_ID}' % (self._runner_name, self._cell.name)
+
+    def _qsub(self, script, webservice):
+        """Submit a job script to the chosen cell's DRMAA helper."""
+        cell = self._cell
+        tasks = saliweb.backend.sge._SGETasks(self._opts)
+        if tasks:
+            task_range = [tasks.first, tasks.last, tasks.step]
+        else:
+            task_range = None
+        try:
+            reply = cell.helper.call('run', script=script,
+                                     native=self._opts + ' -w n -b no',
+                                     directory=self._directory,
+                                     tasks=task_range)
+        except saliweb.backend.cluster._HelperError as detail:
+            raise TransientRunnerError("Could not submit job to SGE cell "
+                                       "%s: %s" % (cell.name, detail))
+        jobids = [str(x) for x in reply['jobids']]
+        if tasks:
+            runid = tasks.get_run_id(jobids)
+        else:
+            runid = jobids[0]
+        cell.job_submitted()
+        runid = cell.name + '/' + runid
+        _CellJobWaiter(webservice, cell, jobids, self, runid).start()
+        return runid
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        """Return True if SGE reports that the given job has finished, False
+           if it is still running, or None if the status cannot be determined.
+        """
+        if jobid in cls._waited_jobs:
+            return False
+        cellname, jobid = jobid.split('/', 1)
+        try:
+            cell = cls._cells.get(cellname)
+        except KeyError:
+            raise RunnerError("Job %s was run on unknown SGE cell %s"
+                              % (jobid, cellname))
+        if '.' in jobid:
+            return saliweb.backend.sge._check_bulk_completed(cell.qstat,
+                                                             cell.env, jobid)
+        else:
+            try:
+                return cell.helper.call('status', jobid=jobid)['done']
+            except saliweb.backend.cluster._HelperError:
+                return None
+SGERouterRunner.add_cell('qb3', SGERunner._env, SGERunner._qstat)
+SGERouterRunner.add_cell('sali', SaliSGERunner._env, SaliSGERunner._qstat)
+Job.register_runner_class(SGERouterRunner)
+
+
+class SlurmRunner(Runner):
+    """Run a set of commands on a Slurm cluster.
+
+       This is used in the same way as :class:`SGERunner`; the job-state
+       file is updated in the same way, and `interpreter` has the same
+       meaning. Call :meth:`set_slurm_options` to pass extra options to
+       sbatch, :meth:`set_slurm_name` to set the job name, or
+       :meth:`set_slurm_tasks` to run an array job.
+
+       Rather than asking Slurm about each job individually, a single
+       squeue snapshot is used to check all running jobs each cycle.
+    """
+
+    _runner_name = 'slurm'
+    _sbatch = 'sbatch'
+    _squeue = 'squeue'
+    _sacct = 'sacct'
+
+    #: How often to check for finished jobs, in seconds
+    _poll_interval = 10.
+    #: How long a squeue snapshot can be reused, in seconds
+    _snapshot_ttl = 5.
+
+    _waited_jobs = _LockedJobDict()
+    _queue = None
+    _poller = None
+    _poller_lock = threading.Lock()
+
+    def __init__(self, script, interpreter='/bin/sh'):
+        Runner.__init__(self)
+        self._opts = []
+        self._name = None
+        self._tasks = saliweb.backend.sge._SGETasks('')
+        self._script = script
+        self._interpreter = interpreter
+        self._directory = _get_job_directory()
+
+    def set_slurm_options(self, opts):
+        """Set additional options to pass to sbatch, as a string,
+           for example '--mem=1G --time=1:00:00'.
+        """
+        self._opts = opts.split()
+
+    def set_slurm_name(self, name):
+        """Set the Slurm job name (equivalent to sbatch's --job-name)."""
+        self._name = re.sub('\s*', '', name)
+
+    def set_slurm_tasks(self, tasks):
+        """Run the script as an array job, with the tasks given in the same
+           form as SGE's -t option (e.g. '1-10' or '2-20:2'). As for SGE,
+           each task can find its index in the SGE_TASK_ID environment
+           variable (as well as Slurm's SLURM_ARRAY_TASK_ID)."""
+        self._tasks = saliweb.backend.sge._SGETasks('-t ' + tasks)
+
+    def _run(self, webservice):
+        """Generate a Slurm script in the job directory and run it.
+           Return the Slurm job ID."""
+        script = os.path.join(self._directory, 'slurm-script.sh')
+        fh = open(script, 'w')
+        self._write_slurm_script(fh,
+                                 webservice.config._get_notify_address())
+        fh.close()
+        return self._submit(script, webservice)
+
+    def _write_slurm_script(self, fh, notify_socket=None):
+        print("#!" + self._interpreter, file=fh)
+        sh = self._interpreter in ('/bin/sh', '/bin/bash')
+        csh = self._interpreter in ('/bin/csh', '/bin/tcsh')
+        if sh:
+            if self._tasks:
+                print("SGE_TASK_ID=$SLURM_ARRAY_TASK_ID; export SGE_TASK_ID",
+                      file=fh)
+            print("_SALI_JOB_DIR=`pwd`", file=fh)
+        if csh:
+            if self._tasks:
+                print("setenv SGE_TASK_ID $SLURM_ARRAY_TASK_ID", file=fh)
+            print("setenv _SALI_JOB_DIR `pwd`", file=fh)
+        if sh or csh:
+            print('echo "STARTED" > ${_SALI_JOB_DIR}/job-state', file=fh)
+        print(self._script, file=fh)
+        if sh or csh:
+            print('echo "DONE" > ${_SALI_JOB_DIR}/job-state', file=fh)
+            if notify_socket:
+                if self._tasks:
+                    jobid = '${SLURM_ARRAY_JOB_ID}'
+                else:
+                    jobid = '${SLURM_JOB_ID}'
+                _write_job_notify(fh, self._interpreter, notify_socket,
+                                  self._runner_name + ':' + jobid)
+
+    def _submit(self, script, webservice):
+        """Submit a job script to the cluster using sbatch."""
+        opts = self._opts[:]
+        if self._name:
+            opts.append('--job-name=' + self._name)
+        tasks = self._tasks
+        if tasks:
+            opts.append('--array=%d-%d:%d' % (tasks.first, tasks.last,
+                                              tasks.step))
+        try:
+            jobid = saliweb.backend.slurm._sbatch(self._sbatch, script,
+                                                  self._directory, opts)
+        except OSError as detail:
+            raise TransientRunnerError("Could not submit Slurm job: %s"
+                                       % detail)
+        if tasks:
+            runid = jobid + '.%d-%d:%d' % (tasks.first, tasks.last, tasks.step)
+        else:
+            runid = jobid
+        self._wait_for_job(webservice, runid)
+        return runid
+
+    def _wait_for_job(self, webservice, runid):
+        """Have the poller thread tell us when the job finishes"""
+        cls = self.__class__
+        cls._poller_lock.acquire()
+        try:
+            p = cls._poller
+            if p is None or p._webservice is not webservice \
+               or not p.add(self, runid):
+                p = cls._poller = saliweb.backend.slurm._SlurmPoller(
+                                        webservice, cls._get_queue(),
+                                        cls._sacct, cls._poll_interval)
+                p.add(self, runid)
+                p.start()
+        finally:
+            cls._poller_lock.release()
+
+    @classmethod
+    def _get_queue(cls):
+        if cls._queue is None:
+            cls._queue = saliweb.backend.slurm._SlurmQueue(cls._squeue,
+                                                           cls._snapshot_ttl)
+        return cls._queue
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        """Return True if Slurm reports that the given job has finished,
+           False if it is still running, or None if the status cannot be
+           determined.
+        """
+        if jobid in cls._waited_jobs:
+            return False
+        jobid = saliweb.backend.slurm._get_base_job_id(jobid)
+        return jobid not in cls._get_queue().get_jobs()
+Job.register_runner_class(SlurmRunner)
+
+
 class _LocalJobWaiter(_JobThread):
     """Wait for a job started by LocalRunner to finish"""
     def __init__(self, webservice, subproc, runner, runid):
@@ -1787,7 +3475,7 @@ class LocalRunner(Runner):
     def __init__(self, cmd):
         Runner.__init__(self)
         self._cmd = cmd
-        self._directory = os.getcwd()
+        self._directory = _get_job_directory()
 
     def _run(self, webservice):
         """Run the command and return a unique job ID."""
@@ -1809,6 +3497,93 @@ class LocalRunner(Runner):
 Job.register_runner_class(LocalRunner)
 
 
+class PoolRunner(Runner):
+    """Run a Python function in a pool of worker processes on the local
+       machine.
+
+       This is much faster than :class:`LocalRunner` for short jobs, since
+       the worker processes are started (and can import any needed modules;
+       see the `preload` option in the `[pool]` section of the configuration
+       file) only once, and then run many jobs each.
+
+       `function` is the full dotted name of the function to call, for
+       example 'mymodule.run_job'; it is called with the given `args` and
+       `kwargs` (which must be picklable) in the job directory. The job-state
+       file is updated automatically. If the function raises an exception,
+       the job fails.
+    """
+
+    _runner_name = 'pool'
+    _waited_jobs = _LockedJobDict()
+    _pool = None
+    _pool_lock = threading.Lock()
+    _next_id = 0
+
+    def __init__(self, function, args=(), kwargs={}):
+        Runner.__init__(self)
+        self._function = function
+        self._args = tuple(args)
+        self._kwargs = dict(kwargs)
+        self._directory = _get_job_directory()
+
+    @classmethod
+    def _get_pool(cls, config):
+        cls._pool_lock.acquire()
+        try:
+            if cls._pool is None:
+                import saliweb.backend.pool
+                cls._pool = saliweb.backend.pool._WorkerPool(config)
+            return cls._pool
+        finally:
+            cls._pool_lock.release()
+
+    @classmethod
+    def _close_pool(cls, wait=True):
+        """Stop the workers. If `wait` is True, first wait for all running
+           jobs to finish; otherwise, kill them."""
+        cls._pool_lock.acquire()
+        try:
+            if cls._pool is not None:
+                cls._pool.close(wait)
+                cls._pool = None
+        finally:
+            cls._pool_lock.release()
+
+    def _run(self, webservice):
+        """Start the job in the pool and return a unique job ID."""
+        cls = self.__class__
+        pool = cls._get_pool(webservice.config)
+        cls._pool_lock.acquire()
+        try:
+            cls._next_id += 1
+            runid = '%d.%d' % (os.getpid(), cls._next_id)
+            cls._waited_jobs.add(runid)
+        finally:
+            cls._pool_lock.release()
+        def job_finished(error):
+            try:
+                if error:
+                    error = RunnerError("Function %s failed: %s"
+                                        % (self._function, error))
+                e = saliweb.backend.events._CompletedJobEvent(webservice,
+                                                              self, runid,
+                                                              error)
+                webservice._event_queue.put(e)
+            finally:
+                cls._waited_jobs.remove(runid)
+        pool.run(self._directory, self._function, self._args, self._kwargs,
+                 job_finished)
+        return runid
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        """Return True if the job has finished or False if it is still
+           running."""
+        # Jobs run by a previous backend process died with its pool
+        return jobid not in cls._waited_jobs
+Job.register_runner_class(PoolRunner)
+
+
 class _SaliWebJobWaiter(_JobThread):
     """Wait for a job started by SaliWebServiceRunner to finish"""
     _start_interval = 10
@@ -1826,8 +3601,13 @@ class _SaliWebJobWaiter(_JobThread):
                 time.sleep(interval)
                 if interval < 1200:
                     interval = interval * 3 / 2
-                results = saliweb.web_service.get_results(self._runid)
+                web_service = self._runner._get_web_service()
+                results = web_service.iter_results(self._runid)
                 if results is not None:
+                    # Read all of the results (a chunk at a time) so that
+                    # they are cached for when the job is completed
+                    for result in results:
+                        pass
                     e = saliweb.backend.events._CompletedJobEvent(
                                 self._webservice, self._runner, self._runid,
                                 None)
@@ -1846,17 +3626,73 @@ class SaliWebServiceResult(object):
 
     def get_filename(self):
         """Return the name of the file corresponding to this result."""
+        import urlparse
         return os.path.basename(urlparse.urlparse(self.url)[2])
 
-    def download(self, fh=None):
+    def download(self, fh=None, checksum=None, directory=None):
         """Download the result file. If `fh` is given, it should be a Python
            file-like object, to which the file is written. Otherwise, the file
-           is written into the job directory with the same name."""
-        fin = urllib.urlopen(self.url)
+           is written into the job directory (or `directory`, if given) with
+           the same name, and if the download is interrupted it is resumed
+           from where it left off. The file is copied a chunk at a time, in
+           binary mode. If `checksum` is given, the file is checked against
+           it (see :func:`saliweb.web_service.download_file`).
+           Return the name of the downloaded file (or None if `fh` is
+           given)."""
+        import saliweb.web_service
         if fh is None:
-            fh = open(self.get_filename(), 'w')
-        for line in fin:
-            fh.write(line)
+            if directory is None:
+                directory = _get_job_directory()
+            fh = os.path.join(directory, self.get_filename())
+            saliweb.web_service.download_file(self.url, fh, checksum=checksum)
+            return fh
+        else:
+            saliweb.web_service.download_file(self.url, fh, checksum=checksum)
+
+    @classmethod
+    def download_all(cls, results, directory=None, max_workers=4,
+                     checksums=None):
+        """Download several result files (e.g. all of the results of a
+           job, as passed to :meth:`Job.postprocess`) at once, using up to
+           `max_workers` threads. Each file is written into the job
+           directory (or `directory`, if given). If `checksums` is given,
+           it is a dict of checksums keyed by filename; any file listed
+           there is checked (see :meth:`download`).
+           Return a list of the downloaded file names, in the same order
+           as `results`. If any download fails, the first exception is
+           raised once the others have finished."""
+        import Queue
+        if directory is None:
+            # Worker threads do not have our job context
+            directory = _get_job_directory()
+        checksums = checksums or {}
+        todo = Queue.Queue()
+        for i, r in enumerate(results):
+            todo.put((i, r))
+        filenames = [None] * len(results)
+        errors = []
+        def worker():
+            while True:
+                try:
+                    i, r = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    filenames[i] = r.download(directory=directory,
+                                              checksum=checksums.get(
+                                                        r.get_filename()))
+                except Exception as detail:
+                    errors.append(detail)
+        threads = []
+        for i in range(min(max_workers, len(results))):
+            t = threading.Thread(target=worker)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return filenames
 
 
 class SaliWebServiceRunner(Runner):
@@ -1875,28 +3711,40 @@ class SaliWebServiceRunner(Runner):
 
     _runner_name = 'saliweb'
     _waited_jobs = _LockedJobDict()
+    _cache_enabled = False
 
     def __init__(self, url, args):
         Runner.__init__(self)
         self._url = url
         self._args = args
-        self._directory = os.getcwd()
+        self._directory = _get_job_directory()
+
+    @classmethod
+    def _get_web_service(cls):
+        """Get the saliweb.web_service module, with its on-disk cache of
+           responses enabled, so that checking on a job several times
+           does not always need a request to the other web service."""
+        import saliweb.web_service
+        if not cls._cache_enabled:
+            cls._cache_enabled = True
+            try:
+                saliweb.web_service.enable_cache()
+            except OSError:
+                pass # Cache directory not writable; just don't cache
+        return saliweb.web_service
 
     def _run(self, webservice):
         """Run the command and return a unique job ID."""
+        web_service = self._get_web_service()
         open(os.path.join(self._directory, 'job-state'), 'w').write('STARTED')
-        cwd = os.getcwd()
-        try:
-            os.chdir(self._directory)
-            runid = saliweb.web_service.submit_job(self._url, self._args)
-        finally:
-            os.chdir(cwd)
+        runid = web_service.submit_job(self._url, self._args,
+                                       directory=self._directory)
         _SaliWebJobWaiter(webservice, self, runid).start()
         return runid
 
     @classmethod
     def _get_results(cls, jobid, directory):
-        results = saliweb.web_service.get_results(jobid)
+        results = cls._get_web_service().get_results(jobid)
         if results is not None:
             open(os.path.join(directory, 'job-state'), 'w').write('DONE')
             return results
@@ -1924,7 +3772,7 @@ class DoNothingRunner(Runner):
 
     def __init__(self):
         Runner.__init__(self)
-        self._directory = os.getcwd()
+        self._directory = _get_job_directory()
 
     def _run(self, webservice):
         """Run and complete immediately"""
@@ -1943,3 +3791,45 @@ class DoNothingRunner(Runner):
         # Jobs complete immediately
         return True
 Job.register_runner_class(DoNothingRunner)
+
+
+class _RetryRunner(Runner):
+    """Stand-in runner for jobs that are waiting to be run again after a
+       transient error. The runner ID is the time (in seconds since the
+       epoch) when the job is due to be run."""
+
+    _runner_name = 'retry'
+
+    @classmethod
+    def _get_due_time(cls, runner_id):
+        """Get the time a job with the given runner ID is due to be run
+           again, or None if it is not waiting to be retried."""
+        if runner_id and runner_id.startswith(cls._runner_name + ':'):
+            return float(runner_id[len(cls._runner_name) + 1:])
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        # The job is not running; it is started again by a _RetryJobEvent
+        return False
+Job.register_runner_class(_RetryRunner)
+
+
+class _SubmittingRunner(Runner):
+    """Stand-in runner for jobs that are being submitted in the background
+       (see :class:`_Submitter`). The runner ID is the name of the runner
+       that is being submitted."""
+
+    _runner_name = 'submitting'
+
+    @classmethod
+    def _get_runner_name(cls, runner_id):
+        """Get the name of the runner being submitted for a job with the
+           given runner ID, or None if the job is not being submitted."""
+        if runner_id and runner_id.startswith(cls._runner_name + ':'):
+            return runner_id[len(cls._runner_name) + 1:]
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        # The job can't finish before it has been submitted
+        return False
+Job.register_runner_class(_SubmittingRunner)
@@ -0,0 +1,127 @@
+from __future__ import print_function
+import datetime
+import re
+import sys
+
+# Number of jobs to update in each database transaction
+batch_size = 100
+
+_time_formats = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def add_select_options(parser):
+    """Add options to select jobs by something other than their name"""
+    parser.add_option("-u", "--user", dest="user", default=None,
+                      help="Only select jobs submitted by USER")
+    parser.add_option("--after", dest="after", default=None, metavar="TIME",
+                      help="Only select jobs submitted at or after TIME "
+                           "(UTC, as YYYY-MM-DD or 'YYYY-MM-DD HH:MM')")
+    parser.add_option("--before", dest="before", default=None,
+                      metavar="TIME",
+                      help="Only select jobs submitted before TIME")
+    parser.add_option("--failure", dest="failure", default=None,
+                      metavar="REGEX",
+                      help="Only select jobs whose failure message matches "
+                           "the regular expression REGEX")
+    parser.add_option("--stdin", action="store_true", dest="stdin",
+                      default=False,
+                      help="Read job names (separated by whitespace) from "
+                           "standard input, in addition to any given on the "
+                           "command line")
+
+
+def parse_time(parser, value):
+    """Convert a time given on the command line to a datetime"""
+    for fmt in _time_formats:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    parser.error("Invalid time %s; use YYYY-MM-DD or 'YYYY-MM-DD HH:MM'"
+                 % value)
+
+
+def check_select_options(parser, opts):
+    """Check options added by add_select_options, and convert them to
+       Python objects"""
+    if opts.after is not None:
+        opts.after = parse_time(parser, opts.after)
+    if opts.before is not None:
+        opts.before = parse_time(parser, opts.before)
+    if opts.failure is not None:
+        try:
+            opts.failure = re.compile(opts.failure)
+        except re.error as detail:
+            parser.error("Invalid regular expression %s: %s"
+                         % (opts.failure, str(detail)))
+
+
+def has_predicates(opts):
+    """Return True if jobs are to be selected by something other than
+       their name"""
+    return opts.user is not None or opts.after is not None \
+           or opts.before is not None or opts.failure is not None
+
+
+def get_names(opts, args):
+    """Get the list of job names given on the command line and/or stdin,
+       or None if no names were given."""
+    names = list(args)
+    if opts.stdin:
+        names.extend(sys.stdin.read().split())
+    if names or opts.stdin:
+        return names
+
+
+def select_jobs(web, opts, states, names):
+    """Get a list of all jobs in any of the given states that match the
+       given names (if not None) and the selection options, with a single
+       database query. A warning is printed for any names that were not
+       found."""
+    jobs = list(web.db._get_jobs(states=states, names=names, user=opts.user,
+                                 submitted_after=opts.after,
+                                 submitted_before=opts.before,
+                                 order_by='submit_time'))
+    if opts.failure is not None:
+        jobs = [j for j in jobs
+                if opts.failure.search(j._metadata['failure'] or '')]
+    if names is not None:
+        found = dict.fromkeys(j.name for j in jobs)
+        for name in names:
+            if name not in found:
+                print("Could not find job", name, file=sys.stderr)
+    return jobs
+
+
+def confirm(prompt):
+    """Ask the user a yes/no question"""
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    reply = sys.stdin.readline()
+    return len(reply) >= 1 and reply[0].upper() == 'Y'
+
+
+def confirm_each(jobs, verb):
+    """Ask the user about each job in turn (e.g. "Delete job foo?" if
+       `verb` is "Delete"), and return a list of only the confirmed jobs.
+       This should be done before calling :func:`process_jobs`, so that
+       no database transaction is held open while waiting for the user."""
+    return [job for job in jobs if confirm("%s job %s? " % (verb, job.name))]
+
+
+def process_jobs(web, jobs, func, verb):
+    """Call `func` for each job. The jobs are processed in batches, with
+       a single database transaction per batch. If there are many jobs,
+       progress is reported on stderr."""
+    report = len(jobs) > batch_size
+    for start in range(0, len(jobs), batch_size):
+        web.db._begin_batch()
+        try:
+            for job in jobs[start:start + batch_size]:
+                func(job)
+        finally:
+            web.db._end_batch()
+        if report:
+            print("%s %d of %d jobs" % (verb,
+                                        min(start + batch_size, len(jobs)),
+                                        len(jobs)), file=sys.stderr)
@@ -0,0 +1,297 @@
+"""Support for submitting jobs to multiple SGE cells from one backend.
+
+   DRMAA can only talk to a single cell per process (and is configured via
+   environment variables), so each cell is handled by its own helper
+   subprocess, running :func:`_helper_main`, which holds the DRMAA session.
+   The backend talks to each helper over a pipe using one JSON object per
+   line; requests carry an ID so that several (e.g. a long-running 'wait'
+   and a 'run') can be outstanding at once.
+"""
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+class _HelperError(Exception):
+    """Exception raised when a cell's DRMAA helper reports an error"""
+    def __init__(self, msg, exc_type=None):
+        Exception.__init__(self, msg)
+        self.exc_type = exc_type
+
+
+def _helper_handle(drmaa, s, req, write):
+    """Handle a single request in the helper process"""
+    reply = {'id': req['id']}
+    try:
+        op = req['op']
+        if op == 'run':
+            jt = s.createJobTemplate()
+            jt.nativeSpecification = req['native']
+            jt.remoteCommand = req['script']
+            jt.workingDirectory = req['directory']
+            if req.get('tasks'):
+                first, last, step = req['tasks']
+                reply['jobids'] = list(s.runBulkJobs(jt, first, last, step))
+            else:
+                reply['jobids'] = [s.runJob(jt)]
+            s.deleteJobTemplate(jt)
+        elif op == 'status':
+            try:
+                s.jobStatus(req['jobid'])
+                reply['done'] = False
+            except drmaa.InvalidJobException:
+                reply['done'] = True
+        elif op == 'wait':
+            jobids = req['jobids']
+            s.synchronize(jobids, drmaa.Session.TIMEOUT_WAIT_FOREVER, False)
+            reply['failed'] = [j for j in jobids
+                               if not s.wait(j,
+                                        drmaa.Session.TIMEOUT_WAIT_FOREVER)]
+        else:
+            raise ValueError("Unknown request: " + op)
+    except Exception as detail:
+        reply['error'] = str(detail)
+        reply['type'] = detail.__class__.__name__
+    write(reply)
+
+
+def _helper_main():
+    """Main loop of a cell's DRMAA helper subprocess. The environment
+       should already be set up for the cell."""
+    import drmaa
+    s = drmaa.Session()
+    s.initialize()
+    lock = threading.Lock()
+    out = sys.stdout
+    def write(reply):
+        lock.acquire()
+        try:
+            out.write(json.dumps(reply) + '\n')
+            out.flush()
+        finally:
+            lock.release()
+    try:
+        for line in iter(sys.stdin.readline, ''):
+            req = json.loads(line)
+            t = threading.Thread(target=_helper_handle,
+                                 args=(drmaa, s, req, write))
+            t.setDaemon(True)
+            t.start()
+    finally:
+        s.exit()
+
+
+class _CellHelper(object):
+    """Client side of a cell's DRMAA helper subprocess. This can be used by
+       multiple threads at once. The helper is started on first use, and
+       restarted if it exits."""
+
+    def __init__(self, env):
+        self._env = env
+        self._lock = threading.Lock()
+        self._proc = None
+        self._next_id = 0
+        self._pending = {}
+
+    def _get_env(self):
+        env = dict(os.environ)
+        for key in list(env.keys()):
+            if key.startswith('SGE_'):
+                del env[key]
+        env.update(self._env)
+        # Make sure the helper can find this module
+        topdir = os.path.dirname(os.path.dirname(os.path.dirname(
+                                               os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join([topdir]
+                           + [x for x in [env.get('PYTHONPATH')] if x])
+        return env
+
+    def _start(self):
+        self._proc = subprocess.Popen([sys.executable, '-c',
+                        'import saliweb.backend.cluster as c; c._helper_main()'],
+                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                        env=self._get_env())
+        t = threading.Thread(target=self._read_replies, args=(self._proc,))
+        t.setDaemon(True)
+        t.start()
+
+    def _read_replies(self, proc):
+        for line in iter(proc.stdout.readline, ''):
+            reply = json.loads(line)
+            self._lock.acquire()
+            try:
+                waiter = self._pending.pop(reply['id'], None)
+            finally:
+                self._lock.release()
+            if waiter is not None:
+                waiter[1] = reply
+                waiter[0].set()
+        # The helper exited; fail anything still outstanding
+        proc.wait()
+        self._lock.acquire()
+        try:
+            if self._proc is proc:
+                self._proc = None
+            pending = self._pending
+            self._pending = {}
+        finally:
+            self._lock.release()
+        for waiter in pending.values():
+            waiter[1] = {'error': 'DRMAA helper exited with code %d'
+                                  % proc.returncode}
+            waiter[0].set()
+
+    def call(self, op, **keys):
+        """Send a request to the helper, wait for the reply and return it.
+           A :exc:`_HelperError` is raised if the request failed."""
+        waiter = [threading.Event(), None]
+        self._lock.acquire()
+        try:
+            if self._proc is None:
+                self._start()
+            self._next_id += 1
+            keys['id'] = self._next_id
+            keys['op'] = op
+            self._pending[self._next_id] = waiter
+            try:
+                self._proc.stdin.write(json.dumps(keys) + '\n')
+                self._proc.stdin.flush()
+            except IOError as detail:
+                del self._pending[self._next_id]
+                raise _HelperError("Could not talk to DRMAA helper: %s"
+                                   % detail)
+        finally:
+            self._lock.release()
+        waiter[0].wait()
+        reply = waiter[1]
+        if 'error' in reply:
+            raise _HelperError(reply['error'], reply.get('type'))
+        return reply
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            proc = self._proc
+            self._proc = None
+        finally:
+            self._lock.release()
+        if proc is not None:
+            proc.stdin.close()
+            proc.wait()
+
+
+def _parse_pending_jobs(lines, now):
+    """Parse the output of 'qstat -s p' and return the number of pending
+       jobs and their mean wait so far, in seconds"""
+    count = 0
+    total_wait = 0.
+    for line in lines:
+        fields = line.split()
+        # job-ID prior name user state submit-date submit-time ...
+        if len(fields) < 7 or not fields[0].isdigit():
+            continue
+        try:
+            submit = datetime.datetime.strptime(fields[5] + ' ' + fields[6],
+                                                '%m/%d/%Y %H:%M:%S')
+        except ValueError:
+            continue
+        count += 1
+        wait = now - submit
+        total_wait += max(wait.days * 86400 + wait.seconds, 0)
+    if count == 0:
+        return 0, 0.
+    return count, total_wait / count
+
+
+class _Cell(object):
+    """A single SGE cell that jobs can be routed to"""
+
+    #: How long to cache the cell's queue state, in seconds
+    load_cache_time = 30.
+
+    def __init__(self, name, env, qstat):
+        self.name = name
+        self.env = env
+        self.qstat = qstat
+        self.helper = _CellHelper(env)
+        self._lock = threading.Lock()
+        self._load = None
+        self._load_time = None
+        self._submitted = 0
+
+    def _query_load(self):
+        """Get the number of pending jobs and their mean wait, in seconds"""
+        p = subprocess.Popen([self.qstat, '-s', 'p', '-u', '*'],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             env=self.env)
+        out = p.stdout.readlines()
+        ret = p.wait()
+        if ret != 0:
+            raise OSError("qstat returned %d (%s)" % (ret, "".join(out)))
+        # qstat reports times in local time
+        return _parse_pending_jobs(out, datetime.datetime.now())
+
+    def get_score(self):
+        """Get a score for the load on this cell; the job will be routed to
+           the cell with the lowest score. This is based on the number of
+           jobs waiting in the queue and how long they have waited so far.
+           Jobs that we submitted since the queue was last checked are
+           counted too, so that bursts of jobs are spread across cells."""
+        self._lock.acquire()
+        try:
+            now = time.time()
+            if self._load is None or now - self._load_time \
+                                     > self.load_cache_time:
+                self._load = self._query_load()
+                self._load_time = now
+                self._submitted = 0
+            pending, wait = self._load
+            return (pending + self._submitted + 1) * (1. + wait / 60.)
+        finally:
+            self._lock.release()
+
+    def job_submitted(self):
+        self._lock.acquire()
+        self._submitted += 1
+        self._lock.release()
+
+
+class _CellRegistry(object):
+    """All SGE cells that jobs can be routed to"""
+
+    def __init__(self):
+        self._cells = {}
+        self._order = []
+
+    def add(self, name, env, qstat):
+        if '/' in name or ':' in name:
+            raise ValueError("Invalid cell name: " + name)
+        if name not in self._cells:
+            self._order.append(name)
+        self._cells[name] = _Cell(name, env, qstat)
+
+    def get(self, name):
+        return self._cells[name]
+
+    def choose(self):
+        """Choose the least loaded cell. Cells whose load cannot be
+           determined (e.g. qstat fails) are skipped."""
+        best = None
+        errors = []
+        for name in self._order:
+            cell = self._cells[name]
+            try:
+                score = cell.get_score()
+            except (OSError, IOError) as detail:
+                errors.append("%s: %s" % (name, detail))
+                continue
+            if best is None or score < best[0]:
+                best = (score, cell)
+        if best is None:
+            raise OSError("No SGE cell is available: " + "; ".join(errors))
+        return best[1]
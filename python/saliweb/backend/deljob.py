@@ -1,5 +1,6 @@
 from __future__ import print_function
 import saliweb.backend
+import saliweb.backend.bulk
 from optparse import OptionParser
 import sys
 
@@ -7,9 +8,14 @@ import sys
 def get_options():
     parser = OptionParser()
     parser.set_usage("""
-%prog [-h] [-f] STATE JOBNAME [...]
+%prog [-h] [-f] [selection options] STATE [JOBNAME ...]
 
-Delete the job(s) JOBNAME in the given STATE.
+Delete the job(s) JOBNAME in the given STATE. Instead of (or as well as)
+naming the jobs, all jobs in STATE that match the selection options can be
+deleted; for example, to delete all FAILED jobs submitted by user 'foo'
+before 2016:
+
+  %prog -u foo --before 2016-01-01 FAILED
 
 STATE must be either FAILED or EXPIRED if the backend daemon is running.
 Jobs in other states can only be deleted if the backend is stopped first.
@@ -17,21 +23,18 @@ Jobs in other states can only be deleted if the backend is stopped first.
     parser.add_option("-f", "--force", action="store_true",
                       default=False, dest="force",
                       help="Delete jobs without prompting")
+    saliweb.backend.bulk.add_select_options(parser)
     opts, args = parser.parse_args()
-    if len(args) < 2:
-        parser.error("Need to specify a state and at least one job name")
+    saliweb.backend.bulk.check_select_options(parser, opts)
+    if len(args) < 1 or (len(args) < 2 and not opts.stdin
+                         and not saliweb.backend.bulk.has_predicates(opts)):
+        parser.error("Need to specify a state and at least one job name "
+                     "or selection option")
+    if opts.stdin and not opts.force:
+        parser.error("--stdin can only be used together with --force")
     return args[0], args[1:], opts
 
 
-def delete_job(job, force):
-    if not force:
-        sys.stdout.write("Delete job %s? " % job.name)
-        reply = sys.stdin.readline()
-        if len(reply) < 1 or reply[0].upper() != 'Y':
-            return
-    job.delete()
-
-
 def check_valid_state(web, state):
     # Check for valid state name
     jobstate = saliweb.backend._JobState(state)
@@ -45,9 +48,19 @@ def main(webservice):
     state, job_names, opts = get_options()
     web = webservice.get_web_service(webservice.config)
     check_valid_state(web, state)
-    for name in job_names:
-        job = web.get_job_by_name(state, name)
-        if job:
-            delete_job(job, opts.force)
-        else:
-            print("Could not find job", name, file=sys.stderr)
+    bulk = saliweb.backend.bulk
+    jobs = bulk.select_jobs(web, opts, [state],
+                            bulk.get_names(opts, job_names))
+    force = opts.force
+    if bulk.has_predicates(opts):
+        if not jobs:
+            print("No matching jobs found", file=sys.stderr)
+            return
+        if not force:
+            if not bulk.confirm("Delete %d job(s) in %s state? "
+                                % (len(jobs), state)):
+                return
+            force = True
+    if not force:
+        jobs = bulk.confirm_each(jobs, "Delete")
+    bulk.process_jobs(web, jobs, lambda job: job.delete(), "Deleted")
@@ -0,0 +1,58 @@
+from __future__ import print_function
+import saliweb.backend
+from optparse import OptionParser
+import sys
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [-n NUM] [STATE]
+
+Show the disk space used by jobs in each state, and the jobs that use
+the most disk space (optionally only those in the given STATE).
+
+This only works if the track_disk_usage option is turned on in the
+configuration file. Sizes are those measured when each job last changed
+state (or was archived), so are only approximate for RUNNING jobs.
+""")
+    parser.add_option("-n", "--num", type="int", default=20, dest="num",
+                      help="Number of jobs to show (default 20)")
+    opts, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error("Specify at most one state")
+    elif len(args) == 1:
+        # Check for valid state name
+        saliweb.backend._JobState(args[0])
+        return args[0], opts
+    else:
+        return None, opts
+
+
+def format_size(size):
+    """Format a size in bytes as a human-readable string"""
+    for suffix in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            return "%.1f%s" % (size, suffix)
+        size /= 1024.
+    return "%.1fT" % size
+
+
+def main(webservice):
+    state, opts = get_options()
+    web = webservice.get_web_service(webservice.config)
+    if not web.config.backend.get('track_disk_usage', False):
+        print("Disk usage tracking is not turned on for this service; set "
+              "track_disk_usage in the [backend] section of the "
+              "configuration file", file=sys.stderr)
+        sys.exit(1)
+    usage = web.db._get_disk_usage_by_state()
+    print("%-15s %10s %10s" % ("State", "Size", "Files"))
+    for s in saliweb.backend._JobState.get_valid_states():
+        if s in usage:
+            size, nfiles = usage[s]
+            print("%-15s %10s %10d" % (s, format_size(size), nfiles))
+    print()
+    print("%-40s %-15s %10s %10s" % ("Job", "State", "Size", "Files"))
+    for name, s, size, nfiles in web.db._get_top_disk_usage(opts.num, state):
+        print("%-40s %-15s %10s %10d" % (name, s, format_size(size), nfiles))
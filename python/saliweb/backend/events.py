@@ -1,5 +1,6 @@
 import threading
 import select
+import socket
 import time
 import collections
 
@@ -30,6 +31,14 @@ class _EventQueue(object):
         self.lock.release()
         return item
 
+    def qsize(self):
+        """Get the number of items currently in the queue"""
+        self.lock.acquire()
+        try:
+            return len(self.queue)
+        finally:
+            self.lock.release()
+
 
 class _PeriodicCheckEvent(object):
     """Event that represents a periodic check for incoming or completed jobs"""
@@ -77,23 +86,117 @@ class _PeriodicCheck(_JobThread):
                                                      self._webservice))
 
 
+class _JobDoneEvent(object):
+    """Event that represents a job telling us that it has finished"""
+    def __init__(self, webservice, runner_id):
+        self.webservice = webservice
+        self.runner_id = runner_id
+
+    def process(self):
+        self.webservice._job_done(self.runner_id)
+
+
+class _RecheckJobEvent(object):
+    """Event that represents a scheduled recheck of a running job"""
+    def __init__(self, webservice, name):
+        self.webservice = webservice
+        self.name = name
+
+    def process(self):
+        self.webservice._recheck_job(self.name)
+
+
+class _RetryJobEvent(object):
+    """Event that represents a scheduled retry of a job after a transient
+       error"""
+    def __init__(self, webservice, name):
+        self.webservice = webservice
+        self.name = name
+
+    def process(self):
+        self.webservice._retry_job(self.name)
+
+
+def _get_socket_event(webservice, msg):
+    """Get the event corresponding to a message sent to the service
+       socket. Jobs send "DONE <runner_id>" when they finish; anything
+       else (usually "INCOMING <jobname>" from the frontend) is taken to
+       mean that there are new incoming jobs."""
+    if msg.startswith('DONE '):
+        return _JobDoneEvent(webservice, msg[5:].strip())
+    else:
+        return _IncomingJobsEvent(webservice)
+
+
 class _IncomingJobs(_JobThread):
-    """Wait for new incoming jobs"""
+    """Wait for new incoming jobs, or messages from finished jobs.
+       The monitor admin tool can also send "STATUS", to which we reply
+       with the daemon's current statistics (see :class:`_DaemonStats`)
+       in JSON format rather than adding an event to the queue."""
+    _read_timeout = 5.
+
     def __init__(self, webservice, sock):
         _JobThread.__init__(self, webservice)
         self._sock = sock
 
+    def _read_message(self, conn):
+        """Read a short message from the connection, giving up if the
+           client does not send it promptly"""
+        conn.settimeout(self._read_timeout)
+        try:
+            return conn.recv(4096)
+        except socket.error:
+            return ''
+
+    def _send_status(self, conn):
+        import json
+        stats = self._webservice._stats
+        if stats is None:
+            status = {}
+        else:
+            status = stats.snapshot(self._webservice._event_queue.qsize())
+        try:
+            conn.sendall(json.dumps(status))
+        except socket.error:
+            pass
+
     def run(self):
-        # Simply emit an IncomingJobsEvent whenever the listening socket is
-        # connected to
+        # Emit an event whenever the listening socket is connected to
         while True:
             rlist, wlist, xlist = select.select([self._sock], [], [])
-            # Note that currently we don't do anything with the
-            # message itself coming in on the socket
+            msg = ''
             if len(rlist) == 1:
                 conn, addr = self._sock.accept()
+                try:
+                    msg = self._read_message(conn)
+                    if msg.startswith('STATUS'):
+                        self._send_status(conn)
+                        continue
+                finally:
+                    conn.close()
+            stats = self._webservice._stats
+            if stats is not None and msg.startswith('INCOMING '):
+                stats.job_incoming(msg[9:].strip())
             q = self._webservice._event_queue
-            q.put(_IncomingJobsEvent(self._webservice))
+            q.put(_get_socket_event(self._webservice, msg))
+
+
+class _JobNotifications(_IncomingJobs):
+    """Wait for messages from finished jobs on the network socket (see the
+       notify_port backend option). Unlike the service socket, anything
+       on the network can connect to this, so only "DONE" messages are
+       accepted."""
+
+    def run(self):
+        while True:
+            conn, addr = self._sock.accept()
+            try:
+                msg = self._read_message(conn)
+            finally:
+                conn.close()
+            if msg.startswith('DONE '):
+                self._webservice._event_queue.put(
+                          _JobDoneEvent(self._webservice, msg[5:].strip()))
 
 
 class _OldJobsEvent(object):
@@ -138,3 +241,6 @@ class _CompletedJobEvent(object):
         job = self.webservice._get_job_by_runner_id(self.runner, self.runid)
         if job:
             job._try_complete(self.webservice, self.run_exception)
+        elif self.webservice._submitter is not None:
+            # The job may have finished before we heard it was submitted
+            self.webservice._submitter.defer_completion(self)
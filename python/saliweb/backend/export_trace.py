@@ -0,0 +1,153 @@
+from __future__ import print_function
+from optparse import OptionParser
+import collections
+import datetime
+import calendar
+import gzip
+
+_header = '# saliweb job trace 1'
+
+_states = ['COMPLETED', 'ARCHIVED', 'EXPIRED']
+
+#: A single job in a trace. `submit` is the time in seconds since the first
+#: job in the trace was submitted; `preprocess`, `run` and `postprocess` are
+#: the time in seconds spent in each step (or None if the job skipped it);
+#: and `disk_usage` is the size in bytes of the job directory when it was
+#: last measured (or None if this is not known).
+TraceJob = collections.namedtuple('TraceJob',
+                                  ['name', 'submit', 'preprocess', 'run',
+                                   'postprocess', 'state', 'disk_usage'])
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [-d DAYS] FILE
+
+Write the submit time of each finished job, and the time it spent in each
+step, to a compact trace FILE (compressed if the name ends in .gz). The
+trace can be replayed with different configurations (e.g. with the
+test/benchmark/replay_trace.py script from the saliweb source) to see how
+the settings in the [limits], [backend] and [oldjobs] sections of the
+configuration file would affect the service.
+
+Only jobs in the COMPLETED, ARCHIVED and EXPIRED states are exported, as
+only these have timestamps for every step.
+""")
+    parser.add_option("-d", "--days", type="float", default=None,
+                      dest="days",
+                      help="Only export jobs submitted in the last DAYS "
+                           "days (default: all jobs)")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Specify a single trace file")
+    return args[0], opts
+
+
+def open_trace(filename, mode='r'):
+    """Open a trace file for reading or writing"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 'b')
+    else:
+        return open(filename, mode)
+
+
+def _get_seconds(t):
+    if t is not None:
+        return calendar.timegm(t.timetuple())
+
+
+def _get_interval(start, end):
+    if start is not None and end is not None:
+        return end - start
+
+
+def _format_value(value):
+    if value is None:
+        return '-'
+    else:
+        return '%d' % value
+
+
+def _parse_value(value, func):
+    if value == '-':
+        return None
+    else:
+        return func(value)
+
+
+def write_trace(fh, rows):
+    """Write a trace to the file-like object `fh`. `rows` should be an
+       iterable of (name, state, submit_time, preprocess_time, run_time,
+       postprocess_time, end_time, disk_usage) tuples, sorted by submit
+       time, as returned by the database. Return the number of jobs
+       written."""
+    print(_header, file=fh)
+    print("# " + "\t".join(TraceJob._fields), file=fh)
+    first = None
+    num = 0
+    for (name, state, submit_time, preprocess_time, run_time,
+         postprocess_time, end_time, disk_usage) in rows:
+        submit_time = _get_seconds(submit_time)
+        preprocess_time = _get_seconds(preprocess_time)
+        run_time = _get_seconds(run_time)
+        postprocess_time = _get_seconds(postprocess_time)
+        end_time = _get_seconds(end_time)
+        if submit_time is None:
+            continue
+        if first is None:
+            first = submit_time
+            print("# start %s" % datetime.datetime.utcfromtimestamp(first)
+                                         .strftime('%Y-%m-%d %H:%M:%S'),
+                  file=fh)
+        # Jobs that skip their run (see Job.skip_run) go straight from
+        # preprocessing to completion
+        preprocess = _get_interval(preprocess_time, run_time or end_time)
+        fields = [name, _format_value(submit_time - first),
+                  _format_value(preprocess),
+                  _format_value(_get_interval(run_time, postprocess_time)),
+                  _format_value(_get_interval(postprocess_time, end_time)),
+                  state, _format_value(disk_usage)]
+        print("\t".join(fields), file=fh)
+        num += 1
+    return num
+
+
+def read_trace(fh):
+    """Read a trace from the file-like object `fh`, as a generator of
+       :class:`TraceJob` objects in order of submission."""
+    line = fh.readline()
+    if line.rstrip('\r\n') != _header:
+        raise ValueError("Not a saliweb job trace file")
+    for line in fh:
+        if line.startswith('#'):
+            continue
+        fields = line.rstrip('\r\n').split('\t')
+        if len(fields) != len(TraceJob._fields):
+            raise ValueError("Invalid line in trace file: " + line)
+        name, submit, preprocess, run, postprocess, state, disk_usage = fields
+        yield TraceJob(name, float(submit), _parse_value(preprocess, float),
+                       _parse_value(run, float),
+                       _parse_value(postprocess, float), state,
+                       _parse_value(disk_usage, int))
+
+
+def main(webservice):
+    filename, opts = get_options()
+    web = webservice.get_web_service(webservice.config)
+    fields = ['name', 'state', 'submit_time', 'preprocess_time', 'run_time',
+              'postprocess_time', 'end_time']
+    if web.config.backend.get('track_disk_usage', False):
+        fields.append('disk_usage')
+    else:
+        fields.append('NULL')
+    keys = {}
+    if opts.days is not None:
+        keys['submitted_after'] = datetime.datetime.utcnow() \
+                                  - datetime.timedelta(days=opts.days)
+    fh = open_trace(filename, 'w')
+    try:
+        num = write_trace(fh, web.db._list_jobs(fields, _states, **keys))
+    finally:
+        fh.close()
+    print("Exported %d jobs to %s" % (num, filename))
@@ -1,5 +1,6 @@
 from __future__ import print_function
 import saliweb.backend
+import saliweb.backend.bulk
 from optparse import OptionParser
 import sys
 
@@ -7,13 +8,18 @@ import sys
 def get_options():
     parser = OptionParser()
     parser.set_usage("""
-%prog [-h] [-n] JOBNAME [...]
+%prog [-h] [-n] [-f] [selection options] [JOBNAME ...]
 
-Force the job(s) JOBNAME into the FAILED state.
+Force the job(s) JOBNAME into the FAILED state. Instead of (or as well as)
+naming the jobs, all jobs that match the selection options can be failed;
+for example, to fail all COMPLETED jobs submitted by user 'foo' today:
+
+  %prog -s COMPLETED -u foo --after 2016-06-01
 
 This can only be done if the backend daemon is stopped first.
 By default, the server admin will receive an email for each failed job, just
-as if it failed "normally". This can be suppressed with the -n option.
+as if it failed "normally" (if many jobs are failed at once, these are
+grouped into digest emails). This can be suppressed with the -n option.
 """)
     parser.add_option("-n", "--no-email", action="store_false",
                       default=True, dest="email",
@@ -21,21 +27,26 @@ as if it failed "normally". This can be suppressed with the -n option.
     parser.add_option("-f", "--force", action="store_true",
                       default=False, dest="force",
                       help="Fail jobs without prompting")
+    parser.add_option("-s", "--state", action="append", dest="states",
+                      default=None, metavar="STATE",
+                      help="Only select jobs in STATE (can be given "
+                           "multiple times; default all states)")
+    saliweb.backend.bulk.add_select_options(parser)
     opts, args = parser.parse_args()
-    if len(args) < 1:
-        parser.error("Need to specify at least one job name")
+    saliweb.backend.bulk.check_select_options(parser, opts)
+    if len(args) < 1 and not opts.stdin and opts.states is None \
+       and not saliweb.backend.bulk.has_predicates(opts):
+        parser.error("Need to specify at least one job name or "
+                     "selection option")
+    if opts.stdin and not opts.force:
+        parser.error("--stdin can only be used together with --force")
+    for state in opts.states or []:
+        # Check for valid state name
+        if state not in saliweb.backend._JobState.get_valid_states():
+            parser.error("Invalid job state %s" % state)
     return args, opts
 
 
-def fail_job(job, force, email):
-    if not force:
-        sys.stdout.write("Fail job %s? " % job.name)
-        reply = sys.stdin.readline()
-        if len(reply) < 1 or reply[0].upper() != 'Y':
-            return
-    job.admin_fail(email)
-
-
 def check_daemon_running(web):
     pid = web.get_running_pid()
     if pid is not None:
@@ -43,22 +54,32 @@ def check_daemon_running(web):
                          "Please stop the backend first")
 
 
-def find_job(web, name, all_states):
-    """Find a job in any state"""
-    for state in all_states:
-        job = web.get_job_by_name(state, name)
-        if job:
-            return job
-
-
 def main(webservice):
     job_names, opts = get_options()
     web = webservice.get_web_service(webservice.config)
     check_daemon_running(web)
-    all_states = saliweb.backend._JobState.get_valid_states()
-    for name in job_names:
-        job = find_job(web, name, all_states)
-        if job:
-            fail_job(job, opts.force, opts.email)
-        else:
-            print("Could not find job", name, file=sys.stderr)
+    bulk = saliweb.backend.bulk
+    states = opts.states or saliweb.backend._JobState.get_valid_states()
+    jobs = bulk.select_jobs(web, opts, states,
+                            bulk.get_names(opts, job_names))
+    force = opts.force
+    if bulk.has_predicates(opts) or opts.states is not None:
+        if not jobs:
+            print("No matching jobs found", file=sys.stderr)
+            return
+        if not force:
+            if not bulk.confirm("Fail %d job(s)? " % len(jobs)):
+                return
+            force = True
+    if not force:
+        jobs = bulk.confirm_each(jobs, "Fail")
+    # Group the admin emails rather than sending one per job
+    digest = opts.email and len(jobs) > 1
+    if digest:
+        web.config._start_mail_queue()
+    try:
+        bulk.process_jobs(web, jobs, lambda job: job.admin_fail(opts.email),
+                          "Failed")
+    finally:
+        if digest:
+            web.config._stop_mail_queue()
@@ -0,0 +1,204 @@
+from __future__ import print_function
+import atexit
+import logging
+import os
+import sys
+import threading
+import saliweb.backend.events
+
+
+class _QueuedStream(object):
+    """A file-like object that passes all writes to a :class:`_LogWriter`,
+       which appends them to the named file in a background thread.
+       Like _DelayFileStream, the file is not created until the first
+       write occurs."""
+
+    def __init__(self, filename, writer):
+        self.filename = os.path.abspath(filename)
+        self.writer = writer
+
+    def write(self, txt):
+        self.writer.write(self.filename, txt)
+
+    def flush(self):
+        # logging.StreamHandler flushes after every record; the writer
+        # thread flushes once each batch of records is written instead
+        pass
+
+
+class _LogWriter(object):
+    """Write log records to job log files in a background thread, so that
+       slow (e.g. NFS) writes never block the backend's event loop.
+
+       Per-job log handlers are kept in a small LRU cache, and the writer
+       thread keeps the corresponding files open, so that successive
+       job methods in a burst of processing (e.g. preprocess and run) do
+       not need to set up handlers or reopen log files. The handler and
+       file for a job should be released (see :meth:`release`) before the
+       job directory is moved or removed."""
+
+    def __init__(self, max_handlers=16):
+        self.max_handlers = max_handlers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        # LRU of filename:handler; most recently used last in _lru
+        self._handlers = {}
+        self._lru = []
+
+    def get_handler(self, filename, formatter=None):
+        """Get a log handler that appends to the named file."""
+        filename = os.path.abspath(filename)
+        self._lock.acquire()
+        try:
+            hdlr = self._handlers.get(filename, None)
+            if hdlr is None:
+                hdlr = logging.StreamHandler(_QueuedStream(filename, self))
+                if formatter:
+                    hdlr.setFormatter(formatter)
+                self._handlers[filename] = hdlr
+            else:
+                self._lru.remove(filename)
+            self._lru.append(filename)
+            while len(self._lru) > self.max_handlers:
+                old = self._lru.pop(0)
+                del self._handlers[old]
+                self._put(('close', old, None))
+            return hdlr
+        finally:
+            self._lock.release()
+
+    def write(self, filename, txt):
+        self._lock.acquire()
+        try:
+            self._put(('write', filename, txt))
+        finally:
+            self._lock.release()
+
+    def release(self, filename, wait=False):
+        """Drop the handler for the named file, and close the file once
+           all pending records have been written to it. If `wait` is True,
+           block until that has happened."""
+        filename = os.path.abspath(filename)
+        self._lock.acquire()
+        try:
+            if filename in self._handlers:
+                del self._handlers[filename]
+                self._lru.remove(filename)
+            done = self._put(('close', filename, None), wait)
+        finally:
+            self._lock.release()
+        if done:
+            done.wait()
+
+    def flush(self, close=False):
+        """Block until all pending records have been written. If `close`
+           is True, also drop all handlers and close all log files."""
+        self._lock.acquire()
+        try:
+            if close:
+                self._handlers = {}
+                self._lru = []
+            done = self._put(('flush', None, close), True)
+        finally:
+            self._lock.release()
+        if done:
+            done.wait()
+
+    def stop(self):
+        """Write all pending records, close all log files, and stop the
+           writer thread (it is restarted if anything else is logged)."""
+        self._lock.acquire()
+        try:
+            self._handlers = {}
+            self._lru = []
+            done = self._put(('stop', None, None), True)
+            thread = self._thread
+            if done:
+                self._pid = None
+        finally:
+            self._lock.release()
+        if done:
+            done.wait()
+            thread.join()
+
+    def _put(self, item, wait=False):
+        """Add an operation to the writer queue, starting the writer thread
+           if necessary. If `wait` is True, return an Event that is set once
+           the operation has been processed (or None if there is nothing to
+           wait for)."""
+        if self._pid != os.getpid():
+            # Threads do not survive a fork, so start a new writer in a
+            # child process (any pending records belong to the parent)
+            if item[0] != 'write':
+                return None
+            self._queue = saliweb.backend.events._EventQueue()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.setDaemon(True)
+            self._pid = os.getpid()
+            self._thread.start()
+        done = None
+        if wait:
+            done = threading.Event()
+        self._queue.put(item + (done,))
+        return done
+
+    def _run(self):
+        files = {}
+        queue = self._queue
+        while True:
+            item = queue.get()
+            touched = {}
+            while item is not None:
+                op, filename, data, done = item
+                if op == 'write':
+                    self._write(files, filename, data)
+                    touched[filename] = None
+                else:
+                    self._flush(files, touched)
+                    touched = {}
+                    if op == 'close':
+                        self._close(files, filename)
+                    elif op == 'stop' or data:
+                        for f in list(files.keys()):
+                            self._close(files, f)
+                    if done:
+                        done.set()
+                    if op == 'stop':
+                        return
+                # Handle everything queued so far as a single batch
+                item = queue.get(0)
+            self._flush(files, touched)
+
+    def _write(self, files, filename, txt):
+        try:
+            fh = files.get(filename, None)
+            if fh is None:
+                fh = files[filename] = open(filename, 'a')
+            fh.write(txt)
+        except EnvironmentError as detail:
+            print("Could not write to log file %s: %s" % (filename, detail),
+                  file=sys.stderr)
+
+    def _flush(self, files, touched):
+        for filename in touched:
+            fh = files.get(filename, None)
+            if fh is not None:
+                try:
+                    fh.flush()
+                except EnvironmentError:
+                    pass
+
+    def _close(self, files, filename):
+        fh = files.pop(filename, None)
+        if fh is not None:
+            try:
+                fh.close()
+            except EnvironmentError:
+                pass
+
+
+_writer = _LogWriter()
+# Stop the thread at exit, rather than leaving it blocked while the
+# interpreter shuts down
+atexit.register(_writer.stop)
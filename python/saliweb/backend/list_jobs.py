@@ -1,33 +1,170 @@
 from __future__ import print_function
 import saliweb.backend
+import saliweb.backend.bulk
 from optparse import OptionParser
 import sys
 
+# Database columns shown for each job in JSON and CSV output
+fields = ['name', 'state', 'user', 'submit_time', 'end_time']
+
 
 def get_options():
     parser = OptionParser()
     default_states = ['FAILED', 'INCOMING', 'PREPROCESSING',
                       'POSTPROCESSING', 'FINALIZING', 'RUNNING']
     parser.set_usage("""
-%prog [-h] [STATE ...]
+%prog [-h] [options] [STATE ...]
 
-Print a list of all jobs in the given STATE(s).
+Print a list of all jobs in the given STATE(s), oldest first.
 If no states are given, the following are used by default:
-""" + ", ".join(default_states))
+""" + ", ".join(default_states) + """
+
+Long lists can be shown a page at a time; for example, use '--limit 100' to
+show the first 100 jobs, then '--limit 100 --start-after LASTJOB' to show
+the next 100, where LASTJOB is the name of the last job shown.""")
+    parser.add_option("-u", "--user", dest="user", default=None,
+                      help="Only show jobs submitted by USER")
+    parser.add_option("--after", dest="after", default=None, metavar="TIME",
+                      help="Only show jobs submitted at or after TIME "
+                           "(UTC, as YYYY-MM-DD or 'YYYY-MM-DD HH:MM')")
+    parser.add_option("--before", dest="before", default=None,
+                      metavar="TIME",
+                      help="Only show jobs submitted before TIME")
+    parser.add_option("--name", dest="name", default=None,
+                      metavar="PATTERN",
+                      help="Only show jobs whose name matches PATTERN, "
+                           "which can contain * and ? wildcards")
+    parser.add_option("-c", "--count", action="store_true", dest="count",
+                      default=False,
+                      help="Only show the number of matching jobs in "
+                           "each state")
+    parser.add_option("-l", "--limit", type="int", dest="limit",
+                      default=None, help="Show at most LIMIT jobs")
+    parser.add_option("--start-after", dest="start_after", default=None,
+                      metavar="JOBNAME",
+                      help="Only show jobs that come after JOBNAME in the "
+                           "list")
+    parser.add_option("--format", type="choice", dest="format",
+                      choices=['text', 'json', 'csv'], default='text',
+                      help="Output format: text (default), json or csv")
     opts, args = parser.parse_args()
+    if opts.after is not None:
+        opts.after = saliweb.backend.bulk.parse_time(parser, opts.after)
+    if opts.before is not None:
+        opts.before = saliweb.backend.bulk.parse_time(parser, opts.before)
+    if opts.limit is not None and opts.limit < 1:
+        parser.error("--limit must be at least 1")
     if len(args) < 1:
         args = default_states
-    return args
+    return args, opts
 
 def check_valid_state(state):
     # Check for valid state name
     return saliweb.backend._JobState(state)
 
+
+def glob_to_like(pattern):
+    """Convert a shell-style wildcard pattern to an SQL LIKE pattern"""
+    like = []
+    for c in pattern:
+        if c in '%_!':
+            like.append('!' + c)
+        elif c == '*':
+            like.append('%')
+        elif c == '?':
+            like.append('_')
+        else:
+            like.append(c)
+    return ''.join(like)
+
+
+def format_value(value):
+    """Convert a database value to something that can be output as JSON"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    else:
+        return value
+
+
+def get_filter(opts):
+    """Get the job filter keyword arguments for the given options"""
+    if opts.name is not None:
+        name_like = glob_to_like(opts.name)
+    else:
+        name_like = None
+    return {'user': opts.user, 'submitted_after': opts.after,
+            'submitted_before': opts.before, 'name_like': name_like}
+
+
+def show_counts(web, states, opts):
+    counts = web.db._count_jobs(states, **get_filter(opts))
+    if opts.format == 'json':
+        import json
+        print(json.dumps(dict((s, counts[s]) for s in states)))
+    elif opts.format == 'csv':
+        import csv
+        w = csv.writer(sys.stdout)
+        w.writerow(['state', 'count'])
+        for state in states:
+            w.writerow([state, counts[state]])
+    else:
+        for state in states:
+            print("%-15s %d" % (state, counts[state]))
+        print("%-15s %d" % ("Total", sum(counts.values())))
+
+
+def show_jobs(web, states, opts):
+    if opts.start_after is not None:
+        # Otherwise we would silently show nothing
+        all_states = saliweb.backend._JobState.get_valid_states()
+        counts = web.db._count_jobs(all_states, names=[opts.start_after])
+        if sum(counts.values()) == 0:
+            raise ValueError("Could not find job %s" % opts.start_after)
+    if opts.limit is None:
+        limit = None
+    else:
+        # Get one extra job, to see if there are any more
+        limit = opts.limit + 1
+    rows = web.db._list_jobs(fields, states, after_name=opts.start_after,
+                             limit=limit, **get_filter(opts))
+    if opts.format == 'json':
+        import json
+        def show(row, first):
+            sys.stdout.write((first and '[\n' or ',\n')
+                             + json.dumps(dict(zip(fields,
+                                          [format_value(v) for v in row]))))
+    elif opts.format == 'csv':
+        import csv
+        w = csv.writer(sys.stdout)
+        w.writerow(fields)
+        def show(row, first):
+            w.writerow([format_value(v) for v in row])
+    else:
+        def show(row, first):
+            print("%-60s %s" % (row[0], row[1]))
+    num = 0
+    last = None
+    more = False
+    for row in rows:
+        if opts.limit is not None and num >= opts.limit:
+            more = True
+            continue
+        show(row, num == 0)
+        num += 1
+        last = row[0]
+    if opts.format == 'json':
+        sys.stdout.write(num == 0 and '[]\n' or '\n]\n')
+    if more:
+        print("More jobs are available; use --start-after %s to see them"
+              % last, file=sys.stderr)
+
+
 def main(webservice):
-    states = get_options()
+    states, opts = get_options()
     for state in states:
         check_valid_state(state)
     web = webservice.get_web_service(webservice.config)
-    for state in states:
-        for job in web.db._get_all_jobs_in_state(state, order_by='submit_time'):
-            print("%-60s %s" % (job.name, state))
+    if opts.count:
+        show_counts(web, states, opts)
+    else:
+        show_jobs(web, states, opts)
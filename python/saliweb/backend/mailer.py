@@ -0,0 +1,268 @@
+from __future__ import print_function
+import smtplib
+import subprocess
+import threading
+import time
+import sys
+
+
+class _PipeSocket(object):
+    """A minimal socket-like object that talks to a local mail transfer
+       agent (e.g. 'sendmail -bs') over its standard input and output."""
+
+    def __init__(self, mailer):
+        self._proc = subprocess.Popen([mailer, '-bs'], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE)
+
+    def sendall(self, data):
+        self._proc.stdin.write(data)
+        self._proc.stdin.flush()
+
+    def makefile(self, mode='rb'):
+        return self._proc.stdout
+
+    def close(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+            except IOError:
+                pass
+            self._proc.wait()
+            self._proc = None
+
+
+class _PipeSMTP(smtplib.SMTP):
+    """An SMTP client that delivers mail by running the given local mailer
+       in SMTP mode, rather than connecting to a mail server."""
+
+    def __init__(self, mailer):
+        smtplib.SMTP.__init__(self)
+        self.sock = _PipeSocket(mailer)
+        code, msg = self.getreply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, msg)
+
+    def close(self):
+        if self.file:
+            self.file = None
+        if self.sock:
+            self.sock.close()
+        self.sock = None
+
+
+def _deliver_batch(mailer, sender, batch):
+    """Deliver a batch of email messages in a single session with the
+       mailer. Each item in `batch` is a [to, msg, tries] list. Return a
+       list of the items that could not be delivered but may succeed if
+       retried later, with their number of tries incremented."""
+    failed = []
+    try:
+        smtp = _PipeSMTP(mailer)
+    except (smtplib.SMTPException, EnvironmentError) as detail:
+        print("Could not start mailer: %s" % detail, file=sys.stderr)
+        smtp = None
+    for to, msg, tries in batch:
+        if smtp is None:
+            failed.append([to, msg, tries + 1])
+            continue
+        try:
+            smtp.sendmail(sender, to, msg.as_string())
+        except (smtplib.SMTPRecipientsRefused,
+                smtplib.SMTPSenderRefused) as detail:
+            # Retrying will not help
+            print("Email to %s rejected: %s" % (", ".join(to), detail),
+                  file=sys.stderr)
+        except (smtplib.SMTPException, EnvironmentError) as detail:
+            print("Could not send email to %s: %s" % (", ".join(to), detail),
+                  file=sys.stderr)
+            failed.append([to, msg, tries + 1])
+            if isinstance(detail, (smtplib.SMTPServerDisconnected,
+                                   EnvironmentError)):
+                smtp.close()
+                smtp = None
+    if smtp is not None:
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, EnvironmentError):
+            smtp.close()
+    return failed
+
+
+class _FailureGroup(object):
+    """Failures of jobs that failed with the same error"""
+
+    def __init__(self, error):
+        self.error = error
+        self.jobs = []
+        self.samples = []
+
+
+class _MailQueue(object):
+    """Deliver email in a background thread, so that the backend does not
+       wait on the mailer. All mail queued since the last delivery is
+       sent in a single SMTP session with the mailer.
+
+       Admin notices about failed jobs are grouped into digests: the first
+       failure is reported immediately, but further failures within the
+       next `digest_interval` seconds are collected and sent as a single
+       email, summarizing how many jobs failed with each error.
+
+       If delivery fails, it is retried (up to `max_tries` times in total)
+       after `retry_interval` seconds."""
+
+    max_tries = 5
+    retry_interval = 60.
+    max_samples = 3
+
+    def __init__(self, config, digest_interval):
+        self.config = config
+        self.digest_interval = digest_interval
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._spool = []
+        self._failures = []
+        self._digest_time = None
+        self._retry_time = None
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self, timeout=60.):
+        """Send all queued mail (and any pending failure digest) and stop
+           the background thread."""
+        self._cond.acquire()
+        self._stopping = True
+        self._cond.notify()
+        self._cond.release()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def put(self, to, msg):
+        """Queue an email message for delivery to the list `to`"""
+        self._cond.acquire()
+        try:
+            self._spool.append([to, msg, 0])
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def add_failure(self, jobname, subject, body, error):
+        """Report the failure of a job to the admin. `error` is the
+           failure reason (a Python traceback)."""
+        self._cond.acquire()
+        try:
+            now = time.time()
+            if self._digest_time is None or self.digest_interval <= 0:
+                # Report the first failure right away, and start collecting
+                # any subsequent failures
+                msg = self.config._make_email(self.config.admin_email,
+                                              subject, body)
+                self._spool.append([[self.config.admin_email], msg, 0])
+                if self.digest_interval > 0:
+                    self._digest_time = now + self.digest_interval
+            else:
+                self._failures.append((jobname, error))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _get_error_key(self, error):
+        """Get the final line of a traceback (usually the exception type and
+           message) to group failures by"""
+        lines = [x for x in error.split('\n') if x.strip()]
+        if lines:
+            return lines[-1].strip()
+        else:
+            return error
+
+    def _make_digest(self):
+        """Make an email summarizing all failures collected so far"""
+        groups = {}
+        order = []
+        for jobname, error in self._failures:
+            key = self._get_error_key(error)
+            g = groups.get(key, None)
+            if g is None:
+                g = groups[key] = _FailureGroup(key)
+                order.append(g)
+            g.jobs.append(jobname)
+            if len(g.samples) < self.max_samples:
+                g.samples.append((jobname, error))
+        order.sort(key=lambda g: len(g.jobs), reverse=True)
+        minutes = self.digest_interval / 60.
+        subject = 'Sali lab %s service: %d more jobs FAILED' \
+                  % (self.config.service_name, len(self._failures))
+        body = ["%d further jobs failed in the %.0f minutes since the last "
+                "failure notice.\n" % (len(self._failures), minutes)]
+        for g in order:
+            body.append("%d jobs failed with: %s" % (len(g.jobs), g.error))
+        for g in order:
+            body.append("\n\n==== %s ====\n" % g.error)
+            body.append("Jobs: " + ", ".join(g.jobs))
+            for jobname, error in g.samples:
+                body.append("\nJob %s failed with the following error:\n%s"
+                            % (jobname, error))
+        self._failures = []
+        return self.config._make_email(self.config.admin_email, subject,
+                                       "\n".join(body))
+
+    def _get_batch(self):
+        """Wait until there is mail to send, and return it. Return None
+           if the queue has been stopped and there is nothing left to do."""
+        self._cond.acquire()
+        try:
+            while True:
+                now = time.time()
+                if self._digest_time is not None \
+                   and (now >= self._digest_time or self._stopping):
+                    if self._failures:
+                        msg = self._make_digest()
+                        self._spool.append([[self.config.admin_email], msg, 0])
+                        # Keep collecting while failures continue
+                        self._digest_time = now + self.digest_interval
+                    else:
+                        self._digest_time = None
+                if self._spool and (self._retry_time is None
+                                    or now >= self._retry_time
+                                    or self._stopping):
+                    batch = self._spool
+                    self._spool = []
+                    return batch
+                if self._stopping:
+                    return None
+                timeout = None
+                for t in (self._digest_time, self._retry_time):
+                    if t is not None and (timeout is None or t - now < timeout):
+                        timeout = max(t - now, 0.)
+                self._cond.wait(timeout)
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            if batch is None:
+                return
+            failed = _deliver_batch(self.config._mailer,
+                                    self.config.admin_email, batch)
+            self._cond.acquire()
+            try:
+                retry = [m for m in failed if m[2] < self.max_tries]
+                for to, msg, tries in failed:
+                    if tries >= self.max_tries or self._stopping:
+                        print("Giving up on delivering email to %s: %s"
+                              % (", ".join(to), msg['Subject']),
+                              file=sys.stderr)
+                if retry and not self._stopping:
+                    self._retry_time = time.time() + self.retry_interval
+                else:
+                    self._retry_time = None
+                if not self._stopping:
+                    self._spool = retry + self._spool
+            finally:
+                self._cond.release()
@@ -0,0 +1,146 @@
+from __future__ import print_function
+from optparse import OptionParser
+import socket
+import json
+import time
+import sys
+
+_states = ['INCOMING', 'PREPROCESSING', 'RUNNING', 'POSTPROCESSING',
+           'FINALIZING', 'COMPLETED', 'FAILED', 'ARCHIVED']
+
+# Maximum number of hooks and users to show
+_max_rows = 10
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [-d SECONDS] [-n NUM]
+
+Show what the backend daemon of a running web service is doing, refreshing
+the display every second (like 'top'). Press Ctrl-C to exit.
+
+All information comes from the daemon itself, not the database, so this
+does not put any extra load on the database server.
+""")
+    parser.add_option("-d", "--delay", type="float", default=1.,
+                      dest="delay",
+                      help="Time in seconds between updates (default 1)")
+    parser.add_option("-n", "--iterations", type="int", default=None,
+                      dest="iterations",
+                      help="Exit after NUM updates (default: run until "
+                           "interrupted)")
+    opts, args = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Wrong number of arguments given")
+    if opts.delay <= 0.:
+        parser.error("--delay must be positive")
+    return opts
+
+
+def get_status(web):
+    """Ask the daemon for its current statistics"""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(10.)
+        s.connect(web.config.socket)
+        s.sendall("STATUS\n")
+        reply = []
+        while True:
+            data = s.recv(65536)
+            if not data:
+                break
+            reply.append(data)
+    finally:
+        s.close()
+    return json.loads(''.join(reply))
+
+
+def format_time(seconds):
+    """Format a time interval in seconds as a human-readable string"""
+    if seconds is None:
+        return '-'
+    elif seconds < 60:
+        return "%.1fs" % seconds
+    elif seconds < 3600:
+        return "%dm%02ds" % divmod(int(seconds), 60)
+    else:
+        hours, seconds = divmod(int(seconds), 3600)
+        return "%dh%02dm" % (hours, seconds // 60)
+
+
+def format_latency(name, latency):
+    if latency['mean'] is None:
+        return "%-8s %8s %8s %8d" % (name, '-', '-', latency['count'])
+    return "%-8s %7.0fms %7.0fms %8d" % (name, latency['mean'] * 1000.,
+                                         latency['max'] * 1000.,
+                                         latency['count'])
+
+
+def format_status(service_name, status, previous):
+    """Get the lines of text to display for the given statistics. The
+       event rate is calculated from the `previous` statistics, if given."""
+    if previous and status['time'] > previous['time']:
+        rate = (status['events'] - previous['events']) \
+               / (status['time'] - previous['time'])
+        rate = "%.1f/s" % rate
+    else:
+        rate = '-'
+    lines = ["%s backend - up %s" % (service_name,
+                                     format_time(status['uptime'])),
+             "Event queue: %d   Events: %d (%s)   Oldest incoming job: %s"
+             % (status['queue_depth'], status['events'], rate,
+                format_time(status['oldest_incoming'])), ""]
+    states = status['states']
+    lines.append("  ".join("%s %d" % (s, states.get(s, 0))
+                           for s in _states))
+    lines.append("")
+    lines.append("%-8s %9s %9s %8s" % ("Runner", "Mean", "Max", "Count"))
+    for kind in ('submit', 'poll'):
+        lines.append(format_latency(kind, status['latency'][kind]))
+    lines.append("")
+    hooks = status['hooks']
+    lines.append("Jobs in hooks: %d" % len(hooks))
+    for hook in hooks[:_max_rows]:
+        lines.append("  %-40s %-16s %s" % (hook['job'], hook['hook'],
+                                           format_time(hook['elapsed'])))
+    lines.append("")
+    users = sorted(status['running_users'].items(),
+                   key=lambda u: (-u[1], u[0]))
+    lines.append("Running jobs by user:")
+    for user, count in users[:_max_rows]:
+        lines.append("  %-40s %d" % (user, count))
+    return lines
+
+
+def main(webservice):
+    opts = get_options()
+    web = webservice.get_web_service(webservice.config)
+    # Clear the screen between updates if output is to a terminal
+    clear = sys.stdout.isatty() and '\033[H\033[2J' or ''
+    previous = None
+    iteration = 0
+    try:
+        while True:
+            try:
+                status = get_status(web)
+            except (socket.error, ValueError) as detail:
+                print("Could not get status from the %s backend (is it "
+                      "running?): %s" % (web.config.service_name,
+                                         str(detail)), file=sys.stderr)
+                sys.exit(1)
+            if not status:
+                print("The %s backend is not keeping statistics"
+                      % web.config.service_name, file=sys.stderr)
+                sys.exit(1)
+            sys.stdout.write(clear)
+            print("\n".join(format_status(web.config.service_name, status,
+                                          previous)))
+            sys.stdout.flush()
+            previous = status
+            iteration += 1
+            if opts.iterations is not None and iteration >= opts.iterations:
+                break
+            time.sleep(opts.delay)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,177 @@
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import multiprocessing
+
+# Connection used by a worker to report which job it is running
+_started = None
+
+
+def _import_function(name):
+    """Get the function with the given dotted name, e.g. 'mymodule.run'"""
+    modname, funcname = name.rsplit('.', 1)
+    __import__(modname)
+    return getattr(sys.modules[modname], funcname)
+
+
+def _init_worker(preload, memory_limit, started):
+    """Set up a newly-started worker process"""
+    global _started
+    _started = started
+    # The backend's signal handlers make no sense in a worker; the pool
+    # is shut down by the backend itself
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if memory_limit is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    for modname in preload:
+        __import__(modname)
+
+
+def _write_job_state(directory, state):
+    fh = open(os.path.join(directory, 'job-state'), 'w')
+    fh.write(state)
+    fh.close()
+
+
+def _run_job(taskid, directory, funcname, args, kwargs):
+    """Run a job in a worker process. Return None on success, or the
+       traceback as a string if the job raised an exception."""
+    # This message is small enough that it is written to the pipe
+    # atomically, so other workers cannot interleave with it
+    _started.send((taskid, os.getpid()))
+    try:
+        os.chdir(directory)
+        _write_job_state(directory, 'STARTED')
+        try:
+            _import_function(funcname)(*args, **kwargs)
+        finally:
+            _write_job_state(directory, 'DONE')
+        return None
+    except (Exception, SystemExit):
+        return traceback.format_exc()
+
+
+class _PoolTask(object):
+    """A job submitted to a :class:`_WorkerPool`"""
+    def __init__(self, callback):
+        self.callback = callback
+        # Process ID of the worker running the job, once it has started
+        self.pid = None
+        # Number of checks which found the worker to have gone away
+        self.missing = 0
+
+
+class _WorkerPool(object):
+    """A pool of worker processes for :class:`PoolRunner`.
+
+       multiprocessing does not report jobs whose worker dies (e.g. is
+       killed for exceeding its memory limit, or crashes). Each worker
+       therefore tells the pool which job it is running, and a monitor
+       thread fails any job whose worker is no longer alive."""
+
+    # Time in seconds between checks for dead workers
+    _check_interval = 0.5
+
+    def __init__(self, config):
+        pool = config.pool
+        self._tasks = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._started, self._started_writer = multiprocessing.Pipe(
+                                                              duplex=False)
+        self.pool = multiprocessing.Pool(pool['workers'],
+                               initializer=_init_worker,
+                               initargs=(pool['preload'],
+                                         pool['memory_limit'],
+                                         self._started_writer),
+                               maxtasksperchild=pool['max_tasks_per_worker'])
+        self._monitor = threading.Thread(target=self._watch_workers)
+        self._monitor.setDaemon(True)
+        self._monitor.start()
+
+    def run(self, directory, funcname, args, kwargs, callback):
+        """Run a job in the pool; `callback` is called (in a pool thread)
+           with the job's result: None on success, or an error message."""
+        self._lock.acquire()
+        try:
+            self._next_id += 1
+            taskid = self._next_id
+            self._tasks[taskid] = _PoolTask(callback)
+        finally:
+            self._lock.release()
+        def finished(result):
+            self._finish(taskid, result)
+        self.pool.apply_async(_run_job,
+                              (taskid, directory, funcname, args, kwargs),
+                              callback=finished)
+
+    def _finish(self, taskid, result):
+        """Report the result of a job, unless it was already reported"""
+        self._lock.acquire()
+        try:
+            task = self._tasks.pop(taskid, None)
+        finally:
+            self._lock.release()
+        if task is not None:
+            task.callback(result)
+
+    def _watch_workers(self):
+        while not self._closed:
+            try:
+                if self._started.poll(self._check_interval):
+                    while self._started.poll():
+                        self._job_started(*self._started.recv())
+            except (EOFError, IOError):
+                return
+            self._check_workers()
+
+    def _job_started(self, taskid, pid):
+        self._lock.acquire()
+        try:
+            task = self._tasks.get(taskid)
+            if task is not None:
+                task.pid = pid
+        finally:
+            self._lock.release()
+
+    def _check_workers(self):
+        """Fail any job whose worker has died. A worker must be missing
+           on two successive checks, since a worker that exits normally
+           (e.g. on reaching max_tasks_per_worker) may do so before its
+           last result has been handled."""
+        live = set(p.pid for p in list(self.pool._pool) if p.exitcode is None)
+        lost = []
+        self._lock.acquire()
+        try:
+            for taskid, task in list(self._tasks.items()):
+                if task.pid is not None and task.pid not in live:
+                    task.missing += 1
+                    if task.missing >= 2:
+                        lost.append((taskid, task.pid))
+        finally:
+            self._lock.release()
+        for taskid, pid in lost:
+            self._finish(taskid, "Worker process %d died while running "
+                                 "the job" % pid)
+
+    def close(self, wait=True):
+        """Stop the workers. If `wait` is True, first wait for all running
+           jobs to finish; otherwise, kill them."""
+        if wait:
+            # Don't use Pool.join() to wait for the jobs, since it never
+            # returns if a job's worker died
+            self.pool.close()
+            while self._tasks:
+                time.sleep(0.1)
+        self.pool.terminate()
+        self.pool.join()
+        self._closed = True
+        self._monitor.join()
+        self._started.close()
+        self._started_writer.close()
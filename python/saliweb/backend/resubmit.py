@@ -1,4 +1,6 @@
 from __future__ import print_function
+import saliweb.backend
+import saliweb.backend.bulk
 from optparse import OptionParser
 import sys
 
@@ -6,22 +8,34 @@ import sys
 def get_options():
     parser = OptionParser()
     parser.set_usage("""
-%prog [-h] JOBNAME [...]
+%prog [-h] [selection options] [JOBNAME ...]
 
 Take the given failed job(s), JOBNAME, and put them back in the incoming queue.
+Instead of (or as well as) naming the jobs, all failed jobs that match the
+selection options can be resubmitted; for example, to resubmit all jobs that
+failed because the cluster was down on June 1st:
+
+  %prog --after 2016-06-01 --before 2016-06-02 --failure 'qmaster'
 """)
+    saliweb.backend.bulk.add_select_options(parser)
     opts, args = parser.parse_args()
-    if len(args) < 1:
-        parser.error("Need to specify a job name")
-    return args
+    saliweb.backend.bulk.check_select_options(parser, opts)
+    if len(args) < 1 and not opts.stdin \
+       and not saliweb.backend.bulk.has_predicates(opts):
+        parser.error("Need to specify a job name or selection option")
+    return args, opts
 
 
 def main(webservice):
-    names = get_options()
+    names, opts = get_options()
     web = webservice.get_web_service(webservice.config)
-    for name in names:
-        job = web.get_job_by_name('FAILED', name)
-        if job:
-            job.resubmit()
-        else:
-            print("Could not find job", name, file=sys.stderr)
+    bulk = saliweb.backend.bulk
+    jobs = bulk.select_jobs(web, opts, ['FAILED'], bulk.get_names(opts, names))
+    if not jobs:
+        if bulk.has_predicates(opts):
+            print("No matching jobs found", file=sys.stderr)
+        return
+    bulk.process_jobs(web, jobs, lambda job: job.resubmit(notify=False),
+                      "Resubmitted")
+    # Wake up the backend once for all of the new incoming jobs
+    saliweb.backend._notify_incoming(web.config, jobs[-1].name)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import hashlib
+
+# Files in a job directory that belong to the job itself, not its results
+_JOB_FILES = ('job-state', 'framework.log')
+
+
+def _hash_inputs(directory, filenames):
+    """Get a hash (as a hex string) of the names and contents of the given
+       input files in a job directory. The order of the names does not
+       matter."""
+    h = hashlib.sha1()
+    for name in sorted(filenames):
+        fname = os.path.join(directory, name)
+        # Include name and size so that file boundaries are unambiguous
+        h.update("%s\0%d\0" % (name, os.path.getsize(fname)))
+        fh = open(fname, 'rb')
+        try:
+            while True:
+                data = fh.read(65536)
+                if not data:
+                    break
+                h.update(data)
+        finally:
+            fh.close()
+    return h.hexdigest()
+
+
+def _copy_results(src, dst):
+    """Make the results of a completed job in directory `src` available in
+       job directory `dst`, by hard linking each file (or copying it, if
+       the directories are on different filesystems). Files that already
+       exist in `dst` are left alone."""
+    for name in os.listdir(src):
+        if name in _JOB_FILES:
+            continue
+        _copy_entry(os.path.join(src, name), os.path.join(dst, name))
+
+
+def _copy_entry(src, dst):
+    if os.path.lexists(dst):
+        return
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+    elif os.path.isdir(src):
+        os.mkdir(dst)
+        for name in os.listdir(src):
+            _copy_entry(os.path.join(src, name), os.path.join(dst, name))
+    else:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
@@ -1,5 +1,6 @@
 import re
 import os
+import subprocess
 import saliweb.backend.events
 from saliweb.backend.events import _JobThread
 
@@ -11,23 +12,32 @@ class _DRMAAJobWaiter(_JobThread):
         self._runner = runner
         self._runid = runid
 
+    def _wait(self):
+        """Wait for all jobs to finish; return an exception if any failed"""
+        from saliweb.backend import TransientRunnerError
+        drmaa, s = self._runner._get_drmaa()
+        failed_jobids = []
+        s.synchronize(self._jobids, drmaa.Session.TIMEOUT_WAIT_FOREVER, False)
+        for j in self._jobids:
+            if not s.wait(j, drmaa.Session.TIMEOUT_WAIT_FOREVER):
+                failed_jobids.append(j)
+        if len(failed_jobids) > 0:
+            return TransientRunnerError("SGE jobs failed: %s. Please contact "
+                                        "the cluster sysadmin." \
+                                        % ', '.join(failed_jobids))
+
     def run(self):
-        from saliweb.backend import RunnerError
         self._runner._waited_jobs.add(self._runid)
         try:
-            drmaa, s = self._runner._get_drmaa()
-            failed_jobids = []
-            s.synchronize(self._jobids, drmaa.Session.TIMEOUT_WAIT_FOREVER,
-                          False)
-            for j in self._jobids:
-                if not s.wait(j, drmaa.Session.TIMEOUT_WAIT_FOREVER):
-                    failed_jobids.append(j)
-            if len(failed_jobids) > 0:
-                failure = RunnerError("SGE jobs failed: %s. Please contact "
-                                      "the cluster sysadmin." \
-                                      % ', '.join(failed_jobids))
-            else:
-                failure = None
+            try:
+                failure = self._wait()
+            except Exception as detail:
+                # We lost contact with SGE, but the job may still be
+                # running, so report a status error (so that the job is
+                # checked again later) rather than a transient error
+                # (which would run a second copy of the job)
+                failure = OSError("Could not wait for SGE jobs: %s"
+                                  % detail)
             e = saliweb.backend.events._CompletedJobEvent(self._webservice,
                                                           self._runner,
                                                           self._runid, failure)
@@ -69,6 +79,28 @@ class _SGETasks(object):
         return job + '.%d-%d:%d' % (self.first, self.last, self.step)
 
 
+def _check_bulk_completed(qstat, env, jobid):
+    """Return True if SGE reports that the given bulk job has finished,
+       False if it is still running, or None if the status cannot be
+       determined. `qstat` and `env` are used to query the SGE cell.
+    """
+    # Unfortunately DRMAA1 only allows us to query individual tasks, and
+    # looping over all tasks in a large parallel job is very inefficient,
+    # so use qstat instead and parse the output.
+    m = re.match('(\S+)\.(\d+)\-(\d+):(\d+)$', jobid)
+    jobid = m.group(1)
+    p = subprocess.Popen([qstat, '-j', jobid], stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, env=env)
+    out = p.stdout.readlines()
+    ret = p.wait()
+    if ret == 0:
+        return False
+    elif len(out) > 0 and out[0].startswith('Following jobs do not exist'):
+        return True
+    else:
+        raise OSError("qstat returned %d (%s)" % (ret, "\n".join(out)))
+
+
 class _DRMAAWrapper(object):
     """Wrapper to start up DRMAA and ensure it is closed down on exit"""
 
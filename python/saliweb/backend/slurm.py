@@ -0,0 +1,205 @@
+import os
+import pwd
+import subprocess
+import threading
+import time
+import saliweb.backend.events
+from saliweb.backend.events import _JobThread
+
+# sacct job states that mean the job did not finish successfully
+_FAILED_STATES = ('BOOT_FAIL', 'CANCELLED', 'DEADLINE', 'FAILED',
+                  'NODE_FAIL', 'OUT_OF_MEMORY', 'PREEMPTED', 'TIMEOUT')
+# Failed job states that are the fault of the cluster, not the job, so that
+# it is worth running the job again
+_TRANSIENT_STATES = ('BOOT_FAIL', 'NODE_FAIL', 'PREEMPTED')
+# sacct job states that mean the job has not finished yet
+_ACTIVE_STATES = ('PENDING', 'RUNNING', 'COMPLETING', 'CONFIGURING',
+                  'REQUEUED', 'RESIZING', 'SUSPENDED')
+
+
+def _get_base_job_id(runid):
+    """Get the Slurm job ID from a runner ID (array jobs have the task
+       range appended, as for SGE)"""
+    return runid.split('.', 1)[0]
+
+
+def _sbatch(sbatch, script, directory, opts):
+    """Submit a job script with 'sbatch --parsable' and return its job ID"""
+    p = subprocess.Popen([sbatch, '--parsable'] + opts + [script],
+                         cwd=directory, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    out = p.stdout.read()
+    ret = p.wait()
+    if ret != 0:
+        raise OSError("sbatch returned %d (%s)" % (ret, out.strip()))
+    # Output is "jobid" or "jobid;cluster"
+    return out.strip().split('\n')[-1].split(';')[0]
+
+
+def _get_finished_jobs(sacct, jobids):
+    """Use sacct to find out which of the given Slurm jobs have finished.
+       Return a dict of job ID to a list of failed tasks (if any) for all
+       finished jobs. Jobs that sacct does not know about are assumed to have
+       finished successfully (e.g. if accounting is disabled, in which case
+       we have to rely on the job-state file)."""
+    p = subprocess.Popen([sacct, '--noheader', '--parsable2', '--allocations',
+                          '--format=JobID,State', '-j', ','.join(jobids)],
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = p.stdout.readlines()
+    ret = p.wait()
+    finished = {}
+    for j in jobids:
+        finished[j] = []
+    if ret != 0:
+        return finished
+    for line in out:
+        fields = line.strip().split('|')
+        if len(fields) < 2:
+            continue
+        task, state = fields[0], fields[1].split()
+        jobid = task.split('_', 1)[0]
+        if jobid not in finished or not state:
+            continue
+        if state[0] in _ACTIVE_STATES:
+            # Out of the queue but not yet fully accounted; check again later
+            del finished[jobid]
+        elif state[0] in _FAILED_STATES:
+            finished[jobid].append("%s (%s)" % (task, state[0]))
+    return finished
+
+
+class _SlurmQueue(object):
+    """Snapshot of the jobs Slurm has in its queue, from a single call to
+       squeue. The snapshot is reused for `ttl` seconds, so that checking
+       many jobs in one cycle only runs squeue once."""
+
+    def __init__(self, squeue, ttl):
+        self.squeue = squeue
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._time = None
+
+    def refresh(self):
+        """Get a new snapshot, and return the set of queued job IDs"""
+        user = pwd.getpwuid(os.getuid()).pw_name
+        p = subprocess.Popen([self.squeue, '--noheader', '--format=%F',
+                              '-u', user], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        out = p.stdout.readlines()
+        ret = p.wait()
+        if ret != 0:
+            raise OSError("squeue returned %d (%s)" % (ret, "".join(out)))
+        jobs = {}
+        for line in out:
+            line = line.strip()
+            if line:
+                jobs[line] = None
+        self._lock.acquire()
+        self._jobs = jobs
+        self._time = time.time()
+        self._lock.release()
+        return jobs
+
+    def get_jobs(self):
+        """Get the set of queued job IDs, from the cached snapshot if it
+           is recent enough"""
+        self._lock.acquire()
+        try:
+            if self._jobs is not None and time.time() - self._time < self.ttl:
+                return self._jobs
+        finally:
+            self._lock.release()
+        return self.refresh()
+
+
+class _SlurmPoller(_JobThread):
+    """Wait for jobs started by a :class:`SlurmRunner` to finish, by
+       checking all of them against a single squeue snapshot every
+       `interval` seconds. The thread exits once it has no jobs left to
+       wait for."""
+
+    def __init__(self, webservice, queue, sacct, interval):
+        _JobThread.__init__(self, webservice)
+        self._queue = queue
+        self._sacct = sacct
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._finished = False
+
+    def add(self, runner, runid):
+        """Start waiting for a job. Return False if the poller thread has
+           already exited (in which case a new one is needed)."""
+        self._lock.acquire()
+        try:
+            if self._finished:
+                return False
+            runner._waited_jobs.add(runid)
+            self._jobs[runid] = (runner, time.time())
+            return True
+        finally:
+            self._lock.release()
+
+    def _get_jobs(self):
+        self._lock.acquire()
+        try:
+            if not self._jobs:
+                self._finished = True
+            return dict(self._jobs)
+        finally:
+            self._lock.release()
+
+    def _poll(self, jobs):
+        start = time.time()
+        try:
+            queued = self._queue.refresh()
+        except OSError:
+            # Try again next time
+            return
+        # Ignore jobs that were submitted after the snapshot was started,
+        # since they may not be in it
+        done = {}
+        for runid, job in jobs.items():
+            jobid = _get_base_job_id(runid)
+            if job[1] < start and jobid not in queued:
+                done[jobid] = runid
+        if not done:
+            return
+        finished = _get_finished_jobs(self._sacct, list(done.keys()))
+        for jobid, failed in finished.items():
+            self._job_finished(done[jobid], failed)
+
+    def _job_finished(self, runid, failed):
+        from saliweb.backend import RunnerError, TransientRunnerError
+        self._lock.acquire()
+        try:
+            runner = self._jobs.pop(runid)[0]
+        finally:
+            self._lock.release()
+        try:
+            if failed:
+                # Each failed task is given as "taskid (STATE)"
+                states = [f.rsplit('(', 1)[-1].rstrip(')') for f in failed]
+                if [st for st in states if st not in _TRANSIENT_STATES]:
+                    errcls = RunnerError
+                else:
+                    errcls = TransientRunnerError
+                failure = errcls("Slurm jobs failed: %s. Please contact "
+                                 "the cluster sysadmin." % ', '.join(failed))
+            else:
+                failure = None
+            e = saliweb.backend.events._CompletedJobEvent(self._webservice,
+                                                          runner, runid,
+                                                          failure)
+            self._webservice._event_queue.put(e)
+        finally:
+            runner._waited_jobs.remove(runid)
+
+    def run(self):
+        while True:
+            time.sleep(self._interval)
+            jobs = self._get_jobs()
+            if not jobs:
+                return
+            self._poll(jobs)
@@ -0,0 +1,165 @@
+import collections
+import threading
+import datetime
+import time
+
+
+class _Latency(object):
+    """Keep track of how long the most recent operations of some kind
+       took"""
+    def __init__(self, size=100):
+        self.count = 0
+        self._recent = collections.deque(maxlen=size)
+
+    def add(self, seconds):
+        self.count += 1
+        self._recent.append(seconds)
+
+    def get(self):
+        """Get a summary of the recent times, as a dict"""
+        if self._recent:
+            mean = sum(self._recent) / len(self._recent)
+            worst = max(self._recent)
+        else:
+            mean = worst = None
+        return {'count': self.count, 'mean': mean, 'max': worst}
+
+
+class _DaemonStats(object):
+    """Statistics on what the backend daemon is currently doing, kept
+       entirely in memory so that they can be shown by the monitor admin
+       tool without querying the database. The event loop updates these as
+       jobs change state; they are corrected from the database only
+       occasionally, since admin tools running in other processes can
+       change jobs without the daemon knowing.
+
+       All methods can be called from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.events = 0
+        self._state_counts = {}
+        # Users that submitted each running job, keyed by job name
+        self._running = {}
+        # Submit times (UTC datetimes) of incoming jobs, keyed by job name
+        self._incoming = {}
+        # Hooks currently running, as (job name, hook name, start time)
+        self._hooks = {}
+        self._next_hook = 0
+        self._latency = {'submit': _Latency(), 'poll': _Latency()}
+
+    def reset(self, state_counts, running, incoming):
+        """Replace all job information with that read from the database.
+           `state_counts` is a dict of job counts keyed by state; `running`
+           and `incoming` are lists of (name, user) and (name, submit_time)
+           pairs for jobs in the RUNNING and INCOMING states."""
+        self._lock.acquire()
+        try:
+            self._state_counts = dict(state_counts)
+            self._running = dict(running)
+            self._incoming = dict(incoming)
+        finally:
+            self._lock.release()
+
+    def event_processed(self):
+        self._lock.acquire()
+        self.events += 1
+        self._lock.release()
+
+    def job_incoming(self, name, submit_time=None):
+        """Note that a job is in the INCOMING state. If the submit time is
+           not known, the current time is used."""
+        self._lock.acquire()
+        try:
+            if name not in self._incoming:
+                self._incoming[name] = submit_time \
+                                       or datetime.datetime.utcnow()
+            elif submit_time is not None:
+                self._incoming[name] = submit_time
+        finally:
+            self._lock.release()
+
+    def job_state_changed(self, name, user, oldstate, newstate):
+        self._lock.acquire()
+        try:
+            self._change_count(oldstate, -1)
+            self._change_count(newstate, 1)
+            if oldstate == 'RUNNING':
+                self._running.pop(name, None)
+            elif oldstate == 'INCOMING':
+                self._incoming.pop(name, None)
+            if newstate == 'RUNNING':
+                self._running[name] = user
+        finally:
+            self._lock.release()
+
+    def job_deleted(self, name, state):
+        self._lock.acquire()
+        try:
+            self._change_count(state, -1)
+            self._running.pop(name, None)
+            self._incoming.pop(name, None)
+        finally:
+            self._lock.release()
+
+    def _change_count(self, state, delta):
+        self._state_counts[state] = max(0,
+                                        self._state_counts.get(state, 0) + delta)
+
+    def hook_started(self, name, hook):
+        """Note that a job's hook (e.g. preprocess) started running.
+           Return a token that should be passed to :meth:`hook_finished`."""
+        self._lock.acquire()
+        try:
+            self._next_hook += 1
+            self._hooks[self._next_hook] = (name, hook, time.time())
+            return self._next_hook
+        finally:
+            self._lock.release()
+
+    def hook_finished(self, token):
+        self._lock.acquire()
+        self._hooks.pop(token, None)
+        self._lock.release()
+
+    def add_latency(self, kind, seconds):
+        """Record how long it took to submit ('submit') a job to a runner,
+           or to ask a runner whether a job finished ('poll')"""
+        self._lock.acquire()
+        try:
+            self._latency[kind].add(seconds)
+        finally:
+            self._lock.release()
+
+    def snapshot(self, queue_depth):
+        """Get all statistics, as a dict that can be converted to JSON"""
+        self._lock.acquire()
+        try:
+            now = time.time()
+            incoming = len(self._incoming)
+            if incoming:
+                oldest = datetime.datetime.utcnow() \
+                         - min(self._incoming.values())
+                oldest = max(0., oldest.days * 86400. + oldest.seconds
+                                 + oldest.microseconds / 1e6)
+            else:
+                oldest = None
+            states = dict(self._state_counts)
+            states['INCOMING'] = incoming
+            users = {}
+            for user in self._running.values():
+                users[user] = users.get(user, 0) + 1
+            hooks = [{'job': name, 'hook': hook, 'elapsed': now - start}
+                     for name, hook, start in self._hooks.values()]
+            hooks.sort(key=lambda h: -h['elapsed'])
+            latency = {}
+            for kind, lat in self._latency.items():
+                latency[kind] = lat.get()
+            return {'time': now, 'uptime': now - self.started,
+                    'events': self.events, 'queue_depth': queue_depth,
+                    'states': states, 'oldest_incoming': oldest,
+                    'running_users': users, 'hooks': hooks,
+                    'latency': latency}
+        finally:
+            self._lock.release()
@@ -0,0 +1,84 @@
+import threading
+import time
+import Queue
+
+
+class _SubmittedJobEvent(object):
+    """Event that represents a job's runner having been submitted to the
+       cluster (successfully, or not, if `exception` is set)"""
+    def __init__(self, webservice, name, runner, runid, exception):
+        self.webservice = webservice
+        self.name = name
+        self.runner = runner
+        self.runid = runid
+        self.exception = exception
+
+    def process(self):
+        self.webservice._job_submitted(self.name, self.runner, self.runid,
+                                       self.exception)
+
+
+class _Submitter(object):
+    """Start runners (by calling their _run method) in a pool of background
+       threads, so that slow submission to the cluster does not hold up the
+       event loop. Each result is posted back to the event loop as a
+       :class:`_SubmittedJobEvent`. No more than `window` submissions
+       should be in flight at once; callers should check :meth:`is_full`.
+
+       Other than the worker threads themselves, all methods should only be
+       called from the event loop."""
+
+    def __init__(self, webservice, threads, window):
+        self._webservice = webservice
+        self.window = window
+        self._queue = Queue.Queue()
+        self._in_flight = 0
+        # Completion events for jobs we have not yet heard were submitted
+        self._early_completions = {}
+        # True if incoming jobs were held back because we were full
+        self.throttled = False
+        for i in range(threads):
+            t = threading.Thread(target=self._worker)
+            t.setDaemon(True)
+            t.start()
+
+    def is_full(self):
+        return self._in_flight >= self.window
+
+    def submit(self, name, runner):
+        """Start submitting the runner for the named job"""
+        self._in_flight += 1
+        self._queue.put((name, runner))
+
+    def submitted(self, runner, runid):
+        """Note that a submission has finished. If the job already finished
+           too, return its completion event (otherwise None)."""
+        self._in_flight -= 1
+        event = self._early_completions.pop((runner._runner_name, runid),
+                                            None)
+        if self._in_flight == 0:
+            self._early_completions = {}
+        return event
+
+    def defer_completion(self, event):
+        """Hold on to a completion event for a job that could not be
+           found. This can happen if the job finishes before we process its
+           :class:`_SubmittedJobEvent`."""
+        if self._in_flight > 0:
+            key = (event.runner._runner_name, event.runid)
+            self._early_completions[key] = event
+
+    def _worker(self):
+        while True:
+            name, runner = self._queue.get()
+            start = time.time()
+            try:
+                runid = runner._run(self._webservice)
+                exception = None
+            except Exception as detail:
+                runid = None
+                exception = detail
+            self._webservice._add_latency('submit', start)
+            self._webservice._event_queue.put(
+                    _SubmittedJobEvent(self._webservice, name, runner,
+                                       runid, exception))
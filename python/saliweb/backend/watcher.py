@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+from saliweb.backend.events import _JobThread
+
+# Constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+NFS_SUPER_MAGIC = 0x6969
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+    return _libc
+
+
+def _is_nfs(directory):
+    """Return True if the given directory is on an NFS filesystem (where
+       inotify will not see changes made by other hosts)"""
+    # The first member of struct statfs is f_type, a word-sized integer
+    buf = ctypes.create_string_buffer(256)
+    if _get_libc().statfs(directory, buf) != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), directory)
+    return ctypes.c_long.from_buffer(buf).value == NFS_SUPER_MAGIC
+
+
+class _JobStateDoneEvent(object):
+    """Event that represents a job's job-state file saying it is done"""
+    def __init__(self, webservice, name):
+        self.webservice = webservice
+        self.name = name
+
+    def process(self):
+        self.webservice._job_state_done(self.name)
+
+
+class _Watcher(_JobThread):
+    """Base class for threads that watch the job-state files of running
+       jobs, and post a :class:`_JobStateDoneEvent` when one of them says
+       DONE."""
+
+    def __init__(self, webservice):
+        _JobThread.__init__(self, webservice)
+        self._lock = threading.Lock()
+
+    def _check_job_state(self, name, directory):
+        """Post an event if the job's state file says DONE. Return True
+           if it did."""
+        try:
+            with open(os.path.join(directory, 'job-state')) as fh:
+                done = fh.read().rstrip('\r\n') == 'DONE'
+        except IOError:
+            return False
+        if done:
+            self._webservice._event_queue.put(
+                              _JobStateDoneEvent(self._webservice, name))
+        return done
+
+
+class _InotifyWatcher(_Watcher):
+    """Watch running job directories using Linux inotify. This only works
+       for directories on a local filesystem."""
+
+    _mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVE_SELF | IN_DELETE_SELF \
+            | IN_ONLYDIR
+
+    def __init__(self, webservice):
+        _Watcher.__init__(self, webservice)
+        libc = _get_libc()
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, "inotify_init: " + os.strerror(e))
+        # Map from watch descriptors to (job name, directory) and back
+        self._wds = {}
+        self._names = {}
+
+    def watch(self, name, directory):
+        """Start watching the given job directory"""
+        self._lock.acquire()
+        try:
+            wd = _get_libc().inotify_add_watch(self._fd, directory,
+                                               self._mask)
+            if wd < 0:
+                e = ctypes.get_errno()
+                raise OSError(e, "inotify_add_watch: " + os.strerror(e),
+                              directory)
+            self._wds[wd] = (name, directory)
+            self._names[name] = wd
+        finally:
+            self._lock.release()
+        # The job may have finished before we started watching
+        if self._check_job_state(name, directory):
+            self.unwatch(name)
+
+    def unwatch(self, name):
+        """Stop watching the directory of the given job"""
+        self._lock.acquire()
+        try:
+            wd = self._names.pop(name, None)
+            if wd is not None:
+                del self._wds[wd]
+                _get_libc().inotify_rm_watch(self._fd, wd)
+        finally:
+            self._lock.release()
+
+    def _forget(self, wd):
+        """Drop a watch that the kernel has removed"""
+        self._lock.acquire()
+        try:
+            job = self._wds.pop(wd, None)
+            if job is not None:
+                del self._names[job[0]]
+        finally:
+            self._lock.release()
+
+    def _read_events(self):
+        """Read all available events, as (wd, mask, name) tuples"""
+        try:
+            buf = os.read(self._fd, 65536)
+        except OSError as detail:
+            if detail.errno == errno.EINTR:
+                return []
+            raise
+        events = []
+        pos = 0
+        while pos + 16 <= len(buf):
+            wd, mask, cookie, namelen = struct.unpack('iIII', buf[pos:pos+16])
+            name = buf[pos+16:pos+16+namelen].rstrip('\0')
+            events.append((wd, mask, name))
+            pos += 16 + namelen
+        return events
+
+    def run(self):
+        while True:
+            rlist, wlist, xlist = select.select([self._fd], [], [])
+            for wd, mask, fname in self._read_events():
+                self._lock.acquire()
+                job = self._wds.get(wd, None)
+                self._lock.release()
+                if job is None:
+                    continue
+                name, directory = job
+                if mask & IN_IGNORED:
+                    self._forget(wd)
+                elif mask & (IN_MOVE_SELF | IN_DELETE_SELF):
+                    # Job is no longer running
+                    self.unwatch(name)
+                elif fname == 'job-state' \
+                     and self._check_job_state(name, directory):
+                    self.unwatch(name)
+
+
+class _PollingWatcher(_Watcher):
+    """Watch running job directories by periodically checking their
+       job-state files. This is used where inotify is not available or
+       does not work (e.g. on NFS, where it does not see changes made on
+       compute nodes)."""
+
+    def __init__(self, webservice, interval):
+        _Watcher.__init__(self, webservice)
+        self._interval = interval
+        self._jobs = {}
+        self._stop_event = threading.Event()
+
+    def watch(self, name, directory):
+        """Start watching the given job directory"""
+        self._lock.acquire()
+        try:
+            self._jobs[name] = [directory, None]
+        finally:
+            self._lock.release()
+
+    def unwatch(self, name):
+        """Stop watching the directory of the given job"""
+        self._lock.acquire()
+        try:
+            self._jobs.pop(name, None)
+        finally:
+            self._lock.release()
+
+    def _poll(self):
+        self._lock.acquire()
+        try:
+            jobs = list(self._jobs.items())
+        finally:
+            self._lock.release()
+        for name, job in jobs:
+            directory, last_stat = job
+            try:
+                s = os.stat(os.path.join(directory, 'job-state'))
+            except OSError:
+                if not os.path.isdir(directory):
+                    # Job is no longer running
+                    self.unwatch(name)
+                continue
+            # Only read the file if it changed since last time (mtime may
+            # have only 1 second resolution, so check the size too)
+            stat = (s.st_mtime, s.st_size)
+            if stat != last_stat:
+                job[1] = stat
+                if self._check_job_state(name, directory):
+                    self.unwatch(name)
+
+    def stop(self):
+        """Stop polling"""
+        self._stop_event.set()
+
+    def run(self):
+        while True:
+            self._stop_event.wait(self._interval)
+            if self._stop_event.isSet():
+                return
+            self._poll()
+
+
+def _get_watcher(webservice, directory, poll_interval):
+    """Get a suitable watcher for job directories in `directory`"""
+    try:
+        if not _is_nfs(directory):
+            return _InotifyWatcher(webservice)
+    except (OSError, AttributeError):
+        # AttributeError is raised if libc lacks inotify or statfs
+        pass
+    return _PollingWatcher(webservice, poll_interval)
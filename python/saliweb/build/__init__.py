@@ -254,6 +254,7 @@ def _setup_install_directories(env):
     env['txtdir'] = os.path.join(env['instdir'], 'txt')
     env['cgidir'] = os.path.join(env['instdir'], 'cgi')
     env['perldir'] = os.path.join(env['instdir'], 'lib')
+    env['vardir'] = os.path.join(env['instdir'], 'var')
 
 
 def _check(env):
@@ -509,7 +510,10 @@ def _check_mysql(env):
                              unix_socket=c.database['socket'],
                              passwd=backend['passwd'])
         cur = db.cursor()
-        for table in ('jobs', 'dependencies'):
+        tables = ['jobs', 'dependencies']
+        if c.backend.get('result_cache', False):
+            tables.append('result_cache')
+        for table in tables:
             cur.execute('DESCRIBE ' + table)
             _check_mysql_schema(env, c, cur, table)
         cur.execute('SHOW GRANTS FOR CURRENT_USER')
@@ -539,7 +543,7 @@ def _check_mysql(env):
         _check_sql_username_length(env, frontend, 'front')
         _check_sql_username_length(env, backend, 'back')
         outfile = _generate_admin_mysql_script(c.database['db'], backend,
-                                               frontend)
+                                               frontend, c)
         print("""
 ** Could not query the jobs table in the %s database using both the
 ** frontend and backend users. The actual error message follows:
@@ -594,14 +598,18 @@ def _check_mysql_grants(env, cursor, database, user, grant, table=None):
     env.Exit(1)
 
 
-def _generate_admin_mysql_script(database, backend, frontend):
+def _generate_admin_mysql_script(database, backend, frontend, config=None):
     d = saliweb.backend.Database(None)
+    if config is not None:
+        d._add_optional_fields(config)
     fd, outfile = tempfile.mkstemp()
+    indexes = ''.join('CREATE INDEX %s_index ON %s.jobs (%s);\n'
+                      % (x.name, database, x.name) for x in d._fields
+                      if x.index)
     commands = """CREATE DATABASE %(database)s;
 GRANT DELETE,CREATE,DROP,INDEX,INSERT,SELECT,UPDATE ON %(database)s.* TO '%(backend_user)s'@'localhost' IDENTIFIED BY '%(backend_passwd)s';
 CREATE TABLE %(database)s.jobs (%(schema)s);
-CREATE INDEX state_index ON %(database)s.jobs (state);
-CREATE TABLE %(database)s.dependencies (%(depschema)s);
+%(indexes)sCREATE TABLE %(database)s.dependencies (%(depschema)s);
 CREATE INDEX child_index ON %(database)s.dependencies (child);
 CREATE INDEX parent_index ON %(database)s.dependencies (parent);
 GRANT SELECT ON %(database)s.jobs to '%(frontend_user)s'@'localhost' identified by '%(frontend_passwd)s';
@@ -611,24 +619,42 @@ GRANT SELECT,INSERT,UPDATE,DELETE ON %(database)s.dependencies to '%(frontend_us
        'backend_passwd': backend['passwd'], 'frontend_user': frontend['user'],
        'frontend_passwd': frontend['passwd'],
        'schema': ', '.join(x.get_schema() for x in d._fields),
+       'indexes': indexes,
        'depschema': ', '.join(x.get_schema() for x in d._dependfields)}
+    if d._result_cache:
+        commands += """CREATE TABLE %(database)s.%(table)s (%(schema)s);
+GRANT DELETE,INSERT,SELECT,UPDATE ON %(database)s.%(table)s TO '%(backend_user)s'@'localhost';
+""" % {'database': database, 'backend_user': backend['user'],
+       'table': d._cachetable,
+       'schema': ', '.join(x.get_schema() for x in d._cachefields)}
     os.write(fd, commands)
     os.close(fd)
     os.chmod(outfile, 0600)
     return outfile
 
 
+def _get_mysql_type(dbtype):
+    """Map a column type reported by MySQL (e.g. int(11)) to the form used
+       by the backend (e.g. INTEGER)."""
+    dbtype = dbtype.upper()
+    m = re.match('(TINYINT|SMALLINT|MEDIUMINT|INT|BIGINT)(\(\d+\))?$', dbtype)
+    if m:
+        return {'INT': 'INTEGER'}.get(m.group(1), m.group(1))
+    return dbtype
+
+
 def _check_mysql_schema(env, config, cursor, table):
     d = saliweb.backend.Database(None)
-    if config.track_hostname:
-        d.set_track_hostname()
+    d._add_optional_fields(config)
     dbfields = []
     for row in cursor:
-        dbfields.append(saliweb.backend.MySQLField(row[0], row[1].upper(),
+        dbfields.append(saliweb.backend.MySQLField(row[0],
+                                                   _get_mysql_type(row[1]),
                                                    null=row[2], key=row[3],
                                                    default=row[4]))
 
-    fields = {'jobs': d._fields, 'dependencies': d._dependfields}[table]
+    fields = {'jobs': d._fields, 'dependencies': d._dependfields,
+              'result_cache': d._cachefields}[table]
     for dbfield, backfield in zip(dbfields, fields):
         dbfield.index = backfield.index # Ignore differences in indexes here
         if dbfield != backfield:
@@ -696,6 +722,9 @@ def _install_directories(env):
                  "setfacl -d -m u:%s:rwx $TARGET" % frontend_user,
                  "setfacl -d -m u:%s:rwx $TARGET" % backend_user,
                  "setfacl -m u:%s:rwx $TARGET" % frontend_user])
+    # Private backend data (e.g. the cached configuration)
+    vardir = os.path.join(config.directories['install'], 'var')
+    env.Command(vardir, None, [Mkdir(vardir), Chmod(vardir, 0700)])
     env.Command(os.path.join(config.directories['install'], 'README'),
                 Value(env['service_name']),
                 _make_readme)
@@ -752,6 +781,7 @@ def _make_web_service(env, target, source):
     modname = source[1].get_contents()
     pydir = source[2].get_contents()
     version = source[3].get_contents()
+    vardir = source[4].get_contents()
     if version != 'None':
         version = "r'%s'" % version
     else:
@@ -761,6 +791,8 @@ def _make_web_service(env, target, source):
         print("pydir = '%s'" % pydir, file=f)
         print("import sys", file=f)
         print("sys.path.insert(0, pydir)", file=f)
+        print("import saliweb.backend", file=f)
+        print("saliweb.backend.Config._cache_dir = '%s'" % vardir, file=f)
         print("import %s" % modname, file=f)
         print("def get_web_service(config):", file=f)
         print("    ws = %s.get_web_service(config)" % modname, file=f)
@@ -772,13 +804,14 @@ def _InstallAdminTools(env, tools=None):
     if tools is None:
         # todo: this list should be auto-generated from backend
         tools = ['resubmit', 'service', 'deljob', 'failjob', 'delete_all_jobs',
-                 'list_jobs']
+                 'list_jobs', 'disk_usage', 'monitor', 'export_trace']
     for bin in tools:
         env.Command(os.path.join(env['bindir'], bin + '.py'), None,
                     _make_script)
     env.Command(os.path.join(env['bindir'], 'webservice.py'),
                 [Value(env['instconfigfile']), Value(env['service_module']),
-                 Value(env['pythondir']), Value(env['version'])],
+                 Value(env['pythondir']), Value(env['version']),
+                 Value(env['vardir'])],
                 _make_web_service)
 
 
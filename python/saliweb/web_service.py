@@ -30,11 +30,25 @@ from __future__ import print_function
 import sys
 import getopt
 import os
-from xml.dom.minidom import parseString
 import xml.parsers.expat
-import subprocess
 import urllib2
+import urllib
+import urlparse
+import httplib
+import cookielib
+import mimetypes
+import binascii
+import threading
+import socket
+import Queue
+import heapq
+import shlex
+import json
+import hashlib
+import tempfile
+import cStringIO
 import time
+import re
 
 def _get_cookie_arg(args):
     opts, args = getopt.getopt(args, "c:", ["cookie="])
@@ -44,26 +58,752 @@ def _get_cookie_arg(args):
             cookie = a
     return cookie, args
 
-def _curl_rest_page(url, curl_args):
-    # Sadly Python currently has no method to POST multipart forms, so we
-    # use curl instead
-    p = subprocess.Popen(['curl', '-s'] + curl_args \
-                          + [url], stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-    (out, err) = p.communicate()
-    exitval = p.wait()
-    if exitval != 0:
-        raise OSError("curl failed with exit %d; stderr:\n%s" % (exitval, err))
+class _ConnectionPool(object):
+    """Keep HTTP connections open after each request, so that further
+       requests to the same host (e.g. submitting many jobs to a service)
+       do not each need a new TCP connection and TLS handshake."""
+    max_idle = 4
+    timeout = 300.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def get(self, scheme, netloc):
+        """Get a connection to the given host. Return the connection and
+           True if it was used before."""
+        key = (scheme, netloc)
+        self._lock.acquire()
+        try:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop(), True
+        finally:
+            self._lock.release()
+        return self._connect(scheme, netloc), False
+
+    def put(self, scheme, netloc, conn):
+        """Return a connection to the pool once its response has been
+           read, so that it can be reused"""
+        self._lock.acquire()
+        try:
+            conns = self._idle.setdefault((scheme, netloc), [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def clear(self):
+        """Close all idle connections"""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            cls = httplib.HTTPSConnection
+        elif scheme == 'http':
+            cls = httplib.HTTPConnection
+        else:
+            raise ValueError("Unsupported URL scheme: %s" % scheme)
+        proxy = urllib.getproxies().get(scheme)
+        host = netloc.rsplit('@', 1)[-1]
+        if proxy and not urllib.proxy_bypass(host.split(':')[0]):
+            proxy = urlparse.urlparse(proxy)[1] or proxy
+            if scheme == 'https':
+                conn = cls(proxy, timeout=self.timeout)
+                conn.set_tunnel(host)
+            else:
+                conn = cls(proxy, timeout=self.timeout)
+                # Requests through an HTTP proxy need the full URL
+                conn._saliweb_full_url = True
+            return conn
+        return cls(host, timeout=self.timeout)
+
+_pool = _ConnectionPool()
+
+
+class _MultipartBody(object):
+    """A multipart/form-data request body, built from arguments in the
+       same form as those accepted by curl's -F option ('foo=bar' sets the
+       'foo' variable to 'bar'; 'foo=@bar' uploads the file 'bar' as 'foo';
+       'foo=<bar' sets 'foo' to the contents of the file 'bar'). Files are
+       read a chunk at a time as the body is sent, rather than all being
+       read into memory first."""
+    chunk_size = 65536
+
+    def __init__(self, fields, directory=None):
+        self.boundary = '------------------------saliweb' \
+                        + binascii.hexlify(os.urandom(12))
+        # Each part is a header followed by either a string or a filename
+        self._parts = []
+        for field in fields:
+            if '=' not in field:
+                raise ValueError("Invalid argument %s; should be of the "
+                                 "form name=value" % field)
+            name, value = field.split('=', 1)
+            if value.startswith('@') or value.startswith('<'):
+                fname = value[1:]
+                path = fname
+                if directory:
+                    path = os.path.join(directory, fname)
+                if not os.path.isfile(path):
+                    raise OSError("Cannot open file %s to upload" % path)
+                if value.startswith('@'):
+                    ctype = mimetypes.guess_type(fname)[0] \
+                            or 'application/octet-stream'
+                    header = 'Content-Disposition: form-data; name="%s"; ' \
+                             'filename="%s"\r\nContent-Type: %s' \
+                             % (name, os.path.basename(fname), ctype)
+                else:
+                    header = 'Content-Disposition: form-data; name="%s"' \
+                             % name
+                self._parts.append((self._get_header(header), None, path))
+            else:
+                header = 'Content-Disposition: form-data; name="%s"' % name
+                self._parts.append((self._get_header(header), value, None))
+
+    def _get_header(self, header):
+        return '--%s\r\n%s\r\n\r\n' % (self.boundary, header)
+
+    def get_content_type(self):
+        return 'multipart/form-data; boundary=' + self.boundary
+
+    def get_length(self):
+        """Get the total size of the body, in bytes"""
+        length = len(self._get_trailer())
+        for header, value, path in self._parts:
+            length += len(header) + 2
+            if path is None:
+                length += len(value)
+            else:
+                length += os.path.getsize(path)
+        return length
+
+    def _get_trailer(self):
+        return '--%s--\r\n' % self.boundary
+
+    def get_chunks(self):
+        """Generate the body, a chunk at a time. This can be called more
+           than once, to send the body again."""
+        for header, value, path in self._parts:
+            yield header
+            if path is None:
+                yield value
+            else:
+                fh = open(path, 'rb')
+                try:
+                    while True:
+                        chunk = fh.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+                finally:
+                    fh.close()
+            yield '\r\n'
+        yield self._get_trailer()
+
+
+class _CookieResponse(object):
+    """Make an httplib response look like a urllib2 one, for cookielib"""
+    def __init__(self, response):
+        self._response = response
+
+    def info(self):
+        return self._response.msg
+
+# Cookie jars read from files, keyed by filename
+_cookie_jars = {}
+_cookie_lock = threading.Lock()
+
+def _get_cookie_jar(cookie):
+    """Get the cookie jar corresponding to a --cookie argument, or None
+       if it is a simple key=value string. Like curl, the cookie file is
+       read but never written; cookies set by the web service are only
+       kept in memory."""
+    if cookie is None or '=' in cookie:
+        return None
+    _cookie_lock.acquire()
+    try:
+        if cookie not in _cookie_jars:
+            jar = cookielib.MozillaCookieJar(cookie)
+            try:
+                jar.load(ignore_discard=True, ignore_expires=True)
+            except (IOError, cookielib.LoadError):
+                # curl silently ignores cookie files it cannot read
+                pass
+            # curl uses an expiry time of 0 for session cookies
+            for c in jar:
+                if c.expires == 0:
+                    c.expires = None
+                    c.discard = True
+            _cookie_jars[cookie] = jar
+        return _cookie_jars[cookie]
+    finally:
+        _cookie_lock.release()
+
+class _ResponseStream(object):
+    """The body of an HTTP response, to be read a chunk at a time. The
+       connection is reused for later requests only if the whole body is
+       read before the stream is closed."""
+    def __init__(self, response, conn, scheme, netloc):
+        self._response = response
+        self._conn = conn
+        self._key = (scheme, netloc)
+
+    def read(self, size):
+        data = self._response.read(size)
+        if not data and self._response.length:
+            # httplib does not complain if the connection is closed early
+            raise httplib.IncompleteRead('', self._response.length)
+        return data
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            _pool.put(self._key[0], self._key[1], self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+# Default time in seconds for which each kind of response is cached: web
+# service information, the results of a finished job, and the 'not done yet'
+# response for a job that is still running (which is not cached by default,
+# since jobs are polled less often than it would stay current)
+_cache_ttls = {'info': 3600, 'results': 3600, 'notdone': 0}
+
+# Response headers kept in the cache
+_cache_headers = ('content-type', 'etag', 'last-modified')
+
+class _CachedResponse(object):
+    """Stand-in for an httplib.HTTPResponse read from the cache"""
+    def __init__(self, meta):
+        self.status = meta['status']
+        self.reason = meta['reason']
+        self.msg = httplib.HTTPMessage(cStringIO.StringIO(
+                        ''.join('%s: %s\r\n' % (h, v)
+                                for h, v in meta['headers'])))
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+
+class _CachingStream(object):
+    """Wrap a :class:`_ResponseStream`, copying the body to a temporary
+       file as it is read. Once the whole body has been read, the file is
+       added to the cache when the stream is closed."""
+    def __init__(self, stream, cache, path, fh, tmpname):
+        self._stream = stream
+        self._cache = cache
+        self._path = path
+        self._fh = fh
+        self._tmpname = tmpname
+        self._size = 0
+        self._complete = False
+
+    def read(self, size):
+        data = self._stream.read(size)
+        if self._fh is not None:
+            self._size += len(data)
+            if self._size > self._cache.max_entry_size:
+                # Too big to be worth caching
+                self._abandon()
+            else:
+                self._fh.write(data)
+                if not data:
+                    self._complete = True
+        return data
+
+    def _abandon(self):
+        self._fh.close()
+        self._fh = None
+        _remove_file(self._tmpname)
+
+    def close(self):
+        self._stream.close()
+        if self._fh is not None:
+            if self._complete:
+                self._fh.close()
+                self._fh = None
+                self._cache._add(self._tmpname, self._path)
+            else:
+                self._abandon()
+
+
+def _remove_file(filename):
+    try:
+        os.unlink(filename)
+    except OSError:
+        pass
+
+
+class _HTTPCache(object):
+    """An on-disk cache of responses from web services. Each response is
+       stored in its own file, containing a line of JSON metadata followed
+       by the body. The file's modification time is the time the response
+       was last fetched or revalidated, and its access time the time it was
+       last used; once the cache is larger than `max_size` bytes, the least
+       recently used responses are removed. A running total of the size is
+       kept, so that the directory is only scanned when it may be too big.
+
+       This is safe to use from multiple threads and processes, since
+       responses are written to temporary files which are then renamed."""
+
+    def __init__(self, directory, max_size, ttls):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_entry_size = max_size // 4
+        self.ttls = ttls
+        # Total size of the cache in bytes, or None if not yet known
+        self._total = None
+        self._total_lock = threading.Lock()
+
+    def get_path(self, url, cookie):
+        key = u'%s\n%s' % (url, cookie)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.cache')
+
+    def get(self, path):
+        """Get the cached response in the given file, as a (metadata,
+           file-like object) pair, or None if it is not in the cache.
+           The file-like object is positioned at the start of the body."""
+        try:
+            fh = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            meta = json.loads(fh.readline())
+            meta['age'] = time.time() - os.fstat(fh.fileno()).st_mtime
+            return meta, fh
+        except (ValueError, OSError):
+            fh.close()
+            return None
+
+    def touch(self, path, revalidated=False):
+        """Note that a cached response was used (and, if `revalidated` is
+           True, that the web service confirmed it is still current)"""
+        try:
+            now = time.time()
+            if revalidated:
+                os.utime(path, (now, now))
+            else:
+                os.utime(path, (now, os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    def get_ttl(self, kind, response):
+        """Get the time for which the given response can be used without
+           asking the web service again, or None if it should not be
+           cached. Cache-Control headers from the web service override the
+           default times."""
+        if response.status == 503 and kind == 'results':
+            kind = 'notdone'
+        elif response.status != 200:
+            return None
+        control = (response.getheader('cache-control') or '').lower()
+        if 'no-store' in control or 'private' in control:
+            return None
+        m = re.search('max-age=(\d+)', control)
+        if m:
+            ttl = int(m.group(1))
+        elif 'no-cache' in control:
+            ttl = 0
+        else:
+            ttl = self.ttls.get(kind)
+        if ttl is None or (ttl <= 0 and not response.getheader('etag')
+                           and not response.getheader('last-modified')):
+            # Nothing to gain by caching the response
+            return None
+        return ttl
+
+    def store(self, path, url, response, ttl, stream):
+        """Start adding a response to the cache. Return a stream that
+           should be read and closed instead of `stream`."""
+        meta = {'url': url, 'status': response.status,
+                'reason': response.reason, 'ttl': ttl,
+                'headers': [(h, response.getheader(h))
+                            for h in _cache_headers
+                            if response.getheader(h) is not None]}
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.directory,
+                                           suffix='.tmp')
+        except OSError:
+            return stream
+        fh = os.fdopen(fd, 'wb')
+        fh.write(json.dumps(meta) + '\n')
+        return _CachingStream(stream, self, path, fh, tmpname)
+
+    def _add(self, tmpname, path):
+        try:
+            size = os.stat(tmpname).st_size
+            try:
+                # Replacing an older copy of the same response
+                size -= os.stat(path).st_size
+            except OSError:
+                pass
+            os.rename(tmpname, path)
+        except OSError:
+            _remove_file(tmpname)
+            return
+        with self._total_lock:
+            if self._total is None or self._total + size > self.max_size:
+                self._evict()
+            else:
+                self._total += size
+
+    def _evict(self):
+        """Remove the least recently used responses, to keep the total
+           size of the cache below max_size. This also updates the running
+           total, which may be out of date if other processes use the
+           cache."""
+        entries = []
+        total = 0
+        now = time.time()
+        for fname in os.listdir(self.directory):
+            path = os.path.join(self.directory, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if fname.endswith('.cache'):
+                entries.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+            elif fname.endswith('.tmp') and st.st_mtime < now - 3600:
+                # Left behind by a process that was killed
+                _remove_file(path)
+        entries.sort()
+        for atime, size, path in entries:
+            if total <= self.max_size:
+                break
+            _remove_file(path)
+            total -= size
+        self._total = total
+
+_cache = None
+
+def _get_default_cache_directory():
+    top = os.environ.get('XDG_CACHE_HOME') \
+          or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(top, 'saliweb')
+
+def enable_cache(directory=None, max_size=50 * 1024 * 1024, ttls=None):
+    """Keep copies of web service information and job results on disk.
+       Information about a web service (as shown by show_info()) and the
+       results of a job (as returned by get_results()) are reused for a
+       while rather than being fetched again each time. If the web service
+       supports it, copies are then revalidated with conditional requests,
+       so that they are only fetched again if they have changed.
+
+       The copies are kept in 'directory' (by default, 'saliweb' in the
+       user's cache directory) which is limited to 'max_size' bytes.
+       'ttls', if given, is a dict overriding the time in seconds for which
+       copies are used without asking the web service again, keyed by
+       'info', 'results' or 'notdone' (the response for a job that hasn't
+       finished yet, which by default is not cached unless the web service
+       supports revalidating it). If a web service sends a Cache-Control
+       header, that is used instead.
+
+       The web_service.py command line tool enables the cache by default.
+    """
+    global _cache
+    if directory is None:
+        directory = _get_default_cache_directory()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    all_ttls = _cache_ttls.copy()
+    all_ttls.update(ttls or {})
+    _cache = _HTTPCache(directory, max_size, all_ttls)
+
+def disable_cache():
+    """Stop keeping copies of web service responses (see enable_cache())."""
+    global _cache
+    _cache = None
+
+def _cached_request(cache, url, cookie, jar, headers, kind):
+    """Make a GET request, using the cached response if possible."""
+    path = cache.get_path(url, cookie)
+    cached = cache.get(path)
+    if cached is not None:
+        meta, fh = cached
+        if meta['age'] < meta['ttl']:
+            cache.touch(path)
+            return _CachedResponse(meta), fh
+        headers = list(headers)
+        for header, value in meta['headers']:
+            if header == 'etag':
+                headers.append(('If-None-Match', value))
+            elif header == 'last-modified':
+                headers.append(('If-Modified-Since', value))
     try:
-        dom = parseString(out)
-    except xml.parsers.expat.ExpatError:
-        print("Web service did not return valid XML:\n" + out, file=sys.stderr)
+        response, stream = _send_request('GET', url, None, cookie, jar,
+                                         headers, True)
+        if cached is not None and response.status == 304:
+            stream.read(65536)
+            stream.close()
+            cache.touch(path, revalidated=True)
+            return _CachedResponse(meta), fh
+    except:
+        if cached is not None:
+            fh.close()
         raise
-    top = dom.getElementsByTagName('saliweb')
-    if len(top) == 0:
-        raise ValueError("Invalid XML: web service did not return "
-                         "XML containing a 'saliweb' tag")
-    return top[0], out
+    if cached is not None:
+        fh.close()
+    ttl = cache.get_ttl(kind, response)
+    if ttl is not None:
+        stream = cache.store(path, url, response, ttl, stream)
+    return response, stream
+
+def _http_request(url, fields=None, cookie=None, directory=None,
+                  follow_redirects=False, headers=(), stream=False,
+                  cache_kind=None):
+    """Make an HTTP request to the given URL, and return the response and
+       its body. If `fields` (a list of arguments as for curl's -F option)
+       is given, they are sent in a POST request; otherwise a GET is done.
+       `cookie` is handled in the same way as curl's --cookie option.
+       Any extra `headers` are given as (name, value) pairs.
+       Connections are kept open and reused for later requests.
+       If `stream` is True, the body is returned as a
+       :class:`_ResponseStream` rather than a string; it must be closed
+       once it has been read.
+       If `cache_kind` is given and the cache is enabled (see
+       :func:`enable_cache`), GET requests are cached as that kind of
+       response."""
+    if fields:
+        body = _MultipartBody(fields, directory)
+        method = 'POST'
+    else:
+        body = None
+        method = 'GET'
+    jar = _get_cookie_jar(cookie)
+    cache = _cache
+    for redirect in range(5):
+        if cache is not None and cache_kind and method == 'GET':
+            response, data = _cached_request(cache, url, cookie, jar,
+                                             headers, cache_kind)
+            if not stream:
+                data = _read_stream(data)
+        else:
+            response, data = _send_request(method, url, body, cookie, jar,
+                                           headers, stream)
+        location = response.getheader('location')
+        if follow_redirects and method == 'GET' and location \
+           and response.status in (301, 302, 303, 307):
+            url = urlparse.urljoin(url, location)
+            if stream:
+                data.close()
+        else:
+            break
+    return response, data
+
+def _read_stream(stream, chunk_size=65536):
+    """Read all of a stream returned by _http_request, and close it"""
+    chunks = []
+    try:
+        while True:
+            data = stream.read(chunk_size)
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+    finally:
+        stream.close()
+
+def _send_request(method, url, body, cookie, jar, extra_headers, stream):
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    target = urlparse.urlunsplit(('', '', path or '/', query, ''))
+    headers = [('User-Agent', 'saliweb-web-service/1.0'), ('Accept', '*/*')]
+    headers.extend(extra_headers)
+    if jar is not None:
+        req = urllib2.Request(url)
+        _cookie_lock.acquire()
+        try:
+            jar.add_cookie_header(req)
+        finally:
+            _cookie_lock.release()
+        if req.has_header('Cookie'):
+            headers.append(('Cookie', req.get_header('Cookie')))
+    elif cookie:
+        headers.append(('Cookie', cookie))
+    if body is not None:
+        headers.append(('Content-Type', body.get_content_type()))
+        headers.append(('Content-Length', str(body.get_length())))
+    while True:
+        conn, reused = _pool.get(scheme, netloc)
+        # Set once the whole request has been sent; after that, the server
+        # may have acted on it even if we get no response
+        sent = False
+        try:
+            if conn.sock is None:
+                conn.connect()
+                # Don't wait to send the body after the headers
+                conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                     1)
+            if getattr(conn, '_saliweb_full_url', False):
+                conn.putrequest(method, url, skip_accept_encoding=True)
+            else:
+                conn.putrequest(method, target, skip_accept_encoding=True)
+            for header, value in headers:
+                conn.putheader(header, value)
+            conn.endheaders()
+            if body is not None:
+                for chunk in body.get_chunks():
+                    conn.send(chunk)
+            sent = True
+            response = conn.getresponse()
+        except (socket.error, httplib.HTTPException) as detail:
+            conn.close()
+            # The server may have closed a kept-alive connection before we
+            # used it, so try again with a new connection. Never resend a
+            # POST that the server may have received, though, since it
+            # might then be done twice (e.g. submitting a duplicate job).
+            if reused and (method == 'GET' or not sent):
+                continue
+            # Let callers know whether it is safe to try again later
+            detail.saliweb_not_sent = not sent
+            raise
+        if jar is not None:
+            _cookie_lock.acquire()
+            try:
+                jar.extract_cookies(_CookieResponse(response), req)
+            finally:
+                _cookie_lock.release()
+        data = _ResponseStream(response, conn, scheme, netloc)
+        if stream:
+            return response, data
+        try:
+            return response, response.read()
+        finally:
+            data.close()
+
+class _SaliwebParser(object):
+    """Parse the XML returned by a web service's REST interface as it is
+       read, rather than building a tree of the whole document. Only the
+       parts that we use (the service name, parameters, and job and
+       results file URLs) are kept, and results file URLs are removed
+       again by :meth:`pop_results`, so memory use does not grow with the
+       size of the document."""
+
+    # Amount of the document to keep, for error messages
+    _max_text = 4096
+
+    def __init__(self):
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+        self._parser.CharacterDataHandler = self._character_data
+        self.text = ''
+        self.found_top = False
+        self.service = None
+        self.jobs = []
+        self.parameters = []
+        self._results = []
+        self._in_top = 0
+        self._in_parameters = False
+        self._param = None
+
+    def feed(self, data, final=False):
+        """Parse the next part of the document. `final` should be True
+           for the last part."""
+        if len(self.text) < self._max_text:
+            self.text += data[:self._max_text - len(self.text)]
+        try:
+            self._parser.Parse(data, final)
+        except xml.parsers.expat.ExpatError:
+            print("Web service did not return valid XML:\n" + self.text,
+                  file=sys.stderr)
+            raise
+        if final and not self.found_top:
+            raise ValueError("Invalid XML: web service did not return "
+                             "XML containing a 'saliweb' tag")
+
+    def pop_results(self):
+        """Return (and forget) the results file URLs parsed so far"""
+        results = self._results
+        self._results = []
+        return results
+
+    def _start_element(self, name, attrs):
+        if name == 'saliweb':
+            self.found_top = True
+            self._in_top += 1
+        elif not self._in_top:
+            return
+        elif name == 'results_file':
+            self._results.append(attrs.get('xlink:href', ''))
+        elif name == 'job':
+            self.jobs.append(attrs.get('xlink:href', ''))
+        elif name == 'service' and self.service is None:
+            self.service = attrs.get('name', '')
+        elif name == 'parameters':
+            self._in_parameters = True
+        elif self._in_parameters and name in ('string', 'file') \
+             and self._param is None:
+            self._param = (name, attrs.get('name', ''),
+                           attrs.get('optional', ''), [])
+
+    def _end_element(self, name):
+        if name == 'saliweb':
+            self._in_top -= 1
+        elif name == 'parameters':
+            self._in_parameters = False
+        elif self._param is not None and name == self._param[0]:
+            tag, pname, optional, text = self._param
+            if tag == 'string':
+                cls = _Parameter
+            else:
+                cls = _FileParameter
+            self.parameters.append(cls(pname, ''.join(text), optional))
+            self._param = None
+
+    def _character_data(self, data):
+        if self._param is not None:
+            self._param[3].append(data)
+
+
+def _parse_stream(stream, parser, chunk_size=65536):
+    """Feed the body of an HTTP response to `parser` a chunk at a time,
+       yielding each results file URL as soon as it has been parsed."""
+    while True:
+        data = stream.read(chunk_size)
+        parser.feed(data, not data)
+        for url in parser.pop_results():
+            yield url
+        if not data:
+            return
+
+class _RequestNotSentError(OSError):
+    """A request to a web service failed before it was sent in full (e.g.
+       because the server could not be contacted). The server cannot have
+       acted on it, so it is safe to send it again."""
+    pass
+
+def _rest_page(url, fields=None, cookie=None, directory=None,
+               cache_kind=None):
+    parser = _SaliwebParser()
+    try:
+        response, stream = _http_request(url, fields, cookie, directory,
+                                         stream=True, cache_kind=cache_kind)
+        try:
+            for result in _parse_stream(stream, parser):
+                pass
+        finally:
+            stream.close()
+    except (socket.error, httplib.HTTPException) as detail:
+        if getattr(detail, 'saliweb_not_sent', False):
+            cls = _RequestNotSentError
+        else:
+            cls = OSError
+        raise cls("Request to %s failed: %s" % (url, str(detail)))
+    return parser, parser.text
 
 class _Parameter(object):
     def __init__(self, name, help, optional):
@@ -89,32 +829,18 @@ class _FileParameter(_Parameter):
         return '%s=@FILENAME' % self.name
 
 def _get_parameters_from_xml(xml):
-    ps = []
-    for param in xml.getElementsByTagName('parameters'):
-        for c in param.childNodes:
-            if c.nodeName == 'string':
-                ps.append(_Parameter(c.getAttribute('name'),
-                                     c.childNodes[0].wholeText,
-                                     c.getAttribute('optional')))
-            elif c.nodeName == 'file':
-                ps.append(_FileParameter(c.getAttribute('name'),
-                                         c.childNodes[0].wholeText,
-                                         c.getAttribute('optional')))
-    return ps
+    parser = _SaliwebParser()
+    parser.feed(xml, True)
+    return parser.parameters
 
 def show_info(url, cookie=None):
     """Given the URL of a Sali lab web service, print information about it."""
     progname = os.path.basename(sys.argv[0])
-    curl_args = []
-    if cookie:
-        curl_args.append('--cookie')
-        curl_args.append(cookie)
-    p, out = _curl_rest_page(url, curl_args)
-    try:
-        service = p.getElementsByTagName('service')[0].getAttribute('name')
-    except IndexError:
+    p, out = _rest_page(url, cookie=cookie, cache_kind='info')
+    if p.service is None:
         raise IOError("Could not get job info: " + out)
-    parameters = _get_parameters_from_xml(p)
+    service = p.service
+    parameters = p.parameters
     if parameters:
         pstr = " ".join(x.get_full_arg() for x in parameters)
     else:
@@ -135,7 +861,7 @@ service page and look at the names of the HTML form elements. Alternatively,
 ask the developer of the web service to implement the
 get_submit_parameter_help() method!""")
 
-def submit_job(url, args, cookie=None):
+def submit_job(url, args, cookie=None, directory=None):
     """Submit a job to a Sali Lab web service (but don't wait for it to end).
        'args' is a service-dependent list of arguments; each should be suitable
        for passing to curl as an argument to its -F option (e.g. 'foo=bar' sets
@@ -145,25 +871,25 @@ def submit_job(url, args, cookie=None):
        is not used, since it is possible for HTML names to be invalid Python
        keywords.)
 
-       If 'cookie' is given, it is passed as the --cookie argument to curl.
-       This is typically used to pass a username and password to the web
-       service. Just as for curl, it can either be a filename or key=value.
+       If 'cookie' is given, it is used in the same way as the --cookie
+       argument to curl. This is typically used to pass a username and
+       password to the web service. Just as for curl, it can either be a
+       filename or key=value.
+
+       If 'directory' is given, any files to upload are relative to that
+       directory rather than the current working directory.
 
        On successful execution, the job is started, and a URL is returned
        at which results will appear (use get_results() to query it).
     """
-    curl_args = []
-    for a in args:
-        curl_args.append('-F')
-        curl_args.append(a)
-    if cookie:
-        curl_args.append('--cookie')
-        curl_args.append(cookie)
-    p, out = _curl_rest_page(url, curl_args)
-    for results in p.getElementsByTagName('job'):
-        url = results.getAttribute('xlink:href')
-        print("Job submitted: results will be found at " + url)
-        return url
+    url = _submit_job(url, args, cookie, directory)
+    print("Job submitted: results will be found at " + url)
+    return url
+
+def _submit_job(url, args, cookie=None, directory=None):
+    p, out = _rest_page(url, args, cookie, directory)
+    if p.jobs:
+        return p.jobs[0]
     raise IOError("Could not submit job: " + out)
 
 def get_results(url):
@@ -172,25 +898,218 @@ def get_results(url):
        of URLs, each pointing to an output file generated by the web service.
        If the job hasn't finished yet, None is returned.
     """
-    try:
-        u = urllib2.urlopen(url)
-    except urllib2.HTTPError as detail:
-        if detail.code == 503:
-            print("Job not done yet")
-            return
-        else:
-            raise
-    dom = parseString(u.read())
+    results = iter_results(url)
+    if results is None:
+        print("Job not done yet")
+        return
     print("Got results:")
     urls = []
-    top = dom.getElementsByTagName('saliweb')[0]
-    for results in top.getElementsByTagName('results_file'):
-        url = results.getAttribute('xlink:href')
-        urls.append(url)
+    for url in results:
         print("   " + url)
-    dom.unlink()
+        urls.append(url)
     return urls
 
+def _get_results(url):
+    results = iter_results(url)
+    if results is not None:
+        return list(results)
+
+class _ResultsIterator(object):
+    """Iterator over the URLs of a job's output files, which reads the
+       results page from the web service a chunk at a time"""
+    def __init__(self, stream):
+        self._stream = stream
+        self._urls = _parse_stream(stream, _SaliwebParser())
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return next(self._urls)
+        except (socket.error, httplib.HTTPException) as detail:
+            self.close()
+            raise urllib2.URLError(detail)
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        """Stop reading the results. This is done automatically once the
+           last URL has been returned."""
+        self._stream.close()
+
+def iter_results(url):
+    """Check for results from a web service.
+       This is like get_results(), but rather than a list, an iterator over
+       the output file URLs is returned. Each URL is returned as soon as it
+       has been read from the web service, so this needs little memory even
+       for jobs with a very large number of output files. If not all of the
+       URLs are needed, call the iterator's close() method.
+       If the job hasn't finished yet, None is returned.
+    """
+    try:
+        response, stream = _http_request(url, follow_redirects=True,
+                                         stream=True, cache_kind='results')
+        if response.status != 200:
+            # Read the (short) error page so the connection can be reused
+            try:
+                while stream.read(65536):
+                    pass
+            finally:
+                stream.close()
+    except (socket.error, httplib.HTTPException) as detail:
+        raise urllib2.URLError(detail)
+    if response.status == 503:
+        return
+    elif response.status != 200:
+        raise urllib2.HTTPError(url, response.status, response.reason,
+                                response.msg, None)
+    return _ResultsIterator(stream)
+
+def _get_checksum(checksum):
+    """Get a hash object, and the expected digest, for a checksum given as
+       'algorithm:hexdigest'"""
+    try:
+        algorithm, digest = checksum.split(':', 1)
+        return hashlib.new(algorithm), digest.lower()
+    except ValueError:
+        raise ValueError("Invalid checksum %s; should be of the form "
+                         "algorithm:hexdigest, e.g. md5:d41d8cd98f00b204e980"
+                         "0998ecf8427e" % checksum)
+
+def _parse_content_range(header):
+    """Get the first byte and the total length from a Content-Range header,
+       or None for either if they are not given"""
+    try:
+        unit, spec = header.split(' ', 1)
+        byte_range, total = spec.split('/', 1)
+        if byte_range == '*':
+            first = None
+        else:
+            first = int(byte_range.split('-')[0])
+        if total == '*':
+            total = None
+        else:
+            total = int(total)
+        return first, total
+    except (AttributeError, ValueError):
+        return None, None
+
+def _download_part(url, filename):
+    """Download url to filename. If the file already exists, only the
+       rest of the file is requested."""
+    offset = 0
+    if os.path.exists(filename):
+        offset = os.path.getsize(filename)
+    headers = []
+    if offset > 0:
+        headers.append(('Range', 'bytes=%d-' % offset))
+    response, stream = _http_request(url, follow_redirects=True,
+                                     headers=headers, stream=True)
+    try:
+        first, total = _parse_content_range(
+                                response.getheader('content-range'))
+        if response.status == 416 and offset > 0 and total == offset:
+            # We already have the whole file
+            mode = None
+        elif response.status == 206 and offset > 0 and first == offset:
+            mode = 'ab'
+        elif response.status == 200:
+            mode = 'wb'
+        elif response.status == 416:
+            # Our partial file is bigger than the real file; start again
+            stream.close()
+            os.unlink(filename)
+            return _download_part(url, filename)
+        else:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, None)
+        if mode is not None:
+            fh = open(filename, mode)
+            try:
+                _copy_stream(stream, fh, None)
+            finally:
+                fh.close()
+    finally:
+        stream.close()
+
+def _copy_stream(stream, fh, hasher, chunk_size=65536):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        fh.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+
+def _check_file_checksum(filename, hasher, digest, chunk_size=65536):
+    fh = open(filename, 'rb')
+    try:
+        while True:
+            chunk = fh.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    finally:
+        fh.close()
+    return hasher.hexdigest() == digest
+
+def download_file(url, dest, checksum=None, resume=True, retries=3):
+    """Download a file, such as a job result file, from a web service.
+       'dest' is either the name of the file to write, or a Python
+       file-like object. The file is downloaded a chunk at a time, in
+       binary mode, so it need not fit in memory.
+
+       When writing to a named file, the data are first written to a
+       temporary file with a '.part' suffix, which is renamed once the
+       download is complete. If the connection is lost part way through, up
+       to 'retries' more requests are made for the rest of the file (using
+       HTTP Range requests). If 'resume' is True, any '.part' file left by
+       an earlier interrupted call is also continued rather than being
+       downloaded again.
+
+       If 'checksum' is given, as 'algorithm:hexdigest' (for example,
+       'sha256:...'; any algorithm supported by Python's hashlib can be
+       used), the downloaded file is checked against it and IOError is
+       raised if it does not match.
+    """
+    hasher = digest = None
+    if checksum:
+        hasher, digest = _get_checksum(checksum)
+    if not isinstance(dest, basestring):
+        try:
+            response, stream = _http_request(url, follow_redirects=True,
+                                             stream=True)
+        except (socket.error, httplib.HTTPException) as detail:
+            raise urllib2.URLError(detail)
+        try:
+            if response.status != 200:
+                raise urllib2.HTTPError(url, response.status, response.reason,
+                                        response.msg, None)
+            _copy_stream(stream, dest, hasher)
+        finally:
+            stream.close()
+        if hasher and hasher.hexdigest() != digest:
+            raise IOError("Checksum mismatch for %s" % url)
+        return
+    part = dest + '.part'
+    if not resume and os.path.exists(part):
+        os.unlink(part)
+    attempt = 0
+    while True:
+        try:
+            _download_part(url, part)
+            break
+        except (socket.error, httplib.HTTPException) as detail:
+            attempt += 1
+            if attempt > retries:
+                raise urllib2.URLError(detail)
+    if hasher and not _check_file_checksum(part, hasher, digest):
+        os.unlink(part)
+        raise IOError("Checksum mismatch for %s" % url)
+    os.rename(part, dest)
+
 def run_job(url, args, cookie=None):
     """Run a job, wait for it to finish, and return its results.
        This is essentially the same as running submit_job(), then
@@ -206,6 +1125,302 @@ def run_job(url, args, cookie=None):
         if results is not None:
             return results
 
+class _Checkpoint(object):
+    """Record the progress of a batch of jobs in a file, one JSON object
+       per line, so that an interrupted batch can be resumed. If the file
+       already exists, the jobs it records are read from it."""
+    def __init__(self, filename, args_list):
+        # Results URLs of submitted jobs, and lists of results of finished
+        # jobs, keyed by the index of the job in args_list
+        self.submitted = {}
+        self.results = {}
+        self._lock = threading.Lock()
+        self._fh = None
+        if filename is None:
+            return
+        partial = False
+        if os.path.exists(filename):
+            partial = self._read(filename, args_list)
+        self._fh = open(filename, 'a')
+        if partial:
+            # End the incomplete line left when the batch was interrupted
+            self._fh.write('\n')
+            self._fh.flush()
+
+    def _read(self, filename, args_list):
+        """Read jobs from an existing file. Return True if the last line
+           is incomplete."""
+        line = ''
+        for line in open(filename):
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # Incomplete line written when the batch was interrupted
+                continue
+            job = rec['job']
+            if job >= len(args_list) or rec['args'] != list(args_list[job]):
+                raise ValueError("Checkpoint file %s is for a different "
+                                 "set of jobs" % filename)
+            if 'results' in rec:
+                self.results[job] = rec['results']
+            else:
+                self.submitted[job] = rec['url']
+        return line != '' and not line.endswith('\n')
+
+    def job_submitted(self, job, args, url):
+        self._write({'job': job, 'args': list(args), 'url': url})
+
+    def job_finished(self, job, args, results):
+        self._write({'job': job, 'args': list(args), 'results': results})
+
+    def _write(self, rec):
+        self._lock.acquire()
+        try:
+            if self._fh is not None:
+                self._fh.write(json.dumps(rec) + '\n')
+                self._fh.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+        finally:
+            self._lock.release()
+
+
+class _Batch(object):
+    """Submit many jobs to a web service, using a fixed number of threads,
+       and then wait for all of them to finish. If a job cannot be
+       submitted, the others are still run, and the error is raised at
+       the end."""
+
+    # Number of times to retry submission if the server cannot be
+    # contacted, and the initial delay between retries in seconds (which
+    # doubles on each retry, up to _max_retry_delay)
+    _submit_retries = 6
+    _retry_delay = 2.
+    _max_retry_delay = 60.
+
+    def __init__(self, url, args_list, cookie, directory, max_workers,
+                 checkpoint):
+        self.url = url
+        self.args_list = [list(args) for args in args_list]
+        self.cookie = cookie
+        self.directory = directory
+        self.max_workers = max_workers
+        self.checkpoint = _Checkpoint(checkpoint, self.args_list)
+        self._todo = Queue.Queue()
+        self._submitted = Queue.Queue()
+        self._stop = threading.Event()
+        self._num_todo = 0
+        self._threads = []
+        self._errors = []
+
+    def _start_submission(self):
+        """Start submitting all jobs that have not been submitted yet"""
+        for job in range(len(self.args_list)):
+            if job not in self.checkpoint.submitted \
+               and job not in self.checkpoint.results:
+                self._todo.put(job)
+                self._num_todo += 1
+        for i in range(min(self.max_workers, self._num_todo)):
+            t = threading.Thread(target=self._worker)
+            t.setDaemon(True)
+            t.start()
+            self._threads.append(t)
+
+    def _stop_workers(self):
+        """Stop starting new submissions, and wait for any that are in
+           progress to finish (so that they are recorded in the checkpoint)"""
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _worker(self):
+        while not self._stop.isSet():
+            try:
+                job = self._todo.get_nowait()
+            except Queue.Empty:
+                return
+            args = self.args_list[job]
+            try:
+                url = self._submit(args)
+            except Exception as detail:
+                self._submitted.put((job, None, detail))
+                continue
+            if url is None:
+                # Stopped while waiting to retry
+                return
+            self.checkpoint.job_submitted(job, args, url)
+            self._submitted.put((job, url, None))
+
+    def _submit(self, args):
+        """Submit a single job, retrying if the server cannot be contacted.
+           Return the results URL, or None if the batch was stopped."""
+        delay = self._retry_delay
+        for attempt in range(self._submit_retries):
+            try:
+                return _submit_job(self.url, args, self.cookie,
+                                   self.directory)
+            except _RequestNotSentError:
+                self._stop.wait(delay)
+                if self._stop.isSet():
+                    return None
+                delay = min(delay * 2, self._max_retry_delay)
+        return _submit_job(self.url, args, self.cookie, self.directory)
+
+    def _get_submitted(self, timeout):
+        """Wait up to timeout seconds (forever if None) for the next job
+           to be submitted. Return its index and URL, or None."""
+        if timeout is None or timeout > 1.:
+            # Wake up regularly, so that Ctrl-C is not blocked
+            timeout = 1.
+        try:
+            job, url, exception = self._submitted.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        self._num_todo -= 1
+        if exception is not None:
+            self._errors.append(exception)
+            return None
+        return job, url
+
+    def _check_errors(self):
+        """Raise the first error encountered while submitting jobs"""
+        if self._errors:
+            raise self._errors[0]
+
+    def submit(self):
+        """Submit all jobs; yield (index, results URL) for each one, in the
+           order they are submitted"""
+        for job in sorted(self.checkpoint.submitted.keys()):
+            yield job, self.checkpoint.submitted[job]
+        self._start_submission()
+        try:
+            while self._num_todo > 0:
+                submitted = self._get_submitted(None)
+                if submitted:
+                    yield submitted
+        finally:
+            self._stop_workers()
+        self._check_errors()
+
+    def run(self, poll_interval, max_poll_interval):
+        """Submit all jobs and wait for them to finish; yield (index,
+           results) for each one, in the order they finish"""
+        for job in sorted(self.checkpoint.results.keys()):
+            yield job, self.checkpoint.results[job]
+        # Jobs waiting for results, as (time of next check, index, URL,
+        # check interval), soonest first
+        waiting = []
+        now = time.time()
+        for job, url in self.checkpoint.submitted.items():
+            if job not in self.checkpoint.results:
+                heapq.heappush(waiting, (now, job, url, poll_interval))
+        self._start_submission()
+        try:
+            while waiting or self._num_todo > 0:
+                if waiting:
+                    timeout = max(0., waiting[0][0] - time.time())
+                else:
+                    timeout = None
+                if self._num_todo > 0 and timeout != 0.:
+                    submitted = self._get_submitted(timeout)
+                    if submitted:
+                        job, url = submitted
+                        heapq.heappush(waiting, (time.time() + poll_interval,
+                                                 job, url, poll_interval))
+                    continue
+                if timeout:
+                    time.sleep(timeout)
+                due, job, url, interval = heapq.heappop(waiting)
+                results = self._poll(url)
+                if results is None:
+                    interval = min(interval * 3 / 2, max_poll_interval)
+                    heapq.heappush(waiting, (time.time() + interval, job,
+                                             url, interval))
+                else:
+                    self.checkpoint.job_finished(job, self.args_list[job],
+                                                 results)
+                    yield job, results
+        finally:
+            self._stop_workers()
+            self.checkpoint.close()
+        self._check_errors()
+
+    def _poll(self, url):
+        """Check for results of a job. Temporary network or server problems
+           are treated as if the job has not finished yet."""
+        try:
+            return _get_results(url)
+        except urllib2.HTTPError as detail:
+            if detail.code >= 500:
+                return None
+            raise
+        except urllib2.URLError:
+            return None
+
+def submit_jobs(url, args_list, cookie=None, directory=None, max_workers=4,
+                checkpoint=None):
+    """Submit many jobs to a Sali Lab web service (but don't wait for them
+       to end). 'args_list' is a list of arguments for each job, each of
+       which is the same as the 'args' argument to submit_job(); 'cookie'
+       and 'directory' are also as for submit_job().
+
+       Up to 'max_workers' jobs are submitted at the same time. If
+       'checkpoint' is given, it names a file in which to record the jobs
+       that were submitted; if this function is called again with the same
+       file (and the same jobs) it will not submit those jobs again.
+
+       A list of URLs is returned, one for each job, at which results will
+       appear (use get_results() to query them).
+
+       If the web service cannot be contacted, submission is retried a few
+       times. If a job still cannot be submitted, the other jobs are
+       submitted anyway, and then the error is raised; calling this
+       function again with the same checkpoint file submits only the
+       jobs that failed.
+    """
+    batch = _Batch(url, args_list, cookie, directory, max_workers,
+                   checkpoint)
+    urls = [None] * len(args_list)
+    try:
+        for job, results_url in batch.submit():
+            urls[job] = results_url
+    finally:
+        batch.checkpoint.close()
+    return urls
+
+def run_jobs(url, args_list, cookie=None, directory=None, max_workers=4,
+             checkpoint=None, poll_interval=10, max_poll_interval=1200):
+    """Run many jobs, and wait for them to finish.
+       Jobs are submitted in the same way as for submit_jobs(). Each job's
+       results URL is checked every 'poll_interval' seconds at first,
+       backing off to 'max_poll_interval' seconds if the job takes a long
+       time to finish.
+
+       This is a generator that yields (index, results) pairs as each job
+       finishes, where 'index' is the index of the job in 'args_list', and
+       'results' is the list of result URLs, as returned by get_results().
+
+       If 'checkpoint' is given, it names a file in which to record the
+       progress of the jobs. If the batch is interrupted, calling this
+       function again with the same file (and the same jobs) resumes it:
+       jobs that were already submitted are not submitted again, and the
+       results of jobs that already finished are yielded first. Errors
+       submitting jobs are handled as for submit_jobs(): they are raised
+       only once all other jobs have finished.
+    """
+    batch = _Batch(url, args_list, cookie, directory, max_workers,
+                   checkpoint)
+    for job, results in batch.run(poll_interval, max_poll_interval):
+        yield job, results
+
 class _Command(object):
     def __init__(self, progname, usage_prefix):
         self.progname = progname
@@ -223,8 +1438,8 @@ the same as the main web page, with /job appended. For example, to access the
 ModLoop server, use http://salilab.org/modloop/job (the main web page is
 at http://salilab.org/modloop/).
 
-If '--cookie' is given, it is passed as the --cookie argument to curl.
-This is typically used to pass a username and password to the web
+If '--cookie' is given, it is used in the same way as curl's --cookie
+argument. This is typically used to pass a username and password to the web
 service. Just as for curl, it can either be a filename or key=value.
 
 If the URL is valid and the web service is working properly, this will show
@@ -251,8 +1466,8 @@ class _SubmitCommand(_Command):
 for more information). The additional arguments depend on the service;
 the output of '%prog info <url>' suggests suitable arguments.
 
-If '--cookie' is given, it is passed as the --cookie argument to curl.
-This is typically used to pass a username and password to the web
+If '--cookie' is given, it is used in the same way as curl's --cookie
+argument. This is typically used to pass a username and password to the web
 service. Just as for curl, it can either be a filename or key=value.
 
 This only submits the job; on successful completion, a new URL is returned,
@@ -304,6 +1519,73 @@ the parameters.
             sys.exit(1)
 
 
+class _BatchCommand(_Command):
+    short_help = "Run many web service jobs at once."
+    usage_args = '[--cookie COOKIE] [-j N] [--checkpoint FILE] <url> <jobfile>'
+    long_help = short_help + """
+<url> identifies the web service to submit to (see '%prog help info'
+for more information). <jobfile> is a file containing one line for each
+job, containing the arguments for that job (as for '%prog submit')
+separated by spaces. Arguments containing spaces can be quoted, as in the
+shell. Blank lines, and lines starting with '#', are ignored.
+
+Up to N (default 4) jobs are submitted at a time. The results of each job
+are shown as it finishes.
+
+Progress is recorded in a checkpoint file (<jobfile>.checkpoint, unless
+--checkpoint is given). If the batch is interrupted, simply run the same
+command again; jobs that were already submitted will not be submitted
+again.
+
+If '--cookie' is given, it is used in the same way as curl's --cookie
+argument (see '%prog help submit').
+"""
+    def main(self, args):
+        try:
+            opts, args = getopt.getopt(args, "c:j:",
+                                       ["cookie=", "jobs=", "checkpoint="])
+            cookie = checkpoint = None
+            max_workers = 4
+            for o, a in opts:
+                if o in ("-c", "--cookie"):
+                    cookie = a
+                elif o in ("-j", "--jobs"):
+                    max_workers = int(a)
+                elif o == "--checkpoint":
+                    checkpoint = a
+        except (getopt.GetoptError, ValueError) as err:
+            print(str(err))
+            self.usage()
+            sys.exit(1)
+        if len(args) != 2 or max_workers < 1:
+            self.usage()
+            sys.exit(1)
+        url, jobfile = args
+        lines, args_list = self.read_jobs(jobfile)
+        if checkpoint is None:
+            checkpoint = jobfile + '.checkpoint'
+        print("Running %d jobs" % len(args_list))
+        for job, results in run_jobs(url, args_list, cookie,
+                                     max_workers=max_workers,
+                                     checkpoint=checkpoint):
+            print("Job on line %d finished; results:" % lines[job])
+            for r in results:
+                print("   " + r)
+            sys.stdout.flush()
+
+    def read_jobs(self, jobfile):
+        """Get the line numbers, and the arguments, of each job in the
+           file"""
+        lines = []
+        args_list = []
+        for n, line in enumerate(open(jobfile)):
+            args = shlex.split(line, comments=True)
+            if args:
+                lines.append(n + 1)
+                args_list.append(args)
+        return lines, args_list
+
+
 class _WebService(object):
     def __init__(self):
         self.short_help = "Run jobs using Sali lab REST web services."
@@ -311,7 +1593,8 @@ class _WebService(object):
         self._all_commands = {'info':_InfoCommand,
                               'submit':_SubmitCommand,
                               'results':_ResultsCommand,
-                              'run':_RunCommand}
+                              'run':_RunCommand,
+                              'batch':_BatchCommand}
 
     def main(self):
         if len(sys.argv) <= 1:
@@ -361,6 +1644,10 @@ Use "%s help <command>" for detailed help on any command.""" % self._progname)
         sys.exit(1)
 
 def main():
+    try:
+        enable_cache()
+    except OSError:
+        pass # e.g. no home directory; just don't cache anything
     ws = _WebService()
     ws.main()
 
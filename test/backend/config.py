@@ -11,11 +11,41 @@ class Config(saliweb.backend.Config):
         self.__tmpdir = tempfile.mkdtemp()
         self._mailer = os.path.join(self.__tmpdir, 'mailer')
         self.__mailoutput = os.path.join(self.__tmpdir, 'output')
+        self.__allmail = os.path.join(self.__tmpdir, 'all-output')
         with open(self._mailer, 'w') as f:
             print("""#!/usr/bin/python
 import sys
-open('%s', 'w').write(sys.stdin.read())
-""" % self.__mailoutput, file=f)
+def reply(msg):
+    sys.stdout.write(msg + '\\r\\n')
+    sys.stdout.flush()
+if '-bs' in sys.argv:
+    # Minimal SMTP session on stdin/stdout
+    reply('220 fake mailer ready')
+    while True:
+        line = sys.stdin.readline()
+        cmd = line[:4].upper()
+        if not line or cmd == 'QUIT':
+            reply('221 bye')
+            break
+        elif cmd == 'DATA':
+            reply('354 go ahead')
+            msg = []
+            while True:
+                line = sys.stdin.readline().rstrip('\\r\\n')
+                if line == '.':
+                    break
+                msg.append(line[1:] if line.startswith('.') else line)
+            open('%s', 'w').write('\\n'.join(msg) + '\\n')
+            open('%s', 'a').write('\\n'.join(msg) + '\\n')
+            reply('250 queued')
+        else:
+            reply('250 ok')
+else:
+    msg = sys.stdin.read()
+    open('%s', 'w').write(msg)
+    open('%s', 'a').write(msg)
+""" % (self.__mailoutput, self.__allmail, self.__mailoutput,
+       self.__allmail), file=f)
         os.chmod(self._mailer, 0755)
 
     def __del__(self):
@@ -30,5 +60,12 @@ open('%s', 'w').write(sys.stdin.read())
         except IOError:
             return None
 
+    def get_all_mail_output(self):
+        """Get all mail sent so far, not just the most recent message"""
+        try:
+            return open(self.__allmail).read()
+        except IOError:
+            return None
+
     def _read_db_auth(self, end):
         self.database['user'] = self.database['passwd'] = 'test'
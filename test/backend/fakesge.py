@@ -0,0 +1,732 @@
+#!/usr/bin/python
+
+"""Stand-in for an SGE cell, so that SGERunner can be tested (or
+   benchmarked) at scale without a cluster.
+
+   Use make_fake_sge() to set up a simulated cluster in a directory. This
+   returns the environment and qstat command to use instead of those of a
+   real cell (SGERunner._env and SGERunner._qstat), and makes this module
+   available as `drmaa`, so that the runner's DRMAA calls also go to the
+   simulated cluster.
+
+   The cluster is a discrete-event simulation: each task waits in the
+   queue for a random time, then for a free slot, then runs for a random
+   time. Nodes can fail (killing the tasks running on them), and the
+   qmaster can be made slow, or unavailable, to reproduce the problems
+   seen on a busy cluster. Simulated time can pass faster than real time,
+   so that hours of cluster activity take only seconds. Tasks are not
+   really run for their simulated duration; instead, when a task finishes
+   successfully its script is run (so that it can update its job-state
+   file), which takes very little time for the scripts that SGERunner
+   generates. As on a real cluster, DRMAA does not report the task as
+   finished until its script has exited.
+
+   Submitted jobs are recorded in a 'fakesge' subdirectory, from which the
+   state of the cluster at any time can be recomputed (all random choices
+   are made from the cluster's seed and the job and task IDs), so that
+   separate qstat processes see the same cluster as the DRMAA session.
+   Each request to the qmaster is also logged to 'fakesge/calls'.
+"""
+
+from __future__ import print_function
+import collections
+import threading
+import subprocess
+import datetime
+import hashlib
+import random
+import Queue
+import pipes
+import fcntl
+import heapq
+import json
+import time
+import sys
+import os
+import re
+
+_default_config = {
+    # Number of nodes, and the number of tasks each can run at once
+    'nodes': 10, 'slots_per_node': 8,
+    # Ranges of simulated time, in seconds, that each task waits before
+    # it can be scheduled, and then runs for
+    'queue_delay': [0., 0.], 'duration': [1., 1.],
+    # Mean simulated time between failures of each node (None for no
+    # failures), and the time a failed node takes to come back
+    'node_mtbf': None, 'node_repair': 600.,
+    # Real time, in seconds, that the qmaster takes to handle each request,
+    # plus that per 1000 unfinished tasks. Requests that would take longer
+    # than qmaster_timeout fail (once that time has passed).
+    'qmaster_delay': 0., 'qmaster_load': 0., 'qmaster_timeout': None,
+    # [start, end] periods of simulated time when the qmaster is down
+    'qmaster_outages': [],
+    # Simulated seconds that pass per real second
+    'time_scale': 1.,
+    'seed': 0}
+
+
+def make_fake_sge(directory, **config):
+    """Set up a simulated SGE cell in the given directory, configured with
+       any of the keyword arguments in _default_config, and make this
+       module available as `drmaa`. Return the environment and the path to
+       the qstat command to use to talk to it."""
+    for key in config:
+        if key not in _default_config:
+            raise ValueError("Unknown cluster option: " + key)
+    c = dict(_default_config)
+    c.update(config)
+    c['epoch'] = time.time()
+    me = os.path.abspath(__file__)
+    if me.endswith('.pyc'):
+        me = me[:-1]
+    os.chmod(me, 0755)
+    statedir = os.path.join(directory, 'fakesge')
+    os.mkdir(statedir)
+    json.dump(c, open(os.path.join(statedir, 'config'), 'w'))
+    qstat = os.path.join(directory, 'qstat')
+    os.symlink(me, qstat)
+    sys.modules['drmaa'] = sys.modules[__name__]
+    return {'SGE_ROOT': directory, 'SGE_CELL': 'fakesge'}, qstat
+
+
+def get_calls(directory):
+    """Get the list of requests made so far to the qmaster of the cell
+       in the given directory"""
+    return open(os.path.join(directory, 'fakesge', 'calls')).read().split()
+
+
+def _get_seed(*keys):
+    return int(hashlib.md5(':'.join(str(k) for k in keys)).hexdigest()[:12],
+               16)
+
+
+class QmasterError(Exception):
+    """Exception raised if the qmaster could not be contacted"""
+    pass
+
+
+class _Job(object):
+    def __init__(self, info):
+        self.id = info['id']
+        self.time = info['time']
+        self.command = info['command']
+        self.directory = info['directory']
+        self.name = info['name']
+        self.array = info['array']
+        if self.array:
+            self.task_ids = range(info['first'], info['last'] + 1,
+                                  info['step'])
+        else:
+            self.task_ids = [1]
+        self.unfinished = len(self.task_ids)
+        self.interpreter = None
+
+
+class _Task(object):
+    __slots__ = ['job', 'task', 'state', 'node', 'duration', 'start', 'end',
+                 'aborted', 'reaped']
+
+    def __init__(self, job, task):
+        self.job = job
+        self.task = task
+        # 'qw' (queued), 'r' (running), 'done' or 'failed'
+        self.state = 'qw'
+        self.node = self.start = self.end = None
+        self.aborted = self.reaped = False
+
+    def get_id(self):
+        if self.job.array:
+            return '%d.%d' % (self.job.id, self.task)
+        else:
+            return str(self.job.id)
+
+    finished = property(lambda self: self.state in ('done', 'failed'))
+
+
+class Cluster(object):
+    """Simulation of the cluster in `statedir`. If `run_scripts` is True,
+       the scripts of tasks that finish successfully are run."""
+
+    def __init__(self, statedir, run_scripts=False):
+        self.statedir = statedir
+        self.config = json.load(open(os.path.join(statedir, 'config')))
+        self.run_scripts = run_scripts
+        self.now = 0.
+        self.jobs = {}
+        self.tasks = {}
+        self.unfinished = 0
+        self._events = []
+        self._seq = 0
+        self._queue = collections.deque()
+        nodes = self.config['nodes']
+        self._free = [self.config['slots_per_node']] * nodes
+        # Heap of the nodes that are up and have a free slot
+        self._free_nodes = range(nodes)
+        self._running = [set() for n in range(nodes)]
+        self._node_rng = [random.Random(_get_seed(self.config['seed'],
+                                                  'node', n))
+                          for n in range(nodes)]
+        if self.config['node_mtbf']:
+            for n in range(nodes):
+                self._schedule_failure(n)
+        self._log_size = 0
+        # Shell used to run task scripts, and the tasks whose scripts are
+        # still running
+        self._execd = None
+        self._scripts = set()
+        self._scripts_lock = threading.Lock()
+        self._ran = set()
+        self._new_ran = []
+        if run_scripts:
+            try:
+                self._ran.update(open(os.path.join(statedir,
+                                                   'ran')).read().split())
+            except IOError:
+                pass
+        self._read_log()
+
+    def clock(self):
+        """Get the current simulated time"""
+        return (time.time() - self.config['epoch']) * self.config['time_scale']
+
+    def get_real_time(self, t):
+        """Get the real time corresponding to simulated time `t`"""
+        return self.config['epoch'] + t / self.config['time_scale']
+
+    def get_next_event_time(self):
+        """Get the simulated time of the next event, or None"""
+        if self._events:
+            return self._events[0][0]
+
+    def advance(self, now=None):
+        """Run the simulation up to the given (by default, current) time"""
+        if now is None:
+            now = self.clock()
+        self._read_log()
+        while self._events and self._events[0][0] <= now:
+            t, seq, kind, data = heapq.heappop(self._events)
+            self.now = max(self.now, t)
+            getattr(self, '_on_' + kind)(data)
+            self._start_tasks()
+        self.now = max(self.now, now)
+        if self._new_ran:
+            open(os.path.join(self.statedir, 'ran'), 'a').write(
+                                      ''.join(k + '\n' for k in self._new_ran))
+            self._new_ran = []
+
+    def wait_scripts(self):
+        """Wait for all task scripts started so far to finish"""
+        while self._scripts:
+            time.sleep(0.01)
+
+    def is_running_script(self, task):
+        """Return True if the given finished task's script is still
+           running"""
+        return task.get_id() in self._scripts
+
+    def request(self, name):
+        """Make a request to the qmaster, which handles one request at a
+           time. Raise QmasterError if it cannot be contacted."""
+        fh = open(os.path.join(self.statedir, 'calls'), 'a')
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            fh.write(name + '\n')
+            fh.flush()
+            now = self.clock()
+            for start, end in self.config['qmaster_outages']:
+                if start <= now < end:
+                    raise QmasterError("unable to contact qmaster using "
+                                       "port 6444 on host \"fakesge\"")
+            delay = self.config['qmaster_delay'] \
+                    + self.config['qmaster_load'] * self.unfinished / 1000.
+            timeout = self.config['qmaster_timeout']
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                raise QmasterError("failed receiving gdi request response "
+                                   "for mid=1 (got syncron message receive "
+                                   "timeout error).")
+            time.sleep(delay)
+        finally:
+            fh.close()
+
+    def submit(self, command, directory, name, tasks=None):
+        """Submit a job, optionally as an array of (first, last, step)
+           tasks. Return its ID."""
+        fh = open(os.path.join(self.statedir, 'jobs'), 'a+')
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            self.advance()
+            info = {'id': max(self.jobs.keys() + [0]) + 1, 'time': self.now,
+                    'command': command, 'directory': directory,
+                    'name': name, 'array': tasks is not None}
+            if tasks is not None:
+                info['first'], info['last'], info['step'] = tasks
+            fh.seek(0, 2)
+            fh.write(json.dumps(info) + '\n')
+            fh.flush()
+            self._log_size = fh.tell()
+        finally:
+            fh.close()
+        self._add_job(info)
+        return info['id']
+
+    def kill(self, task):
+        """Kill the given task"""
+        if task.state == 'r':
+            self._running[task.node].discard(task)
+            self._release(task.node)
+        elif task.state == 'qw':
+            self._queue = collections.deque(t for t in self._queue
+                                            if t is not task)
+        if not task.finished:
+            task.aborted = True
+            self._finish(task, 'failed')
+
+    def _read_log(self):
+        """Add any jobs submitted by other processes"""
+        try:
+            fh = open(os.path.join(self.statedir, 'jobs'))
+        except IOError:
+            return
+        fh.seek(self._log_size)
+        data = fh.read()
+        fh.close()
+        # Ignore any partially-written line
+        data = data[:data.rfind('\n') + 1]
+        self._log_size += len(data)
+        for line in data.split('\n')[:-1]:
+            self._add_job(json.loads(line))
+
+    def _add_job(self, info):
+        job = _Job(info)
+        self.jobs[job.id] = job
+        self.unfinished += job.unfinished
+        for n in job.task_ids:
+            task = _Task(job, n)
+            rng = random.Random(_get_seed(self.config['seed'], job.id, n))
+            delay = rng.uniform(*self.config['queue_delay'])
+            task.duration = rng.uniform(*self.config['duration'])
+            self.tasks[task.get_id()] = task
+            self._push(job.time + delay, 'queued', task)
+
+    def _push(self, t, kind, data):
+        self._seq += 1
+        heapq.heappush(self._events, (t, self._seq, kind, data))
+
+    def _schedule_failure(self, node):
+        rng = self._node_rng[node]
+        self._push(self.now + rng.expovariate(1. / self.config['node_mtbf']),
+                   'fail', node)
+
+    def _start_tasks(self):
+        while self._queue and self._free_nodes:
+            node = self._free_nodes[0]
+            task = self._queue.popleft()
+            task.state = 'r'
+            task.node = node
+            task.start = self.now
+            self._running[node].add(task)
+            self._free[node] -= 1
+            if self._free[node] == 0:
+                heapq.heappop(self._free_nodes)
+            self._push(self.now + task.duration, 'end', task)
+
+    def _release(self, node):
+        self._free[node] += 1
+        if self._free[node] == 1:
+            heapq.heappush(self._free_nodes, node)
+
+    def _finish(self, task, state):
+        task.state = state
+        task.end = self.now
+        task.job.unfinished -= 1
+        self.unfinished -= 1
+        if state == 'done' and self.run_scripts:
+            self._run_script(task)
+
+    def _on_queued(self, task):
+        if not task.finished:
+            self._queue.append(task)
+
+    def _on_end(self, task):
+        # Ignore tasks that were killed
+        if task.state == 'r':
+            self._running[task.node].discard(task)
+            self._release(task.node)
+            self._finish(task, 'done')
+
+    def _on_fail(self, node):
+        for task in self._running[node]:
+            task.aborted = True
+            self._finish(task, 'failed')
+        self._running[node] = set()
+        self._free[node] = 0
+        if node in self._free_nodes:
+            self._free_nodes.remove(node)
+            heapq.heapify(self._free_nodes)
+        self._push(self.now + self.config['node_repair'], 'repair', node)
+
+    def _on_repair(self, node):
+        self._free[node] = self.config['slots_per_node']
+        heapq.heappush(self._free_nodes, node)
+        self._schedule_failure(node)
+
+    def _run_script(self, task):
+        key = task.get_id()
+        if key in self._ran:
+            return
+        self._ran.add(key)
+        self._new_ran.append(key)
+        job = task.job
+        if job.interpreter is None:
+            try:
+                job.interpreter = open(job.command).readline()[2:].strip()
+            except IOError:
+                pass
+            job.interpreter = job.interpreter or '/bin/sh'
+        out = os.path.join(job.directory, '%s.%%s%d' % (job.name, job.id))
+        if job.array:
+            task_id = str(task.task)
+            out += '.%d' % task.task
+        else:
+            task_id = 'undefined'
+        # Forking from a large process is slow, so have a shell do it (fed
+        # from a separate thread, so that the simulation is not held up if
+        # the shell falls behind)
+        if self._execd is None:
+            self._execd = subprocess.Popen(['/bin/sh'], stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           close_fds=True)
+            self._execd_queue = Queue.Queue()
+            for func in (self._feed_execd, self._read_execd):
+                t = threading.Thread(target=func, args=(self._execd,))
+                t.setDaemon(True)
+                t.start()
+        self._scripts_lock.acquire()
+        try:
+            self._scripts.add(key)
+        finally:
+            self._scripts_lock.release()
+        self._execd_queue.put(
+                   "(cd %s && JOB_ID=%d SGE_TASK_ID=%s %s %s < /dev/null "
+                   "> %s 2> %s; echo %s) &\n"
+                   % (pipes.quote(job.directory), job.id, task_id,
+                      pipes.quote(job.interpreter), pipes.quote(job.command),
+                      pipes.quote(out % 'o'), pipes.quote(out % 'e'), key))
+
+    def _feed_execd(self, execd):
+        while True:
+            cmd = self._execd_queue.get()
+            if cmd is None:
+                execd.stdin.close()
+                break
+            execd.stdin.write(cmd)
+            execd.stdin.flush()
+
+    def _read_execd(self, execd):
+        """Note each task script finishing"""
+        for line in iter(execd.stdout.readline, ''):
+            self._scripts_lock.acquire()
+            try:
+                self._scripts.discard(line.strip())
+            finally:
+                self._scripts_lock.release()
+
+    def close(self):
+        """Stop running task scripts"""
+        if self._execd is not None:
+            self._execd_queue.put(None)
+            self._execd.wait()
+            self._execd = None
+
+
+# Emulation of the drmaa module
+
+class DrmaaException(Exception):
+    pass
+
+class InvalidJobException(DrmaaException):
+    pass
+
+class ExitTimeoutException(DrmaaException):
+    pass
+
+class DrmCommunicationException(DrmaaException):
+    pass
+
+
+JobInfo = collections.namedtuple('JobInfo',
+                 ['jobId', 'hasExited', 'hasSignal', 'terminatedSignal',
+                  'hasCoreDump', 'wasAborted', 'exitStatus', 'resourceUsage'])
+
+
+class JobState(object):
+    UNDETERMINED = 'undetermined'
+    QUEUED_ACTIVE = 'queued_active'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+_job_states = {'qw': JobState.QUEUED_ACTIVE, 'r': JobState.RUNNING,
+               'done': JobState.DONE, 'failed': JobState.FAILED}
+
+
+class JobControlAction(object):
+    TERMINATE = 'terminate'
+
+
+class JobTemplate(object):
+    def __init__(self):
+        self.remoteCommand = None
+        self.args = []
+        self.nativeSpecification = ''
+        self.workingDirectory = None
+        self.jobName = None
+
+
+class Session(object):
+    """A DRMAA session with the simulated cluster given by the SGE_ROOT and
+       SGE_CELL environment variables. Submission, status and control of
+       jobs are qmaster requests; waiting for jobs is not (SGE pushes job
+       events to the session instead)."""
+
+    TIMEOUT_WAIT_FOREVER = -1
+    TIMEOUT_NO_WAIT = 0
+    JOB_IDS_SESSION_ALL = 'DRMAA_JOB_IDS_SESSION_ALL'
+
+    def __init__(self, contactString=None):
+        self._cluster = None
+        self._lock = threading.Lock()
+        self._jobs = set()
+
+    def initialize(self, contactString=None):
+        self._cluster = Cluster(os.path.join(os.environ['SGE_ROOT'],
+                                             os.environ['SGE_CELL']),
+                                run_scripts=True)
+
+    def exit(self):
+        self._cluster.close()
+        self._cluster = None
+
+    def createJobTemplate(self):
+        return JobTemplate()
+
+    def deleteJobTemplate(self, jt):
+        pass
+
+    def _request(self, name):
+        self._lock.acquire()
+        try:
+            self._cluster.advance()
+        finally:
+            self._lock.release()
+        try:
+            self._cluster.request(name)
+        except QmasterError as detail:
+            raise DrmCommunicationException(str(detail))
+
+    def _submit(self, jt, tasks=None):
+        name = jt.jobName
+        if name is None:
+            name = os.path.basename(jt.remoteCommand)
+            # Like SGE, parse the script for a job name
+            try:
+                for line in open(jt.remoteCommand):
+                    m = re.match('#\$\s+\-N\s+(\S+)', line)
+                    if m:
+                        name = m.group(1)
+            except IOError:
+                pass
+        self._lock.acquire()
+        try:
+            jobid = self._cluster.submit(jt.remoteCommand,
+                                         jt.workingDirectory
+                                         or os.path.expanduser('~'),
+                                         name, tasks)
+            self._jobs.add(jobid)
+        finally:
+            self._lock.release()
+        return jobid
+
+    def runJob(self, jt):
+        self._request('runJob')
+        return str(self._submit(jt))
+
+    def runBulkJobs(self, jt, first, last, step):
+        self._request('runBulkJobs')
+        jobid = self._submit(jt, (first, last, step))
+        return ['%d.%d' % (jobid, t) for t in range(first, last + 1, step)]
+
+    def _get_tasks(self, jobIds):
+        """Get the tasks with the given IDs, which must not have been
+           waited for already. The lock must be held."""
+        if self.JOB_IDS_SESSION_ALL in jobIds:
+            return [t for t in self._cluster.tasks.values()
+                    if t.job.id in self._jobs and not t.reaped]
+        tasks = []
+        for jobid in jobIds:
+            task = self._cluster.tasks.get(jobid)
+            if task is None or task.reaped:
+                raise InvalidJobException("code 18: The job specified by "
+                                          "the 'jobid' does not exist.")
+            tasks.append(task)
+        return tasks
+
+    def jobStatus(self, jobId):
+        self._request('jobStatus')
+        self._lock.acquire()
+        try:
+            self._cluster.advance()
+            task = self._cluster.tasks.get(jobId)
+            # Finished jobs are forgotten, unless they were submitted by
+            # this session and have not been waited for yet
+            if task is None or task.reaped \
+               or (task.finished and task.job.id not in self._jobs):
+                raise InvalidJobException("code 18: The job specified by "
+                                          "the 'jobid' does not exist.")
+            return _job_states[task.state]
+        finally:
+            self._lock.release()
+
+    def control(self, jobId, action):
+        self._request('control')
+        self._lock.acquire()
+        try:
+            self._cluster.advance()
+            for task in self._get_tasks([jobId]):
+                self._cluster.kill(task)
+        finally:
+            self._lock.release()
+
+    def _wait_tasks(self, jobIds, timeout):
+        """Wait for the given tasks to finish, and return them"""
+        if timeout >= 0:
+            deadline = time.time() + timeout
+        else:
+            deadline = None
+        self._lock.acquire()
+        try:
+            tasks = waiting = self._get_tasks(jobIds)
+        finally:
+            self._lock.release()
+        while True:
+            self._lock.acquire()
+            try:
+                self._cluster.advance()
+                waiting = [t for t in waiting if not t.finished
+                           or self._cluster.is_running_script(t)]
+                if not waiting:
+                    return tasks
+                wake = self._cluster.get_next_event_time()
+                scripts = any(t.finished for t in waiting)
+            finally:
+                self._lock.release()
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                raise ExitTimeoutException("time-out while waiting for job "
+                                           "completion")
+            # Check at least every second, in case we missed an event
+            # (e.g. a job being killed by another thread), but not so often
+            # that checking on many tasks takes all of our time
+            sleep = 1.
+            if wake is not None:
+                sleep = min(sleep, self._cluster.get_real_time(wake) - now)
+            if scripts:
+                sleep = min(sleep, 0.01)
+            sleep = max(sleep, 0.01)
+            if deadline is not None:
+                sleep = min(sleep, deadline - now)
+            time.sleep(max(sleep, 0.))
+
+    def synchronize(self, jobIds, timeout=-1, dispose=False):
+        tasks = self._wait_tasks(jobIds, timeout)
+        if dispose:
+            for task in tasks:
+                task.reaped = True
+
+    def wait(self, jobId, timeout=-1):
+        task = self._wait_tasks([jobId], timeout)[0]
+        task.reaped = True
+        return JobInfo(jobId, not task.aborted, False, None, False,
+                       task.aborted, 0,
+                       {'start_time': str(task.start),
+                        'end_time': str(task.end)})
+
+
+# qstat command
+
+def get_state_dir():
+    if 'SGE_ROOT' in os.environ and 'SGE_CELL' in os.environ:
+        return os.path.join(os.environ['SGE_ROOT'], os.environ['SGE_CELL'])
+    return os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                        'fakesge')
+
+
+def qstat_job(cluster, jobid):
+    job = None
+    if jobid.isdigit():
+        job = cluster.jobs.get(int(jobid))
+    if job is None or job.unfinished == 0:
+        print("Following jobs do not exist or permissions are not "
+              "sufficient: ")
+        print(jobid)
+        return 1
+    print("=" * 62)
+    print("job_number:                 %d" % job.id)
+    print("job_name:                   %s" % job.name)
+    print("cwd:                        %s" % job.directory)
+    print("script_file:                %s" % job.command)
+    if job.array:
+        print("job-array tasks:            %d-%d:%d"
+              % (job.task_ids[0], job.task_ids[-1],
+                 len(job.task_ids) > 1 and job.task_ids[1] - job.task_ids[0]
+                 or 1))
+    return 0
+
+
+_qstat_states = {'qw': 'p', 'r': 'r'}
+
+
+def qstat_list(cluster, states):
+    print("job-ID  prior   name       user         state submit/start at"
+          "     queue                          slots ja-task-ID")
+    print("-" * 113)
+    for jobid in sorted(cluster.jobs.keys()):
+        job = cluster.jobs[jobid]
+        if job.unfinished == 0:
+            continue
+        for n in job.task_ids:
+            task = cluster.tasks['%d.%d' % (job.id, n) if job.array
+                                 else str(job.id)]
+            if task.finished or _qstat_states[task.state] not in states:
+                continue
+            if task.state == 'r':
+                t, queue = task.start, 'all.q@node%03d' % task.node
+            else:
+                t, queue = job.time, ''
+            t = datetime.datetime.fromtimestamp(cluster.get_real_time(t))
+            print("%7d 0.50000 %-10.10s %-12s %-5s %s %-30s %5d %s"
+                  % (job.id, job.name, 'saliweb', task.state,
+                     t.strftime('%m/%d/%Y %H:%M:%S'), queue, 1,
+                     job.array and str(n) or ''))
+    return 0
+
+
+def main():
+    cluster = Cluster(get_state_dir())
+    cluster.advance()
+    try:
+        cluster.request('qstat')
+    except QmasterError as detail:
+        print("error: " + str(detail), file=sys.stderr)
+        sys.exit(1)
+    args = sys.argv[1:]
+    if '-j' in args:
+        sys.exit(qstat_job(cluster, args[args.index('-j') + 1]))
+    states = 'pr'
+    if '-s' in args:
+        states = args[args.index('-s') + 1]
+    sys.exit(qstat_list(cluster, states))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+"""Stand-in for the Slurm sbatch, squeue and sacct commands, so that
+   SlurmRunner can be tested (or benchmarked) without a cluster.
+
+   Use make_fake_slurm() to make sbatch, squeue and sacct links to this
+   script in a directory. Jobs are run right away on the local machine, in
+   the background; their state is kept in a 'fakeslurm' subdirectory of the
+   directory containing the links. Each command invocation is also logged
+   to 'fakeslurm/calls'.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import re
+import subprocess
+
+
+def make_fake_slurm(directory):
+    """Make sbatch, squeue and sacct commands in the given directory, and
+       return a dict of their full paths"""
+    me = os.path.abspath(__file__)
+    if me.endswith('.pyc'):
+        me = me[:-1]
+    os.chmod(me, 0755)
+    cmds = {}
+    for cmd in ('sbatch', 'squeue', 'sacct'):
+        cmds[cmd] = os.path.join(directory, cmd)
+        os.symlink(me, cmds[cmd])
+    return cmds
+
+
+def get_state_dir():
+    d = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])),
+                     'fakeslurm')
+    if not os.path.exists(d):
+        os.mkdir(d)
+    return d
+
+
+def get_tasks(jobdir):
+    return open(os.path.join(jobdir, 'tasks')).read().split()
+
+
+def get_task_state(jobdir, task):
+    try:
+        ret = open(os.path.join(jobdir, task + '.exit')).read()
+    except IOError:
+        return 'RUNNING'
+    if ret.strip() == '0':
+        return 'COMPLETED'
+    else:
+        return 'FAILED'
+
+
+def get_jobs(statedir):
+    return sorted([x for x in os.listdir(statedir) if x.isdigit()], key=int)
+
+
+def sbatch(statedir, args):
+    script = args[-1]
+    tasks = ['batch']
+    for a in args[:-1]:
+        m = re.match('\-\-array=(\d+)\-(\d+):(\d+)$', a)
+        if m:
+            tasks = [str(x) for x in range(int(m.group(1)),
+                                           int(m.group(2)) + 1,
+                                           int(m.group(3)))]
+    if not os.path.exists(script):
+        print("sbatch: error: Unable to open file %s" % script,
+              file=sys.stderr)
+        return 1
+    interpreter = open(script).readline()[2:].strip()
+    # Allocate a new job ID
+    jobid = len(get_jobs(statedir)) + 1
+    while True:
+        jobdir = os.path.join(statedir, str(jobid))
+        try:
+            os.mkdir(jobdir)
+            break
+        except OSError:
+            jobid += 1
+    jobid = str(jobid)
+    open(os.path.join(jobdir, 'tasks'), 'w').write(" ".join(tasks))
+    for task in tasks:
+        env = dict(os.environ)
+        env['SLURM_JOB_ID'] = jobid
+        if task == 'batch':
+            out = 'slurm-%s.out' % jobid
+        else:
+            env['SLURM_ARRAY_JOB_ID'] = jobid
+            env['SLURM_ARRAY_TASK_ID'] = task
+            out = 'slurm-%s_%s.out' % (jobid, task)
+        exitfile = os.path.join(jobdir, task + '.exit')
+        subprocess.Popen(['/bin/sh', '-c',
+                          '"$0" "$1"; echo $? > "$2.tmp"; mv "$2.tmp" "$2"',
+                          interpreter, script, exitfile],
+                         stdout=open(out, 'w'), stderr=subprocess.STDOUT,
+                         env=env, close_fds=True)
+    print(jobid)
+    return 0
+
+
+def squeue(statedir, args):
+    for jobid in get_jobs(statedir):
+        jobdir = os.path.join(statedir, jobid)
+        if 'RUNNING' in [get_task_state(jobdir, t) for t in get_tasks(jobdir)]:
+            print(jobid)
+    return 0
+
+
+def sacct(statedir, args):
+    jobids = args[args.index('-j') + 1].split(',')
+    for jobid in jobids:
+        jobdir = os.path.join(statedir, jobid)
+        if not os.path.exists(jobdir):
+            continue
+        for task in get_tasks(jobdir):
+            state = get_task_state(jobdir, task)
+            if task == 'batch':
+                print("%s|%s" % (jobid, state))
+            else:
+                print("%s_%s|%s" % (jobid, task, state))
+    return 0
+
+
+def main():
+    statedir = get_state_dir()
+    cmd = os.path.basename(sys.argv[0])
+    open(os.path.join(statedir, 'calls'), 'a').write(cmd + '\n')
+    func = {'sbatch': sbatch, 'squeue': squeue, 'sacct': sacct}[cmd]
+    sys.exit(func(statedir, sys.argv[1:]))
+
+if __name__ == '__main__':
+    main()
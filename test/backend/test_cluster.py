@@ -0,0 +1,233 @@
+import unittest
+import datetime
+import threading
+import time
+import os
+import saliweb.backend.events
+import saliweb.backend.cluster
+from saliweb.backend.cluster import _CellHelper, _CellRegistry, _HelperError
+from saliweb.backend import SGERouterRunner, RunnerError
+import testutil
+
+fake_drmaa = """
+import os
+import time
+
+class InvalidJobException(Exception): pass
+
+class JobTemplate(object): pass
+
+class Session(object):
+    TIMEOUT_WAIT_FOREVER = -1
+    def initialize(self): pass
+    def exit(self): pass
+    def createJobTemplate(self):
+        return JobTemplate()
+    def deleteJobTemplate(self, jt): pass
+    def runJob(self, jt):
+        if 'badopt' in jt.nativeSpecification:
+            raise ValueError("bad option")
+        # Job ID shows which cell's environment we are using
+        return os.environ['SGE_CELL'] + '1'
+    def runBulkJobs(self, jt, first, last, step):
+        return ['%s2.%d' % (os.environ['SGE_CELL'], i)
+                for i in range(first, last + 1, step)]
+    def jobStatus(self, jobid):
+        if jobid.startswith('lost'):
+            raise ValueError("cannot contact qmaster")
+        if jobid.startswith('done'):
+            raise InvalidJobException()
+        return 'running'
+    def synchronize(self, jobids, timeout, dispose):
+        if 'slow' in jobids:
+            time.sleep(0.5)
+    def wait(self, jobid, timeout):
+        return not jobid.startswith('fail')
+"""
+
+def make_fake_drmaa(tmpdir):
+    fh = open(os.path.join(tmpdir, 'drmaa.py'), 'w')
+    fh.write(fake_drmaa)
+    fh.close()
+
+def make_qstat(tmpdir, name, pending, age, fail=False):
+    """Make a fake qstat that reports `pending` jobs waiting for `age`
+       seconds"""
+    submit = datetime.datetime.now() - datetime.timedelta(seconds=age)
+    lines = ["job-ID  prior   name  user  state submit/start at     "
+             "queue  slots ja-task-ID",
+             "-" * 60]
+    for i in range(pending):
+        lines.append("%6d 0.55500 job%d  foo   qw    %s      1"
+                     % (100 + i, i, submit.strftime('%m/%d/%Y %H:%M:%S')))
+    fname = os.path.join(tmpdir, name)
+    fh = open(fname, 'w')
+    fh.write("#!/bin/sh\n")
+    if fail:
+        fh.write("echo 'cannot contact qmaster'\nexit 1\n")
+    else:
+        fh.write("cat <<END\n%s\nEND\n" % "\n".join(lines))
+    fh.close()
+    os.chmod(fname, 0755)
+    return fname
+
+
+class DummyConfig(object):
+    socket = None
+    def _get_notify_address(self):
+        return self.socket
+
+class DummyWebService(object):
+    def __init__(self):
+        self.config = DummyConfig()
+        self._event_queue = saliweb.backend.events._EventQueue()
+
+
+class Test(unittest.TestCase):
+    """Check routing of jobs to multiple SGE cells"""
+
+    def test_parse_pending_jobs(self):
+        """Check parsing of qstat pending jobs output"""
+        now = datetime.datetime(2011, 3, 15, 10, 30, 0)
+        lines = ["job-ID  prior   name  user  state submit/start at",
+                 "---------------------------------------------------",
+                 "  123 0.55500 foo  bar  qw    03/15/2011 10:20:00   1",
+                 "  124 0.55500 foo  bar  qw    03/15/2011 10:28:00   1",
+                 "  125 0.55500 foo  bar  qw    garbage date          1"]
+        count, wait = saliweb.backend.cluster._parse_pending_jobs(lines, now)
+        self.assertEqual(count, 2)
+        self.assertAlmostEqual(wait, 360., places=3)
+        self.assertEqual(saliweb.backend.cluster._parse_pending_jobs(
+                                                   lines[:2], now), (0, 0.))
+
+    def test_helper(self):
+        """Check talking to a cell's DRMAA helper"""
+        with testutil.temp_working_dir() as d:
+            tmpdir = d.tmpdir
+            make_fake_drmaa(tmpdir)
+            h = _CellHelper({'SGE_CELL': 'cellA', 'PYTHONPATH': tmpdir})
+            try:
+                r = h.call('run', script='test.sh', native=' -w n -b no',
+                           directory=tmpdir, tasks=None)
+                self.assertEqual(r['jobids'], ['cellA1'])
+                r = h.call('run', script='test.sh', native='-t 2-6:2',
+                           directory=tmpdir, tasks=[2, 6, 2])
+                self.assertEqual(r['jobids'],
+                                 ['cellA2.2', 'cellA2.4', 'cellA2.6'])
+                self.assertEqual(h.call('status', jobid='donejob')['done'],
+                                 True)
+                self.assertEqual(h.call('status', jobid='runjob')['done'],
+                                 False)
+                try:
+                    h.call('run', script='test.sh', native='badopt',
+                           directory=tmpdir)
+                    self.fail("HelperError not raised")
+                except _HelperError as detail:
+                    self.assertEqual(str(detail), 'bad option')
+                    self.assertEqual(detail.exc_type, 'ValueError')
+                self.assertRaises(_HelperError, h.call, 'garbage')
+                # A slow request should not hold up others
+                results = []
+                def wait():
+                    r = h.call('wait', jobids=['slow', 'failjob', 'ok'])
+                    results.append(r['failed'])
+                t = threading.Thread(target=wait)
+                t.start()
+                time.sleep(0.1)
+                self.assertEqual(h.call('status', jobid='runjob')['done'],
+                                 False)
+                self.assertEqual(results, [])
+                t.join()
+                self.assertEqual(results, [['failjob']])
+            finally:
+                h.close()
+
+    def test_choose_cell(self):
+        """Check choice of the least loaded SGE cell"""
+        with testutil.temp_working_dir() as d:
+            tmpdir = d.tmpdir
+            reg = _CellRegistry()
+            self.assertRaises(ValueError, reg.add, 'bad/name', {}, 'qstat')
+            reg.add('busy', {}, make_qstat(tmpdir, 'q1', 10, 60))
+            reg.add('idle', {}, make_qstat(tmpdir, 'q2', 2, 60))
+            self.assertEqual(reg.choose().name, 'idle')
+            # Long waits count against a cell
+            reg.add('slow', {}, make_qstat(tmpdir, 'q3', 1, 3600))
+            self.assertEqual(reg.choose().name, 'idle')
+            # Cells that can't be queried are skipped
+            reg.add('idle', {}, make_qstat(tmpdir, 'q2', 0, 0, fail=True))
+            self.assertEqual(reg.choose().name, 'busy')
+            reg = _CellRegistry()
+            reg.add('down', {}, make_qstat(tmpdir, 'q4', 0, 0, fail=True))
+            self.assertRaises(OSError, reg.choose)
+
+    def test_spread_burst(self):
+        """Check that a burst of jobs is spread across cells"""
+        with testutil.temp_working_dir() as d:
+            tmpdir = d.tmpdir
+            reg = _CellRegistry()
+            reg.add('c1', {}, make_qstat(tmpdir, 'q1', 0, 0))
+            reg.add('c2', {}, make_qstat(tmpdir, 'q2', 0, 0))
+            counts = {'c1': 0, 'c2': 0}
+            for i in range(10):
+                cell = reg.choose()
+                cell.job_submitted()
+                counts[cell.name] += 1
+            self.assertEqual(counts, {'c1': 5, 'c2': 5})
+
+    def test_router_runner(self):
+        """Check SGERouterRunner"""
+        oldcells = SGERouterRunner._cells
+        with testutil.temp_working_dir() as d:
+            make_fake_drmaa(d.tmpdir)
+            try:
+                SGERouterRunner._cells = _CellRegistry()
+                SGERouterRunner.add_cell('c1', {'SGE_CELL': 'c1',
+                                                'PYTHONPATH': d.tmpdir},
+                                         make_qstat(d.tmpdir, 'q1', 5, 60))
+                SGERouterRunner.add_cell('c2', {'SGE_CELL': 'c2',
+                                                'PYTHONPATH': d.tmpdir},
+                                         make_qstat(d.tmpdir, 'q2', 0, 0))
+                ws = DummyWebService()
+                ws.config.socket = '/test/socket'
+                r = SGERouterRunner('echo foo')
+                runid = r._run(ws)
+                self.assertEqual(runid, 'c2/c21')
+                script = open('sge-script.sh').read()
+                self.assert_('"DONE sgeroute:c2/${JOB_ID}"' in script)
+                e = ws._event_queue.get(timeout=5.)
+                self.assertEqual(e.runid, 'c2/c21')
+                self.assertEqual(e.run_exception, None)
+
+                r = SGERouterRunner('echo foo')
+                r.set_sge_options('-t 1-2')
+                self.assertEqual(r._run(ws), 'c2/c22.1-2:1')
+                e = ws._event_queue.get(timeout=5.)
+                self.assertEqual(e.runid, 'c2/c22.1-2:1')
+
+                r = SGERouterRunner('echo foo')
+                r.set_sge_options('badopt')
+                self.assertRaises(RunnerError, r._run, ws)
+
+                # Wait for the waiter threads to finish
+                for i in range(20):
+                    if 'c2/c22.1-2:1' not in SGERouterRunner._waited_jobs:
+                        break
+                    time.sleep(0.05)
+                self.assertEqual(SGERouterRunner._check_completed(
+                                              'c1/donejob', ''), True)
+                self.assertEqual(SGERouterRunner._check_completed(
+                                              'c2/runjob', ''), False)
+                # Helper errors mean the status cannot be determined
+                self.assertEqual(SGERouterRunner._check_completed(
+                                              'c1/lostjob', ''), None)
+                self.assertRaises(RunnerError,
+                                  SGERouterRunner._check_completed,
+                                  'c3/donejob', '')
+            finally:
+                for name in ('c1', 'c2'):
+                    SGERouterRunner._cells.get(name).helper.close()
+                SGERouterRunner._cells = oldcells
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,9 @@ from StringIO import StringIO
 import config
 from email.MIMEText import MIMEText
 import re
+import os
+import datetime
+import testutil
 
 basic_config = """
 [general]
@@ -79,6 +82,78 @@ class ConfigTest(unittest.TestCase):
                                    mail, flags=re.DOTALL),
                              'Unexpected mail output: ' + mail)
 
+    def test_disk_usage(self):
+        """Check Config disk usage options"""
+        conf = get_config()
+        self.assertEqual(conf.backend['track_disk_usage'], False)
+        self.assertEqual(conf.oldjobs['archive_size'], None)
+        conf = get_config(extra='[backend]\ntrack_disk_usage: true')
+        self.assertEqual(conf.backend['track_disk_usage'], True)
+        for size, expected in (('100', 100), ('2K', 2048),
+                               ('1.5M', 1572864), ('3g', 3 * 1024 ** 3),
+                               ('NEVER', None)):
+            conf = get_config(archive='3h\narchive_size: ' + size,
+                              extra='[backend]\ntrack_disk_usage: true')
+            self.assertEqual(conf.oldjobs['archive_size'], expected)
+        self.assertRaises(ValueError, get_config,
+                          archive='3h\narchive_size: 4X',
+                          extra='[backend]\ntrack_disk_usage: true')
+        # Cannot archive by size without tracking disk usage
+        self.assertRaises(ConfigError, get_config,
+                          archive='3h\narchive_size: 4G')
+
+    def test_result_cache(self):
+        """Check Config result cache options"""
+        conf = get_config()
+        self.assertEqual(conf.backend['result_cache'], False)
+        self.assertEqual(conf.backend['result_cache_size'], None)
+        self.assertEqual(conf.backend['result_cache_age'], None)
+        conf = get_config(extra='[backend]\nresult_cache: true\n'
+                                'result_cache_size: 2K\n'
+                                'result_cache_age: 2d')
+        self.assertEqual(conf.backend['result_cache'], True)
+        self.assertEqual(conf.backend['result_cache_size'], 2048)
+        self.assertEqual(conf.backend['result_cache_age'],
+                         datetime.timedelta(days=2))
+
+    def test_notify(self):
+        """Check Config job notification options"""
+        conf = get_config()
+        self.assertEqual(conf.backend['notify_port'], None)
+        self.assertEqual(conf._get_notify_address(), 'test.socket')
+        conf = get_config(extra='[backend]\nnotify_port: 8123\n'
+                                'notify_host: backend.example.com')
+        self.assertEqual(conf._get_notify_address(),
+                         ('backend.example.com', 8123))
+
+    def test_retry(self):
+        """Check Config retry options"""
+        conf = get_config()
+        self.assertEqual(conf.retry, {'max_attempts': 0,
+                                      'backoff_seconds': 60.,
+                                      'max_backoff_seconds': 3600.})
+        conf = get_config(extra='[retry]\nmax_attempts: 3\n'
+                                'backoff_seconds: 10\n'
+                                'max_backoff_seconds: 30')
+        self.assertEqual(conf.retry, {'max_attempts': 3,
+                                      'backoff_seconds': 10.,
+                                      'max_backoff_seconds': 30.})
+
+    def test_pool(self):
+        """Check Config worker pool options"""
+        conf = get_config()
+        self.assertEqual(conf.pool, {'workers': None,
+                                     'max_tasks_per_worker': 100,
+                                     'memory_limit': None, 'preload': []})
+        conf = get_config(extra='[pool]\nworkers: 4\n'
+                                'max_tasks_per_worker: 0\n'
+                                'memory_limit: 2G\n'
+                                'preload: os.path, , modeller')
+        self.assertEqual(conf.pool, {'workers': 4,
+                                     'max_tasks_per_worker': None,
+                                     'memory_limit': 2 * 1024 ** 3,
+                                     'preload': ['os.path', 'modeller']})
+
     def test_directory_defaults(self):
         """Check Config directory defaults"""
         # FAILED and ARCHIVED default to COMPLETED
@@ -130,5 +205,53 @@ class ConfigTest(unittest.TestCase):
         conf = get_config(expire='1y', archive='1y')
         conf = get_config(expire='never', archive='never')
 
+    @testutil.run_in_tempdir
+    def test_cache(self):
+        """Check caching of configuration read from a file"""
+        class CountingConfig(Config):
+            populated = 0
+            def populate(self, config):
+                CountingConfig.populated += 1
+                Config.populate(self, config)
+        def write_config(expire):
+            with open('test.conf', 'w') as fh:
+                fh.write(basic_config % ('', '3h', expire))
+        write_config('90d')
+        # No caching unless a cache directory is set
+        conf = CountingConfig('test.conf')
+        self.assertEqual(CountingConfig.populated, 1)
+        self.assertEqual(os.listdir('.'), ['test.conf'])
+        os.mkdir('var')
+        CountingConfig._cache_dir = os.path.abspath('var')
+        CountingConfig.populated = 0
+        conf = CountingConfig('test.conf')
+        self.assertEqual(CountingConfig.populated, 1)
+        self.assertEqual(os.listdir('var'), ['test.conf.cache'])
+        # Second read should come from the cache
+        conf = CountingConfig('test.conf')
+        self.assertEqual(CountingConfig.populated, 1)
+        self.assertEqual(conf.oldjobs['expire'].days, 90)
+        self.assertEqual(conf.directories['INCOMING'], '/in')
+        self.assertEqual(conf._config_dir, os.getcwd())
+        # Changing the file should invalidate the cache
+        write_config('900d')
+        conf = CountingConfig('test.conf')
+        self.assertEqual(CountingConfig.populated, 2)
+        self.assertEqual(conf.oldjobs['expire'].days, 900)
+        # A corrupt cache should be ignored
+        with open('var/test.conf.cache', 'w') as fh:
+            fh.write('garbage')
+        conf = CountingConfig('test.conf')
+        self.assertEqual(CountingConfig.populated, 3)
+        self.assertEqual(conf.oldjobs['expire'].days, 900)
+        # Unwritable directory is not an error
+        os.unlink('var/test.conf.cache')
+        os.chmod('var', 0555)
+        try:
+            conf = CountingConfig('test.conf')
+        finally:
+            os.chmod('var', 0755)
+        self.assertEqual(conf.oldjobs['expire'].days, 900)
+
 if __name__ == '__main__':
     unittest.main()
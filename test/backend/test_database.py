@@ -75,9 +75,17 @@ class DatabaseTest(unittest.TestCase):
         config = DummyConfig()
         db = saliweb.backend.Database(Job)
         db._connect(config)
-        self.assertEqual(db._OperationalError, 'Dummy MySQL OperationalError')
         self.assertEqual(db._placeholder, '%s')
         self.assertEqual(db.config, config)
+        # Connection should not be made until it is needed
+        self.assertEqual(db._conn, None)
+        self.assertEqual(db.conn.sql,
+                    ['SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED'])
+        self.assertEqual(db._OperationalError, 'Dummy MySQL OperationalError')
+        # Dummy MySQLdb module has no server-side cursors
+        self.assertEqual(db._streaming_cursor, None)
+        # Subsequent uses should reuse the same connection
+        self.assertEqual(id(db.conn), id(db._conn))
         self.assertEqual(db.conn.sql,
                     ['SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED'])
         self.assertEqual(db.conn.args, ())
@@ -102,6 +110,103 @@ class DatabaseTest(unittest.TestCase):
         self.assertEqual(len(db._fields), numfields + 1)
         self.assertEqual(db._fields[-1].name, 'hostname')
 
+    def test_set_track_disk_usage(self):
+        """Test Database.set_track_disk_usage()"""
+        db = MemoryDatabase(Job)
+        numfields = len(db._fields)
+        db.set_track_disk_usage()
+        self.assertEqual(len(db._fields), numfields + 2)
+        self.assertEqual(db._fields[-2].name, 'disk_usage')
+        self.assertEqual(db._fields[-1].name, 'disk_files')
+
+    def test_add_optional_fields(self):
+        """Test Database._add_optional_fields()"""
+        class DummyConfig(object):
+            track_hostname = True
+            backend = {'track_disk_usage': True}
+            retry = {'max_attempts': 3}
+        db = MemoryDatabase(Job)
+        numfields = len(db._fields)
+        db._add_optional_fields(DummyConfig())
+        self.assertEqual([f.name for f in db._fields[numfields:]],
+                         ['hostname', 'disk_usage', 'disk_files',
+                          'retry_count'])
+        DummyConfig.track_hostname = False
+        DummyConfig.backend = {}
+        DummyConfig.retry = {'max_attempts': 0}
+        db = MemoryDatabase(Job)
+        db._add_optional_fields(DummyConfig())
+        self.assertEqual(len(db._fields), numfields)
+
+    def test_disk_usage(self):
+        """Check Database disk usage queries"""
+        db = MemoryDatabase(Job)
+        db.set_track_disk_usage()
+        db._connect(None)
+        db._create_tables()
+        make_test_jobs(db.conn)
+        c = db.conn.cursor()
+        for name, size, nfiles in (('job2', 100, 2), ('job3', 300, 5),
+                                   ('ready-for-archive', 200, 1)):
+            c.execute('UPDATE jobs SET disk_usage=?, disk_files=? '
+                      'WHERE name=?', (size, nfiles, name))
+        db.conn.commit()
+        usage = db._get_disk_usage_by_state()
+        self.assertEqual(usage['RUNNING'], (400, 7))
+        self.assertEqual(usage['COMPLETED'], (200, 1))
+        self.assertEqual(usage['INCOMING'], (0, 0))
+        self.assertEqual(db._get_top_disk_usage(2),
+                         [('job3', 'RUNNING', 300, 5),
+                          ('ready-for-archive', 'COMPLETED', 200, 1)])
+        self.assertEqual(db._get_top_disk_usage(5, 'COMPLETED'),
+                         [('ready-for-archive', 'COMPLETED', 200, 1)])
+
+    def test_result_cache(self):
+        """Check Database result cache queries"""
+        db = MemoryDatabase(Job)
+        numfields = len(db._fields)
+        db.set_result_cache()
+        self.assertEqual(db._fields[numfields].name, 'input_hash')
+        db._connect(None)
+        db._create_tables()
+        make_test_jobs(db.conn)
+        c = db.conn.cursor()
+        for name, h in (('job2', 'h1'), ('ready-for-archive', 'h2'),
+                        ('never-archive', 'h3'), ('ready-for-expire', 'h4')):
+            c.execute('UPDATE jobs SET input_hash=? WHERE name=?', (h, name))
+        db.conn.commit()
+        self.assertEqual(db._count_jobs_with_input_hash('h1',
+                                     saliweb.backend._IN_FLIGHT_STATES), 1)
+        self.assertEqual(db._count_jobs_with_input_hash('h2',
+                                     saliweb.backend._IN_FLIGHT_STATES), 0)
+        self.assertEqual(db._get_cached_result('h2'), None)
+        db._add_cached_result('h2', 'ready-for-archive', 100)
+        db._add_cached_result('h3', 'never-archive', 200)
+        db._add_cached_result('h4', 'ready-for-expire', 300)
+        self.assertEqual(db._get_cached_result('h2'),
+                         ('ready-for-archive', '/'))
+        self.assertEqual(list(c.execute('SELECT hits FROM result_cache '
+                                        'WHERE input_hash=?', ('h2',))),
+                         [(1,)])
+        # Results of jobs that are no longer COMPLETED are not used
+        self.assertEqual(db._get_cached_result('h4'), None)
+        self.assertEqual(db._evict_cached_results(), 1)
+        # Least recently used entries are evicted first
+        c.execute("UPDATE result_cache SET last_used=0 WHERE input_hash='h3'")
+        db.conn.commit()
+        self.assertEqual(db._evict_cached_results(max_size=150), 1)
+        self.assertEqual([r[0] for r in c.execute('SELECT input_hash '
+                                                  'FROM result_cache')],
+                         ['h2'])
+        self.assertEqual(db._evict_cached_results(
+                             max_age=datetime.timedelta(days=1)), 0)
+        c.execute("UPDATE result_cache SET created=0")
+        db.conn.commit()
+        self.assertEqual(db._evict_cached_results(
+                             max_age=datetime.timedelta(days=1)), 1)
+        db._delete_tables()
+        db._drop_tables()
+
     def test_create_tables(self):
         """Make sure that Database._create_tables() makes tables and indexes"""
         db = MemoryDatabase(Job)
@@ -232,6 +337,13 @@ class DatabaseTest(unittest.TestCase):
         self.assertEqual(len(jobs), 1)
         jobs = list(db._get_all_jobs_in_state('INCOMING', name='job2'))
         self.assertEqual(len(jobs), 0)
+        jobs = list(db._get_all_jobs_in_state('RUNNING',
+                                              runner_id_prefix='SGE-job'))
+        self.assertEqual([j.name for j in jobs], ['job3'])
+        # LIKE wildcards in the prefix should match only themselves
+        jobs = list(db._get_all_jobs_in_state('RUNNING',
+                                              runner_id_prefix='SGE_job'))
+        self.assertEqual(len(jobs), 0)
         jobs = list(db._get_all_jobs_in_state('INCOMING',
                                               after_time='expire_time'))
         self.assertEqual(len(jobs), 0)
@@ -243,6 +355,101 @@ class DatabaseTest(unittest.TestCase):
                                               after_time='expire_time'))
         self.assertEqual(len(jobs), 0)
 
+    def test_get_jobs_multiple(self):
+        """Check Database._get_jobs()"""
+        db = MemoryDatabase(Job)
+        db._connect(None)
+        db._create_tables()
+        make_test_jobs(db.conn)
+        c = db.conn.cursor()
+        c.execute("UPDATE jobs SET user='foo' WHERE name IN ('job1', 'job3')")
+        def get_names(**keys):
+            return sorted(j.name for j in db._get_jobs(**keys))
+        self.assertEqual(len(get_names()), 9)
+        self.assertEqual(get_names(states=['INCOMING', 'RUNNING']),
+                         ['job1', 'job2', 'job3'])
+        self.assertEqual(get_names(states=[]), [])
+        self.assertEqual(get_names(names=['job1', 'preproc', 'garbage']),
+                         ['job1', 'preproc'])
+        self.assertEqual(get_names(names=[]), [])
+        self.assertEqual(get_names(states=['RUNNING'], user='foo'), ['job3'])
+        now = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.assertEqual(get_names(submitted_after=now), ['job2'])
+        self.assertEqual(get_names(states=['RUNNING'], submitted_before=now),
+                         ['job3'])
+        # Each job should be in the correct state
+        for j in db._get_jobs(states=['INCOMING', 'RUNNING']):
+            self.assertEqual(j._get_state(),
+                             'INCOMING' if j.name == 'job1' else 'RUNNING')
+        # Long lists of names should be split into multiple queries
+        names = ['dummy%d' % i for i in range(1200)] + ['job2']
+        self.assertEqual(get_names(names=names), ['job2'])
+
+    def test_list_jobs(self):
+        """Check Database._list_jobs() and _count_jobs()"""
+        db = MemoryDatabase(Job)
+        db._connect(None)
+        db._create_tables()
+        make_test_jobs(db.conn)
+        c = db.conn.cursor()
+        c.execute("UPDATE jobs SET user='foo' WHERE name IN ('job1', 'job3')")
+        def get_names(states, **keys):
+            return [r[0] for r in db._list_jobs(['name'], states, **keys)]
+        self.assertEqual(get_names([]), [])
+        # Jobs should be sorted by submit time, then name
+        states = ['INCOMING', 'RUNNING', 'COMPLETED']
+        self.assertEqual(get_names(states),
+                         ['job1', 'job3', 'never-archive',
+                          'ready-for-archive', 'job2'])
+        self.assertEqual(get_names(states, limit=2), ['job1', 'job3'])
+        self.assertEqual(get_names(states, after_name='job3', limit=2),
+                         ['never-archive', 'ready-for-archive'])
+        self.assertEqual(get_names(states, after_name='ready-for-archive'),
+                         ['job2'])
+        self.assertEqual(get_names(states, user='foo'), ['job1', 'job3'])
+        self.assertEqual(get_names(states, name_like='job%'),
+                         ['job1', 'job3', 'job2'])
+        self.assertEqual(get_names(states, name_like='%!_%'), [])
+        self.assertEqual(get_names(states, name_like='%-for-%'),
+                         ['ready-for-archive'])
+        rows = list(db._list_jobs(['name', 'state'], ['RUNNING'],
+                                  user='foo'))
+        self.assertEqual(rows, [('job3', 'RUNNING')])
+        self.assertEqual(db._count_jobs(states),
+                         {'INCOMING': 1, 'RUNNING': 2, 'COMPLETED': 2})
+        self.assertEqual(db._count_jobs(states, user='foo'),
+                         {'INCOMING': 1, 'RUNNING': 1, 'COMPLETED': 0})
+        self.assertEqual(db._count_jobs([]), {})
+
+    def test_batch(self):
+        """Check batching of database updates"""
+        class CountingConnection(object):
+            def __init__(self, conn):
+                self.conn = conn
+                self.commits = 0
+            def cursor(self):
+                return self.conn.cursor()
+            def commit(self):
+                self.commits += 1
+                self.conn.commit()
+        db = MemoryDatabase(Job)
+        db._connect(None)
+        db._create_tables()
+        make_test_jobs(db.conn)
+        db.conn = CountingConnection(db.conn)
+        jobs = list(db._get_jobs(states=['RUNNING']))
+        db._begin_batch()
+        for job in jobs:
+            job._metadata['runner_id'] = 'new-SGE-ID'
+            db._change_job_state(job._metadata, 'RUNNING', 'FAILED')
+        self.assertEqual(db.conn.commits, 0)
+        db._end_batch()
+        self.assertEqual(db.conn.commits, 1)
+        self.assertEqual(len(list(db._get_all_jobs_in_state('FAILED'))), 2)
+        # Outside of a batch, every change is committed
+        db._change_job_state(jobs[0]._metadata, 'FAILED', 'INCOMING')
+        self.assertEqual(db.conn.commits, 2)
+
     def test_change_job_state(self):
         """Check Database._change_job_state()"""
         db = MemoryDatabase(Job)
@@ -290,5 +497,20 @@ class DatabaseTest(unittest.TestCase):
         self.assertEqual(db._get_job_dependencies(),
                          {'foo':['bar'], 'a':['one', 'two']})
 
+    def test_complete_removes_dependencies(self):
+        """Check that dependencies on a job are removed when it completes"""
+        db = MemoryDatabase(Job)
+        db._connect(None)
+        db._create_tables()
+        make_test_jobs(db.conn)
+        c = db.conn.cursor()
+        query = "INSERT INTO dependencies(child,parent) VALUES(?,?)"
+        c.execute(query, ('job1', 'finalize'))
+        c.execute(query, ('job1', 'job2'))
+        db.conn.commit()
+        job = list(db._get_all_jobs_in_state('FINALIZING'))[0]
+        db._change_job_state(job._metadata, 'FINALIZING', 'COMPLETED')
+        self.assertEqual(db._get_job_dependencies(), {'job1':['job2']})
+
 if __name__ == '__main__':
     unittest.main()
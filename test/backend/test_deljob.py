@@ -1,7 +1,8 @@
 import unittest
 import sys
+import datetime
 from saliweb.backend import InvalidStateError
-from saliweb.backend.deljob import check_valid_state, get_options, delete_job
+from saliweb.backend.deljob import check_valid_state, get_options
 from saliweb.backend.deljob import main
 import StringIO
 
@@ -42,6 +43,15 @@ class DelJobTest(unittest.TestCase):
                 sys.stderr = oldstderr
                 sys.argv = old
         self.assertRaises(SystemExit, run_get_options, [])
+        self.assertRaises(SystemExit, run_get_options, ['FAILED'])
+        self.assertRaises(SystemExit, run_get_options, ['FAILED', '--stdin'])
+        self.assertRaises(SystemExit, run_get_options,
+                          ['FAILED', '--before', 'yesterday'])
+        state, jobnames, opts = run_get_options(['FAILED', '-u', 'foo',
+                                                 '--after', '2016-01-02'])
+        self.assertEqual(jobnames, [])
+        self.assertEqual(opts.user, 'foo')
+        self.assertEqual(opts.after, datetime.datetime(2016, 1, 2))
         state, jobnames, opts = run_get_options(['FAILED', 'testjob1', 'job2'])
         self.assertEqual(state, 'FAILED')
         self.assertEqual(jobnames, ['testjob1', 'job2'])
@@ -51,62 +61,78 @@ class DelJobTest(unittest.TestCase):
             self.assertEqual(opts.force, True)
             self.assertEqual(jobnames, ['testjob'])
 
-    def test_delete_job(self):
-        """Test deljob delete_job()"""
+    def test_confirm(self):
+        """Test deljob main() asking about each job"""
+        events = []
         class DummyJob(object):
-            deleted = False
-            name = 'testjob'
+            def __init__(self, name):
+                self.name = name
             def delete(self):
-                self.deleted = True
+                events.append('delete ' + self.name)
+        class DummyDB(object):
+            def _get_jobs(self, states, names, **keys):
+                return [DummyJob(name) for name in names]
+            def _begin_batch(self):
+                events.append('begin')
+            def _end_batch(self):
+                events.append('end')
+        class DummyWebService(object):
+            db = DummyDB()
+            def get_running_pid(self):
+                return None
+        class DummyModule(object):
+            config = 'testconfig'
+            def get_web_service(self, config):
+                return DummyWebService()
         class DummyStdin(object):
-            def __init__(self, answer):
-                self.answer = answer
+            def __init__(self, answers):
+                self.answers = answers
             def readline(self):
-                return self.answer
-        def run_delete_job(job, force, answer):
-            oldout = sys.stdout
-            oldin = sys.stdin
-            try:
-                sio = StringIO.StringIO()
-                sys.stdout = sio
-                sys.stdin = DummyStdin(answer)
-                delete_job(job, force)
-                return sio.getvalue()
-            finally:
-                sys.stdout = oldout
-                sys.stdin = oldin
-        j = DummyJob()
-        out = run_delete_job(j, True, None)
-        self.assertEqual(j.deleted, True)
-        self.assertEqual(out, '')
-        for no in ('', 'n', 'x'):
-            j = DummyJob()
-            out = run_delete_job(j, False, no)
-            self.assertEqual(j.deleted, False)
-            self.assertEqual(out, 'Delete job testjob? ')
-        for yes in ('y', 'Y', 'yes'):
-            j = DummyJob()
-            out = run_delete_job(j, False, yes)
-            self.assertEqual(j.deleted, True)
-            self.assertEqual(out, 'Delete job testjob? ')
+                events.append('ask')
+                return self.answers.pop(0)
+        old = sys.argv
+        oldout = sys.stdout
+        oldin = sys.stdin
+        try:
+            sio = StringIO.StringIO()
+            sys.stdout = sio
+            sys.stdin = DummyStdin(['y', 'n', 'Yes'])
+            sys.argv = ['testprogram', 'FAILED', 'job1', 'job2', 'job3']
+            main(DummyModule())
+        finally:
+            sys.argv = old
+            sys.stdout = oldout
+            sys.stdin = oldin
+        self.assertEqual(sio.getvalue(), 'Delete job job1? Delete job job2? '
+                                         'Delete job job3? ')
+        # All questions should be asked before the database is touched
+        self.assertEqual(events, ['ask', 'ask', 'ask', 'begin',
+                                  'delete job1', 'delete job3', 'end'])
 
     def test_main(self):
         """Test deljob main()"""
         class DummyJob(object):
+            name = 'testjob'
             def __init__(self, mod):
                 self.mod = mod
             def delete(self):
                 self.mod.job_deleted = True
+        class DummyDB(object):
+            def __init__(self, mod):
+                self.mod = mod
+            def _get_jobs(self, states, names, **keys):
+                if 'FAILED' in states and 'testjob' in names:
+                    yield DummyJob(self.mod)
+            def _begin_batch(self):
+                pass
+            def _end_batch(self):
+                pass
         class DummyWebService(object):
             def __init__(self, mod):
                 self.mod = mod
+                self.db = DummyDB(mod)
             def get_running_pid(self):
                 return 9999
-            def get_job_by_name(self, state, name):
-                if state == 'FAILED' and name == 'testjob':
-                    return DummyJob(self.mod)
-                else:
-                    return None
         class DummyModule(object):
             config = 'testconfig'
             job_deleted = False
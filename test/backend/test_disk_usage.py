@@ -0,0 +1,83 @@
+import unittest
+import sys
+from saliweb.backend.disk_usage import get_options, format_size, main
+import StringIO
+
+class Tests(unittest.TestCase):
+
+    def test_get_options(self):
+        """Test disk_usage get_options()"""
+        def run_get_options(args):
+            old = sys.argv
+            oldstderr = sys.stderr
+            try:
+                sys.stderr = StringIO.StringIO()
+                sys.argv = ['testprogram'] + args
+                return get_options()
+            finally:
+                sys.stderr = oldstderr
+                sys.argv = old
+        state, opts = run_get_options([])
+        self.assertEqual(state, None)
+        self.assertEqual(opts.num, 20)
+        state, opts = run_get_options(['-n', '5', 'COMPLETED'])
+        self.assertEqual(state, 'COMPLETED')
+        self.assertEqual(opts.num, 5)
+        self.assertRaises(SystemExit, run_get_options, ['FAILED', 'RUNNING'])
+
+    def test_format_size(self):
+        """Test disk_usage format_size()"""
+        self.assertEqual(format_size(10), '10.0B')
+        self.assertEqual(format_size(2048), '2.0K')
+        self.assertEqual(format_size(3 * 1024 * 1024), '3.0M')
+        self.assertEqual(format_size(1024 ** 4), '1.0T')
+
+    def test_main(self):
+        """Test disk_usage main()"""
+        class DummyDatabase(object):
+            def _get_disk_usage_by_state(self):
+                return {'RUNNING': (2048, 3), 'COMPLETED': (100, 1)}
+            def _get_top_disk_usage(self, limit, state):
+                self.limit, self.state = limit, state
+                return [('job1', 'RUNNING', 2048, 3)]
+        class DummyConfig(object):
+            def __init__(self, track):
+                self.backend = {'track_disk_usage': track}
+        class DummyWebService(object):
+            def __init__(self, track):
+                self.db = DummyDatabase()
+                self.config = DummyConfig(track)
+        class DummyModule(object):
+            config = 'testconfig'
+            def __init__(self, track):
+                self.track = track
+            def get_web_service(self, config):
+                self.web = DummyWebService(self.track)
+                return self.web
+
+        old = sys.argv
+        oldout = sys.stdout
+        olderr = sys.stderr
+        try:
+            sys.stdout = sio = StringIO.StringIO()
+            sys.stderr = StringIO.StringIO()
+            sys.argv = ['testprogram', '-n', '3']
+            mod = DummyModule(True)
+            main(mod)
+            self.assertEqual(mod.web.db.limit, 3)
+            self.assertEqual(mod.web.db.state, None)
+            lines = sio.getvalue().split('\n')
+            self.assertEqual(lines[1].split(), ['RUNNING', '2.0K', '3'])
+            self.assertEqual(lines[2].split(), ['COMPLETED', '100.0B', '1'])
+            self.assertEqual(lines[5].split(),
+                             ['job1', 'RUNNING', '2.0K', '3'])
+
+            mod = DummyModule(False)
+            self.assertRaises(SystemExit, main, mod)
+        finally:
+            sys.argv = old
+            sys.stdout = oldout
+            sys.stderr = olderr
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,9 @@ import unittest
 import time
 import os
 import socket
+import json
 import saliweb.backend.events
+import saliweb.backend.stats
 
 class EventsTest(unittest.TestCase):
     """Check events"""
@@ -16,6 +18,8 @@ class EventsTest(unittest.TestCase):
         self.assertEqual(e.get(), 'a')
         self.assertEqual(e.get(), 'b')
         self.assertEqual(e.get(0), None)
+        e.put('c')
+        self.assertEqual(e.qsize(), 1)
 
     def test_incoming_jobs_event(self):
         """Check the _IncomingJobsEvent class"""
@@ -50,6 +54,7 @@ class EventsTest(unittest.TestCase):
             def _try_complete(self, webservice, run_exception):
                 webservice.run_exception = run_exception
         class DummyWebService(object):
+            _submitter = None
             def _get_job_by_runner_id(self, runner, runid):
                 if runid == 'bad':
                     return None
@@ -141,6 +146,7 @@ class EventsTest(unittest.TestCase):
         ws = dummy()
         ws.config = dummy()
         ws.config.backend = {'check_minutes':1}
+        ws._stats = None
 
         if os.path.exists('test.sock'):
             os.unlink('test.sock')
@@ -160,7 +166,93 @@ class EventsTest(unittest.TestCase):
         x = q.get(timeout=0.)
         self.assert_(isinstance(x, saliweb.backend.events._IncomingJobsEvent))
         self.assertEqual(q.get(timeout=0.), None)
+        # Jobs can also tell us they finished
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect('test.sock')
+        s.send("DONE sge:1234\n")
+        s.close()
+        x = q.get(timeout=5.)
+        self.assert_(isinstance(x, saliweb.backend.events._JobDoneEvent))
+        self.assertEqual(x.runner_id, 'sge:1234')
         os.unlink('test.sock')
 
+    def test_job_notifications(self):
+        """Check the _JobNotifications class"""
+        class dummy: pass
+        ws = dummy()
+        ws._stats = None
+        ws._event_queue = saliweb.backend.events._EventQueue()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(5)
+        t = saliweb.backend.events._JobNotifications(ws, sock)
+        t.start()
+        # Only messages from finished jobs should be accepted
+        for msg in ("INCOMING job1", "STATUS\n", "DONE sge:1234\n"):
+            s = socket.create_connection(sock.getsockname())
+            s.send(msg)
+            s.close()
+        x = ws._event_queue.get(timeout=5.)
+        self.assert_(isinstance(x, saliweb.backend.events._JobDoneEvent))
+        self.assertEqual(x.runner_id, 'sge:1234')
+        self.assertEqual(ws._event_queue.get(timeout=0.), None)
+        sock.close()
+
+    def test_status(self):
+        """Check STATUS messages sent to the _IncomingJobs thread"""
+        class dummy: pass
+        ws = dummy()
+        ws._stats = saliweb.backend.stats._DaemonStats()
+        ws._event_queue = saliweb.backend.events._EventQueue()
+        ws._event_queue.put('dummy event')
+
+        if os.path.exists('test.sock'):
+            os.unlink('test.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind('test.sock')
+        sock.listen(5)
+        t = saliweb.backend.events._IncomingJobs(ws, sock)
+        t.start()
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect('test.sock')
+        s.send("INCOMING job1")
+        s.close()
+        self.assert_(isinstance(ws._event_queue.get(timeout=5.), str))
+        self.assert_(isinstance(ws._event_queue.get(timeout=5.),
+                                saliweb.backend.events._IncomingJobsEvent))
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect('test.sock')
+        s.send("STATUS\n")
+        reply = ''
+        while True:
+            data = s.recv(4096)
+            if not data:
+                break
+            reply += data
+        status = json.loads(reply)
+        self.assertEqual(status['queue_depth'], 0)
+        self.assertEqual(status['states'], {'INCOMING': 1})
+        # No event should have been added for the STATUS message
+        self.assertEqual(ws._event_queue.get(timeout=0.), None)
+        os.unlink('test.sock')
+
+    def test_job_done_event(self):
+        """Check the _JobDoneEvent class"""
+        class dummy:
+            def _job_done(self, runner_id): self.runner_id = runner_id
+        d = dummy()
+        e = saliweb.backend.events._JobDoneEvent(d, 'sge:1234')
+        e.process()
+        self.assertEqual(d.runner_id, 'sge:1234')
+
+    def test_recheck_job_event(self):
+        """Check the _RecheckJobEvent class"""
+        class dummy:
+            def _recheck_job(self, name): self.name = name
+        d = dummy()
+        e = saliweb.backend.events._RecheckJobEvent(d, 'job1')
+        e.process()
+        self.assertEqual(d.name, 'job1')
+
 if __name__ == '__main__':
     unittest.main()
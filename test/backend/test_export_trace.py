@@ -0,0 +1,151 @@
+import unittest
+import datetime
+import gzip
+import sys
+from saliweb.backend.export_trace import get_options, write_trace, \
+                                          read_trace, open_trace, main
+import StringIO
+import testutil
+
+def make_time(seconds):
+    return datetime.datetime(2016, 6, 1) + datetime.timedelta(seconds=seconds)
+
+def make_row(name, state, submit, preprocess, run, postprocess, end,
+             disk_usage=None):
+    return (name, state, make_time(submit), make_time(preprocess),
+            None if run is None else make_time(run),
+            None if postprocess is None else make_time(postprocess),
+            make_time(end), disk_usage)
+
+class Tests(unittest.TestCase):
+
+    def test_get_options(self):
+        """Test export_trace get_options()"""
+        def run_get_options(args):
+            old = sys.argv
+            oldstderr = sys.stderr
+            try:
+                sys.stderr = StringIO.StringIO()
+                sys.argv = ['testprogram'] + args
+                return get_options()
+            finally:
+                sys.stderr = oldstderr
+                sys.argv = old
+        filename, opts = run_get_options(['trace'])
+        self.assertEqual(filename, 'trace')
+        self.assertEqual(opts.days, None)
+        filename, opts = run_get_options(['-d', '30', 'trace.gz'])
+        self.assertEqual(filename, 'trace.gz')
+        self.assertEqual(opts.days, 30.)
+        self.assertRaises(SystemExit, run_get_options, [])
+        self.assertRaises(SystemExit, run_get_options, ['a', 'b'])
+
+    def test_write_read(self):
+        """Test writing and reading a trace"""
+        rows = [make_row('job1', 'COMPLETED', 10, 12, 15, 3615, 3620, 2048),
+                make_row('job2', 'EXPIRED', 70, 70, None, None, 75),
+                (None, 'ARCHIVED', None, None, None, None, None, None)]
+        fh = StringIO.StringIO()
+        self.assertEqual(write_trace(fh, rows), 2)
+        lines = fh.getvalue().split('\n')
+        self.assertEqual(lines[0], '# saliweb job trace 1')
+        self.assertEqual(lines[2], '# start 2016-06-01 00:00:10')
+        self.assertEqual(lines[3].split('\t'),
+                         ['job1', '0', '3', '3600', '5', 'COMPLETED',
+                          '2048'])
+        self.assertEqual(lines[4].split('\t'),
+                         ['job2', '60', '5', '-', '-', 'EXPIRED', '-'])
+        jobs = list(read_trace(StringIO.StringIO(fh.getvalue())))
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(jobs[0].name, 'job1')
+        self.assertEqual(jobs[0].submit, 0.)
+        self.assertEqual(jobs[0].preprocess, 3.)
+        self.assertEqual(jobs[0].run, 3600.)
+        self.assertEqual(jobs[0].postprocess, 5.)
+        self.assertEqual(jobs[0].state, 'COMPLETED')
+        self.assertEqual(jobs[0].disk_usage, 2048)
+        self.assertEqual(jobs[1].submit, 60.)
+        self.assertEqual(jobs[1].run, None)
+        self.assertEqual(jobs[1].postprocess, None)
+        self.assertEqual(jobs[1].disk_usage, None)
+
+        # Empty trace
+        fh = StringIO.StringIO()
+        self.assertEqual(write_trace(fh, []), 0)
+        self.assertEqual(list(read_trace(StringIO.StringIO(fh.getvalue()))),
+                         [])
+
+    def test_read_invalid(self):
+        """Test reading invalid traces"""
+        fh = StringIO.StringIO("garbage\n")
+        self.assertRaises(ValueError, list, read_trace(fh))
+        fh = StringIO.StringIO("# saliweb job trace 1\njob1\t0\t1\n")
+        self.assertRaises(ValueError, list, read_trace(fh))
+
+    @testutil.run_in_tempdir
+    def test_open_trace(self):
+        """Test open_trace()"""
+        for fname in ('trace', 'trace.gz'):
+            fh = open_trace(fname, 'w')
+            write_trace(fh, [make_row('job1', 'COMPLETED', 0, 0, 1, 2, 3)])
+            fh.close()
+            jobs = list(read_trace(open_trace(fname)))
+            self.assertEqual([j.name for j in jobs], ['job1'])
+        self.assertEqual(gzip.open('trace.gz').readline(),
+                         '# saliweb job trace 1\n')
+
+    @testutil.run_in_tempdir
+    def test_main(self):
+        """Test export_trace main()"""
+        class DummyDatabase(object):
+            def _list_jobs(self, fields, states, **keys):
+                self.fields, self.states, self.keys = fields, states, keys
+                return [make_row('job1', 'COMPLETED', 0, 1, 2, 3, 4, 100)]
+        class DummyConfig(object):
+            def __init__(self, track):
+                self.backend = {'track_disk_usage': track}
+        class DummyWebService(object):
+            def __init__(self, track):
+                self.db = DummyDatabase()
+                self.config = DummyConfig(track)
+        class DummyModule(object):
+            config = 'testconfig'
+            def __init__(self, track):
+                self.track = track
+            def get_web_service(self, config):
+                self.web = DummyWebService(self.track)
+                return self.web
+
+        old = sys.argv
+        oldout = sys.stdout
+        try:
+            sys.stdout = sio = StringIO.StringIO()
+            sys.argv = ['testprogram', 'trace']
+            mod = DummyModule(True)
+            main(mod)
+            db = mod.web.db
+            self.assertEqual(db.fields[-1], 'disk_usage')
+            self.assertEqual(db.states,
+                             ['COMPLETED', 'ARCHIVED', 'EXPIRED'])
+            self.assertEqual(db.keys, {})
+            self.assertEqual(sio.getvalue(),
+                             'Exported 1 jobs to trace\n')
+            jobs = list(read_trace(open('trace')))
+            self.assertEqual(jobs[0].disk_usage, 100)
+
+            sys.argv = ['testprogram', '-d', '7', 'trace']
+            mod = DummyModule(False)
+            main(mod)
+            db = mod.web.db
+            self.assertEqual(db.fields[-1], 'NULL')
+            cutoff = db.keys['submitted_after']
+            expected = datetime.datetime.utcnow() \
+                       - datetime.timedelta(days=7)
+            self.assert_(abs(cutoff - expected)
+                         < datetime.timedelta(seconds=60))
+        finally:
+            sys.argv = old
+            sys.stdout = oldout
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 import sys
-from saliweb.backend.failjob import check_daemon_running, get_options, fail_job
+from saliweb.backend.failjob import check_daemon_running, get_options
 from saliweb.backend.failjob import main
 import StringIO
 
@@ -34,6 +34,13 @@ class FailJobTest(unittest.TestCase):
                 sys.stderr = oldstderr
                 sys.argv = old
         self.assertRaises(SystemExit, run_get_options, [])
+        self.assertRaises(SystemExit, run_get_options, ['-s', 'garbage'])
+        self.assertRaises(SystemExit, run_get_options, ['--stdin'])
+        jobnames, opts = run_get_options(['-s', 'RUNNING', '-s', 'COMPLETED',
+                                          '--failure', 'qmaster.*down'])
+        self.assertEqual(jobnames, [])
+        self.assertEqual(opts.states, ['RUNNING', 'COMPLETED'])
+        self.assert_(opts.failure.search('qmaster is down'))
         jobnames, opts = run_get_options(['testjob1', 'job2'])
         self.assertEqual(jobnames, ['testjob1', 'job2'])
         self.assertEqual(opts.force, False)
@@ -47,66 +54,78 @@ class FailJobTest(unittest.TestCase):
             self.assertEqual(opts.email, False)
             self.assertEqual(jobnames, ['testjob'])
 
-    def test_fail_job(self):
-        """Test failjob fail_job()"""
+    def test_confirm(self):
+        """Test failjob main() asking about each job"""
+        events = []
         class DummyJob(object):
-            failed = False
-            name = 'testjob'
+            def __init__(self, name):
+                self.name = name
             def admin_fail(self, email):
-                self.failed = True
-                self.failed_email = email
+                events.append('fail %s %s' % (self.name, email))
+        class DummyDB(object):
+            def _get_jobs(self, states, names, **keys):
+                return [DummyJob(name) for name in names]
+            def _begin_batch(self):
+                events.append('begin')
+            def _end_batch(self):
+                events.append('end')
+        class DummyWebService(object):
+            db = DummyDB()
+            def get_running_pid(self):
+                return None
+        class DummyModule(object):
+            config = 'testconfig'
+            def get_web_service(self, config):
+                return DummyWebService()
         class DummyStdin(object):
-            def __init__(self, answer):
-                self.answer = answer
+            def __init__(self, answers):
+                self.answers = answers
             def readline(self):
-                return self.answer
-        def run_fail_job(job, force, email, answer):
-            oldout = sys.stdout
-            oldin = sys.stdin
-            try:
-                sio = StringIO.StringIO()
-                sys.stdout = sio
-                sys.stdin = DummyStdin(answer)
-                fail_job(job, force, email)
-                return sio.getvalue()
-            finally:
-                sys.stdout = oldout
-                sys.stdin = oldin
-        j = DummyJob()
-        out = run_fail_job(j, True, True, None)
-        self.assertEqual(j.failed, True)
-        self.assertEqual(j.failed_email, True)
-        self.assertEqual(out, '')
-        for no in ('', 'n', 'x'):
-            j = DummyJob()
-            out = run_fail_job(j, False, True, no)
-            self.assertEqual(j.failed, False)
-            self.assertEqual(out, 'Fail job testjob? ')
-        for yes in ('y', 'Y', 'yes'):
-            j = DummyJob()
-            out = run_fail_job(j, False, False, yes)
-            self.assertEqual(j.failed, True)
-            self.assertEqual(j.failed_email, False)
-            self.assertEqual(out, 'Fail job testjob? ')
+                events.append('ask')
+                return self.answers.pop(0)
+        old = sys.argv
+        oldout = sys.stdout
+        oldin = sys.stdin
+        try:
+            sio = StringIO.StringIO()
+            sys.stdout = sio
+            sys.stdin = DummyStdin(['', 'y'])
+            sys.argv = ['testprogram', '--no-email', 'job1', 'job2']
+            main(DummyModule())
+        finally:
+            sys.argv = old
+            sys.stdout = oldout
+            sys.stdin = oldin
+        self.assertEqual(sio.getvalue(), 'Fail job job1? Fail job job2? ')
+        # All questions should be asked before the database is touched
+        self.assertEqual(events, ['ask', 'ask', 'begin', 'fail job2 False',
+                                  'end'])
 
     def test_main(self):
         """Test failjob main()"""
         class DummyJob(object):
+            name = 'testjob'
             def __init__(self, mod):
                 self.mod = mod
             def admin_fail(self, email):
                 self.mod.job_failed = True
                 self.mod.job_failed_email = email
+        class DummyDB(object):
+            def __init__(self, mod):
+                self.mod = mod
+            def _get_jobs(self, states, names, **keys):
+                if 'COMPLETED' in states and 'testjob' in names:
+                    yield DummyJob(self.mod)
+            def _begin_batch(self):
+                pass
+            def _end_batch(self):
+                pass
         class DummyWebService(object):
             def __init__(self, mod):
                 self.mod = mod
+                self.db = DummyDB(mod)
             def get_running_pid(self):
                 return None
-            def get_job_by_name(self, state, name):
-                if state == 'COMPLETED' and name == 'testjob':
-                    return DummyJob(self.mod)
-                else:
-                    return None
         class DummyModule(object):
             config = 'testconfig'
             job_failed = False
@@ -6,10 +6,14 @@ import datetime
 import os
 import re
 import tempfile
+import threading
 import testutil
 from memory_database import MemoryDatabase
 from saliweb.backend import WebService, Job, InvalidStateError, Runner
 from saliweb.backend import MySQLField
+import saliweb.backend
+import saliweb.backend.events
+import saliweb.backend.joblog
 from config import Config
 from StringIO import StringIO
 
@@ -54,6 +58,22 @@ archive: %s
 expire: %s
 """
 
+batch_log = []
+class BatchMockRunner(MockRunner):
+    _runner_name = 'batchmock'
+    def _run(self, webservice):
+        batch_log.append([self.id])
+        return self.id
+    def _get_batch_key(self):
+        return self.id.split('-')[0]
+    @classmethod
+    def _run_batch(cls, runners, webservice):
+        if runners[0].id.startswith('fail'):
+            raise ValueError("Failure in batch submission")
+        batch_log.append([r.id for r in runners])
+        return [r.id + '.task' for r in runners]
+Job.register_runner_class(BatchMockRunner)
+
 class MyJob(Job):
     def preprocess(self):
         l = self.logger # Make sure self.logger is populated
@@ -101,13 +121,18 @@ class MyJob(Job):
         l = self.logger # Make sure self.logger is populated
         if self.name == 'fail-run':
             raise ValueError('Failure in running')
+        if self.name == 'transient-run':
+            raise saliweb.backend.TransientRunnerError('Cluster is down')
         self._metadata['testfield'] = 'run'
         f = open('job-output', 'w')
         f.close()
+        if self.name.startswith('batch-'):
+            return BatchMockRunner(self.name[6:])
         return MockRunner('MyJob ID')
     def rerun(self, data):
-        f = open(data, 'w')
-        f.close()
+        if data is not None:
+            f = open(data, 'w')
+            f.close()
         return Job.rerun(self, data)
     def archive(self):
         l = self.logger # Make sure self.logger is populated
@@ -127,6 +152,13 @@ class MyJob(Job):
     def _get_runner_results(self):
         if self.name == 'fail-batch-exception':
             raise ValueError('Failure in batch completion')
+        elif self.name == 'qstat-glitch':
+            raise OSError('qstat returned 1')
+        elif self.name == 'qstat-glitch-once':
+            glitch = os.path.join(self.directory, 'glitched')
+            if not os.path.exists(glitch):
+                open(glitch, 'w').close()
+                raise OSError('qstat returned 1')
         elif self.name == 'batch-complete-race':
             # Simulate job completing just after the first check of the
             # state file
@@ -138,6 +170,10 @@ class MyJob(Job):
         if self.name == 'fail-batch-complete':
             return True
 
+class CachedJob(MyJob):
+    def get_cache_inputs(self):
+        return ['input']
+
 def add_incoming_job(db, name):
     c = db.conn.cursor()
     jobdir = os.path.join(db.config.directories['INCOMING'], name)
@@ -250,7 +286,7 @@ def add_finalizing_job(db, name):
     db.conn.commit()
     return jobdir
 
-def setup_webservice(archive='30d', expire='90d'):
+def setup_webservice(archive='30d', expire='90d', extra=''):
     tmpdir = tempfile.mkdtemp()
     incoming = os.path.join(tmpdir, 'incoming')
     preprocessing = os.path.join(tmpdir, 'preprocessing')
@@ -262,7 +298,7 @@ def setup_webservice(archive='30d', expire='90d'):
     db.add_field(MySQLField('testfield', 'TEXT'))
     conf = Config(StringIO(basic_config \
                            % (incoming, preprocessing, failed, archive,
-                              expire)))
+                              expire) + extra))
     web = WebService(conf, db)
     db._create_tables()
     return db, conf, web, tmpdir
@@ -316,6 +352,46 @@ class JobTest(unittest.TestCase):
         os.rmdir(runjobdir)
         cleanup_webservice(conf, tmpdir)
 
+    def test_batch_startup(self):
+        """Check startup of incoming jobs in batches"""
+        global batch_log
+        batch_log = []
+        db, conf, web, tmpdir = setup_webservice(
+                                  extra='[limits]\nrunning: 10\n'
+                                        '[backend]\nbatch_size: 2\n')
+        self.assertEqual(conf.backend['batch_size'], 2)
+        names = ['batch-a-1', 'job1', 'batch-b-1', 'batch-a-2', 'batch-a-3',
+                 'batch-fail-1', 'batch-fail-2']
+        for name in names:
+            add_incoming_job(db, name)
+        web._process_incoming_jobs()
+        # Compatible jobs should be started together, up to 2 at a time
+        self.assertEqual(batch_log, [['a-1', 'a-2'], ['a-3'], ['b-1']])
+        expected = {'batch-a-1': 'batchmock:a-1.task',
+                    'batch-a-2': 'batchmock:a-2.task',
+                    'batch-a-3': 'batchmock:a-3', 'job1': 'mock:MyJob ID',
+                    'batch-b-1': 'batchmock:b-1'}
+        for name, runner_id in expected.items():
+            job = web.get_job_by_name('RUNNING', name)
+            self.assertEqual(job._metadata['runner_id'], runner_id)
+        # Completion should be tracked for each job in a batch
+        for name in ('batch-a-1', 'batch-a-2'):
+            job = web._get_job_by_runner_id(BatchMockRunner(''),
+                                            name[6:] + '.task')
+            self.assertEqual(job.name, name)
+        # Failure to submit a batch should fail all of its jobs
+        for name in ('batch-fail-1', 'batch-fail-2'):
+            job = web.get_job_by_name('FAILED', name)
+            self.assert_fail_msg('Failure in batch submission', job)
+        for name in names:
+            for state in ('RUNNING', 'FAILED'):
+                jobdir = os.path.join(conf.directories[state], name)
+                if os.path.exists(jobdir):
+                    for f in os.listdir(jobdir):
+                        os.unlink(os.path.join(jobdir, f))
+                    os.rmdir(jobdir)
+        cleanup_webservice(conf, tmpdir)
+
     def test_sanity_check_no_directory(self):
         """Make sure that sanity checks catch jobs without directories"""
         utcnow = datetime.datetime.utcnow()
@@ -420,6 +496,8 @@ class JobTest(unittest.TestCase):
 
         # Job should now have moved from INCOMING to RUNNING
         job = web.get_job_by_name('RUNNING', 'log-preprocess')
+        # Log messages are written asynchronously
+        saliweb.backend.joblog._writer.flush()
         # Make sure that the logger file was closed
         for f in testutil.get_open_files():
             self.assert_('framework.log' not in f,
@@ -496,6 +574,144 @@ class JobTest(unittest.TestCase):
         os.rmdir(failjobdir)
         cleanup_webservice(conf, tmpdir)
 
+    def test_background_submit(self):
+        """Check submission of jobs in the background"""
+        db, conf, web, tmpdir = setup_webservice(
+                      extra='[backend]\nsubmit_threads: 1\nsubmit_window: 1\n')
+        web._event_queue = saliweb.backend.events._EventQueue()
+        web._start_submitter()
+        injobdir = add_incoming_job(db, 'job1')
+        injobdir = add_incoming_job(db, 'job2')
+        web._process_incoming_jobs()
+        # Only one job fits in the submission window
+        job = web.get_job_by_name('RUNNING', 'job1')
+        self.assertEqual(job._metadata['runner_id'], 'submitting:mock')
+        job = web.get_job_by_name('INCOMING', 'job2')
+        self.assertEqual(web._submitter.throttled, True)
+        # It should not be considered complete while being submitted
+        web._process_completed_jobs()
+        job = web.get_job_by_name('RUNNING', 'job1')
+        # Once the submission finishes, the next job should be submitted
+        e = web._event_queue.get(timeout=5.)
+        e.process()
+        job = web.get_job_by_name('RUNNING', 'job1')
+        self.assertEqual(job._metadata['runner_id'], 'mock:MyJob ID')
+        job = web.get_job_by_name('RUNNING', 'job2')
+        self.assertEqual(job._metadata['runner_id'], 'submitting:mock')
+        web._event_queue.get(timeout=5.).process()
+        for name in ('job1', 'job2'):
+            job = web.get_job_by_name('RUNNING', name)
+            for f in os.listdir(job.directory):
+                os.unlink(os.path.join(job.directory, f))
+            os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_retry_run(self):
+        """Check retry of jobs after transient runner errors"""
+        db, conf, web, tmpdir = setup_webservice(
+                      extra='[retry]\nmax_attempts: 2\nbackoff_seconds: 0\n')
+        web._event_queue = saliweb.backend.events._EventQueue()
+        injobdir = add_incoming_job(db, 'transient-run')
+        web._process_incoming_jobs()
+        # Job should wait in RUNNING state to be run again
+        job = web.get_job_by_name('RUNNING', 'transient-run')
+        self.assertEqual(job._metadata['retry_count'], 1)
+        self.assert_(job._metadata['runner_id'].startswith('retry:'))
+        # It should not be considered complete in the meantime
+        web._process_completed_jobs()
+        job = web.get_job_by_name('RUNNING', 'transient-run')
+        e = web._event_queue.get(timeout=5.)
+        self.assert_(isinstance(e, saliweb.backend.events._RetryJobEvent))
+        # Retries should be rescheduled if the service is restarted
+        web._schedule_retries()
+        e = web._event_queue.get(timeout=5.)
+        self.assertEqual(e.name, 'transient-run')
+        e.process()
+        job = web.get_job_by_name('RUNNING', 'transient-run')
+        self.assertEqual(job._metadata['retry_count'], 2)
+        # No admin email should have been sent yet
+        self.assertEqual(conf.get_mail_output(), None)
+        # After max_attempts retries, the job should fail
+        web._event_queue.get(timeout=5.).process()
+        job = web.get_job_by_name('FAILED', 'transient-run')
+        self.assert_fail_msg('TransientRunnerError: Cluster is down', job)
+        # Resubmission should reset the retry count
+        job.resubmit()
+        job = web.get_job_by_name('INCOMING', 'transient-run')
+        self.assertEqual(job._metadata['retry_count'], 0)
+        for f in os.listdir(job.directory):
+            os.unlink(os.path.join(job.directory, f))
+        os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_retry_status(self):
+        """Check retry of job status checks after transient errors"""
+        db, conf, web, tmpdir = setup_webservice(
+                      extra='[retry]\nmax_attempts: 1\nbackoff_seconds: 0\n')
+        web._event_queue = saliweb.backend.events._EventQueue()
+        runjobdir = add_running_job(db, 'qstat-glitch', completed=True)
+        web._process_completed_jobs()
+        # Job should still be running, and checked again later
+        job = web.get_job_by_name('RUNNING', 'qstat-glitch')
+        self.assertEqual(web._status_rechecks, {'qstat-glitch': 1})
+        # Status checks should not use up the budget for reruns
+        self.assertEqual(job._metadata['retry_count'], 0)
+        self.assertEqual(job._metadata['runner_id'], 'mock:SGE-qstat-glitch')
+        e = web._event_queue.get(timeout=5.)
+        self.assert_(isinstance(e, saliweb.backend.events._RecheckJobEvent))
+        e.process()
+        job = web.get_job_by_name('FAILED', 'qstat-glitch')
+        self.assert_fail_msg('OSError: qstat returned 1', job)
+        for f in os.listdir(job.directory):
+            os.unlink(os.path.join(job.directory, f))
+        os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_retry_lost_job(self):
+        """Check that jobs the runner lost track of are not run again"""
+        db, conf, web, tmpdir = setup_webservice(
+                      extra='[retry]\nmax_attempts: 1\nbackoff_seconds: 0\n')
+        web._event_queue = saliweb.backend.events._EventQueue()
+        runjobdir = add_running_job(db, 'job1', completed=True)
+        job = web.get_job_by_name('RUNNING', 'job1')
+        job._try_complete(web, OSError('Could not wait for SGE jobs'))
+        # Job should be checked again later, not run again
+        job = web.get_job_by_name('RUNNING', 'job1')
+        self.assertEqual(job._metadata['retry_count'], 0)
+        self.assertEqual(job._metadata['runner_id'], 'mock:SGE-job1')
+        e = web._event_queue.get(timeout=5.)
+        self.assert_(isinstance(e, saliweb.backend.events._RecheckJobEvent))
+        e.process()
+        job = web.get_job_by_name('COMPLETED', 'job1')
+        for f in os.listdir(job.directory):
+            os.unlink(os.path.join(job.directory, f))
+        os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_retry_status_reset(self):
+        """Check that retry counts are reset once the job completes"""
+        db, conf, web, tmpdir = setup_webservice(
+                      extra='[retry]\nmax_attempts: 1\nbackoff_seconds: 0\n')
+        web._event_queue = saliweb.backend.events._EventQueue()
+        runjobdir = add_running_job(db, 'qstat-glitch-once', completed=True)
+        c = db.conn.cursor()
+        c.execute("UPDATE jobs SET retry_count=1")
+        db.conn.commit()
+        web._process_completed_jobs()
+        # A previous rerun should not prevent the status check being retried
+        job = web.get_job_by_name('RUNNING', 'qstat-glitch-once')
+        self.assertEqual(job._metadata['retry_count'], 1)
+        self.assertEqual(web._status_rechecks, {'qstat-glitch-once': 1})
+        web._event_queue.get(timeout=5.).process()
+        # Once the job completes, both counts should be reset
+        job = web.get_job_by_name('COMPLETED', 'qstat-glitch-once')
+        self.assertEqual(job._metadata['retry_count'], 0)
+        self.assertEqual(web._status_rechecks, {})
+        for f in os.listdir(job.directory):
+            os.unlink(os.path.join(job.directory, f))
+        os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
     def test_ok_complete(self):
         """Check normal job completion"""
         db, conf, web, tmpdir = setup_webservice()
@@ -527,6 +743,93 @@ class JobTest(unittest.TestCase):
                                mail, flags=re.DOTALL),
                      'Unexpected mail output: ' + mail)
 
+    def test_disk_usage(self):
+        """Check measurement of job disk usage"""
+        db, conf, web, tmpdir = setup_webservice(
+                                 extra='[backend]\ntrack_disk_usage: true\n')
+        runjobdir = add_running_job(db, 'job1', completed=True)
+        with open(os.path.join(runjobdir, 'output'), 'w') as fh:
+            fh.write('x' * 10000)
+        web._process_completed_jobs()
+        job = web.get_job_by_name('COMPLETED', 'job1')
+        # output, framework.log, postproc, finalize, complete files
+        self.assertEqual(job._metadata['disk_files'], 5)
+        self.assert_(job._metadata['disk_usage'] >= 10000)
+        # Should not archive early without archive_size
+        self.assertNotEqual(job._metadata['archive_time'],
+                            job._metadata['end_time'])
+        for f in os.listdir(job.directory):
+            os.unlink(os.path.join(job.directory, f))
+        os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_result_cache(self):
+        """Check reuse of results of jobs with identical inputs"""
+        db, conf, web, tmpdir = setup_webservice(
+                                 extra='[backend]\nresult_cache: true\n')
+        db._jobcls = CachedJob
+        for name in ('job1', 'job2', 'job3'):
+            d = add_incoming_job(db, name)
+            with open(os.path.join(d, 'input'), 'w') as fh:
+                fh.write('foo' if name == 'job3' else 'bar')
+        web._process_incoming_jobs()
+        # job2 should wait for job1, since it has the same inputs
+        job1 = web.get_job_by_name('RUNNING', 'job1')
+        job2 = web.get_job_by_name('INCOMING', 'job2')
+        job3 = web.get_job_by_name('RUNNING', 'job3')
+        self.assertEqual(job1._metadata['input_hash'],
+                         job2._metadata['input_hash'])
+        self.assertNotEqual(job1._metadata['input_hash'],
+                            job3._metadata['input_hash'])
+        with open(os.path.join(job1.directory, 'job-state'), 'w') as fh:
+            print("DONE", file=fh)
+        web._process_completed_jobs()
+        job1 = web.get_job_by_name('COMPLETED', 'job1')
+
+        # job2 should now get a copy of job1's results without running
+        web._process_incoming_jobs()
+        job2 = web.get_job_by_name('COMPLETED', 'job2')
+        self.assertEqual(job2._metadata['run_time'], None)
+        self.assertEqual(job2._metadata['testfield'], 'complete')
+        for f in ('preproc', 'job-output', 'postproc', 'finalize'):
+            self.assert_(os.path.samefile(os.path.join(job1.directory, f),
+                                          os.path.join(job2.directory, f)))
+        # Only the job that actually ran should be in the cache
+        c = db.conn.cursor()
+        self.assertEqual(list(c.execute('SELECT name FROM result_cache')),
+                         [('job1',)])
+        # Cache entries should be removed once the job is archived
+        job1._try_archive()
+        web._process_old_jobs()
+        self.assertEqual(list(c.execute('SELECT name FROM result_cache')),
+                         [])
+        for job in (job1, job2, job3):
+            for f in os.listdir(job.directory):
+                os.unlink(os.path.join(job.directory, f))
+            os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_archive_size(self):
+        """Check early archival of jobs that exceed archive_size"""
+        db, conf, web, tmpdir = setup_webservice(
+                                 archive='30d\narchive_size: 5K',
+                                 extra='[backend]\ntrack_disk_usage: true\n')
+        runjobdir = add_running_job(db, 'job1', completed=True)
+        with open(os.path.join(runjobdir, 'output'), 'w') as fh:
+            fh.write('x' * 10000)
+        web._process_completed_jobs()
+        # Job should have gone straight through to ARCHIVED
+        job = web.get_job_by_name('ARCHIVED', 'job1')
+        self.assertEqual(job._metadata['archive_time'],
+                         job._metadata['end_time'])
+        self.assertEqual(job._metadata['testfield'], 'archive')
+        # output, framework.log, postproc, finalize, complete, archive files
+        self.assertEqual(job._metadata['disk_files'], 6)
+        for f in os.listdir(job.directory):
+            os.unlink(os.path.join(job.directory, f))
+        os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
     def test_complete_no_expire(self):
         """Check completion of a job that should never expire or be archived"""
         db, conf, web, tmpdir = setup_webservice(expire='NEVER',
@@ -625,7 +928,19 @@ class JobTest(unittest.TestCase):
         """Make sure that batch system failures are handled correctly"""
         db, conf, web, tmpdir = setup_webservice()
         runjobdir = add_running_job(db, 'fail-batch-complete', completed=False)
+        web._event_queue = saliweb.backend.events._EventQueue()
         web._process_completed_jobs()
+        # Job should not fail immediately; the state file should be
+        # rechecked a few times (without blocking)
+        job = web.get_job_by_name('RUNNING', 'fail-batch-complete')
+        self.assertNotEqual(job, None)
+        self.assertEqual(web._state_file_rechecks, {'fail-batch-complete': 1})
+        for i in range(8):
+            event = web._event_queue.get(timeout=5.)
+            self.assert_(isinstance(event,
+                                 saliweb.backend.events._RecheckJobEvent))
+            event.process()
+        self.assertEqual(web._state_file_rechecks, {})
 
         # Job should now have moved from RUNNING to FAILED
         job = web.get_job_by_name('FAILED', 'fail-batch-complete')
@@ -807,6 +1122,40 @@ class JobTest(unittest.TestCase):
         self.assertEqual(c.fetchone()[0], 1)
         cleanup_webservice(conf, tmpdir)
 
+    def test_job_done_notification(self):
+        """Check jobs telling us they finished"""
+        db, conf, web, tmpdir = setup_webservice()
+        # The job-state file may not yet be visible, but the notification
+        # should be enough to complete the job
+        for name, runner_id in (('job1', 'mock:SGE-job1'),
+                                ('job2', 'mock:SGE-job2.1-4:1')):
+            runjobdir = add_running_job(db, name, completed=False)
+            c = db.conn.cursor()
+            c.execute('UPDATE jobs SET runner_id=? WHERE name=?',
+                      (runner_id, name))
+            db.conn.commit()
+        web._job_done('mock:SGE-job1')
+        web._job_done('mock:SGE-job2')
+        web._job_done('mock:unknown-job')
+        # Jobs we were already told about should not be checked again
+        web._notified_jobs['job3'] = None
+        runjobdir = add_running_job(db, 'job3', completed=False)
+        c = db.conn.cursor()
+        c.execute("UPDATE jobs SET runner_id='mock:SGE-job3.1-4:1' "
+                  "WHERE name='job3'")
+        db.conn.commit()
+        web._job_done('mock:SGE-job3')
+        job = web.get_job_by_name('RUNNING', 'job3')
+        del web._notified_jobs['job3']
+        web._job_done('mock:SGE-job3')
+        for name in ('job1', 'job2', 'job3'):
+            job = web.get_job_by_name('COMPLETED', name)
+            for f in os.listdir(job.directory):
+                os.unlink(os.path.join(job.directory, f))
+            os.rmdir(job.directory)
+        self.assertEqual(web._notified_jobs, {})
+        cleanup_webservice(conf, tmpdir)
+
     def test_get_job_results(self):
         """Check Job._get_job_results method"""
         db, conf, web, tmpdir = setup_webservice()
@@ -898,6 +1247,65 @@ class JobTest(unittest.TestCase):
         self.assertEqual(j._get_runner_results(), True)
         self.assertEqual(checked_jobs, ['job1', 'job2', 'job:with:colons'])
 
+    def test_job_context(self):
+        """Check running of job methods with a job context"""
+        def hook(arg, key):
+            context = saliweb.backend._get_job_context()
+            r = saliweb.backend.DoNothingRunner()
+            return (arg, key, os.getcwd(), r._directory, context.directory,
+                    os.path.samestat(os.fstat(context.dirfd),
+                                     os.stat(context.directory)))
+        db, conf, web, tmpdir = setup_webservice()
+        jobdir = add_incoming_job(db, 'job1')
+        job = web.get_job_by_name('INCOMING', 'job1')
+        cwd = os.getcwd()
+        ret = job._run_in_job_directory(hook, 'foo', key='bar')
+        self.assertEqual(ret, ('foo', 'bar', jobdir, jobdir, jobdir, True))
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(saliweb.backend._get_job_context(), None)
+        self.assertFalse(hasattr(job, 'logger'))
+        # Hooks that do not need chdir should still get the job directory
+        job.chdir_hooks = False
+        ret = job._run_in_job_directory(hook, 'foo', key='bar')
+        self.assertEqual(ret, ('foo', 'bar', cwd, jobdir, jobdir, True))
+        os.rmdir(jobdir)
+        cleanup_webservice(conf, tmpdir)
+
+    def test_job_context_logging(self):
+        """Check logging from job methods running in several threads"""
+        db, conf, web, tmpdir = setup_webservice()
+        started = threading.Event()
+        logged = threading.Event()
+        def first_hook():
+            started.set()
+            logged.wait(5.)
+            # Messages can also be logged via the shared service logger
+            logging.getLogger('test_service').warning('first message')
+        def second_hook():
+            started.wait(5.)
+            logging.getLogger('test_service').warning('second message')
+            logged.set()
+        jobs = []
+        for name in ('job1', 'job2'):
+            add_incoming_job(db, name)
+            jobs.append(web.get_job_by_name('INCOMING', name))
+            # Otherwise only one hook can run at a time
+            jobs[-1].chdir_hooks = False
+        t = threading.Thread(target=jobs[0]._run_in_job_directory,
+                             args=(first_hook,))
+        t.start()
+        jobs[1]._run_in_job_directory(second_hook)
+        t.join()
+        for job, msg in zip(jobs, ('first message', 'second message')):
+            job._release_log_handler(wait=True)
+            logfile = os.path.join(job.directory, 'framework.log')
+            lines = open(logfile).readlines()
+            self.assertEqual(len(lines), 1)
+            self.assert_(lines[0].endswith('WARNING %s\n' % msg), lines)
+            os.unlink(logfile)
+            os.rmdir(job.directory)
+        cleanup_webservice(conf, tmpdir)
+
     def test_close_open_files(self):
         """Check Job._close_open_files()"""
         db, conf, web, tmpdir = setup_webservice()
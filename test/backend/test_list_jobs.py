@@ -2,7 +2,10 @@ import unittest
 import sys
 from saliweb.backend import InvalidStateError
 from saliweb.backend.list_jobs import check_valid_state, get_options, main
+from saliweb.backend.list_jobs import glob_to_like
 import StringIO
+import datetime
+import json
 
 class Tests(unittest.TestCase):
 
@@ -25,59 +28,140 @@ class Tests(unittest.TestCase):
             finally:
                 sys.stderr = oldstderr
                 sys.argv = old
-        states = run_get_options(['FAILED', 'RUNNING'])
+        states, opts = run_get_options(['FAILED', 'RUNNING'])
         self.assertEqual(states, ['FAILED', 'RUNNING'])
+        self.assertEqual(opts.format, 'text')
+        self.assertEqual(opts.limit, None)
+        states, opts = run_get_options([])
+        self.assertEqual(len(states), 6)
+        states, opts = run_get_options(['--after', '2016-02-03 04:05',
+                                        '--limit', '10', '--start-after',
+                                        'foo', '--format', 'csv', 'FAILED'])
+        self.assertEqual(opts.after, datetime.datetime(2016, 2, 3, 4, 5))
+        self.assertEqual(opts.limit, 10)
+        self.assertEqual(opts.start_after, 'foo')
+        self.assertEqual(opts.format, 'csv')
+        self.assertRaises(SystemExit, run_get_options, ['--format', 'xml'])
+        self.assertRaises(SystemExit, run_get_options, ['--limit', '0'])
+        self.assertRaises(SystemExit, run_get_options, ['--before', 'garbage'])
+
+    def test_glob_to_like(self):
+        """Test conversion of wildcards to SQL LIKE patterns"""
+        self.assertEqual(glob_to_like('foo*'), 'foo%')
+        self.assertEqual(glob_to_like('f?o_1%!'), 'f_o!_1!%!!')
 
     def test_main(self):
         """Test list_jobs main()"""
-        class DummyJob(object):
-            def __init__(self, name):
-                self.name = name
         class DummyDatabase(object):
-            def _get_all_jobs_in_state(self, state, order_by):
-                if state == 'FAILED':
-                    return [DummyJob('foo'), DummyJob('bar')]
-                elif state == 'PREPROCESSING':
-                    return [DummyJob('testpre')]
-                elif state == 'RUNNING':
-                    return [DummyJob('baz')]
-                else:
-                    return []
+            jobs = [('foo', 'FAILED'), ('testpre', 'PREPROCESSING'),
+                    ('bar', 'FAILED'), ('baz', 'RUNNING')]
+            def _list_jobs(self, fields, states, after_name, limit, **keys):
+                self.fields = fields
+                self.keys = keys
+                jobs = self.jobs
+                if after_name is not None:
+                    jobs = jobs[[j[0] for j in jobs].index(after_name) + 1:]
+                jobs = [j for j in jobs if j[1] in states]
+                if limit is not None:
+                    jobs = jobs[:limit]
+                for name, state in jobs:
+                    yield (name, state, 'testuser',
+                           datetime.datetime(2016, 1, 2, 3, 4, 5), None)
+            def _count_jobs(self, states, names=None, **keys):
+                counts = dict.fromkeys(states, 0)
+                for name, state in self.jobs:
+                    if state in states and (names is None or name in names):
+                        counts[state] += 1
+                return counts
         class DummyWebService(object):
             def __init__(self, mod):
                 self.mod = mod
                 self.db = DummyDatabase()
         class DummyModule(object):
             config = 'testconfig'
-            job_deleted = False
             def get_web_service(self, config):
-                return DummyWebService(self)
+                self.web = DummyWebService(self)
+                return self.web
 
-        old = sys.argv
-        oldout = sys.stdout
-        try:
-            sio = StringIO.StringIO()
-            sys.stdout = sio
-            mod = DummyModule()
-            sys.argv = ['testprogram', 'FAILED', 'RUNNING']
-            main(mod)
-            self.assertEqual(sio.getvalue(),
+        def run_main(args):
+            old = sys.argv
+            oldout = sys.stdout
+            olderr = sys.stderr
+            try:
+                sys.stdout = StringIO.StringIO()
+                sys.stderr = StringIO.StringIO()
+                mod = DummyModule()
+                sys.argv = ['testprogram'] + args
+                main(mod)
+                return (mod.web.db, sys.stdout.getvalue(),
+                        sys.stderr.getvalue())
+            finally:
+                sys.argv = old
+                sys.stdout = oldout
+                sys.stderr = olderr
+
+        db, out, err = run_main(['FAILED', 'RUNNING'])
+        self.assertEqual(out,
 'foo                                                          FAILED\n'
 'bar                                                          FAILED\n'
 'baz                                                          RUNNING\n')
-            sio = StringIO.StringIO()
-            sys.stdout = sio
-            mod = DummyModule()
-            sys.argv = ['testprogram']
-            main(mod)
-            self.assertEqual(sio.getvalue(),
+        self.assertEqual(db.keys, {'user': None, 'submitted_after': None,
+                                   'submitted_before': None,
+                                   'name_like': None})
+        db, out, err = run_main([])
+        self.assertEqual(out,
 'foo                                                          FAILED\n'
-'bar                                                          FAILED\n'
 'testpre                                                      PREPROCESSING\n'
+'bar                                                          FAILED\n'
 'baz                                                          RUNNING\n')
-        finally:
-            sys.argv = old
-            sys.stdout = oldout
+        db, out, err = run_main(['-u', 'testuser', '--name', 'b*', 'FAILED'])
+        self.assertEqual(db.keys['user'], 'testuser')
+        self.assertEqual(db.keys['name_like'], 'b%')
+
+        # Check pagination
+        db, out, err = run_main(['--limit', '2'])
+        self.assertEqual(out.split('\n')[1].split()[0], 'testpre')
+        self.assertEqual(err, 'More jobs are available; use --start-after '
+                              'testpre to see them\n')
+        db, out, err = run_main(['--limit', '2', '--start-after', 'testpre'])
+        self.assertEqual([x.split()[0] for x in out.split('\n') if x],
+                         ['bar', 'baz'])
+        self.assertEqual(err, '')
+        # Unknown jobs should be reported, not treated as an empty list
+        self.assertRaises(ValueError, run_main, ['--start-after', 'garbage',
+                                                 'FAILED'])
+        # The job need not be in one of the listed states
+        db, out, err = run_main(['--start-after', 'testpre', 'FAILED'])
+        self.assertEqual([x.split()[0] for x in out.split('\n') if x],
+                         ['bar'])
+        db, out, err = run_main(['--after', '2016-01-01', '--before',
+                                 '2016-02-01', 'FAILED'])
+        self.assertEqual(db.keys['submitted_after'],
+                         datetime.datetime(2016, 1, 1))
+        self.assertEqual(db.keys['submitted_before'],
+                         datetime.datetime(2016, 2, 1))
+
+        # Check machine-readable output
+        db, out, err = run_main(['--format', 'json', 'RUNNING'])
+        self.assertEqual(json.loads(out),
+                         [{'name': 'baz', 'state': 'RUNNING',
+                           'user': 'testuser',
+                           'submit_time': '2016-01-02T03:04:05',
+                           'end_time': None}])
+        db, out, err = run_main(['--format', 'json', 'EXPIRED'])
+        self.assertEqual(json.loads(out), [])
+        db, out, err = run_main(['--format', 'csv', 'RUNNING'])
+        self.assertEqual(out, 'name,state,user,submit_time,end_time\r\n'
+                              'baz,RUNNING,testuser,2016-01-02T03:04:05,\r\n')
+
+        # Check counts
+        db, out, err = run_main(['--count', 'FAILED', 'RUNNING', 'EXPIRED'])
+        self.assertEqual(out, 'FAILED          2\n'
+                              'RUNNING         1\n'
+                              'EXPIRED         0\n'
+                              'Total           3\n')
+        db, out, err = run_main(['--count', '--format', 'json', 'FAILED'])
+        self.assertEqual(json.loads(out), {'FAILED': 2})
 
 
 if __name__ == '__main__':
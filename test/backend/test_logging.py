@@ -1,7 +1,9 @@
 from __future__ import print_function
 import unittest
 import os
+import logging
 from saliweb.backend import _DelayFileStream
+from saliweb.backend.joblog import _LogWriter
 import testutil
 
 class LoggingTest(unittest.TestCase):
@@ -24,5 +26,51 @@ class LoggingTest(unittest.TestCase):
         contents = open('foo').read()
         self.assertEqual(contents, 'test text\n')
 
+    @testutil.run_in_tempdir
+    def test_log_writer(self):
+        """Check asynchronous writing of log files"""
+        w = _LogWriter(max_handlers=2)
+        h = w.get_handler('foo')
+        self.assert_(isinstance(h, logging.Handler))
+        # Handlers should be cached
+        self.assertEqual(w.get_handler('foo'), h)
+        w.flush()
+        self.assertEqual(os.path.exists('foo'), False)
+        h.emit(logging.makeLogRecord({'msg': 'foo message'}))
+        w.flush()
+        self.assertEqual(open('foo').read(), 'foo message\n')
+        # File should be kept open until released
+        self.assert_(os.path.join(os.getcwd(), 'foo')
+                     in testutil.get_open_files())
+        w.release('foo', wait=True)
+        self.assert_(os.path.join(os.getcwd(), 'foo')
+                     not in testutil.get_open_files())
+        self.assertNotEqual(w.get_handler('foo'), h)
+        # Least recently used handler should be dropped
+        h = w.get_handler('bar')
+        w.get_handler('baz')
+        w.get_handler('foo')
+        self.assertEqual(w.get_handler('baz'), w.get_handler('baz'))
+        self.assertNotEqual(w.get_handler('bar'), h)
+        for f in ('bar', 'baz'):
+            w.get_handler(f).emit(logging.makeLogRecord({'msg': f}))
+        w.flush(close=True)
+        self.assertEqual(open('bar').read(), 'bar\n')
+        self.assertEqual(open('baz').read(), 'baz\n')
+        for f in ('foo', 'bar', 'baz'):
+            self.assert_(os.path.join(os.getcwd(), f)
+                         not in testutil.get_open_files())
+            os.unlink(f)
+        # Writer thread can be stopped, and restarts when needed
+        thread = w._thread
+        w.get_handler('foo').emit(logging.makeLogRecord({'msg': 'foo'}))
+        w.stop()
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(open('foo').read(), 'foo\n')
+        w.get_handler('foo').emit(logging.makeLogRecord({'msg': 'bar'}))
+        w.stop()
+        self.assertEqual(open('foo').read(), 'foo\nbar\n')
+        os.unlink('foo')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import re
+import sys
+import time
+from StringIO import StringIO
+from saliweb.backend.mailer import _deliver_batch, _MailQueue
+import config
+
+basic_config = """
+[general]
+admin_email: test@salilab.org
+service_name: test_service
+socket: test.socket
+
+[backend]
+user: test
+state_file: state_file
+check_minutes: 10
+%s
+
+[database]
+db: testdb
+frontend_config: frontend.conf
+backend_config: backend.conf
+
+[directories]
+install: /
+incoming: /in
+preprocessing: /preproc
+
+[oldjobs]
+archive: 30d
+expire: 90d
+"""
+
+def get_config(extra=''):
+    return config.Config(StringIO(basic_config % extra))
+
+class MailerTest(unittest.TestCase):
+    """Check background delivery of email"""
+
+    def test_deliver_batch(self):
+        """Check _deliver_batch()"""
+        conf = get_config()
+        batch = [[['user1'], conf._make_email('user1', 'subj1', 'body1'), 0],
+                 [['user2'], conf._make_email('user2', 'subj2',
+                                              'body2\n.dotted line'), 0]]
+        failed = _deliver_batch(conf._mailer, conf.admin_email, batch)
+        self.assertEqual(failed, [])
+        mail = conf.get_all_mail_output()
+        self.assert_(re.search('Subject: subj1.*To: user1.*body1.*'
+                               'Subject: subj2.*To: user2.*body2\n'
+                               '\.dotted line', mail, flags=re.DOTALL),
+                     'Unexpected mail output: ' + mail)
+        # Failed deliveries should be returned for retry
+        olderr = sys.stderr
+        try:
+            sys.stderr = StringIO()
+            failed = _deliver_batch('/not/exist/mailer', conf.admin_email,
+                                    batch)
+        finally:
+            sys.stderr = olderr
+        self.assertEqual([x[2] for x in failed], [1, 1])
+
+    def test_queue(self):
+        """Check queued delivery via Config.send_email()"""
+        conf = get_config()
+        self.assertEqual(conf.backend['failure_digest_minutes'], 5)
+        conf._start_mail_queue()
+        try:
+            conf.send_email('testto', 'testsubj', 'testbody')
+        finally:
+            conf._stop_mail_queue()
+        mail = conf.get_mail_output()
+        self.assert_(re.search('Subject: testsubj.*From: '
+                               'test@salilab\.org.*To: testto.*testbody',
+                               mail, flags=re.DOTALL),
+                     'Unexpected mail output: ' + mail)
+        # Mail should be sent immediately once the queue is stopped
+        conf.send_email('testto', 'subj2', 'testbody')
+        self.assert_('Subject: subj2' in conf.get_mail_output())
+
+    def test_failure_digest(self):
+        """Check digests of job failures"""
+        conf = get_config('failure_digest_minutes: 10')
+        self.assertEqual(conf.backend['failure_digest_minutes'], 10)
+        conf._start_mail_queue()
+        try:
+            for i in range(5):
+                if i == 2:
+                    err = 'Traceback\nIOError: disk full'
+                else:
+                    err = 'Traceback\nValueError: bad input'
+                conf._send_job_failure_email('job%d' % i, 'job%d FAILED' % i,
+                                             'job%d body' % i, err)
+        finally:
+            conf._stop_mail_queue()
+        mail = conf.get_all_mail_output()
+        # First failure should be reported individually
+        self.assert_(re.search('Subject: job0 FAILED.*job0 body', mail,
+                               flags=re.DOTALL),
+                     'Unexpected mail output: ' + mail)
+        for i in range(1, 5):
+            self.assert_('Subject: job%d FAILED' % i not in mail)
+        # Remaining failures should be summarized
+        self.assert_(re.search('Subject: Sali lab test_service service: '
+                               '4 more jobs FAILED.*'
+                               '3 jobs failed with: ValueError: bad input\n'
+                               '1 jobs failed with: IOError: disk full.*'
+                               'Jobs: job1, job3, job4.*'
+                               'Job job1 failed with the following error',
+                               mail, flags=re.DOTALL),
+                     'Unexpected mail output: ' + mail)
+
+    def test_no_digest(self):
+        """Check failure notices with digests turned off"""
+        conf = get_config('failure_digest_minutes: 0')
+        conf._start_mail_queue()
+        try:
+            for i in range(3):
+                conf._send_job_failure_email('job%d' % i, 'job%d FAILED' % i,
+                                             'job%d body' % i, 'error')
+        finally:
+            conf._stop_mail_queue()
+        mail = conf.get_all_mail_output()
+        for i in range(3):
+            self.assert_('Subject: job%d FAILED' % i in mail)
+
+    def test_retry(self):
+        """Check retry of failed deliveries"""
+        conf = get_config()
+        mailer = conf._mailer
+        conf._mailer = '/not/exist/mailer'
+        q = _MailQueue(conf, 0)
+        q.retry_interval = 1000.
+        olderr = sys.stderr
+        try:
+            sys.stderr = StringIO()
+            q.start()
+            q.put(['testto'], conf._make_email('testto', 'subj', 'body'))
+            # Wait for the first delivery attempt to fail
+            for i in range(200):
+                if q._retry_time is not None:
+                    break
+                time.sleep(0.01)
+            self.assertNotEqual(q._retry_time, None)
+            self.assertEqual(conf.get_all_mail_output(), None)
+            # Stopping the queue should retry immediately
+            conf._mailer = mailer
+            q.stop()
+        finally:
+            sys.stderr = olderr
+        self.assert_('Subject: subj' in conf.get_all_mail_output())
+
+if __name__ == '__main__':
+    unittest.main()
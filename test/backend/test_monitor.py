@@ -0,0 +1,141 @@
+import unittest
+import threading
+import socket
+import json
+import sys
+from saliweb.backend.monitor import get_options, format_time, \
+                                    format_status, get_status, main
+import saliweb.backend.stats
+import StringIO
+import testutil
+
+
+def run_get_options(args):
+    old = sys.argv
+    oldstderr = sys.stderr
+    try:
+        sys.stderr = StringIO.StringIO()
+        sys.argv = ['testprogram'] + args
+        return get_options()
+    finally:
+        sys.stderr = oldstderr
+        sys.argv = old
+
+
+class DummyConfig(object):
+    service_name = 'test_service'
+    socket = 'test.sock'
+
+class DummyWebService(object):
+    config = DummyConfig()
+
+class DummyModule(object):
+    config = 'testconfig'
+    def get_web_service(self, config):
+        return DummyWebService()
+
+
+def serve_status(status, num):
+    """Reply to `num` STATUS requests on test.sock with `status`"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind('test.sock')
+    sock.listen(5)
+    def serve():
+        for i in range(num):
+            conn, addr = sock.accept()
+            if conn.recv(4096).startswith('STATUS'):
+                conn.sendall(json.dumps(status))
+            conn.close()
+        sock.close()
+    t = threading.Thread(target=serve)
+    t.setDaemon(True)
+    t.start()
+    return t
+
+
+class Tests(unittest.TestCase):
+
+    def test_get_options(self):
+        """Test monitor get_options()"""
+        opts = run_get_options([])
+        self.assertEqual(opts.delay, 1.)
+        self.assertEqual(opts.iterations, None)
+        opts = run_get_options(['-d', '0.5', '-n', '3'])
+        self.assertEqual(opts.delay, 0.5)
+        self.assertEqual(opts.iterations, 3)
+        self.assertRaises(SystemExit, run_get_options, ['-d', '0'])
+        self.assertRaises(SystemExit, run_get_options, ['foo'])
+
+    def test_format_time(self):
+        """Test monitor format_time()"""
+        self.assertEqual(format_time(None), '-')
+        self.assertEqual(format_time(1.25), '1.2s')
+        self.assertEqual(format_time(125.), '2m05s')
+        self.assertEqual(format_time(7500.), '2h05m')
+
+    def test_format_status(self):
+        """Test monitor format_status()"""
+        s = saliweb.backend.stats._DaemonStats()
+        s.reset({'RUNNING': 2, 'FAILED': 1}, [('job1', 'foo'), ('job2', None)],
+                [])
+        s.hook_started('job3', 'preprocess')
+        s.add_latency('submit', 0.25)
+        status = json.loads(json.dumps(s.snapshot(4)))
+        lines = format_status('test_service', status, None)
+        text = "\n".join(lines)
+        self.assert_('Event queue: 4   Events: 0 (-)' in text)
+        self.assert_('RUNNING 2  POSTPROCESSING 0' in text)
+        self.assert_('Jobs in hooks: 1' in lines)
+        self.assert_('preprocess' in text)
+        self.assert_('    250ms' in text)
+        # Event rate is calculated from the previous status
+        previous = dict(status)
+        previous['time'] -= 2.
+        previous['events'] -= 10
+        text = "\n".join(format_status('test_service', status, previous))
+        self.assert_('Events: 0 (5.0/s)' in text)
+
+    @testutil.run_in_tempdir
+    def test_get_status(self):
+        """Test monitor get_status()"""
+        t = serve_status({'foo': 'bar'}, 1)
+        self.assertEqual(get_status(DummyWebService()), {'foo': 'bar'})
+        t.join()
+
+    @testutil.run_in_tempdir
+    def test_main(self):
+        """Test monitor main()"""
+        s = saliweb.backend.stats._DaemonStats()
+        t = serve_status(s.snapshot(0), 2)
+        old = sys.argv
+        oldout = sys.stdout
+        try:
+            sys.stdout = StringIO.StringIO()
+            sys.argv = ['testprogram', '-n', '2', '-d', '0.01']
+            main(DummyModule())
+            out = sys.stdout.getvalue()
+        finally:
+            sys.stdout = oldout
+            sys.argv = old
+        t.join()
+        self.assertEqual(out.count('test_service backend - up'), 2)
+
+    @testutil.run_in_tempdir
+    def test_main_not_running(self):
+        """Test monitor main() with no running backend"""
+        old = sys.argv
+        olderr = sys.stderr
+        try:
+            sys.stderr = StringIO.StringIO()
+            sys.argv = ['testprogram']
+            self.assertRaises(SystemExit, main, DummyModule())
+            err = sys.stderr.getvalue()
+        finally:
+            sys.stderr = olderr
+            sys.argv = old
+        self.assert_('Could not get status from the test_service backend'
+                     in err)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import unittest
+import re
+import os
+import sys
+import saliweb.backend.events
+import saliweb.backend.pool
+from saliweb.backend import PoolRunner, RunnerError
+import testutil
+
+class DummyConfig(object):
+    pool = {'workers': 2, 'max_tasks_per_worker': 2, 'memory_limit': None,
+            'preload': ['testpooljobs']}
+
+class DummyWebService(object):
+    def __init__(self):
+        self.config = DummyConfig()
+        self._event_queue = saliweb.backend.events._EventQueue()
+
+def write_job_module(directory):
+    fh = open(os.path.join(directory, 'testpooljobs.py'), 'w')
+    fh.write("""
+import os
+def write_pid(fname, contents='foo'):
+    open(fname, 'w').write('%s %d' % (contents, os.getpid()))
+def fail():
+    raise ValueError("job went wrong")
+def use_memory():
+    x = 'x' * (400 * 1024 * 1024)
+def crash():
+    os._exit(1)
+def exit():
+    raise SystemExit(0)
+""")
+    fh.close()
+
+def wait_for_events(ws, num):
+    events = []
+    for i in range(100):
+        e = ws._event_queue.get(timeout=0.1)
+        if e is not None:
+            events.append(e)
+            if len(events) == num:
+                return events
+    raise AssertionError("Timed out waiting for job completion events")
+
+
+class Test(unittest.TestCase):
+    """Check PoolRunner class"""
+
+    def test_run(self):
+        """Check running of jobs in a worker pool"""
+        with testutil.temp_working_dir() as d:
+            write_job_module(d.tmpdir)
+            sys.path.insert(0, d.tmpdir)
+            try:
+                ws = DummyWebService()
+                runners = []
+                for i in range(6):
+                    jobdir = os.path.join(d.tmpdir, 'job%d' % i)
+                    os.mkdir(jobdir)
+                    os.chdir(jobdir)
+                    r = PoolRunner('testpooljobs.write_pid', ('out',),
+                                   {'contents': 'job%d' % i})
+                    runid = r._run(ws)
+                    self.assertEqual(PoolRunner._check_completed(runid, ''),
+                                     False)
+                    runners.append((r, runid))
+                events = wait_for_events(ws, 6)
+                self.assertEqual(sorted([e.runid for e in events]),
+                                 sorted([x[1] for x in runners]))
+                for e in events:
+                    self.assertEqual(e.run_exception, None)
+                    self.assertEqual(PoolRunner._check_completed(e.runid, ''),
+                                     True)
+                pids = {}
+                for i in range(6):
+                    jobdir = os.path.join(d.tmpdir, 'job%d' % i)
+                    self.assertEqual(open(os.path.join(jobdir,
+                                                 'job-state')).read(), 'DONE')
+                    contents, pid = open(os.path.join(jobdir,
+                                                      'out')).read().split()
+                    self.assertEqual(contents, 'job%d' % i)
+                    pids[pid] = pids.get(pid, 0) + 1
+                # Workers should be recycled after 2 tasks
+                self.assertEqual(max(pids.values()), 2)
+
+                # Failed jobs
+                os.chdir(d.tmpdir)
+                r = PoolRunner('testpooljobs.fail')
+                r._run(ws)
+                r = PoolRunner('testpooljobs.not_exist')
+                r._run(ws)
+                events = wait_for_events(ws, 2)
+                for e in events:
+                    self.assert_(isinstance(e.run_exception, RunnerError))
+                errs = sorted([str(e.run_exception) for e in events])
+                self.assert_('job went wrong' in errs[0], errs[0])
+                self.assert_('not_exist' in errs[1], errs[1])
+            finally:
+                PoolRunner._close_pool()
+                del sys.path[0]
+
+    def test_memory_limit(self):
+        """Check worker pool memory limit"""
+        with testutil.temp_working_dir() as d:
+            write_job_module(d.tmpdir)
+            sys.path.insert(0, d.tmpdir)
+            ws = DummyWebService()
+            ws.config.pool = {'workers': 1, 'max_tasks_per_worker': None,
+                              'memory_limit': None,
+                              'preload': []}
+            try:
+                r = PoolRunner('testpooljobs.use_memory')
+                r._run(ws)
+                e = wait_for_events(ws, 1)[0]
+                self.assertEqual(e.run_exception, None)
+                PoolRunner._close_pool()
+                ws.config.pool['memory_limit'] = 200 * 1024 ** 2
+                r = PoolRunner('testpooljobs.use_memory')
+                r._run(ws)
+                e = wait_for_events(ws, 1)[0]
+                self.assert_('MemoryError' in str(e.run_exception))
+            finally:
+                PoolRunner._close_pool()
+                del sys.path[0]
+
+    def test_worker_death(self):
+        """Check jobs whose worker process dies"""
+        with testutil.temp_working_dir() as d:
+            write_job_module(d.tmpdir)
+            sys.path.insert(0, d.tmpdir)
+            ws = DummyWebService()
+            try:
+                crashed = PoolRunner('testpooljobs.crash')._run(ws)
+                exited = PoolRunner('testpooljobs.exit')._run(ws)
+                ok = PoolRunner('testpooljobs.write_pid', ('out',))._run(ws)
+                events = dict((e.runid, e) for e in wait_for_events(ws, 3))
+                self.assert_(re.search('Worker process \d+ died',
+                                       str(events[crashed].run_exception)),
+                             str(events[crashed].run_exception))
+                self.assert_('SystemExit' in str(events[exited].run_exception))
+                self.assertEqual(events[ok].run_exception, None)
+                for runid in (crashed, exited, ok):
+                    self.assertEqual(PoolRunner._check_completed(runid, ''),
+                                     True)
+            finally:
+                PoolRunner._close_pool()
+                del sys.path[0]
+
+    def test_close_no_wait(self):
+        """Check stopping the pool without waiting for jobs"""
+        ws = DummyWebService()
+        ws.config.pool = {'workers': 1, 'max_tasks_per_worker': None,
+                          'memory_limit': None, 'preload': []}
+        with testutil.temp_working_dir() as d:
+            PoolRunner('time.sleep', (60,))._run(ws)
+            pool = PoolRunner._pool.pool
+            PoolRunner._close_pool(wait=False)
+            self.assertEqual(PoolRunner._pool, None)
+            self.assertEqual([p for p in pool._pool if p.is_alive()], [])
+
+if __name__ == '__main__':
+    unittest.main()
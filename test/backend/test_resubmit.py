@@ -9,18 +9,28 @@ class ResubmitTest(unittest.TestCase):
     def test_main(self):
         """Test resubmit main()"""
         class DummyJob(object):
+            name = 'testjob'
             def __init__(self, mod):
                 self.mod = mod
-            def resubmit(self):
+            def resubmit(self, notify):
                 self.mod.job_resub = True
+        class DummyDB(object):
+            def __init__(self, mod):
+                self.mod = mod
+            def _get_jobs(self, states, names, **keys):
+                if states == ['FAILED'] and 'testjob' in names:
+                    yield DummyJob(self.mod)
+            def _begin_batch(self):
+                pass
+            def _end_batch(self):
+                pass
+        class DummyConfig(object):
+            socket = '/not/exist'
         class DummyWebService(object):
             def __init__(self, mod):
                 self.mod = mod
-            def get_job_by_name(self, state, name):
-                if state == 'FAILED' and name == 'testjob':
-                    return DummyJob(self.mod)
-                else:
-                    return None
+                self.db = DummyDB(mod)
+                self.config = DummyConfig()
         class DummyModule(object):
             config = 'testconfig'
             job_resub = False
@@ -54,6 +64,69 @@ class ResubmitTest(unittest.TestCase):
             sys.argv = old
             sys.stderr = olderr
 
+    def test_bulk(self):
+        """Test resubmit of many jobs selected by user"""
+        class DummyJob(object):
+            def __init__(self, name):
+                self.name = name
+                self.resub = False
+            def resubmit(self, notify):
+                self.resub = True
+                self.notify = notify
+        class DummyDB(object):
+            batches = 0
+            def __init__(self):
+                self.jobs = [DummyJob('job%d' % i) for i in range(150)]
+            def _get_jobs(self, states, names, user, **keys):
+                self.states = states
+                if user == 'foo':
+                    return self.jobs
+                else:
+                    return []
+            def _begin_batch(self):
+                self.batches += 1
+            def _end_batch(self):
+                pass
+        class DummyConfig(object):
+            socket = '/not/exist'
+        class DummyWebService(object):
+            def __init__(self):
+                self.db = DummyDB()
+                self.config = DummyConfig()
+        class DummyModule(object):
+            config = 'testconfig'
+            def get_web_service(self, config):
+                self.web = DummyWebService()
+                return self.web
+
+        old = sys.argv
+        olderr = sys.stderr
+        try:
+            sio = StringIO.StringIO()
+            sys.stderr = sio
+            mod = DummyModule()
+            sys.argv = ['testprogram', '-u', 'bar']
+            main(mod)
+            self.assertEqual(sio.getvalue(), 'No matching jobs found\n')
+
+            sio = StringIO.StringIO()
+            sys.stderr = sio
+            mod = DummyModule()
+            sys.argv = ['testprogram', '-u', 'foo']
+            main(mod)
+            self.assertEqual(sio.getvalue(),
+                             'Resubmitted 100 of 150 jobs\n'
+                             'Resubmitted 150 of 150 jobs\n')
+            db = mod.web.db
+            self.assertEqual(db.states, ['FAILED'])
+            self.assertEqual(db.batches, 2)
+            for j in db.jobs:
+                self.assertEqual(j.resub, True)
+                self.assertEqual(j.notify, False)
+        finally:
+            sys.argv = old
+            sys.stderr = olderr
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,7 @@ from __future__ import print_function
 import unittest
 from StringIO import StringIO
 import saliweb.backend.events
-from saliweb.backend import SGERunner, SaliSGERunner, Job
+from saliweb.backend import SGERunner, SaliSGERunner, SGERouterRunner, Job
 import testutil
 import sys
 import re
@@ -10,6 +10,7 @@ import os
 import time
 import shutil
 import tempfile
+import subprocess
 
 class BrokenRunner(SGERunner):
     # Duplicate runner name, so it shouldn't work
@@ -25,6 +26,8 @@ class DummyDRMAASession(object):
     def jobStatus(self, jobid):
         if jobid == 'donejob':
             raise DummyDRMAAModule.InvalidJobException()
+        elif jobid == 'dummyJob.2':
+            raise DummyDRMAAModule.InvalidJobException()
         elif jobid == 'runningjob':
             return 'running'
         elif jobid == 'queuedjob':
@@ -92,6 +95,22 @@ echo foo
 echo "DONE" > ${_SALI_JOB_DIR}/job-state
 """
             self.assertEqual(sio.getvalue(), expected)
+            # Job should optionally notify the backend when it finishes
+            sio = StringIO()
+            r._write_sge_script(sio, '/test/socket')
+            last = sio.getvalue().split('\n')[-2]
+            self.assert_(last.startswith("python -c 'import socket"))
+            self.assert_(last.endswith(
+                    "/test/socket \"DONE %s:${JOB_ID}\" >& /dev/null || true"
+                    % r._runner_name), last)
+            # Compute nodes can also use a network socket
+            sio = StringIO()
+            r._write_sge_script(sio, ('testhost', 8123))
+            last = sio.getvalue().split('\n')[-2]
+            self.assert_('socket.create_connection' in last, last)
+            self.assert_(last.endswith(
+                    "testhost 8123 \"DONE %s:${JOB_ID}\" >& /dev/null || true"
+                    % r._runner_name), last)
 
     @testutil.run_in_tempdir
     def test_check_completed(self):
@@ -122,6 +141,9 @@ else:
         self.assertEqual(TestRunner._check_completed('runningbulk.1-10:1', ''),
                          False)
         self.assertEqual(TestRunner._check_completed('queuedjob', ''), False)
+        # Single tasks should be queried directly
+        self.assertEqual(TestRunner._check_completed('dummyJob.2-2:1', ''),
+                         True)
         self.assertEqual(TestRunner._check_completed('waitedjob', ''), False)
 
     def test_get_drmaa(self):
@@ -170,5 +192,102 @@ else:
         self.assertNotEqual(e2, None)
         self.assertEqual(e3, None)
 
+    def test_batch_key(self):
+        """Check SGERunner._get_batch_key()"""
+        def get_key(cls, opts='', interpreter='/bin/sh'):
+            r = cls('echo foo', interpreter=interpreter)
+            r.set_sge_options(opts)
+            return r._get_batch_key()
+        self.assertEqual(get_key(SGERunner, '-l diva1=1G'),
+                         (SGERunner, '/bin/sh', '-l diva1=1G'))
+        self.assertNotEqual(get_key(SGERunner), get_key(SaliSGERunner))
+        self.assertNotEqual(get_key(SGERunner),
+                            get_key(SGERunner, interpreter='/bin/csh'))
+        self.assertEqual(get_key(SGERunner, '-t 1-10'), None)
+        self.assertEqual(get_key(SGERunner, interpreter='/usr/bin/python'),
+                         None)
+        self.assertEqual(get_key(SGERouterRunner), None)
+
+    def _run_batch_task(self, script, batchdir, task):
+        # Run just the cleanup part of the batch script for the given task
+        cleanup = [x for x in open(script) if x.startswith(('rm', 'if'))]
+        env = {'SGE_TASK_ID': task, 'PATH': os.environ['PATH']}
+        p = subprocess.Popen(['/bin/sh'], stdin=subprocess.PIPE, cwd=batchdir,
+                             env=env)
+        p.communicate(''.join(cleanup))
+        self.assertEqual(p.returncode, 0)
+
+    @testutil.run_in_tempdir
+    def test_run_batch(self):
+        """Check SGERunner._run_batch()"""
+        class DummyConfig(object):
+            socket = '/test/socket'
+            directories = {'RUNNING': os.path.abspath('running')}
+            def _get_notify_address(self):
+                return self.socket
+        class DummyWebService(object):
+            def __init__(self):
+                self.config = DummyConfig()
+                self._event_queue = saliweb.backend.events._EventQueue()
+        ws = DummyWebService()
+        os.mkdir('running')
+        runners = []
+        for i in range(3):
+            os.mkdir('job%d' % i)
+            os.chdir('job%d' % i)
+            r = TestRunner('echo foo', interpreter=['/bin/sh', '/bin/csh'][i % 2])
+            r.set_sge_options('-l diva1=1G')
+            if i == 2:
+                r.set_sge_name('myjob')
+            runners.append(r)
+            os.chdir('..')
+        runids = TestRunner._run_batch(runners, ws)
+        self.assertEqual(runids, ['dummyJob.1-1:1', 'dummyJob.2-2:1',
+                                  'dummyJob.3-3:1'])
+        jt = DummyDRMAASession.deleted_template
+        self.assertEqual(jt.nativeSpecification, '-l diva1=1G -w n -b no')
+        # The array job should not run in (or write to) any job directory
+        batchdir = jt.workingDirectory
+        self.assertEqual(os.path.dirname(batchdir),
+                         ws.config.directories['RUNNING'])
+        self.assert_(os.path.basename(batchdir).startswith('.sge-batch-'))
+        self.assertEqual(jt.remoteCommand,
+                         os.path.join(batchdir, 'sge-batch.sh'))
+        self.assertEqual(sorted(os.listdir(os.path.join(batchdir, 'tasks'))),
+                         ['1', '2', '3'])
+        batch = open(jt.remoteCommand).read().split('\n')
+        self.assertEqual(batch[:6], ['#!/bin/sh', '#$ -S /bin/sh', '#$ -cwd',
+                                     '#$ -o /dev/null', '#$ -e /dev/null',
+                                     'case "$SGE_TASK_ID" in'])
+        self.assertEqual(batch[7],
+                   '2) (cd %s && /bin/csh sge-script.sh '
+                   '> sge-script.sh.o$JOB_ID 2> sge-script.sh.e$JOB_ID) ;;'
+                   % runners[1]._directory)
+        self.assert_(batch[8].endswith('> myjob.o$JOB_ID 2> myjob.e$JOB_ID) ;;'))
+        # The batch directory should be removed only by the last task to end
+        for task in ('2', '3'):
+            self._run_batch_task(jt.remoteCommand, batchdir, task)
+            self.assert_(os.path.exists(jt.remoteCommand))
+        self._run_batch_task(jt.remoteCommand, batchdir, '1')
+        self.assertFalse(os.path.exists(batchdir))
+        # Each job should report completion of its own task
+        for i in range(3):
+            script = open('job%d/sge-script.sh' % i).read().split('\n')
+            self.assert_(script[-2].endswith(
+                  '"DONE %s:${JOB_ID}.${SGE_TASK_ID}-${SGE_TASK_ID}:1" %s '
+                  '|| true' % (TestRunner._runner_name,
+                               ['> /dev/null 2>&1', '>& /dev/null'][i % 2])),
+                  script[-2])
+        # One completion event per job
+        events = []
+        for i in range(20):
+            e = ws._event_queue.get(timeout=0.1)
+            if e:
+                events.append(e)
+            if len(events) == 3:
+                break
+        self.assertEqual(sorted([(e.runid, e.runner) for e in events]),
+                         sorted(zip(runids, runners)))
+
 if __name__ == '__main__':
     unittest.main()
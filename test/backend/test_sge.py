@@ -103,6 +103,36 @@ class SGETest(unittest.TestCase):
                  "wait jobN.fail timeout forever",
                  'remove job dict jobN.1-2:1'])
 
+    def test_drmaa_waiter_error(self):
+        """Check _DRMAAJobWaiter handling of DRMAA errors"""
+        class DummyWebService(object):
+            def __init__(self):
+                self._event_queue = saliweb.backend.events._EventQueue()
+        class DummyDRMAASession(object):
+            def synchronize(self, jobids, timeout, cleanup):
+                raise ValueError("cannot contact qmaster")
+        class DummyRunner(object):
+            _waited_jobs = saliweb.backend._LockedJobDict()
+            @classmethod
+            def _get_drmaa(cls):
+                class Dummy(object): pass
+                drmaa = Dummy()
+                drmaa.Session = Dummy()
+                drmaa.Session.TIMEOUT_WAIT_FOREVER = 'forever'
+                return drmaa, DummyDRMAASession()
+        ws = DummyWebService()
+        w = _DRMAAJobWaiter(ws, ['jobN'], DummyRunner(), 'jobN')
+        w.start()
+        w.join()
+        e = ws._event_queue.get(timeout=0.)
+        # The job may still be running, so this should not be reported as
+        # a transient error (which would run the job again)
+        self.assert_(isinstance(e.run_exception, OSError))
+        self.assert_(not saliweb.backend._is_transient_error(
+                                                    e.run_exception))
+        self.assert_('cannot contact qmaster' in str(e.run_exception))
+        self.assert_('jobN' not in DummyRunner._waited_jobs)
+
     def test_drmaa_wrapper(self):
         """Check the _DRMAAWrapper class"""
         events = []
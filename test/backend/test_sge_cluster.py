@@ -0,0 +1,230 @@
+import unittest
+import time
+import os
+import sys
+import saliweb.backend
+import saliweb.backend.events
+import saliweb.backend.cluster
+from saliweb.backend import SGERunner, _LockedJobDict
+import testutil
+import fakesge
+
+
+class DummyConfig(object):
+    socket = None
+    def _get_notify_address(self):
+        return self.socket
+
+class DummyWebService(object):
+    def __init__(self):
+        self.config = DummyConfig()
+        self._event_queue = saliweb.backend.events._EventQueue()
+
+
+def make_runner_class(directory, **config):
+    """Make an SGERunner subclass that uses a simulated cluster"""
+    env, qstat = fakesge.make_fake_sge(directory, **config)
+    class TestRunner(SGERunner):
+        _env = env
+        _qstat = qstat
+        _drmaa = None
+        _waited_jobs = _LockedJobDict()
+    return TestRunner
+
+def wait_for_event(ws):
+    for i in range(100):
+        e = ws._event_queue.get(timeout=0.1)
+        if e is not None:
+            return e
+    raise AssertionError("Timed out waiting for job completion event")
+
+def wait_scripts(runner):
+    runner._get_drmaa()[1]._cluster.wait_scripts()
+
+
+class Test(unittest.TestCase):
+    """Check SGERunner against a simulated SGE cluster"""
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        if 'drmaa' in sys.modules:
+            del sys.modules['drmaa']
+
+    def test_run(self):
+        """Check running of jobs on the simulated cluster"""
+        with testutil.temp_working_dir() as d:
+            TestRunner = make_runner_class(d.tmpdir, time_scale=100.)
+            ws = DummyWebService()
+            r = TestRunner('echo foo')
+            r.set_sge_name('myjob')
+            runid = r._run(ws)
+            self.assertEqual(runid, '1')
+            e = wait_for_event(ws)
+            self.assertEqual(e.runid, '1')
+            self.assertEqual(e.run_exception, None)
+            wait_scripts(TestRunner)
+            self.assertEqual(open('job-state').read(), 'DONE\n')
+            self.assertEqual(open('myjob.o1').read(), 'foo\n')
+
+            # Array jobs
+            r = TestRunner('echo $SGE_TASK_ID > task$SGE_TASK_ID')
+            r.set_sge_options('-t 2-6:2')
+            runid = r._run(ws)
+            self.assertEqual(runid, '2.2-6:2')
+            e = wait_for_event(ws)
+            self.assertEqual(e.runid, '2.2-6:2')
+            wait_scripts(TestRunner)
+            for t in ('2', '4', '6'):
+                self.assertEqual(open('task' + t).read(), t + '\n')
+            self.assertEqual(fakesge.get_calls(d.tmpdir),
+                             ['runJob', 'runBulkJobs'])
+
+    def test_check_completed(self):
+        """Check SGERunner._check_completed() on the simulated cluster"""
+        with testutil.temp_working_dir() as d:
+            TestRunner = make_runner_class(d.tmpdir, time_scale=10.)
+            ws = DummyWebService()
+            r = TestRunner('echo foo')
+            r.set_sge_options('-t 1-3')
+            bulk = r._run(ws)
+            runid = TestRunner('echo foo')._run(ws)
+            # Use a new DRMAA session, as if the backend were restarted
+            class RestartedRunner(TestRunner):
+                _drmaa = None
+                _waited_jobs = _LockedJobDict()
+            self.assertEqual(RestartedRunner._check_completed(bulk, ''), False)
+            self.assertEqual(RestartedRunner._check_completed('1.2-2:1', ''),
+                             False)
+            self.assertEqual(RestartedRunner._check_completed(runid, ''),
+                             False)
+            self.assertEqual(RestartedRunner._check_completed('20', ''), True)
+            self.assertEqual(RestartedRunner._check_completed('20.1-4:1', ''),
+                             True)
+            for i in range(2):
+                wait_for_event(ws)
+            self.assertEqual(RestartedRunner._check_completed(bulk, ''), True)
+            self.assertEqual(RestartedRunner._check_completed('1.2-2:1', ''),
+                             True)
+            self.assertEqual(RestartedRunner._check_completed(runid, ''), True)
+            calls = fakesge.get_calls(d.tmpdir)
+            self.assertEqual(calls.count('qstat'), 3)
+            self.assertEqual(calls.count('jobStatus'), 5)
+
+    def test_drmaa(self):
+        """Check the simulated DRMAA session"""
+        with testutil.temp_working_dir() as d:
+            TestRunner = make_runner_class(d.tmpdir, duration=[1000., 1000.])
+            drmaa, s = TestRunner._get_drmaa()
+            jt = s.createJobTemplate()
+            jt.remoteCommand = 'test.sh'
+            jt.workingDirectory = d.tmpdir
+            jobid = s.runJob(jt)
+            self.assertEqual(s.jobStatus(jobid), drmaa.JobState.RUNNING)
+            self.assertRaises(drmaa.ExitTimeoutException, s.wait, jobid, 0.01)
+            s.control(jobid, drmaa.JobControlAction.TERMINATE)
+            info = s.wait(jobid, drmaa.Session.TIMEOUT_WAIT_FOREVER)
+            self.assertEqual(info.jobId, jobid)
+            self.assert_(info.wasAborted)
+            self.assertFalse(info.hasExited)
+            # Jobs can only be waited for once
+            self.assertRaises(drmaa.InvalidJobException, s.wait, jobid)
+            self.assertRaises(drmaa.InvalidJobException, s.jobStatus, jobid)
+            self.assertRaises(drmaa.InvalidJobException, s.jobStatus, '42')
+
+    def test_node_failure(self):
+        """Check that node failures kill running tasks"""
+        with testutil.temp_working_dir() as d:
+            TestRunner = make_runner_class(d.tmpdir, nodes=1, node_mtbf=1.,
+                                           node_repair=1., time_scale=1000.,
+                                           duration=[1000., 1000.])
+            ws = DummyWebService()
+            r = TestRunner('echo foo')
+            r.set_sge_options('-t 1-3')
+            runid = r._run(ws)
+            e = wait_for_event(ws)
+            self.assertEqual(e.runid, runid)
+            # Task scripts should not have been run
+            wait_scripts(TestRunner)
+            self.assertFalse(os.path.exists('job-state'))
+            self.assertEqual(TestRunner._check_completed(runid, ''), True)
+            c = TestRunner._get_drmaa()[1]._cluster
+            for t in ('1.1', '1.2', '1.3'):
+                self.assertEqual(c.tasks[t].state, 'failed')
+                self.assert_(c.tasks[t].aborted)
+
+    def test_qmaster(self):
+        """Check simulation of a slow or unavailable qmaster"""
+        with testutil.temp_working_dir() as d:
+            for sub in ('slow', 'timeout', 'down'):
+                os.mkdir(sub)
+            TestRunner = make_runner_class(os.path.join(d.tmpdir, 'slow'),
+                                           qmaster_delay=0.1)
+            start = time.time()
+            self.assertEqual(TestRunner._check_completed('1', ''), True)
+            self.assert_(time.time() - start >= 0.1)
+
+            TestRunner = make_runner_class(os.path.join(d.tmpdir, 'timeout'),
+                                           qmaster_delay=0.1,
+                                           qmaster_timeout=0.01)
+            try:
+                TestRunner._check_completed('1', '')
+                self.fail("DrmCommunicationException not raised")
+            except fakesge.DrmCommunicationException as detail:
+                self.assert_(saliweb.backend._is_status_error(detail))
+            self.assertRaises(OSError, TestRunner._check_completed,
+                              '1.1-2:1', '')
+
+            TestRunner = make_runner_class(os.path.join(d.tmpdir, 'down'),
+                                           qmaster_outages=[[0., 1000.]])
+            r = TestRunner('echo foo')
+            try:
+                r._run(DummyWebService())
+                self.fail("DrmCommunicationException not raised")
+            except fakesge.DrmCommunicationException as detail:
+                self.assert_(saliweb.backend._is_transient_error(detail))
+
+    def test_qstat(self):
+        """Check the simulated qstat command"""
+        with testutil.temp_working_dir() as d:
+            env, qstat = fakesge.make_fake_sge(d.tmpdir, nodes=1,
+                                               slots_per_node=1,
+                                               duration=[100., 100.])
+            c = fakesge.Cluster(os.path.join(d.tmpdir, 'fakesge'))
+            c.submit('test.sh', d.tmpdir, 'test', (1, 3, 1))
+            cell = saliweb.backend.cluster._Cell('test', env, qstat)
+            pending, wait = cell._query_load()
+            self.assertEqual(pending, 2)
+            self.assert_(wait < 5.)
+
+    def test_simulation(self):
+        """Check the cluster simulation"""
+        with testutil.temp_working_dir() as d:
+            fakesge.make_fake_sge(d.tmpdir, nodes=2, slots_per_node=2,
+                                  queue_delay=[5., 5.], duration=[10., 20.])
+            statedir = os.path.join(d.tmpdir, 'fakesge')
+            c = fakesge.Cluster(statedir)
+            c.submit('/bin/true', d.tmpdir, 'test', (1, 10, 1))
+            tasks = [c.tasks['1.%d' % i] for i in range(1, 11)]
+            c.advance(4.)
+            self.assertEqual([t.state for t in tasks], ['qw'] * 10)
+            c.advance(6.)
+            # Only as many tasks as there are slots should run
+            self.assertEqual([t.state for t in tasks], ['r'] * 4 + ['qw'] * 6)
+            c.advance(1000.)
+            self.assertEqual([t.state for t in tasks], ['done'] * 10)
+            self.assertEqual(c.unfinished, 0)
+            for t in tasks:
+                self.assert_(10. <= t.end - t.start <= 20.)
+                running = [u for u in tasks if u.start <= t.start < u.end]
+                self.assert_(len(running) <= 4)
+            # A new simulation of the same cluster should give the same
+            # results
+            c2 = fakesge.Cluster(statedir)
+            c2.advance(1000.)
+            self.assertEqual([(t.start, t.end, t.node) for t in tasks],
+                             [(c2.tasks[t.get_id()].start,
+                               c2.tasks[t.get_id()].end,
+                               c2.tasks[t.get_id()].node) for t in tasks])
+
+if __name__ == '__main__':
+    unittest.main()
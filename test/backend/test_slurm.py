@@ -0,0 +1,164 @@
+from __future__ import print_function
+import unittest
+from StringIO import StringIO
+import os
+import saliweb.backend.events
+import saliweb.backend.slurm
+from saliweb.backend import SlurmRunner, RunnerError
+import testutil
+import fakeslurm
+
+
+class DummyConfig(object):
+    socket = None
+    def _get_notify_address(self):
+        return self.socket
+
+class DummyWebService(object):
+    def __init__(self):
+        self.config = DummyConfig()
+        self._event_queue = saliweb.backend.events._EventQueue()
+
+
+def make_runner_class(directory):
+    """Make a SlurmRunner subclass that uses fake Slurm commands"""
+    cmds = fakeslurm.make_fake_slurm(directory)
+    class TestRunner(SlurmRunner):
+        _sbatch = cmds['sbatch']
+        _squeue = cmds['squeue']
+        _sacct = cmds['sacct']
+        _poll_interval = 0.05
+        _queue = None
+        _poller = None
+    return TestRunner
+
+def get_calls(directory):
+    return open(os.path.join(directory, 'fakeslurm', 'calls')).read().split()
+
+def wait_for_event(ws):
+    for i in range(100):
+        e = ws._event_queue.get(timeout=0.1)
+        if e is not None:
+            return e
+    raise AssertionError("Timed out waiting for job completion event")
+
+
+class Test(unittest.TestCase):
+    """Check SlurmRunner class"""
+
+    def test_generate_script(self):
+        """Check that SlurmRunner generates reasonable scripts"""
+        r = SlurmRunner('echo foo')
+        sio = StringIO()
+        r._write_slurm_script(sio)
+        self.assertEqual(sio.getvalue(), """#!/bin/sh
+_SALI_JOB_DIR=`pwd`
+echo "STARTED" > ${_SALI_JOB_DIR}/job-state
+echo foo
+echo "DONE" > ${_SALI_JOB_DIR}/job-state
+""")
+        r = SlurmRunner('echo foo', interpreter='/bin/csh')
+        r.set_slurm_tasks('2-10:2')
+        sio = StringIO()
+        r._write_slurm_script(sio, '/test/socket')
+        lines = sio.getvalue().split('\n')
+        self.assertEqual(lines[1], 'setenv SGE_TASK_ID $SLURM_ARRAY_TASK_ID')
+        self.assert_(lines[-2].endswith(
+             '/test/socket "DONE slurm:${SLURM_ARRAY_JOB_ID}" >& /dev/null '
+             '|| true'), lines[-2])
+        r = SlurmRunner('echo foo', interpreter='/usr/bin/python')
+        sio = StringIO()
+        r._write_slurm_script(sio, '/test/socket')
+        self.assertEqual(sio.getvalue(), "#!/usr/bin/python\necho foo\n")
+
+    def test_options(self):
+        """Check SlurmRunner options"""
+        r = SlurmRunner('echo foo')
+        r.set_slurm_name('test\t job ')
+        self.assertEqual(r._name, 'testjob')
+        r.set_slurm_options('--mem=1G  --time=1:00:00')
+        self.assertEqual(r._opts, ['--mem=1G', '--time=1:00:00'])
+        self.assertRaises(ValueError, r.set_slurm_tasks, 'garbage')
+
+    def test_run(self):
+        """Check running of Slurm jobs"""
+        with testutil.temp_working_dir() as d:
+            TestRunner = make_runner_class(d.tmpdir)
+            ws = DummyWebService()
+            r = TestRunner('echo foo')
+            r.set_slurm_name('myjob')
+            runid = r._run(ws)
+            self.assertEqual(runid, '1')
+            self.assert_(os.path.exists('slurm-script.sh'))
+            e = wait_for_event(ws)
+            self.assertEqual(e.runid, '1')
+            self.assertEqual(e.runner, r)
+            self.assertEqual(e.run_exception, None)
+            self.assertEqual(open('job-state').read(), 'DONE\n')
+
+            # Array jobs
+            r = TestRunner('echo $SGE_TASK_ID > task$SGE_TASK_ID')
+            r.set_slurm_tasks('2-6:2')
+            runid = r._run(ws)
+            self.assertEqual(runid, '2.2-6:2')
+            e = wait_for_event(ws)
+            self.assertEqual(e.runid, '2.2-6:2')
+            self.assertEqual(e.run_exception, None)
+            for t in ('2', '4', '6'):
+                self.assertEqual(open('task' + t).read(), t + '\n')
+
+            # Failed jobs
+            r = TestRunner('exit 1')
+            runid = r._run(ws)
+            e = wait_for_event(ws)
+            self.assertEqual(e.runid, '3')
+            self.assert_(isinstance(e.run_exception, RunnerError))
+            self.assert_('3 (FAILED)' in str(e.run_exception))
+
+            # Failure to submit
+            r = TestRunner('echo foo')
+            r._directory = os.path.join(d.tmpdir, 'not-exist')
+            self.assertRaises(RunnerError, r._submit, 'not-exist.sh', ws)
+
+    def test_check_completed(self):
+        """Check SlurmRunner._check_completed()"""
+        with testutil.temp_working_dir() as d:
+            TestRunner = make_runner_class(d.tmpdir)
+            # Don't let the poller take squeue snapshots
+            TestRunner._poll_interval = 60.
+            ws = DummyWebService()
+            r = TestRunner('sleep 2')
+            runid = r._run(ws)
+            self.assertEqual(TestRunner._check_completed(runid, ''), False)
+            # Forget about waiting for the job, as if we were restarted
+            TestRunner._waited_jobs.remove(runid)
+            TestRunner._poller._jobs = {}
+            self.assertEqual(TestRunner._check_completed(runid, ''), False)
+            self.assertEqual(TestRunner._check_completed('20', ''), True)
+            self.assertEqual(TestRunner._check_completed('21.1-4:1', ''),
+                             True)
+            # Only one squeue snapshot should have been taken
+            self.assertEqual(get_calls(d.tmpdir).count('squeue'), 1)
+            TestRunner._queue.ttl = 0.
+            self.assertEqual(TestRunner._check_completed('20', ''), True)
+            self.assertEqual(get_calls(d.tmpdir).count('squeue'), 2)
+
+    def test_get_finished_jobs(self):
+        """Check parsing of sacct output"""
+        with testutil.temp_working_dir() as d:
+            fh = open('sacct', 'w')
+            fh.write("""#!/bin/sh
+echo "1|COMPLETED"
+echo "2_1|COMPLETED"
+echo "2_2|CANCELLED by 1000"
+echo "3|COMPLETING"
+echo "garbage"
+""")
+            fh.close()
+            os.chmod('sacct', 0755)
+            f = saliweb.backend.slurm._get_finished_jobs(
+                      os.path.join(d.tmpdir, 'sacct'), ['1', '2', '3', '4'])
+            self.assertEqual(f, {'1': [], '2': ['2_2 (CANCELLED)'], '4': []})
+
+if __name__ == '__main__':
+    unittest.main()
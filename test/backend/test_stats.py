@@ -0,0 +1,71 @@
+import unittest
+import datetime
+from saliweb.backend.stats import _DaemonStats, _Latency
+
+
+class Test(unittest.TestCase):
+    """Check statistics kept by the backend daemon"""
+
+    def test_latency(self):
+        """Check the _Latency class"""
+        lat = _Latency(size=2)
+        self.assertEqual(lat.get(), {'count': 0, 'mean': None, 'max': None})
+        for t in (10., 1., 3.):
+            lat.add(t)
+        # Only the most recent times should be kept
+        self.assertEqual(lat.get(), {'count': 3, 'mean': 2., 'max': 3.})
+
+    def test_states(self):
+        """Check tracking of job states"""
+        s = _DaemonStats()
+        old = datetime.datetime.utcnow() - datetime.timedelta(seconds=60)
+        s.reset({'RUNNING': 1, 'COMPLETED': 4}, [('job1', 'foo')],
+                [('job2', old)])
+        s.job_incoming('job3')
+        s.job_state_changed('job2', 'bar', 'INCOMING', 'PREPROCESSING')
+        s.job_state_changed('job2', 'bar', 'PREPROCESSING', 'RUNNING')
+        snap = s.snapshot(5)
+        self.assertEqual(snap['queue_depth'], 5)
+        self.assertEqual(snap['states'], {'INCOMING': 1, 'PREPROCESSING': 0,
+                                          'RUNNING': 2, 'COMPLETED': 4})
+        self.assertEqual(snap['running_users'], {'foo': 1, 'bar': 1})
+        self.assert_(snap['oldest_incoming'] < 10.)
+        s.job_deleted('job1', 'RUNNING')
+        s.job_deleted('job3', 'INCOMING')
+        snap = s.snapshot(0)
+        self.assertEqual(snap['states']['RUNNING'], 1)
+        self.assertEqual(snap['running_users'], {'bar': 1})
+        self.assertEqual(snap['oldest_incoming'], None)
+        # Submit time from the database should override the notify time
+        s.job_incoming('job4')
+        s.job_incoming('job4', old)
+        self.assert_(s.snapshot(0)['oldest_incoming'] >= 60.)
+
+    def test_hooks(self):
+        """Check tracking of running hooks"""
+        s = _DaemonStats()
+        t1 = s.hook_started('job1', 'preprocess')
+        t2 = s.hook_started('job2', 'postprocess')
+        self.assertNotEqual(t1, t2)
+        hooks = s.snapshot(0)['hooks']
+        self.assertEqual(sorted((h['job'], h['hook']) for h in hooks),
+                         [('job1', 'preprocess'), ('job2', 'postprocess')])
+        s.hook_finished(t1)
+        hooks = s.snapshot(0)['hooks']
+        self.assertEqual([h['job'] for h in hooks], ['job2'])
+
+    def test_events(self):
+        """Check counting of events and latencies"""
+        s = _DaemonStats()
+        s.event_processed()
+        s.event_processed()
+        s.add_latency('submit', 2.)
+        s.add_latency('poll', 0.5)
+        snap = s.snapshot(0)
+        self.assertEqual(snap['events'], 2)
+        self.assertEqual(snap['latency']['submit']['max'], 2.)
+        self.assertEqual(snap['latency']['poll']['count'], 1)
+        self.assert_(snap['uptime'] >= 0.)
+
+if __name__ == '__main__':
+    unittest.main()
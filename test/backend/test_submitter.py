@@ -0,0 +1,132 @@
+import unittest
+import threading
+import time
+import sys
+import saliweb.backend.events
+from saliweb.backend import SGERunner
+from saliweb.backend.submitter import _Submitter, _SubmittedJobEvent
+
+
+class DummyRunner(object):
+    _runner_name = 'dummy'
+    def __init__(self, runid, event=None):
+        self.runid = runid
+        self.event = event
+    def _run(self, webservice):
+        if self.event:
+            self.event.wait()
+        if self.runid == 'fail':
+            raise ValueError("qmaster is down")
+        return self.runid
+
+class DummyWebService(object):
+    def __init__(self):
+        self._event_queue = saliweb.backend.events._EventQueue()
+        self.submitted = []
+        self.latency = []
+    def _add_latency(self, kind, start):
+        self.latency.append(kind)
+    def _job_submitted(self, name, runner, runid, exception):
+        self.submitted.append((name, runid, exception))
+
+class DummyDRMAA(object):
+    class AlreadyActiveSession(Exception): pass
+    class Session(object):
+        initialized = 0
+        def initialize(self):
+            if DummyDRMAA.Session.initialized:
+                raise DummyDRMAA.AlreadyActiveSession()
+            time.sleep(0.1)
+            DummyDRMAA.Session.initialized += 1
+        def exit(self): pass
+
+class DRMAARunner(SGERunner):
+    def _run(self, webservice):
+        drmaa, s = self._get_drmaa()
+        return self._script
+
+def get_event(ws):
+    e = ws._event_queue.get(timeout=5.)
+    if e is None:
+        raise AssertionError("Timed out waiting for submission event")
+    return e
+
+
+class Test(unittest.TestCase):
+    """Check background submission of runners"""
+
+    def test_submit(self):
+        """Check submission of runners in background threads"""
+        ws = DummyWebService()
+        s = _Submitter(ws, 2, 10)
+        s.submit('job1', DummyRunner('100'))
+        e = get_event(ws)
+        self.assert_(isinstance(e, _SubmittedJobEvent))
+        e.process()
+        self.assertEqual(ws.submitted, [('job1', '100', None)])
+        self.assertEqual(ws.latency, ['submit'])
+        self.assertEqual(s.submitted(e.runner, e.runid), None)
+        s.submit('job2', DummyRunner('fail'))
+        e = get_event(ws)
+        self.assertEqual(e.runid, None)
+        self.assert_(isinstance(e.exception, ValueError))
+
+    def test_slow_submit(self):
+        """Check that a slow submission does not hold up others"""
+        ws = DummyWebService()
+        s = _Submitter(ws, 2, 10)
+        slow = threading.Event()
+        s.submit('slow', DummyRunner('1', slow))
+        s.submit('fast', DummyRunner('2'))
+        self.assertEqual(get_event(ws).name, 'fast')
+        slow.set()
+        self.assertEqual(get_event(ws).name, 'slow')
+
+    def test_window(self):
+        """Check the limit on submissions in flight"""
+        ws = DummyWebService()
+        s = _Submitter(ws, 1, 2)
+        self.assertEqual(s.is_full(), False)
+        s.submit('job1', DummyRunner('1'))
+        s.submit('job2', DummyRunner('2'))
+        self.assertEqual(s.is_full(), True)
+        e = get_event(ws)
+        # Still full until the event loop has processed the event
+        self.assertEqual(s.is_full(), True)
+        s.submitted(e.runner, e.runid)
+        self.assertEqual(s.is_full(), False)
+
+    def test_early_completion(self):
+        """Check jobs that finish before their submission is processed"""
+        ws = DummyWebService()
+        s = _Submitter(ws, 1, 10)
+        r = DummyRunner('1')
+        s.submit('job1', r)
+        e = get_event(ws)
+        completed = saliweb.backend.events._CompletedJobEvent(ws, r, '1',
+                                                              None)
+        s.defer_completion(completed)
+        self.assertEqual(s.submitted(e.runner, e.runid), completed)
+        # Completions are not kept if nothing is being submitted
+        s.defer_completion(completed)
+        self.assertEqual(s._early_completions, {})
+
+    def test_concurrent_drmaa(self):
+        """Check that DRMAA is started up only once by several threads"""
+        sys.modules['drmaa'] = DummyDRMAA()
+        try:
+            ws = DummyWebService()
+            s = _Submitter(ws, 4, 10)
+            for i in range(8):
+                s.submit('job%d' % i, DRMAARunner(str(i)))
+            events = [get_event(ws) for i in range(8)]
+            self.assertEqual([e.exception for e in events], [None] * 8)
+            self.assertEqual(sorted(e.runid for e in events),
+                             [str(i) for i in range(8)])
+            self.assertEqual(DummyDRMAA.Session.initialized, 1)
+        finally:
+            DRMAARunner._drmaa = None
+            del sys.modules['drmaa']
+
+if __name__ == '__main__':
+    unittest.main()
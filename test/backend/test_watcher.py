@@ -0,0 +1,98 @@
+import unittest
+import os
+import time
+import saliweb.backend.events
+import saliweb.backend.watcher
+from saliweb.backend.watcher import _get_watcher, _InotifyWatcher, \
+                                    _PollingWatcher, _JobStateDoneEvent
+import testutil
+
+class DummyWebService(object):
+    def __init__(self):
+        self._event_queue = saliweb.backend.events._EventQueue()
+    def _job_state_done(self, name):
+        self.done = name
+
+def write_state(directory, state):
+    with open(os.path.join(directory, 'job-state'), 'w') as fh:
+        fh.write(state + '\n')
+
+class WatcherTest(unittest.TestCase):
+    """Check watching of job-state files"""
+
+    def test_job_state_done_event(self):
+        """Check the _JobStateDoneEvent class"""
+        ws = DummyWebService()
+        e = _JobStateDoneEvent(ws, 'job1')
+        e.process()
+        self.assertEqual(ws.done, 'job1')
+
+    def check_watcher(self, w, ws, tmpdir):
+        job1 = os.path.join(tmpdir, 'job1')
+        job2 = os.path.join(tmpdir, 'job2')
+        os.mkdir(job1)
+        os.mkdir(job2)
+        # job2 already finished before we started watching
+        write_state(job2, 'DONE')
+        w.start()
+        w.watch('job1', job1)
+        w.watch('job2', job2)
+        e = ws._event_queue.get(timeout=5.)
+        self.assertEqual(e.name, 'job2')
+        write_state(job1, 'STARTED')
+        time.sleep(0.1)
+        self.assertEqual(ws._event_queue.get(timeout=0.), None)
+        write_state(job1, 'DONE')
+        e = ws._event_queue.get(timeout=5.)
+        self.assert_(isinstance(e, _JobStateDoneEvent))
+        self.assertEqual(e.name, 'job1')
+        for d in (job1, job2):
+            os.unlink(os.path.join(d, 'job-state'))
+            os.rmdir(d)
+
+    def test_inotify(self):
+        """Check _InotifyWatcher"""
+        with testutil.temp_working_dir() as d:
+            tmpdir = d.tmpdir
+            ws = DummyWebService()
+            try:
+                w = _InotifyWatcher(ws)
+            except (OSError, AttributeError):
+                return # inotify not available on this system
+            self.check_watcher(w, ws, tmpdir)
+            # Directory moves should drop the watch
+            d = os.path.join(tmpdir, 'job3')
+            os.mkdir(d)
+            w.watch('job3', d)
+            os.rename(d, d + '.moved')
+            for i in range(100):
+                if 'job3' not in w._names:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(w._names, {})
+            os.rmdir(d + '.moved')
+
+    def test_polling(self):
+        """Check _PollingWatcher"""
+        with testutil.temp_working_dir() as d:
+            tmpdir = d.tmpdir
+            ws = DummyWebService()
+            w = _PollingWatcher(ws, 0.01)
+            self.check_watcher(w, ws, tmpdir)
+            self.assertEqual(w._jobs, {})
+            w.stop()
+            w.join()
+
+    def test_get_watcher(self):
+        """Check _get_watcher()"""
+        with testutil.temp_working_dir() as d:
+            tmpdir = d.tmpdir
+            ws = DummyWebService()
+            w = _get_watcher(ws, tmpdir, 10.)
+            self.assert_(isinstance(w, (_InotifyWatcher, _PollingWatcher)))
+            # Should fall back to polling if the directory does not exist
+            w = _get_watcher(ws, os.path.join(tmpdir, 'garbage'), 10.)
+            self.assert_(isinstance(w, _PollingWatcher))
+
+if __name__ == '__main__':
+    unittest.main()
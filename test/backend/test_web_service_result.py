@@ -1,40 +1,179 @@
 import unittest
 import os
+import re
 import StringIO
-import urllib
+import hashlib
+import threading
+import BaseHTTPServer
+import SocketServer
+import urllib2
+import saliweb.backend
+import saliweb.web_service
 from saliweb.backend import SaliWebServiceResult
+import testutil
 
 testurl = 'http://modbase.compbio.ucsf.edu/modloop/job/job_279120/' + \
           'output.pdb?passwd=oGHxb7R3xy'
 
-def dummy_urlopen(url):
-    return StringIO.StringIO('dummy')
+# Binary file contents, larger than a single chunk
+test_data = ''.join(chr(i % 256) for i in range(200000))
+
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve test_data, with support for Range requests. Files with 'flaky'
+       in their name are cut off half way through the first time."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if 'missing' in self.path:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.server.ranges.append(self.headers.get('Range'))
+        start = 0
+        m = re.match('bytes=(\d+)-', self.headers.get('Range') or '')
+        if m:
+            start = int(m.group(1))
+            if start >= len(test_data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d'
+                                 % len(test_data))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d'
+                             % (start, len(test_data) - 1, len(test_data)))
+        else:
+            self.send_response(200)
+        body = test_data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if 'flaky' in self.path and self.path not in self.server.flaked:
+            self.server.flaked.append(self.path)
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = 1
+        else:
+            self.wfile.write(body)
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           MockHandler)
+        self.ranges = []
+        self.flaked = []
 
 
 class Test(unittest.TestCase):
     """Test the SaliWebServiceResult class."""
 
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.server = MockServer()
+        t = threading.Thread(target=self.server.serve_forever,
+                             kwargs={'poll_interval': 0.01})
+        t.setDaemon(True)
+        t.start()
+        self.top = 'http://%s:%d' % self.server.server_address
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.shutdown()
+        self.server.server_close()
+        saliweb.web_service._pool.clear()
+
     def test_get_filename(self):
         """Test get_filename() method"""
         r = SaliWebServiceResult(testurl)
         self.assertEqual(r.get_filename(), 'output.pdb')
 
+    @testutil.run_in_tempdir
     def test_download(self):
         """Test download() method"""
-        r = SaliWebServiceResult('http://modbase.compbio.ucsf.edu/modloop/' \
-                                 'job/job_279120/output.pdb?passwd=oGHxb7R3xy')
-        old = urllib.urlopen
+        r = SaliWebServiceResult(self.top + '/job/job_279120/output.pdb'
+                                 '?passwd=oGHxb7R3xy')
+        sio = StringIO.StringIO()
+        self.assertEqual(r.download(fh=sio), None)
+        self.assertEqual(sio.getvalue(), test_data)
+        self.assertEqual(r.download(), os.path.join(os.getcwd(),
+                                                    'output.pdb'))
+        self.assertEqual(open('output.pdb', 'rb').read(), test_data)
+        self.assertFalse(os.path.exists('output.pdb.part'))
+        os.unlink('output.pdb')
+
+    @testutil.run_in_tempdir
+    def test_download_job_directory(self):
+        """Test download() into the job directory"""
+        os.mkdir('jobdir')
+        r = SaliWebServiceResult(self.top + '/output.pdb')
+        context = saliweb.backend._JobContext(os.path.abspath('jobdir'), None)
+        saliweb.backend._current_job_context.context = context
         try:
-            urllib.urlopen = dummy_urlopen
-            sio = StringIO.StringIO()
-            r.download(fh=sio)
-            self.assertEqual(sio.getvalue(), 'dummy')
             r.download()
-            r = open('output.pdb').read()
-            self.assertEqual(r, 'dummy')
-            os.unlink('output.pdb')
         finally:
-            urllib.urlopen = old
+            saliweb.backend._current_job_context.context = None
+        self.assertEqual(open('jobdir/output.pdb', 'rb').read(), test_data)
+
+    @testutil.run_in_tempdir
+    def test_download_resume(self):
+        """Test resuming of interrupted downloads"""
+        r = SaliWebServiceResult(self.top + '/flaky.pdb')
+        r.download()
+        self.assertEqual(open('flaky.pdb', 'rb').read(), test_data)
+        self.assertEqual(self.server.ranges, [None, 'bytes=100000-'])
+        # Partial file left by an earlier run should be continued
+        open('output.pdb.part', 'wb').write(test_data[:1000])
+        r = SaliWebServiceResult(self.top + '/output.pdb')
+        r.download()
+        self.assertEqual(open('output.pdb', 'rb').read(), test_data)
+        self.assertEqual(self.server.ranges[-1], 'bytes=1000-')
+        # Complete partial file
+        open('output.pdb.part', 'wb').write(test_data)
+        r.download()
+        self.assertEqual(open('output.pdb', 'rb').read(), test_data)
+        # Partial file that is too big should be replaced
+        open('output.pdb.part', 'wb').write(test_data + 'garbage')
+        r.download()
+        self.assertEqual(open('output.pdb', 'rb').read(), test_data)
+        self.assertRaises(urllib2.HTTPError,
+                          SaliWebServiceResult(self.top + '/missing').download)
+
+    @testutil.run_in_tempdir
+    def test_download_checksum(self):
+        """Test checksum verification of downloads"""
+        good = 'md5:' + hashlib.md5(test_data).hexdigest()
+        r = SaliWebServiceResult(self.top + '/output.pdb')
+        r.download(checksum=good)
+        self.assertRaises(IOError, r.download, checksum='md5:1234')
+        self.assertFalse(os.path.exists('output.pdb.part'))
+        self.assertRaises(IOError, r.download, fh=StringIO.StringIO(),
+                          checksum='md5:1234')
+        self.assertRaises(ValueError, r.download, checksum='garbage')
+
+    @testutil.run_in_tempdir
+    def test_download_all(self):
+        """Test download_all() method"""
+        results = [SaliWebServiceResult(self.top + '/out%d.pdb' % i)
+                   for i in range(6)]
+        results.append(SaliWebServiceResult(self.top + '/flaky.pdb'))
+        fnames = SaliWebServiceResult.download_all(results, directory='.',
+                         max_workers=3,
+                         checksums={'out1.pdb': 'md5:'
+                                       + hashlib.md5(test_data).hexdigest()})
+        self.assertEqual([os.path.basename(f) for f in fnames],
+                         ['out%d.pdb' % i for i in range(6)] + ['flaky.pdb'])
+        for f in fnames:
+            self.assertEqual(open(f, 'rb').read(), test_data)
+        results.append(SaliWebServiceResult(self.top + '/missing'))
+        self.assertRaises(urllib2.HTTPError,
+                          SaliWebServiceResult.download_all, results)
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,7 @@ import time
 import os
 from saliweb.backend import SaliWebServiceRunner
 import saliweb
+import saliweb.web_service
 import saliweb.backend.events
 import testutil
 
@@ -20,14 +21,22 @@ class DummyWebService(object):
 class DummyModule(object):
     def __init__(self):
         self.get_results_counter = 0
-    def submit_job(self, url, args):
+        self.cache_enabled = False
+    def enable_cache(self):
+        self.cache_enabled = True
+    def submit_job(self, url, args, directory=None):
         self.url = url
         self.args = args
+        self.directory = directory
         return 'jobid'
     def get_results(self, url):
         self.get_results_counter += 1
         if self.get_results_counter > 2:
             return ['http://foo/result1', 'http://foo/result2']
+    def iter_results(self, url):
+        results = self.get_results(url)
+        if results is not None:
+            return iter(results)
 
 
 class Test(unittest.TestCase):
@@ -37,16 +46,20 @@ class Test(unittest.TestCase):
         """Check that SaliWebServiceRunner runs jobs"""
         oldin = saliweb.backend._SaliWebJobWaiter._start_interval
         old = saliweb.web_service
+        oldcache = SaliWebServiceRunner._cache_enabled
         dm = DummyModule()
         try:
             saliweb.backend._SaliWebJobWaiter._start_interval = 0.01
             saliweb.web_service = dm
+            SaliWebServiceRunner._cache_enabled = False
             ws = DummyWebService()
             with testutil.temp_working_dir() as d:
                 r = SaliWebServiceRunner('testurl', ['arg1', 'arg2'])
                 os.chdir(d.origdir)
                 url = r._run(ws)
                 self.assertEqual(url, 'jobid')
+                # Files should be uploaded from the job directory
+                self.assertEqual(dm.directory, d.tmpdir)
                 event1 = ws._event_queue.get()
                 self.assertEqual(event1.run_exception, None)
                 self.assertEqual(event1.runid, 'jobid')
@@ -57,12 +70,14 @@ class Test(unittest.TestCase):
                     if 'jobid' not in SaliWebServiceRunner._waited_jobs:
                         break
                     time.sleep(0.05)
+                self.assertTrue(dm.cache_enabled)
                 res = SaliWebServiceRunner._check_completed(url, d.tmpdir)
                 self.assertEqual(len(res), 2)
                 state = open(os.path.join(d.tmpdir, 'job-state')).read()
                 self.assertEqual(state, 'DONE')
         finally:
             saliweb.web_service = old
+            SaliWebServiceRunner._cache_enabled = oldcache
             saliweb.backend._SaliWebJobWaiter._start_interval = oldin
 
 if __name__ == '__main__':
@@ -6,40 +6,127 @@ import urllib2
 import os
 import sys
 import time
+import threading
+import socket
+import cgi
+import BaseHTTPServer
+import SocketServer
 from saliweb import web_service
-from xml.dom.minidom import parseString
 import xml.parsers.expat
 import subprocess
 from cStringIO import StringIO
 
-class MockURL(object):
-    ns = 'xmlns:xlink="http://www.w3.org/1999/xlink"'
-    def __init__(self, url):
-        self.url = url
-    def read(self):
-        return """
+ns = 'xmlns:xlink="http://www.w3.org/1999/xlink"'
+
+class MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stand-in for a web service's REST interface"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.cookies.append(self.headers.get('Cookie'))
+        self.server.paths.append(self.path)
+        top = 'http://%s:%d' % self.server.server_address
+        if 'etag' in self.path:
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.respond(304, '')
+            else:
+                self.respond(200, '<saliweb><service name="modfoo"/>'
+                                  '</saliweb>', [('ETag', '"v1"')])
+        elif 'nostore' in self.path:
+            self.respond(200, '<saliweb><service name="modfoo"/></saliweb>',
+                         [('Cache-Control', 'no-store')])
+        elif 'invalidxml' in self.path:
+            self.respond(200, "this is not valid xml")
+        elif 'wrongxml' in self.path:
+            self.respond(200, "<wrongtag />")
+        elif 'noparam' in self.path:
+            self.respond(200, '<saliweb><service name="modfoo"/></saliweb>')
+        elif 'longjob' in self.path and self.server.longjob_calls < 3:
+            self.server.longjob_calls += 1
+            self.respond(503, "not done", [('Cache-Control', 'no-cache')])
+        elif 'notdone' in self.path:
+            self.respond(503, "not done")
+        elif 'badurl' in self.path:
+            self.respond(404, "not found")
+        elif 'redirect' in self.path:
+            self.send_response(302)
+            self.send_header('Location', top + '/jobresults/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif 'submit' in self.path:
+            # As for curl, submitting with no arguments does a GET
+            self.do_submit()
+        elif 'manyresults' in self.path:
+            self.respond(200, '<saliweb %s>' % ns
+                         + ''.join('<results_file xlink:href="http://r%d/" />'
+                                   % i for i in range(10000))
+                         + '</saliweb>')
+        elif 'jobresults' in self.path or 'longjob' in self.path:
+            self.respond(200, """
 <saliweb %s>
 <results_file xlink:href="http://results1/" />
 <results_file xlink:href="http://results2/" />
 </saliweb>
-""" % self.ns
+""" % ns)
+        else:
+            self.respond(200, '<saliweb><service name="modfoo"/>'
+                              '<parameters><string name="foo">bar</string>'
+                              '</parameters></saliweb>')
+
+    def do_POST(self):
+        self.server.cookies.append(self.headers.get('Cookie'))
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST'})
+        self.server.forms.append(dict((k, (form[k].filename, form[k].value))
+                                      for k in form.keys()))
+        self.do_submit()
+
+    def do_submit(self):
+        top = 'http://%s:%d' % self.server.server_address
+        if 'dropsubmit' in self.path:
+            # Accept the job, but drop the connection without responding
+            self.close_connection = 1
+        elif 'badsubmit' in self.path:
+            self.respond(200, '<saliweb><error>invalid job submission'
+                              '</error></saliweb>')
+        elif 'oksubmit' in self.path:
+            self.respond(200, '<saliweb %s><job xlink:href="%s/jobresults/" />'
+                              '</saliweb>' % (ns, top))
+        elif 'longsubmit' in self.path:
+            self.respond(200, '<saliweb %s><job xlink:href="%s/longjob/" />'
+                              '</saliweb>' % (ns, top))
+
+    def respond(self, code, body, headers=()):
+        self.send_response(code)
+        for header, value in headers:
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-def mock_sleep(interval):
-    pass
 
-class MockURLOpen(object):
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
     def __init__(self):
-        self.numcalls = 0
-    def __call__(self, url):
-        if 'longjob' in url and self.numcalls < 100:
-            self.numcalls += 1
-            raise urllib2.HTTPError('url', 503, 'msg', [], None)
-        elif 'notdone' in url:
-            raise urllib2.HTTPError('url', 503, 'msg', [], None)
-        elif 'badurl' in url:
-            raise urllib2.HTTPError('url', 404, 'msg', [], None)
-        else:
-            return MockURL(url)
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           MockHandler)
+        self.connections = 0
+        self.longjob_calls = 0
+        self.cookies = []
+        self.forms = []
+        self.paths = []
+
+
+def mock_sleep(interval):
+    pass
 
 class WebServiceTests(unittest.TestCase):
     """Test the web_service script."""
@@ -47,55 +134,116 @@ class WebServiceTests(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
         self.tmpdir = tempfile.mkdtemp()
-        curl = os.path.join(self.tmpdir, 'curl')
-        open(curl, 'w').write("""#!/usr/bin/python
-from __future__ import print_function
-import sys
-url = sys.argv[-1]
-ns = 'xmlns:xlink="http://www.w3.org/1999/xlink"'
-if 'badcurl' in url:
-    print("some curl error", file=sys.stderr)
-    sys.exit(1)
-elif 'invalidxml' in url:
-    print("this is not valid xml")
-elif 'wrongxml' in url:
-    print("<wrongtag />")
-elif 'noparam' in url:
-    print('<saliweb><service name="modfoo"/></saliweb>')
-elif 'badsubmit' in url:
-    print('<saliweb><error>invalid job submission</error></saliweb>')
-elif 'oksubmit' in url:
-    print('<saliweb %s><job xlink:href="http://jobresults/" /></saliweb>' % ns)
-elif 'longsubmit' in url:
-    print('<saliweb %s><job xlink:href="http://longjob/" /></saliweb>' % ns)
-else:
-    print('<saliweb><service name="modfoo"/>'
-          '<parameters><string name="foo">bar</string>'
-          '</parameters></saliweb>')
-""")
-        os.chmod(curl, 0700)
-        os.environ['PATH'] = self.tmpdir + ':' + os.environ['PATH']
-        self.orig_urlopen = urllib2.urlopen
-        urllib2.urlopen = MockURLOpen()
+        self.server = MockServer()
+        t = threading.Thread(target=self.server.serve_forever,
+                             kwargs={'poll_interval': 0.01})
+        t.setDaemon(True)
+        t.start()
+        self.top = 'http://%s:%d' % self.server.server_address
         self.orig_sleep = time.sleep
         time.sleep = mock_sleep
+        # Don't put anything in the user's real cache
+        self.orig_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmpdir, 'cache')
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
-        shutil.rmtree(self.tmpdir)
-        urllib2.urlopen = self.orig_urlopen
         time.sleep = self.orig_sleep
+        web_service.disable_cache()
+        if self.orig_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.orig_cache_home
+        self.server.shutdown()
+        self.server.server_close()
+        web_service._pool.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def get_closed_url(self):
+        """Get a URL on a port that nothing is listening on"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        return 'http://127.0.0.1:%d/job' % port
+
+    def test_rest_page(self):
+        """Check _rest_page function"""
+        self.assertRaises(OSError, web_service._rest_page,
+                          self.get_closed_url())
+        olderr = sys.stderr
+        try:
+            sys.stderr = StringIO()
+            self.assertRaises(xml.parsers.expat.ExpatError,
+                              web_service._rest_page,
+                              self.top + '/invalidxml/job')
+        finally:
+            sys.stderr = olderr
+        self.assertRaises(ValueError, web_service._rest_page,
+                          self.top + '/wrongxml/job')
+        top, out = web_service._rest_page(self.top + '/ok/job')
 
-    def test_curl_rest_page(self):
-        """Check _curl_rest_page function"""
-        self.assertRaises(OSError, web_service._curl_rest_page,
-                          'http://badcurl/job', [])
-        self.assertRaises(xml.parsers.expat.ExpatError,
-                          web_service._curl_rest_page,
-                          'http://invalidxml/job', [])
-        self.assertRaises(ValueError, web_service._curl_rest_page,
-                          'http://wrongxml/job', [])
-        top, out = web_service._curl_rest_page('http://ok/job', [])
+    def test_keep_alive(self):
+        """Check that connections are reused"""
+        for i in range(5):
+            web_service._rest_page(self.top + '/ok/job')
+        self.assertEqual(self.server.connections, 1)
+        # If the server closes the connection, a new one should be made
+        web_service._pool.clear()
+        web_service._rest_page(self.top + '/ok/job')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_no_resubmit(self):
+        """Check that a POST is not resent on a reused connection"""
+        web_service._rest_page(self.top + '/ok/job')
+        self.assertRaises(OSError, web_service.submit_job,
+                          self.top + '/dropsubmit/', ['foo=bar'])
+        self.assertEqual(len(self.server.forms), 1)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_upload(self):
+        """Check upload of files and form fields"""
+        open(os.path.join(self.tmpdir, 'input.pdb'), 'w').write('x' * 200000)
+        open(os.path.join(self.tmpdir, 'name.txt'), 'w').write('testjob')
+        url = web_service.submit_job(self.top + '/oksubmit/',
+                                     ['foo=bar', 'pdb=@input.pdb',
+                                      'name=<name.txt'],
+                                     directory=self.tmpdir)
+        form = self.server.forms[0]
+        self.assertEqual(form['foo'], (None, 'bar'))
+        self.assertEqual(form['pdb'], ('input.pdb', 'x' * 200000))
+        self.assertEqual(form['name'], (None, 'testjob'))
+        # Missing files, or arguments without '=', are errors
+        self.assertRaises(OSError, web_service.submit_job,
+                          self.top + '/oksubmit/', ['pdb=@notexist.pdb'])
+        self.assertRaises(ValueError, web_service.submit_job,
+                          self.top + '/oksubmit/', ['foo'])
+
+    def test_multipart_body(self):
+        """Check _MultipartBody class"""
+        b = web_service._MultipartBody(['foo=bar', 'baz=@' + __file__])
+        body = ''.join(b.get_chunks())
+        self.assertEqual(len(body), b.get_length())
+        self.assert_(body.startswith('--' + b.boundary + '\r\n'))
+        self.assert_(body.endswith('--' + b.boundary + '--\r\n'))
+        self.assert_(b.get_content_type().endswith('boundary=' + b.boundary))
+        # Body can be sent more than once
+        self.assertEqual(''.join(b.get_chunks()), body)
+
+    def test_cookies(self):
+        """Check sending of cookies"""
+        web_service.show_info(self.top + '/ok/', cookie='foo=bar')
+        self.assertEqual(self.server.cookies[-1], 'foo=bar')
+        cookie_file = os.path.join(self.tmpdir, 'cookies.txt')
+        open(cookie_file, 'w').write("""# Netscape HTTP Cookie File
+127.0.0.1\tFALSE\t/\tFALSE\t0\tsession\tsecret
+""")
+        web_service.show_info(self.top + '/ok/', cookie=cookie_file)
+        self.assertEqual(self.server.cookies[-1], 'session=secret')
+        # Missing cookie files are ignored, just as for curl
+        web_service.show_info(self.top + '/ok/',
+                              cookie=os.path.join(self.tmpdir, 'notexist'))
+        self.assertEqual(self.server.cookies[-1], None)
 
     def test_parameters(self):
         """Test _Parameter and _FileParameter classes"""
@@ -120,8 +268,6 @@ else:
     <file name="file1">help3</file>
   </parameters>
 </saliweb>"""
-        xml = parseString(xml).getElementsByTagName('saliweb')[0]
-        pxml = parseString(pxml).getElementsByTagName('saliweb')[0]
         ps = web_service._get_parameters_from_xml(xml)
         self.assertEqual(ps, [])
         ps = web_service._get_parameters_from_xml(pxml)
@@ -132,33 +278,299 @@ else:
 
     def test_show_info(self):
         """Test show_info()"""
-        o = web_service.show_info('http://noparam/')
-        o = web_service.show_info('http://ok/')
-        o = web_service.show_info('http://ok/', cookie='foo=bar')
+        o = web_service.show_info(self.top + '/noparam/')
+        o = web_service.show_info(self.top + '/ok/')
+        o = web_service.show_info(self.top + '/ok/', cookie='foo=bar')
 
     def test_submit_job(self):
         """Test submit_job()"""
         self.assertRaises(IOError, web_service.submit_job,
-                          'http://badsubmit/', [])
-        url = web_service.submit_job('http://oksubmit/', ['foo=bar'])
-        self.assertEqual(url, "http://jobresults/")
-        url = web_service.submit_job('http://oksubmit/', ['foo=bar'],
+                          self.top + '/badsubmit/', [])
+        url = web_service.submit_job(self.top + '/oksubmit/', ['foo=bar'])
+        self.assertEqual(url, self.top + "/jobresults/")
+        url = web_service.submit_job(self.top + '/oksubmit/', ['foo=bar'],
                                      cookie='foo=bar')
-        self.assertEqual(url, "http://jobresults/")
+        self.assertEqual(url, self.top + "/jobresults/")
 
     def test_get_results(self):
         """Test get_results()"""
-        self.assertEqual(web_service.get_results('http://notdone/'), None)
+        self.assertEqual(web_service.get_results(self.top + '/notdone/'), None)
         self.assertRaises(urllib2.HTTPError, web_service.get_results,
-                          'http://badurl/')
-        urls = web_service.get_results('http://jobresults/')
+                          self.top + '/badurl/')
+        urls = web_service.get_results(self.top + '/jobresults/')
+        self.assertEqual(urls, [u'http://results1/', u'http://results2/'])
+        urls = web_service.get_results(self.top + '/redirect/')
         self.assertEqual(urls, [u'http://results1/', u'http://results2/'])
+        self.assertRaises(urllib2.URLError, web_service.get_results,
+                          self.get_closed_url())
+
+    def test_iter_results(self):
+        """Test iter_results()"""
+        self.assertEqual(web_service.iter_results(self.top + '/notdone/'),
+                         None)
+        self.assertRaises(urllib2.HTTPError, web_service.iter_results,
+                          self.top + '/badurl/')
+        urls = web_service.iter_results(self.top + '/manyresults/')
+        self.assertEqual(urls.next(), u'http://r0/')
+        self.assertEqual(len(list(urls)), 9999)
+        # Connection should be reused once all results are read
+        web_service.iter_results(self.top + '/notdone/')
+        self.assertEqual(self.server.connections, 1)
+        # Iterator can be closed without reading all results
+        urls = web_service.iter_results(self.top + '/manyresults/')
+        self.assertEqual(urls.next(), u'http://r0/')
+        urls.close()
+        self.assertEqual(list(web_service.iter_results(self.top
+                                                       + '/jobresults/')),
+                         [u'http://results1/', u'http://results2/'])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_saliweb_parser(self):
+        """Test _SaliwebParser class"""
+        doc = '<?xml version="1.0"?><saliweb %s><service name="modfoo"/>' \
+              '<results_file xlink:href="http://r1/"/><ignored>' \
+              '<results_file xlink:href="http://r2/"/></ignored>' \
+              '<job xlink:href="http://job/"/><parameters>' \
+              '<string name="foo">help &amp; more</string></parameters>' \
+              '</saliweb>' % ns
+        # Feed the document a byte at a time
+        p = web_service._SaliwebParser()
+        results = []
+        for c in doc:
+            p.feed(c)
+            results.extend(p.pop_results())
+        p.feed('', True)
+        self.assertEqual(results, [u'http://r1/', u'http://r2/'])
+        self.assertEqual(p.pop_results(), [])
+        self.assertEqual(p.service, u'modfoo')
+        self.assertEqual(p.jobs, [u'http://job/'])
+        self.assertEqual([(x.name, x.help) for x in p.parameters],
+                         [(u'foo', u'help & more')])
+        # Elements outside of the saliweb tag are ignored
+        p = web_service._SaliwebParser()
+        self.assertRaises(ValueError, p.feed,
+                          '<top><results_file xlink:href="foo"/></top>', True)
+        self.assertEqual(p.pop_results(), [])
+        # Only the start of the document is kept for error messages
+        p = web_service._SaliwebParser()
+        p.feed('<saliweb>' + ' ' * 10000)
+        self.assertEqual(len(p.text), p._max_text)
+
+    def test_cache(self):
+        """Test caching of web service responses"""
+        cachedir = os.path.join(self.tmpdir, 'testcache')
+        web_service.enable_cache(cachedir, ttls={'notdone': 1000})
+        def get_requests(func, *args):
+            self.server.paths = []
+            ret = func(*args)
+            return ret, len(self.server.paths)
+        self.assertEqual(get_requests(web_service.show_info,
+                                      self.top + '/ok/')[1], 1)
+        self.assertEqual(get_requests(web_service.show_info,
+                                      self.top + '/ok/')[1], 0)
+        # Cookies are part of the cache key
+        self.assertEqual(get_requests(web_service.show_info,
+                                      self.top + '/ok/', 'foo=bar')[1], 1)
+        self.assertEqual(get_requests(web_service._get_results,
+                                      self.top + '/jobresults/'),
+                         ([u'http://results1/', u'http://results2/'], 1))
+        self.assertEqual(get_requests(web_service._get_results,
+                                      self.top + '/jobresults/'),
+                         ([u'http://results1/', u'http://results2/'], 0))
+        self.assertEqual(get_requests(web_service._get_results,
+                                      self.top + '/notdone/'), (None, 1))
+        self.assertEqual(get_requests(web_service._get_results,
+                                      self.top + '/notdone/'), (None, 0))
+        # Errors and submissions are not cached
+        for i in range(2):
+            self.assertRaises(urllib2.HTTPError, web_service._get_results,
+                              self.top + '/badurl/')
+            web_service._submit_job(self.top + '/oksubmit/', [])
+        self.assertEqual(self.server.paths[-4:], ['/badurl/', '/oksubmit/',
+                                                  '/badurl/', '/oksubmit/'])
+        # Responses marked no-store by the web service are not cached
+        for i in range(2):
+            self.assertEqual(get_requests(web_service.show_info,
+                                          self.top + '/nostore/')[1], 1)
+        self.assertEqual(len([f for f in os.listdir(cachedir)
+                              if f.endswith('.cache')]), 4)
+        # Partially read responses are not cached
+        urls = web_service.iter_results(self.top + '/manyresults/')
+        urls.next()
+        urls.close()
+        self.assertEqual(len([f for f in os.listdir(cachedir)
+                              if f.endswith('.cache')]), 4)
+
+    def test_cache_revalidate(self):
+        """Test revalidation of cached responses"""
+        cachedir = os.path.join(self.tmpdir, 'testcache')
+        web_service.enable_cache(cachedir, ttls={'info': 0})
+        for i in range(3):
+            web_service.show_info(self.top + '/etag/')
+        self.assertEqual(self.server.paths, ['/etag/'] * 3)
+        # Connection should be reused after a 304 response
+        self.assertEqual(self.server.connections, 1)
+        # Responses with no validators are not cached if they expire
+        # immediately
+        web_service.show_info(self.top + '/ok/')
+        self.assertEqual(len(os.listdir(cachedir)), 1)
+
+    def test_cache_notdone(self):
+        """Test that unfinished jobs are not cached by default"""
+        cachedir = os.path.join(self.tmpdir, 'testcache')
+        web_service.enable_cache(cachedir)
+        for i in range(2):
+            self.assertEqual(web_service._get_results(self.top + '/notdone/'),
+                             None)
+        self.assertEqual(self.server.paths, ['/notdone/'] * 2)
+        self.assertEqual(os.listdir(cachedir), [])
+
+    def test_cache_evict(self):
+        """Test removal of least recently used responses from the cache"""
+        cachedir = os.path.join(self.tmpdir, 'testcache')
+        web_service.enable_cache(cachedir)
+        cache = web_service._cache
+        web_service.show_info(self.top + '/ok1/')
+        size = os.stat(cache.get_path(self.top + '/ok1/', None)).st_size
+        self.assertEqual(cache._total, size)
+        # The cache directory should only be scanned when it is too big
+        scans = []
+        def count_evict(orig_evict=cache._evict):
+            scans.append(None)
+            orig_evict()
+        cache._evict = count_evict
+        # Make room for only two responses
+        cache.max_size = int(size * 2.5)
+        for name in ('ok2', 'ok1', 'ok3'):
+            web_service.show_info(self.top + '/%s/' % name)
+            # Make sure access times differ
+            for fname in os.listdir(cachedir):
+                path = os.path.join(cachedir, fname)
+                st = os.stat(path)
+                os.utime(path, (st.st_atime - 10, st.st_mtime))
+        self.assertEqual(sorted(os.listdir(cachedir)),
+                         sorted(os.path.basename(cache.get_path(
+                                      self.top + '/%s/' % name, None))
+                                for name in ('ok1', 'ok3')))
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(cache._total, size * 2)
+        # Responses that are too big are not kept
+        cache.max_entry_size = size
+        web_service._get_results(self.top + '/manyresults/')
+        self.assertEqual(len(os.listdir(cachedir)), 2)
 
     def test_run_job(self):
         """Test run_job()"""
-        urls = web_service.run_job('http://longsubmit/', ['foo=bar'])
+        urls = web_service.run_job(self.top + '/longsubmit/', ['foo=bar'])
         self.assertEqual(urls, [u'http://results1/', u'http://results2/'])
 
+    def test_submit_jobs(self):
+        """Test submit_jobs()"""
+        args_list = [['foo=%d' % i] for i in range(5)]
+        urls = web_service.submit_jobs(self.top + '/oksubmit/', args_list,
+                                       max_workers=2)
+        self.assertEqual(urls, [self.top + "/jobresults/"] * 5)
+        self.assertEqual(sorted(f['foo'][1] for f in self.server.forms),
+                         ['0', '1', '2', '3', '4'])
+        # Jobs recorded in the checkpoint should not be submitted again
+        cp = os.path.join(self.tmpdir, 'checkpoint')
+        urls = web_service.submit_jobs(self.top + '/oksubmit/', args_list[:3],
+                                       checkpoint=cp)
+        self.assertEqual(len(self.server.forms), 8)
+        urls = web_service.submit_jobs(self.top + '/oksubmit/', args_list[:3],
+                                       checkpoint=cp)
+        self.assertEqual(len(self.server.forms), 8)
+        self.assertEqual(urls, [self.top + "/jobresults/"] * 3)
+        # Checkpoint must match the jobs
+        self.assertRaises(ValueError, web_service.submit_jobs,
+                          self.top + '/oksubmit/', [['bar=baz']],
+                          checkpoint=cp)
+        # Submission errors should be reported
+        self.assertRaises(IOError, web_service.submit_jobs,
+                          self.top + '/badsubmit/', [[]])
+
+    def test_run_jobs(self):
+        """Test run_jobs()"""
+        args_list = [['foo=%d' % i] for i in range(4)]
+        cp = os.path.join(self.tmpdir, 'checkpoint')
+        jobs = web_service.run_jobs(self.top + '/longsubmit/', args_list,
+                                    max_workers=3, checkpoint=cp,
+                                    poll_interval=0.01)
+        # Stop part way through
+        job, results = jobs.next()
+        self.assertEqual(results, [u'http://results1/', u'http://results2/'])
+        jobs.close()
+        # Simulate interruption while writing the checkpoint
+        open(cp, 'a').write('{"job": ')
+        numforms = len(self.server.forms)
+        done = list(web_service.run_jobs(self.top + '/longsubmit/', args_list,
+                                         checkpoint=cp, poll_interval=0.01))
+        self.assertEqual(sorted(j for j, r in done), [0, 1, 2, 3])
+        # The first job should have come from the checkpoint
+        self.assertEqual(done[0][0], job)
+        self.assert_(len(self.server.forms) <= 4)
+        # Everything is in the checkpoint now, so nothing is submitted
+        numforms = len(self.server.forms)
+        done = list(web_service.run_jobs(self.top + '/longsubmit/', args_list,
+                                         checkpoint=cp))
+        self.assertEqual(len(done), 4)
+        self.assertEqual(len(self.server.forms), numforms)
+
+    def test_batch_submit_errors(self):
+        """Test handling of submission errors in a batch"""
+        orig_submit = web_service._submit_job
+        attempts = []
+        def mock_submit(url, args, cookie, directory):
+            attempts.append(args[0])
+            if args[0] == 'fail':
+                raise IOError("Could not submit job")
+            elif args[0] == 'flaky' and attempts.count('flaky') < 3:
+                raise web_service._RequestNotSentError("server is down")
+            elif args[0] == 'down':
+                raise web_service._RequestNotSentError("server is down")
+            return url + args[0]
+        web_service._submit_job = mock_submit
+        orig_delay = web_service._Batch._retry_delay
+        web_service._Batch._retry_delay = 0.
+        cp = os.path.join(self.tmpdir, 'checkpoint')
+        try:
+            # A failed job should not stop the others from being submitted
+            args_list = [['ok1'], ['fail'], ['flaky'], ['ok2']]
+            self.assertRaises(IOError, web_service.submit_jobs, 'u/',
+                              args_list, max_workers=1, checkpoint=cp)
+            self.assertEqual(attempts, ['ok1', 'fail', 'flaky', 'flaky',
+                                        'flaky', 'ok2'])
+            # All jobs except the failed one should have been checkpointed
+            web_service._submit_job = lambda url, args, cookie, directory: \
+                                                        url + 'resubmitted'
+            urls = web_service.submit_jobs('u/', args_list, checkpoint=cp)
+            self.assertEqual(urls, ['u/ok1', 'u/resubmitted', 'u/flaky',
+                                    'u/ok2'])
+            # Give up eventually if the server cannot be contacted
+            web_service._submit_job = mock_submit
+            del attempts[:]
+            self.assertRaises(web_service._RequestNotSentError,
+                              web_service.submit_jobs, 'u/', [['down']])
+            self.assertEqual(len(attempts),
+                             web_service._Batch._submit_retries + 1)
+        finally:
+            web_service._submit_job = orig_submit
+            web_service._Batch._retry_delay = orig_delay
+
+    def test_not_sent_error(self):
+        """Test errors for requests that could not be sent"""
+        self.assertRaises(web_service._RequestNotSentError,
+                          web_service.submit_job, self.get_closed_url(),
+                          ['foo=bar'])
+
+    def test_batch_poll(self):
+        """Test polling of jobs in a batch"""
+        b = web_service._Batch(self.top, [], None, None, 1, None)
+        # Network problems should be treated as if the job is not done
+        self.assertEqual(b._poll(self.get_closed_url()), None)
+        self.assertEqual(b._poll(self.top + '/notdone/'), None)
+        self.assertRaises(urllib2.HTTPError, b._poll, self.top + '/badurl/')
+
     def run_web_service_subprocess(self, args):
         """Run web_service.py in a subprocess"""
         # Find path to web_service.py (can't use python -m with older Python)
@@ -227,21 +639,22 @@ else:
         out, err, exit = self.run_web_service(['info'])
         self.assertEqual(exit, 1)
         self.assertTrue("sample usage for submitting jobs" in out, msg=out)
-        out, err, exit = self.run_web_service(['info', 'http://noparam/'])
-        self.assertEqual(exit, 0)
-        self.assertTrue("web_service.py submit http://noparam/ "
-                        "[name1=ARG] [name2=@FILENAME] ..." in out, msg=out)
-        out, err, exit = self.run_web_service(['info', 'http://ok/'])
+        out, err, exit = self.run_web_service(['info', self.top + '/noparam/'])
         self.assertEqual(exit, 0)
-        self.assertTrue("web_service.py submit http://ok/ foo=ARG" in out,
+        self.assertTrue("web_service.py submit %s/noparam/ "
+                        "[name1=ARG] [name2=@FILENAME] ..." % self.top in out,
                         msg=out)
+        out, err, exit = self.run_web_service(['info', self.top + '/ok/'])
+        self.assertEqual(exit, 0)
+        self.assertTrue("web_service.py submit %s/ok/ foo=ARG" % self.top
+                        in out, msg=out)
 
     def test_submit_command(self):
         """Check running web_service.py submit command"""
         out, err, exit = self.run_web_service(['submit'])
         self.assertEqual(exit, 1)
         self.assertTrue("This only submits the job" in out, msg=out)
-        out, err, exit = self.run_web_service(['submit', 'http://oksubmit/'])
+        out, err, exit = self.run_web_service(['submit', self.top + '/oksubmit/'])
         self.assertEqual(exit, 0)
         self.assertTrue("Job submitted: results will be found at" in out,
                         msg=out)
@@ -252,17 +665,42 @@ else:
         self.assertEqual(exit, 1)
         self.assertTrue("If the job has finished," in out, msg=out)
 
-        out, err, exit = self.run_web_service(['results', 'http://jobresults/'])
+        out, err, exit = self.run_web_service(['results', self.top + '/jobresults/'])
         self.assertEqual(exit, 0)
         self.assertTrue("http://results1/" in out, msg=out)
 
+    def test_batch_command(self):
+        """Check running web_service.py batch command"""
+        out, err, exit = self.run_web_service(['batch'])
+        self.assertEqual(exit, 1)
+        self.assertTrue("Run many web service jobs" in out, msg=out)
+        out, err, exit = self.run_web_service(['batch', '-j', 'x', 'a', 'b'])
+        self.assertEqual(exit, 1)
+
+        jobfile = os.path.join(self.tmpdir, 'jobs')
+        open(jobfile, 'w').write("""# test jobs
+foo=bar name='job 1'
+
+foo=baz
+""")
+        out, err, exit = self.run_web_service(['batch', '-j', '2',
+                                               self.top + '/longsubmit/',
+                                               jobfile])
+        self.assertEqual(exit, 0)
+        self.assertTrue("Running 2 jobs" in out, msg=out)
+        self.assertTrue("Job on line 2 finished" in out, msg=out)
+        self.assertTrue("Job on line 4 finished" in out, msg=out)
+        self.assertEqual(sorted(f['foo'][1] for f in self.server.forms),
+                         ['bar', 'baz'])
+        self.assertTrue(os.path.exists(jobfile + '.checkpoint'))
+
     def test_run_command(self):
         """Check running web_service.py run command"""
         out, err, exit = self.run_web_service(['run'])
         self.assertEqual(exit, 1)
         self.assertTrue("basically the equivalent" in out, msg=out)
 
-        out, err, exit = self.run_web_service(['run', 'http://oksubmit/'])
+        out, err, exit = self.run_web_service(['run', self.top + '/oksubmit/'])
         self.assertEqual(exit, 0)
         self.assertTrue("http://results1/" in out, msg=out)
 
@@ -45,7 +45,7 @@ class TestFatalError(Exception): pass
 job_log = []
 class LoggingJob(Job):
     """Test Job subclass that logs which methods are called"""
-    def _try_run(self, webservice):
+    def _try_run(self, webservice, batcher=None):
         if self.name == 'fatal-error-run':
             raise TestFatalError("fatal error in run")
         job_log.append((self.name, 'run'))
@@ -126,6 +126,33 @@ class WebServiceTest(unittest.TestCase):
         job = web._get_job_by_runner_id(goodrunner, 'job-3')
         self.assertEqual(job, None)
 
+    def test_stats(self):
+        """Check daemon statistics kept by WebService"""
+        db, conf, web = self._setup_webservice()
+        web._start_stats()
+        # Check internal state, since the test database does not store
+        # submit times as datetime objects
+        s = web._stats
+        self.assertEqual(s._state_counts['INCOMING'], 1)
+        self.assertEqual(s._state_counts['RUNNING'], 2)
+        self.assertEqual(s._state_counts['COMPLETED'], 2)
+        self.assertEqual(sorted(s._running.keys()), ['job2', 'job3'])
+        self.assertEqual(s._incoming.keys(), ['job1'])
+        # Statistics should be updated as jobs change state
+        job = web.get_job_by_name('RUNNING', 'job3')
+        db._change_job_state(job._metadata, 'RUNNING', 'POSTPROCESSING')
+        job = web.get_job_by_name('INCOMING', 'job1')
+        db._delete_job(job._metadata, 'INCOMING')
+        self.assertEqual(s._state_counts['INCOMING'], 0)
+        self.assertEqual(s._state_counts['RUNNING'], 1)
+        self.assertEqual(s._state_counts['POSTPROCESSING'], 2)
+        self.assertEqual(s._running.keys(), ['job2'])
+        self.assertEqual(s._incoming, {})
+        # Changes made behind our back are picked up by a reset
+        s.reset({}, [], [])
+        web._reset_stats()
+        self.assertEqual(s._state_counts['RUNNING'], 1)
+
     def test_process_incoming(self):
         """Check WebService._process_incoming_jobs()"""
         global job_log
@@ -416,6 +443,16 @@ class WebServiceTest(unittest.TestCase):
         class DummyWebService(WebService):
             def __init__(self):
                 pass
+            def _start_watcher(self):
+                pass
+            def _start_notifications(self):
+                pass
+            def _start_submitter(self):
+                pass
+            def _start_stats(self):
+                pass
+            def _schedule_retries(self):
+                pass
         def make_thread(name):
             class DummyThread(object):
                 def __init__(self, *args):
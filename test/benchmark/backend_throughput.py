@@ -0,0 +1,447 @@
+#!/usr/bin/python
+
+"""Measure how many jobs per second the backend can push through.
+
+For each scenario, a web service is set up in a temporary directory, using
+the test suite's in-memory database (so no MySQL server is needed) and a
+runner that 'runs' each job by simply waiting for a given time (with a run
+time of zero, this behaves just like DoNothingRunner). Synthetic jobs are
+added to the database and announced on the service socket, just as the
+frontend does, and the backend's event loop (`_do_periodic_actions`) is run
+in-process until every job has completed.
+
+Scenarios cover different backlog sizes, shapes of job dependencies, and
+costs of the job's preprocess and postprocess methods. For each, the
+throughput is reported, together with percentiles of the time each job
+spent in each phase:
+
+  wait      from submission until the preprocess method is called
+  start     from preprocess until the job's runner is started
+  complete  from the runner finishing until the job is COMPLETED
+  total     from submission until the job is COMPLETED
+
+Results are also saved as JSON; give the file from an earlier release with
+--compare to see how throughput has changed. Each scenario is run in its
+own process, since the backend's threads cannot be cleanly stopped."""
+
+from __future__ import print_function
+from optparse import OptionParser
+from StringIO import StringIO
+import multiprocessing
+import threading
+import datetime
+import platform
+import tempfile
+import socket
+import shutil
+import traceback
+import json
+import time
+import sys
+import os
+
+topdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(topdir, 'python'))
+sys.path.insert(0, os.path.join(topdir, 'test', 'backend'))
+import saliweb.backend
+import saliweb.backend.events
+from memory_database import MemoryDatabase
+from config import Config
+
+config = """
+[general]
+admin_email: test@example.com
+service_name: ModBench
+socket: %(dir)s/modbench.socket
+
+[backend]
+user: modbench
+state_file: %(dir)s/state_file
+check_minutes: 10
+
+[database]
+db: modbench
+frontend_config: frontend.conf
+backend_config: backend.conf
+
+[directories]
+install: %(dir)s
+incoming: %(dir)s/incoming
+preprocessing: %(dir)s/preprocessing
+
+[oldjobs]
+archive: 30d
+expire: 90d
+
+[limits]
+running: %(running)d
+"""
+
+dependency_shapes = ['none', 'chain', 'tree', 'fanout']
+phases = ['wait', 'start', 'complete', 'total']
+
+
+class BenchmarkDone(Exception):
+    pass
+
+
+class StopEvent(object):
+    """Event that stops the backend's event loop"""
+    def process(self):
+        raise BenchmarkDone()
+
+
+class Timings(object):
+    """Record when each job reached each phase"""
+    def __init__(self, njobs):
+        self.njobs = njobs
+        self.times = {}
+        self.completed = 0
+        self.webservice = None
+
+    def mark(self, name, phase):
+        self.times.setdefault(name, {})[phase] = time.time()
+
+    def job_completed(self, name):
+        self.mark(name, 'completed')
+        self.completed += 1
+        if self.completed == self.njobs:
+            self.webservice._event_queue.put(StopEvent())
+
+timings = None
+
+
+class BenchRunner(saliweb.backend.Runner):
+    """Runner that finishes the job after `run_time` seconds"""
+    _runner_name = 'benchmark'
+
+    def __init__(self, name, run_time):
+        saliweb.backend.Runner.__init__(self)
+        self._name = name
+        self._run_time = run_time
+        self._directory = saliweb.backend._get_job_directory()
+
+    def _run(self, webservice):
+        timings.mark(self._name, 'started')
+        if self._run_time > 0:
+            t = threading.Timer(self._run_time, self._finish, [webservice])
+            t.setDaemon(True)
+            t.start()
+        else:
+            self._finish(webservice)
+        return self._name
+
+    def _finish(self, webservice):
+        open(os.path.join(self._directory, 'job-state'), 'w').write('DONE\n')
+        timings.mark(self._name, 'finished')
+        webservice._event_queue.put(saliweb.backend.events._CompletedJobEvent(
+                                          webservice, self, self._name, None))
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        return True
+saliweb.backend.Job.register_runner_class(BenchRunner)
+
+
+class BenchJob(saliweb.backend.Job):
+    hook_cost = 0.
+    run_time = 0.
+
+    def preprocess(self):
+        timings.mark(self.name, 'preprocess')
+        time.sleep(self.hook_cost)
+
+    def run(self):
+        return BenchRunner(self.name, self.run_time)
+
+    def postprocess(self):
+        time.sleep(self.hook_cost)
+
+    def complete(self):
+        timings.job_completed(self.name)
+
+
+def get_list(parser, value, convert, choices=None):
+    try:
+        values = [convert(x) for x in value.split(',')]
+    except ValueError:
+        parser.error("Invalid list: " + value)
+    for v in values:
+        if choices is not None and v not in choices:
+            parser.error("Invalid value %s; choose from %s"
+                         % (v, ", ".join(choices)))
+    return values
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [options]
+
+Measure the throughput of the backend with synthetic jobs.
+Options that take a LIST accept several comma-separated values; every
+combination of them is run as a separate scenario.
+""")
+    parser.add_option('-n', '--jobs', dest='jobs', default='100,1000',
+                      metavar='LIST',
+                      help="Number of jobs in the backlog (default 100,1000)")
+    parser.add_option('-d', '--depends', dest='depends', default='none,tree',
+                      metavar='LIST',
+                      help="Shape of job dependencies: none, chain (each "
+                           "job depends on the previous one), tree (a "
+                           "binary tree) or fanout (all jobs depend on the "
+                           "first) (default none,tree)")
+    parser.add_option('--hook-cost', dest='hook_cost', default='0',
+                      metavar='LIST',
+                      help="Time in seconds taken by each job's preprocess "
+                           "and postprocess methods (default 0)")
+    parser.add_option('--run-time', type='float', dest='run_time',
+                      default=0., metavar='SECONDS',
+                      help="Time each job takes to run (default 0)")
+    parser.add_option('--rate', type='float', dest='rate', default=0.,
+                      help="Submit jobs at RATE per second, rather than all "
+                           "at once")
+    parser.add_option('--max-running', type='int', dest='max_running',
+                      default=10000,
+                      help="Maximum number of jobs running at once "
+                           "(default 10000)")
+    parser.add_option('--check-interval', type='float',
+                      dest='check_interval', default=1.,
+                      metavar='SECONDS',
+                      help="Time between the backend's periodic checks for "
+                           "jobs (default 1); jobs whose dependencies have "
+                           "finished are only started by these checks")
+    parser.add_option('--timeout', type='float', dest='timeout', default=600.,
+                      metavar='SECONDS',
+                      help="Give up on a scenario after this time "
+                           "(default 600)")
+    parser.add_option('-o', '--output', dest='output',
+                      default='backend_throughput.json', metavar='FILE',
+                      help="Save results as JSON to FILE (default "
+                           "backend_throughput.json)")
+    parser.add_option('--compare', dest='compare', default=None,
+                      metavar='FILE',
+                      help="Compare throughput with earlier results in FILE")
+    opts, args = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Wrong number of arguments given")
+    opts.jobs = get_list(parser, opts.jobs, int)
+    opts.depends = get_list(parser, opts.depends, str, dependency_shapes)
+    opts.hook_cost = get_list(parser, opts.hook_cost, float)
+    return opts
+
+
+def get_dependencies(names, shape):
+    """Get (child, parent) pairs for the given shape of dependencies"""
+    if shape == 'chain':
+        return [(names[i], names[i - 1]) for i in range(1, len(names))]
+    elif shape == 'tree':
+        return [(names[i], names[(i - 1) // 2]) for i in range(1, len(names))]
+    elif shape == 'fanout':
+        return [(name, names[0]) for name in names[1:]]
+    else:
+        return []
+
+
+class SubmitEvent(object):
+    """Event that adds a new job to the database, as the frontend would.
+       (This is done in the event loop, since the in-memory database can
+       only be used from a single thread.)"""
+    def __init__(self, web, name, dependencies):
+        self.web = web
+        self.name = name
+        self.dependencies = dependencies
+
+    def process(self):
+        add_jobs(self.web, [self.name], self.dependencies)
+
+
+def add_jobs(web, names, dependencies):
+    c = web.db.conn.cursor()
+    now = datetime.datetime.utcnow()
+    for name in names:
+        directory = os.path.join(web.config.directories['INCOMING'], name)
+        os.mkdir(directory)
+        c.execute("INSERT INTO jobs(name,state,submit_time,directory,url) "
+                  "VALUES(?,?,?,?,?)", (name, 'INCOMING', now, directory,
+                                        'http://localhost/job/' + name))
+        timings.mark(name, 'submitted')
+    for child, parent in dependencies:
+        c.execute("INSERT INTO dependencies(child,parent) VALUES(?,?)",
+                  (child, parent))
+    web.db._commit()
+
+
+def notify(web, name):
+    """Tell the backend about a new job, as the frontend would"""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(web.config.socket)
+    s.sendall('INCOMING %s' % name)
+    s.close()
+
+
+def submit_jobs(web, names, dependencies, rate):
+    """Submit jobs at the given rate, from a separate thread"""
+    by_child = {}
+    for child, parent in dependencies:
+        by_child.setdefault(child, []).append((child, parent))
+    start = time.time()
+    for i, name in enumerate(names):
+        delay = start + i / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        web._event_queue.put(SubmitEvent(web, name, by_child.get(name, [])))
+        notify(web, name)
+
+
+def run_scenario(scenario, opts, queue):
+    """Run a single scenario, and put its results on `queue`"""
+    global timings
+    njobs = scenario['jobs']
+    timings = Timings(njobs)
+    BenchJob.hook_cost = scenario['hook_cost']
+    BenchJob.run_time = scenario['run_time']
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for d in ('incoming', 'preprocessing'):
+            os.mkdir(os.path.join(tmpdir, d))
+        conf = Config(StringIO(config % {'dir': tmpdir,
+                                         'running': scenario['max_running']}))
+        conf.backend['check_minutes'] = scenario['check_interval'] / 60.
+        db = MemoryDatabase(BenchJob)
+        web = saliweb.backend.WebService(conf, db)
+        web.create_database_tables()
+        timings.webservice = web
+        names = ['job%06d' % i for i in range(njobs)]
+        dependencies = get_dependencies(names, scenario['depends'])
+        if scenario['rate'] <= 0:
+            add_jobs(web, names, dependencies)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(conf.socket)
+        sock.listen(5)
+        def start_load():
+            # Wait for the event loop to start
+            while web._event_queue is None:
+                time.sleep(0.001)
+            t = threading.Timer(opts.timeout, web._event_queue.put,
+                                [StopEvent()])
+            t.setDaemon(True)
+            t.start()
+            if scenario['rate'] > 0:
+                submit_jobs(web, names, dependencies, scenario['rate'])
+            else:
+                notify(web, names[0])
+        t = threading.Thread(target=start_load)
+        t.setDaemon(True)
+        t.start()
+        start = time.time()
+        try:
+            web._do_periodic_actions(sock)
+        except BenchmarkDone:
+            pass
+        elapsed = time.time() - start
+        queue.put(get_results(scenario, elapsed))
+    except Exception:
+        # Don't leave the parent process waiting for results
+        queue.put({'error': traceback.format_exc()})
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def get_percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    def percentile(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100.))]
+    return {'p50': percentile(50), 'p90': percentile(90),
+            'p99': percentile(99), 'max': values[-1]}
+
+
+def get_results(scenario, elapsed):
+    durations = dict((p, []) for p in phases)
+    for name, t in timings.times.items():
+        if 'completed' not in t:
+            continue
+        durations['wait'].append(t['preprocess'] - t['submitted'])
+        durations['start'].append(t['started'] - t['preprocess'])
+        durations['complete'].append(t['completed'] - t['finished'])
+        durations['total'].append(t['completed'] - t['submitted'])
+    results = dict(scenario)
+    results['completed'] = timings.completed
+    results['elapsed'] = elapsed
+    results['jobs_per_second'] = timings.completed / elapsed
+    results['phases'] = dict((p, get_percentiles(durations[p]))
+                             for p in phases)
+    return results
+
+
+# Settings that make up a scenario; results are only compared with those
+# of an earlier run if all of these match
+scenario_keys = ['jobs', 'depends', 'hook_cost', 'run_time', 'rate',
+                 'max_running', 'check_interval']
+
+
+def get_key(results):
+    return tuple(results.get(k) for k in scenario_keys)
+
+
+def report(results, previous):
+    print("%6d jobs  depends %-6s  hook cost %6.3fs: %8.1f jobs/s"
+          % (results['jobs'], results['depends'], results['hook_cost'],
+             results['jobs_per_second']), end='')
+    old = previous.get(get_key(results))
+    if old:
+        print("  (%+.1f%% vs. %.1f jobs/s)"
+              % ((results['jobs_per_second'] / old['jobs_per_second'] - 1.)
+                 * 100., old['jobs_per_second']), end='')
+    print()
+    if results['completed'] < results['jobs']:
+        print("   only %d jobs completed before the timeout"
+              % results['completed'])
+    print("   %-10s %9s %9s %9s %9s" % ('phase (ms)', 'p50', 'p90', 'p99',
+                                        'max'))
+    for phase in phases:
+        p = results['phases'][phase]
+        if p:
+            print("   %-10s %9.2f %9.2f %9.2f %9.2f"
+                  % (phase, p['p50'] * 1000., p['p90'] * 1000.,
+                     p['p99'] * 1000., p['max'] * 1000.))
+
+
+def main():
+    opts = get_options()
+    previous = {}
+    if opts.compare:
+        for results in json.load(open(opts.compare))['scenarios']:
+            previous[get_key(results)] = results
+    all_results = []
+    for njobs in opts.jobs:
+        for depends in opts.depends:
+            for hook_cost in opts.hook_cost:
+                scenario = {'jobs': njobs, 'depends': depends,
+                            'hook_cost': hook_cost,
+                            'run_time': opts.run_time, 'rate': opts.rate,
+                            'max_running': opts.max_running,
+                            'check_interval': opts.check_interval}
+                queue = multiprocessing.Queue()
+                p = multiprocessing.Process(target=run_scenario,
+                                            args=(scenario, opts, queue))
+                p.start()
+                results = queue.get()
+                p.join()
+                if 'error' in results:
+                    print("Scenario %s failed:\n%s"
+                          % (str(scenario), results['error']),
+                          file=sys.stderr)
+                    continue
+                report(results, previous)
+                all_results.append(results)
+    with open(opts.output, 'w') as fh:
+        json.dump({'time': time.time(), 'host': platform.node(),
+                   'python': platform.python_version(),
+                   'scenarios': all_results}, fh, indent=2)
+    print("Results saved in " + opts.output)
+
+if __name__ == '__main__':
+    main()
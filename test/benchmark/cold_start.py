@@ -0,0 +1,166 @@
+#!/usr/bin/python
+
+"""Measure how long it takes the backend admin tools to start up.
+
+A minimal web service is set up in a temporary directory, and
+`service.py status` (which only needs to read the configuration and the
+state file) is run repeatedly in fresh Python processes. Times are
+reported both with and without the cached copy of the configuration
+file, together with the time taken to start a bare Python interpreter
+for comparison. No MySQL server is needed, since the tool never queries
+the database."""
+
+from __future__ import print_function
+from optparse import OptionParser
+import subprocess
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+pydir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..',
+                                     'python'))
+
+config = """
+[general]
+admin_email: test@example.com
+service_name: ModBench
+socket: %(dir)s/modbench.socket
+
+[backend]
+user: modbench
+state_file: %(dir)s/state_file
+check_minutes: 10
+
+[database]
+db: modbench
+frontend_config: frontend.conf
+backend_config: backend.conf
+
+[directories]
+install: %(dir)s
+incoming: %(dir)s/incoming
+preprocessing: %(dir)s/preprocessing
+
+[oldjobs]
+archive: 30d
+expire: 90d
+"""
+
+db_config = """
+[%send_db]
+user: modbench_%send
+passwd: test
+"""
+
+service_module = """
+import saliweb.backend
+
+def get_web_service(config_file):
+    db = saliweb.backend.Database(saliweb.backend.Job)
+    config = saliweb.backend.Config(config_file)
+    return saliweb.backend.WebService(config, db)
+"""
+
+web_service = """
+config = '%s'
+import saliweb.backend
+saliweb.backend.Config._cache_dir = '%s'
+import modbench
+def get_web_service(config):
+    return modbench.get_web_service(config)
+"""
+
+tool = """
+import webservice
+import saliweb.backend.service
+saliweb.backend.service.main(webservice)
+"""
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [-n REPEATS]
+
+Measure the startup time of the backend admin tools.
+""")
+    parser.add_option('-n', '--repeats', type='int', dest='repeats',
+                      default=20, help="Number of times to run each command "
+                                       "(default 20)")
+    opts, args = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Wrong number of arguments given")
+    return opts
+
+
+def setup_service(tmpdir):
+    for d in ('conf', 'bin', 'var', 'incoming', 'preprocessing'):
+        os.mkdir(os.path.join(tmpdir, d))
+    conf = os.path.join(tmpdir, 'conf', 'live.conf')
+    with open(conf, 'w') as fh:
+        fh.write(config % {'dir': tmpdir})
+    for end in ('front', 'back'):
+        with open(os.path.join(tmpdir, 'conf', end + 'end.conf'), 'w') as fh:
+            fh.write(db_config % (end, end))
+    bindir = os.path.join(tmpdir, 'bin')
+    with open(os.path.join(bindir, 'modbench.py'), 'w') as fh:
+        fh.write(service_module)
+    with open(os.path.join(bindir, 'webservice.py'), 'w') as fh:
+        fh.write(web_service % (conf, os.path.join(tmpdir, 'var')))
+    script = os.path.join(bindir, 'service.py')
+    with open(script, 'w') as fh:
+        fh.write(tool)
+    return conf, script
+
+
+def time_command(cmd, repeats, env, before=None):
+    """Run a command repeatedly; return a sorted list of wall clock times"""
+    times = []
+    null = open(os.devnull, 'w')
+    for i in range(repeats):
+        if before:
+            before()
+        start = time.time()
+        subprocess.call(cmd, env=env, stdout=null, stderr=null)
+        times.append(time.time() - start)
+    null.close()
+    return sorted(times)
+
+
+def report(name, times):
+    print("%-32s min %7.1f ms   median %7.1f ms"
+          % (name, times[0] * 1000., times[len(times) // 2] * 1000.))
+
+
+def main():
+    opts = get_options()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        conf, script = setup_service(tmpdir)
+        cache = os.path.join(tmpdir, 'var', 'live.conf.cache')
+        def remove_cache():
+            if os.path.exists(cache):
+                os.unlink(cache)
+        env = os.environ.copy()
+        env['PYTHONPATH'] = pydir
+        python = sys.executable
+        # Make sure byte-compiled modules are up to date before timing
+        subprocess.call([python, script, 'status'], env=env,
+                        stdout=open(os.devnull, 'w'))
+        report("python (no imports)",
+               time_command([python, '-c', 'pass'], opts.repeats, env))
+        report("import saliweb.backend",
+               time_command([python, '-c', 'import saliweb.backend'],
+                            opts.repeats, env))
+        report("service.py status (no cache)",
+               time_command([python, script, 'status'], opts.repeats, env,
+                            before=remove_cache))
+        report("service.py status (cached)",
+               time_command([python, script, 'status'], opts.repeats, env))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+#!/usr/bin/python
+
+"""Replay a trace of a web service's jobs with different configurations,
+to help choose the settings in the [limits], [backend] and [oldjobs]
+sections of its configuration file.
+
+The trace is written by the export_trace.py admin tool, and gives the
+submit time of each job and the time it spent being preprocessed, running
+on the cluster, and being postprocessed. Each job is submitted to a
+backend (using the test suite's in-memory database) at the same point in
+the trace as it was originally, and passes through the backend's own
+_process_incoming_jobs and _process_completed_jobs logic. Time is
+simulated, so a trace of months of jobs can be replayed in minutes:
+each job's Job.preprocess and Job.postprocess methods simply move the
+clock on by the time they took originally (since the backend runs these
+methods one at a time, other jobs must wait for them) and each job's
+runner finishes once the job has run for as long as it did originally.
+As with a real backend, a new job is started only when a job is
+submitted or at the next periodic check (every check_minutes), and a
+finished job is noticed as soon as it tells the backend (or, with
+--no-notify, at the next periodic check).
+
+Every combination of the given candidate values is replayed, and for each
+the time jobs waited before they were started (percentiles), how much of
+the `running` limit was used by jobs running on the cluster, the largest
+number of jobs running at once, and the largest number of finished jobs
+kept (not yet expired) and not yet archived are reported. To see how the
+service would cope with a surge in submissions (e.g. before a conference
+deadline) use --load to submit the jobs faster than in the trace."""
+
+from __future__ import print_function
+from optparse import OptionParser
+from StringIO import StringIO
+import datetime
+import tempfile
+import shutil
+import heapq
+import sys
+import os
+
+topdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(topdir, 'python'))
+sys.path.insert(0, os.path.join(topdir, 'test', 'backend'))
+import saliweb.backend
+from saliweb.backend.export_trace import open_trace, read_trace
+from memory_database import MemoryDatabase
+from config import Config
+
+config = """
+[general]
+admin_email: test@example.com
+service_name: Replay
+socket: %(dir)s/replay.socket
+
+[backend]
+user: replay
+state_file: %(dir)s/state_file
+check_minutes: %(check_minutes)d
+
+[database]
+db: replay
+frontend_config: frontend.conf
+backend_config: backend.conf
+
+[directories]
+install: %(dir)s
+incoming: %(dir)s/incoming
+preprocessing: %(dir)s/preprocessing
+
+[oldjobs]
+archive: %(archive)s
+expire: %(expire)s
+
+[limits]
+running: %(running)d
+"""
+
+# Time the trace starts, in the simulated database
+_epoch = datetime.datetime(2000, 1, 1)
+
+
+class Simulation(object):
+    """A simulated clock, the events waiting for it, and what happened to
+       each job in the replay"""
+
+    def __init__(self, jobs, load):
+        self.now = 0.
+        self.jobs = {}
+        self._events = []
+        self._seq = 0
+        self.submitted = {}
+        self.started = {}
+        self.finished = {}
+        self.failed = 0
+        self.running = 0
+        self.peak_running = 0
+        self.running_time = 0.
+        for job in jobs:
+            self.jobs[job.name] = job
+            self.submitted[job.name] = job.submit / load
+
+    def schedule(self, t, func, *args):
+        """Call `func` with the given arguments at simulated time `t`"""
+        self._seq += 1
+        heapq.heappush(self._events, (t, self._seq, func, args))
+
+    def run(self):
+        """Handle events in order until there are none left. Event handlers
+           can move the clock on, in which case later events are late."""
+        while self._events:
+            t, seq, func, args = heapq.heappop(self._events)
+            self.now = max(self.now, t)
+            func(*args)
+
+    def unfinished(self):
+        return len(self.finished) < len(self.jobs)
+
+    def job_preprocessing(self, name):
+        self.started[name] = self.now
+        self.now += self.jobs[name].preprocess or 0.
+
+    def job_running(self, name):
+        self.running += 1
+        self.peak_running = max(self.peak_running, self.running)
+
+    def job_postprocessing(self, name):
+        self.running -= 1
+        self.now += self.jobs[name].postprocess or 0.
+
+    def job_finished(self, name, failed=False):
+        self.finished[name] = self.now
+        if failed:
+            self.failed += 1
+
+simulation = None
+
+
+class ReplayRunner(saliweb.backend.Runner):
+    """Runner that 'runs' a job for as long as it ran in the trace"""
+    _runner_name = 'replay'
+    _finish_times = {}
+
+    def __init__(self, name):
+        saliweb.backend.Runner.__init__(self)
+        self._name = name
+        self._directory = saliweb.backend._get_job_directory()
+
+    def _run(self, webservice):
+        duration = simulation.jobs[self._name].run or 0.
+        simulation.running_time += duration
+        finish = simulation.now + duration
+        self._finish_times[self._name] = finish
+        simulation.schedule(finish, job_done, webservice, self._name,
+                            self._directory)
+        return self._name
+
+    @classmethod
+    def _check_completed(cls, jobid, directory):
+        return simulation.now >= cls._finish_times[jobid]
+saliweb.backend.Job.register_runner_class(ReplayRunner)
+
+
+class ReplayJob(saliweb.backend.Job):
+    def preprocess(self):
+        simulation.job_preprocessing(self.name)
+        if simulation.jobs[self.name].run is None:
+            self.skip_run()
+
+    def run(self):
+        simulation.job_running(self.name)
+        return ReplayRunner(self.name)
+
+    def postprocess(self):
+        simulation.job_postprocessing(self.name)
+
+    def complete(self):
+        simulation.job_finished(self.name)
+
+    def _fail(self, reason, email=True):
+        if self._get_state() == 'RUNNING':
+            simulation.running -= 1
+        saliweb.backend.Job._fail(self, reason, email=False)
+        simulation.job_finished(self.name, failed=True)
+
+
+def submit_job(web, name):
+    """Add a job to the database and tell the backend, as the frontend
+       would"""
+    directory = os.path.join(web.config.directories['INCOMING'], name)
+    os.mkdir(directory)
+    submit_time = _epoch + datetime.timedelta(
+                                       seconds=simulation.submitted[name])
+    web.db.conn.execute("INSERT INTO jobs(name,state,submit_time,directory,"
+                        "url) VALUES(?,?,?,?,?)",
+                        (name, 'INCOMING', submit_time, directory,
+                         'http://localhost/job/' + name))
+    web.db._commit()
+    web._process_incoming_jobs()
+
+
+def job_done(web, name, directory):
+    """Finish a job's run on the cluster"""
+    with open(os.path.join(directory, 'job-state'), 'w') as fh:
+        fh.write('DONE\n')
+    if web.notify:
+        web._job_done(ReplayRunner._runner_name + ':' + name)
+
+
+def periodic_check(web, interval):
+    web._process_completed_jobs()
+    web._process_incoming_jobs()
+    if simulation.unfinished():
+        simulation.schedule(simulation.now + interval, periodic_check,
+                            web, interval)
+
+
+class ReplayWebService(saliweb.backend.WebService):
+    notify = True
+
+    def _schedule_event(self, event, delay):
+        simulation.schedule(simulation.now + delay, event.process)
+
+
+def get_list(parser, value, func):
+    try:
+        return [func(x) for x in value.split(',')]
+    except ValueError:
+        parser.error("Invalid list: " + value)
+
+
+def get_oldjobs(parser, opts):
+    """Get every valid combination of the archive and expire settings, and
+       the corresponding time deltas, parsed as the backend would"""
+    oldjobs = []
+    for archive in opts.archive:
+        for expire in opts.expire:
+            try:
+                conf = Config(StringIO(config % {'dir': '/', 'running': 1,
+                                                 'check_minutes': 1,
+                                                 'archive': archive,
+                                                 'expire': expire}))
+            except saliweb.backend.ConfigError:
+                # archive is later than expire
+                continue
+            except ValueError as detail:
+                parser.error(str(detail))
+            oldjobs.append((archive, expire, conf.oldjobs['archive'],
+                            conf.oldjobs['expire']))
+    if not oldjobs:
+        parser.error("archive times must not be greater than expire times")
+    return oldjobs
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [options] TRACE
+
+Replay a trace written by the export_trace.py admin tool, with each
+combination of the given settings (LIST options take one or more
+comma-separated values), and report how long jobs waited to start.
+""")
+    parser.add_option('-r', '--running', dest='running', default='5',
+                      metavar='LIST',
+                      help="Values of 'running' in the [limits] section "
+                           "to try (default 5)")
+    parser.add_option('-c', '--check-minutes', dest='check_minutes',
+                      default='10', metavar='LIST',
+                      help="Values of 'check_minutes' in the [backend] "
+                           "section to try (default 10)")
+    parser.add_option('-a', '--archive', dest='archive', default='7d',
+                      metavar='LIST',
+                      help="Values of 'archive' in the [oldjobs] section "
+                           "to try (default 7d)")
+    parser.add_option('-e', '--expire', dest='expire', default='30d',
+                      metavar='LIST',
+                      help="Values of 'expire' in the [oldjobs] section "
+                           "to try (default 30d)")
+    parser.add_option('--load', type='float', dest='load', default=1.,
+                      metavar='FACTOR',
+                      help="Submit jobs FACTOR times as fast as in the "
+                           "trace (default 1)")
+    parser.add_option('--no-notify', action='store_false', dest='notify',
+                      default=True,
+                      help="Jobs do not tell the backend when they finish, "
+                           "so it only notices at the next periodic check")
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Specify a single trace file")
+    if opts.load <= 0.:
+        parser.error("--load must be positive")
+    opts.running = get_list(parser, opts.running, int)
+    opts.check_minutes = get_list(parser, opts.check_minutes, int)
+    opts.archive = get_list(parser, opts.archive, str)
+    opts.expire = get_list(parser, opts.expire, str)
+    opts.oldjobs = get_oldjobs(parser, opts)
+    return args[0], opts
+
+
+def get_percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    def percentile(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100.))]
+    return {'p50': percentile(50), 'p90': percentile(90),
+            'p99': percentile(99), 'max': values[-1]}
+
+
+def get_peak(intervals):
+    """Get the largest number of the given (start, end) time intervals
+       that overlap (an end of None means the interval never ends)"""
+    changes = []
+    for start, end in intervals:
+        changes.append((start, 1))
+        if end is not None:
+            changes.append((end, -1))
+    # An interval that ends when another starts does not overlap it
+    changes.sort()
+    num = peak = 0
+    for t, change in changes:
+        num += change
+        peak = max(peak, num)
+    return peak
+
+
+def format_time(seconds):
+    """Format a time interval in seconds as a short string"""
+    for unit, size in (('d', 86400.), ('h', 3600.), ('m', 60.)):
+        if seconds >= size:
+            return "%.1f%s" % (seconds / size, unit)
+    return "%.0fs" % seconds
+
+
+def replay(opts, jobs, running, check_minutes):
+    """Replay the trace with the given settings, and return the simulation"""
+    global simulation
+    simulation = Simulation(jobs, opts.load)
+    ReplayRunner._finish_times = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for d in ('incoming', 'preprocessing'):
+            os.mkdir(os.path.join(tmpdir, d))
+        conf = Config(StringIO(config % {'dir': tmpdir, 'running': running,
+                                         'check_minutes': check_minutes,
+                                         'archive': 'NEVER',
+                                         'expire': 'NEVER'}))
+        web = ReplayWebService(conf, MemoryDatabase(ReplayJob))
+        web.notify = opts.notify
+        web.create_database_tables()
+        for job in jobs:
+            simulation.schedule(simulation.submitted[job.name], submit_job,
+                                web, job.name)
+        interval = check_minutes * 60.
+        simulation.schedule(interval, periodic_check, web, interval)
+        simulation.run()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return simulation
+
+
+def get_retention(sim, archive, expire):
+    """Get the largest number of finished jobs that are kept, and that are
+       not yet archived, with the given archive and expire time deltas"""
+    def add(t, delta):
+        if delta is not None:
+            return t + delta.days * 86400. + delta.seconds
+    kept = []
+    unarchived = []
+    for t in sim.finished.values():
+        kept.append((t, add(t, expire)))
+        unarchived.append((t, add(t, archive)))
+    return get_peak(kept), get_peak(unarchived)
+
+
+def report(sim, running, check_minutes, oldjobs):
+    archive, expire, archive_delta, expire_delta = oldjobs
+    kept, unarchived = get_retention(sim, archive_delta, expire_delta)
+    p = get_percentiles([sim.started[name] - sim.submitted[name]
+                         for name in sim.started])
+    span = max(sim.finished.values()) - min(sim.submitted.values())
+    if span > 0.:
+        util = "%.1f%%" % (100. * sim.running_time / (running * span))
+    else:
+        util = "-"
+    print("%7d %6d %7s %7s  %7s %7s %7s %7s  %6s %6d  %7d %7d  %d"
+          % (running, check_minutes, archive, expire,
+             format_time(p['p50']), format_time(p['p90']),
+             format_time(p['p99']), format_time(p['max']), util,
+             sim.peak_running, kept, unarchived, sim.failed))
+
+
+def main():
+    filename, opts = get_options()
+    fh = open_trace(filename)
+    jobs = list(read_trace(fh))
+    fh.close()
+    if not jobs:
+        print("No jobs in trace", file=sys.stderr)
+        sys.exit(1)
+    span = (jobs[-1].submit - jobs[0].submit) / opts.load
+    print("Replaying %d jobs submitted over %s%s"
+          % (len(jobs), format_time(span),
+             " (%g times as fast as in the trace)" % opts.load
+             if opts.load != 1. else ""))
+    print()
+    print("%7s %6s %7s %7s  %-31s  %6s %6s  %-15s  %s"
+          % ("running", "check", "archive", "expire",
+             "  ----- wait before start -----", "util", "peak",
+             "--- peak jobs ---", "failed"))
+    print("%7s %6s %7s %7s  %7s %7s %7s %7s  %6s %6s  %7s %7s"
+          % ("", "(min)", "", "", "p50", "p90", "p99", "max", "", "run",
+             "kept", "unarch"))
+    for running in opts.running:
+        for check_minutes in opts.check_minutes:
+            sim = replay(opts, jobs, running, check_minutes)
+            for oldjobs in opts.oldjobs:
+                report(sim, running, check_minutes, oldjobs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/python
+
+"""Measure how the backend copes with a large, busy SGE cluster.
+
+A web service is set up in a temporary directory, using the test suite's
+in-memory database, and its jobs are run with SGERunner on a simulated
+SGE cell (see test/backend/fakesge.py) rather than a real cluster. The
+cell's size, how long tasks wait in the queue and run for, node failures,
+and how slowly its qmaster responds can all be set, and simulated time
+passes faster than real time, so that (for example) a job of 10000 array
+tasks that each run for up to an hour can be pushed through the backend in
+well under a minute on a laptop.
+
+Reported are the time taken, the number of tasks that were running at
+once on the cluster, how long after a job's last task finished the
+backend marked the job as completed, the number of requests made to the
+qmaster, and the time the backend spent submitting jobs and checking on
+their status. To keep each task cheap, jobs do not notify the backend over
+its socket when they finish, so the backend relies on DRMAA and the
+job-state file alone. Each task's script is still run when it finishes,
+though, so if thousands of tasks finish within a second or so of each
+other (in real time) the lag may simply reflect the time taken to start
+all of those processes."""
+
+from __future__ import print_function
+from optparse import OptionParser
+from StringIO import StringIO
+import multiprocessing
+import threading
+import datetime
+import tempfile
+import socket
+import shutil
+import time
+import sys
+import os
+import re
+
+topdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(topdir, 'python'))
+sys.path.insert(0, os.path.join(topdir, 'test', 'backend'))
+import saliweb.backend
+from memory_database import MemoryDatabase
+from config import Config
+import fakesge
+
+config = """
+[general]
+admin_email: test@example.com
+service_name: SGEBench
+socket: %(dir)s/sgebench.socket
+
+[backend]
+user: sgebench
+state_file: %(dir)s/state_file
+check_minutes: 10
+batch_size: %(batch_size)d
+
+[database]
+db: sgebench
+frontend_config: frontend.conf
+backend_config: backend.conf
+
+[directories]
+install: %(dir)s
+incoming: %(dir)s/incoming
+preprocessing: %(dir)s/preprocessing
+
+[oldjobs]
+archive: 30d
+expire: 90d
+
+[limits]
+running: 100000
+"""
+
+
+class BenchmarkDone(Exception):
+    pass
+
+
+class StopEvent(object):
+    """Event that stops the backend's event loop"""
+    def process(self):
+        raise BenchmarkDone()
+
+
+class Timings(object):
+    """Record when each job finished"""
+    def __init__(self, njobs):
+        self.njobs = njobs
+        self.finished = {}
+        self.failed = 0
+        self.webservice = None
+
+    def job_finished(self, job, failed=False):
+        runid = job._metadata['runner_id'].split(':', 1)[1]
+        self.finished[job.name] = (time.time(), runid)
+        if failed:
+            self.failed += 1
+        if len(self.finished) == self.njobs:
+            self.webservice._event_queue.put(StopEvent())
+
+timings = None
+
+
+class BenchRunner(saliweb.backend.SGERunner):
+    _runner_name = 'simsge'
+    _drmaa = None
+    _waited_jobs = saliweb.backend._LockedJobDict()
+
+    def _write_sge_script(self, fh, notify_socket=None):
+        saliweb.backend.SGERunner._write_sge_script(self, fh)
+saliweb.backend.Job.register_runner_class(BenchRunner)
+
+
+class BenchJob(saliweb.backend.Job):
+    tasks = 1
+
+    def run(self):
+        r = BenchRunner(':')
+        if self.tasks > 1:
+            r.set_sge_options('-t 1-%d' % self.tasks)
+        return r
+
+    def complete(self):
+        timings.job_finished(self)
+
+    def _fail(self, reason, email=True):
+        saliweb.backend.Job._fail(self, reason, email=False)
+        timings.job_finished(self, failed=True)
+
+
+def get_range(parser, value):
+    try:
+        values = [float(x) for x in value.split(',')]
+    except ValueError:
+        values = []
+    if len(values) == 1:
+        values *= 2
+    if len(values) != 2 or values[0] > values[1]:
+        parser.error("Invalid range: " + value)
+    return values
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [options]
+
+Measure how the backend copes with a large simulated SGE cluster.
+Times on the cluster (RANGE options take MIN,MAX or a single value) are
+in simulated seconds.
+""")
+    parser.add_option('-n', '--jobs', type='int', dest='jobs', default=1,
+                      help="Number of jobs to run (default 1)")
+    parser.add_option('-t', '--tasks', type='int', dest='tasks',
+                      default=10000,
+                      help="Number of array tasks in each job (default "
+                           "10000)")
+    parser.add_option('--batch-size', type='int', dest='batch_size',
+                      default=0,
+                      help="Run up to this many single-task jobs as one "
+                           "array job (default 0, no batching)")
+    parser.add_option('--nodes', type='int', dest='nodes', default=1250,
+                      help="Number of nodes in the cluster (default 1250)")
+    parser.add_option('--slots-per-node', type='int', dest='slots_per_node',
+                      default=8,
+                      help="Number of tasks each node can run at once "
+                           "(default 8)")
+    parser.add_option('--queue-delay', dest='queue_delay', default='0,60',
+                      metavar='RANGE',
+                      help="Time each task waits in the queue before it "
+                           "can be scheduled (default 0,60)")
+    parser.add_option('--duration', dest='duration', default='600,3600',
+                      metavar='RANGE',
+                      help="Time each task runs for (default 600,3600)")
+    parser.add_option('--node-mtbf', type='float', dest='node_mtbf',
+                      default=None, metavar='SECONDS',
+                      help="Mean time between failures of each node "
+                           "(default: nodes do not fail)")
+    parser.add_option('--node-repair', type='float', dest='node_repair',
+                      default=600., metavar='SECONDS',
+                      help="Time a failed node takes to come back "
+                           "(default 600)")
+    parser.add_option('--time-scale', type='float', dest='time_scale',
+                      default=100.,
+                      help="Simulated seconds that pass per real second "
+                           "(default 100)")
+    parser.add_option('--qmaster-delay', type='float', dest='qmaster_delay',
+                      default=0., metavar='SECONDS',
+                      help="Real time the qmaster takes to handle each "
+                           "request (default 0)")
+    parser.add_option('--qmaster-load', type='float', dest='qmaster_load',
+                      default=0., metavar='SECONDS',
+                      help="Extra real time the qmaster takes per request "
+                           "for every 1000 unfinished tasks (default 0)")
+    parser.add_option('--qmaster-timeout', type='float',
+                      dest='qmaster_timeout', default=None,
+                      metavar='SECONDS',
+                      help="Requests to the qmaster that would take longer "
+                           "than this fail (default: no timeout)")
+    parser.add_option('--check-interval', type='float',
+                      dest='check_interval', default=10.,
+                      metavar='SECONDS',
+                      help="Time between the backend's periodic checks for "
+                           "jobs (default 10)")
+    parser.add_option('--seed', type='int', dest='seed', default=0,
+                      help="Seed for the cluster's random choices "
+                           "(default 0)")
+    parser.add_option('--timeout', type='float', dest='timeout', default=600.,
+                      metavar='SECONDS',
+                      help="Give up after this time (default 600)")
+    opts, args = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Wrong number of arguments given")
+    opts.queue_delay = get_range(parser, opts.queue_delay)
+    opts.duration = get_range(parser, opts.duration)
+    return opts
+
+
+def add_jobs(web, names):
+    c = web.db.conn.cursor()
+    now = datetime.datetime.utcnow()
+    for name in names:
+        directory = os.path.join(web.config.directories['INCOMING'], name)
+        os.mkdir(directory)
+        c.execute("INSERT INTO jobs(name,state,submit_time,directory,url) "
+                  "VALUES(?,?,?,?,?)", (name, 'INCOMING', now, directory,
+                                        'http://localhost/job/' + name))
+    web.db._commit()
+
+
+def notify(web, name):
+    """Tell the backend about a new job, as the frontend would"""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(web.config.socket)
+    s.sendall('INCOMING %s' % name)
+    s.close()
+
+
+def get_tasks(cluster, runid):
+    """Get the simulated tasks that make up the given SGE run ID"""
+    m = re.match('(\d+)\.(\d+)\-(\d+):(\d+)$', runid)
+    if m:
+        return [cluster.tasks['%s.%d' % (m.group(1), t)]
+                for t in range(int(m.group(2)), int(m.group(3)) + 1,
+                               int(m.group(4)))]
+    else:
+        return [cluster.tasks[runid]]
+
+
+def get_peak_running(cluster):
+    """Get the largest number of tasks that were running at once"""
+    changes = []
+    for task in cluster.tasks.values():
+        if task.start is not None:
+            changes.append((task.start, 1))
+            changes.append((task.end, -1))
+    changes.sort()
+    running = peak = 0
+    for t, change in changes:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def get_percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    def percentile(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100.))]
+    return {'p50': percentile(50), 'p90': percentile(90),
+            'p99': percentile(99), 'max': values[-1]}
+
+
+def report(opts, web, tmpdir, elapsed):
+    cluster = BenchRunner._drmaa.session._cluster
+    cluster.advance()
+    print("Cluster: %d nodes x %d slots; %d jobs of %d tasks"
+          % (opts.nodes, opts.slots_per_node, opts.jobs, opts.tasks))
+    print("%d jobs finished (%d failed) in %.2f s; %.0f simulated s"
+          % (len(timings.finished), timings.failed, elapsed,
+             elapsed * opts.time_scale))
+    print("Peak running tasks: %d" % get_peak_running(cluster))
+    lags = []
+    for finished, runid in timings.finished.values():
+        last = max(t.end for t in get_tasks(cluster, runid))
+        lags.append(finished - cluster.get_real_time(last))
+    p = get_percentiles(lags)
+    if p:
+        print("Job completion lag (ms):  p50 %.1f  p90 %.1f  p99 %.1f  "
+              "max %.1f" % (p['p50'] * 1000., p['p90'] * 1000.,
+                            p['p99'] * 1000., p['max'] * 1000.))
+    calls = {}
+    for call in fakesge.get_calls(tmpdir):
+        calls[call] = calls.get(call, 0) + 1
+    print("qmaster requests: " + ", ".join("%s %d" % c
+                                            for c in sorted(calls.items())))
+    latency = web._stats.snapshot(0)['latency']
+    for kind in ('submit', 'poll'):
+        lat = latency[kind]
+        if lat['mean'] is None:
+            print("Runner %-6s  -" % kind)
+        else:
+            print("Runner %-6s  mean %.1f ms  max %.1f ms  (%d calls)"
+                  % (kind, lat['mean'] * 1000., lat['max'] * 1000.,
+                     lat['count']))
+
+
+def run(opts):
+    global timings
+    timings = Timings(opts.jobs)
+    BenchJob.tasks = opts.tasks
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for d in ('incoming', 'preprocessing'):
+            os.mkdir(os.path.join(tmpdir, d))
+        BenchRunner._env, BenchRunner._qstat = fakesge.make_fake_sge(tmpdir,
+                      nodes=opts.nodes, slots_per_node=opts.slots_per_node,
+                      queue_delay=opts.queue_delay, duration=opts.duration,
+                      node_mtbf=opts.node_mtbf, node_repair=opts.node_repair,
+                      qmaster_delay=opts.qmaster_delay,
+                      qmaster_load=opts.qmaster_load,
+                      qmaster_timeout=opts.qmaster_timeout,
+                      time_scale=opts.time_scale, seed=opts.seed)
+        conf = Config(StringIO(config % {'dir': tmpdir,
+                                         'batch_size': opts.batch_size}))
+        conf.backend['check_minutes'] = opts.check_interval / 60.
+        db = MemoryDatabase(BenchJob)
+        web = saliweb.backend.WebService(conf, db)
+        web.create_database_tables()
+        timings.webservice = web
+        names = ['job%06d' % i for i in range(opts.jobs)]
+        add_jobs(web, names)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(conf.socket)
+        sock.listen(5)
+        def start_load():
+            # Wait for the event loop to start
+            while web._event_queue is None:
+                time.sleep(0.001)
+            t = threading.Timer(opts.timeout, web._event_queue.put,
+                                [StopEvent()])
+            t.setDaemon(True)
+            t.start()
+            notify(web, names[0])
+        t = threading.Thread(target=start_load)
+        t.setDaemon(True)
+        t.start()
+        start = time.time()
+        try:
+            web._do_periodic_actions(sock)
+        except BenchmarkDone:
+            pass
+        report(opts, web, tmpdir, time.time() - start)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    opts = get_options()
+    # Run in a separate process, since the backend's threads cannot be
+    # cleanly stopped
+    p = multiprocessing.Process(target=run, args=(opts,))
+    p.start()
+    p.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+"""Measure how quickly saliweb.web_service can submit jobs.
+
+A stand-in for a web service's REST interface is run on a local port, and
+jobs (each uploading a small input file) are submitted to it repeatedly
+with `submit_job`, which keeps its connection to the server open between
+requests. For comparison, the same requests are also made by running
+`curl` once per job, as older versions of `web_service.py` did.
+The stand-in server does no work, so the times are those of the client
+alone (plus the loopback network)."""
+
+from __future__ import print_function
+from optparse import OptionParser
+import BaseHTTPServer
+import SocketServer
+import subprocess
+import threading
+import tempfile
+import shutil
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'python'))
+from saliweb import web_service
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go, so that timings are not distorted by
+    # Nagle's algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        # Discard the uploaded form
+        length = int(self.headers.get('Content-Length', 0))
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 65536)))
+        body = '<saliweb xmlns:xlink="http://www.w3.org/1999/xlink">' \
+               '<job xlink:href="http://localhost/job/testjob" /></saliweb>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [-n JOBS] [-s SIZE]
+
+Measure the time taken to submit jobs with saliweb.web_service.
+""")
+    parser.add_option('-n', '--jobs', type='int', dest='jobs', default=200,
+                      help="Number of jobs to submit (default 200)")
+    parser.add_option('-s', '--size', type='int', dest='size', default=10000,
+                      help="Size in bytes of the file uploaded with each "
+                           "job (default 10000)")
+    opts, args = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Wrong number of arguments given")
+    return opts
+
+
+def submit_native(url, args, directory):
+    # Discard the 'Job submitted' message
+    oldout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        web_service.submit_job(url, args, directory=directory)
+    finally:
+        sys.stdout.close()
+        sys.stdout = oldout
+
+
+def submit_curl(url, args, directory):
+    cmd = ['curl', '-s']
+    for a in args:
+        cmd.extend(['-F', a])
+    p = subprocess.Popen(cmd + [url], stdout=subprocess.PIPE, cwd=directory)
+    p.communicate()
+
+
+def time_submit(func, url, args, directory, jobs):
+    """Submit jobs; return a sorted list of wall clock times"""
+    times = []
+    for i in range(jobs):
+        start = time.time()
+        func(url, args, directory)
+        times.append(time.time() - start)
+    return sorted(times)
+
+
+def report(name, times):
+    total = sum(times)
+    print("%-24s %7.2f ms/job (median %6.2f ms)   %7.1f jobs/s"
+          % (name, total / len(times) * 1000.,
+             times[len(times) // 2] * 1000., len(times) / total))
+
+
+def main():
+    opts = get_options()
+    tmpdir = tempfile.mkdtemp()
+    server = Server(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    try:
+        open(os.path.join(tmpdir, 'input.pdb'), 'w').write('x' * opts.size)
+        url = 'http://%s:%d/job' % server.server_address
+        args = ['input_pdb=@input.pdb', 'job_name=testjob']
+        report("web_service (native)",
+               time_submit(submit_native, url, args, tmpdir, opts.jobs))
+        try:
+            report("curl subprocess",
+                   time_submit(submit_curl, url, args, tmpdir, opts.jobs))
+        except OSError:
+            print("curl subprocess: curl not found")
+    finally:
+        web_service._pool.clear()
+        server.shutdown()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
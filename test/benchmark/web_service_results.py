@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+"""Measure how quickly, and in how much memory, saliweb.web_service can
+read the list of results of a job with many output files.
+
+A stand-in for a web service's REST interface is run on a local port,
+serving a synthetic results document with the requested number of
+`results_file` elements. This is read both with `iter_results`, which
+parses the document as it arrives, and (for comparison) by reading the
+whole document and parsing it with minidom, as older versions of
+`web_service.py` did. Each method is run in its own process, so that the
+peak memory use reported for one does not include that of the other."""
+
+from __future__ import print_function
+from optparse import OptionParser
+from xml.dom.minidom import parseString
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+import threading
+import resource
+import urllib2
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'python'))
+from saliweb import web_service
+
+_head = '<saliweb xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+_line = '<results_file xlink:href="http://localhost/job/testjob/' \
+        'output%08d.pdb?passwd=abcdefghij" />\n'
+_tail = '</saliweb>\n'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        # Generate the document as it is sent, so that the server does not
+        # need to hold it all in memory
+        files = self.server.files
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(_head) + len(_tail)
+                                               + len(_line % 0) * files))
+        self.end_headers()
+        self.wfile.write(_head)
+        for start in range(0, files, 1000):
+            self.wfile.write(''.join(_line % i for i in
+                                     range(start, min(start + 1000, files))))
+        self.wfile.write(_tail)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def get_options():
+    parser = OptionParser()
+    parser.set_usage("""
+%prog [-h] [-n FILES]
+
+Measure the time and memory taken to get the results of a job with many
+output files with saliweb.web_service.
+""")
+    parser.add_option('-n', '--files', type='int', dest='files',
+                      default=200000,
+                      help="Number of output files in the results "
+                           "document (default 200000)")
+    opts, args = parser.parse_args()
+    if len(args) != 0:
+        parser.error("Wrong number of arguments given")
+    return opts
+
+
+def count_streaming(url):
+    num = 0
+    for result in web_service.iter_results(url):
+        num += 1
+    return num
+
+
+def count_minidom(url):
+    dom = parseString(urllib2.urlopen(url).read())
+    num = len(dom.getElementsByTagName('results_file'))
+    dom.unlink()
+    return num
+
+
+def get_max_rss():
+    """Get the peak memory use of this process, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run_method(func, url, queue):
+    start_rss = get_max_rss()
+    start = time.time()
+    num = func(url)
+    queue.put((num, time.time() - start, get_max_rss() - start_rss))
+
+
+def report(name, func, url, files):
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=run_method, args=(func, url, queue))
+    p.start()
+    num, elapsed, rss = queue.get()
+    p.join()
+    if num != files:
+        raise ValueError("%s: expected %d results, got %d"
+                         % (name, files, num))
+    print("%-22s %8.2f s  %9.0f files/s   peak memory +%7.1f MB"
+          % (name, elapsed, files / elapsed, rss))
+
+
+def main():
+    opts = get_options()
+    server = Server(('127.0.0.1', 0), Handler)
+    server.files = opts.files
+    t = threading.Thread(target=server.serve_forever)
+    t.setDaemon(True)
+    t.start()
+    try:
+        url = 'http://%s:%d/job/testjob/' % server.server_address
+        print("Results document: %d files, %.1f MB"
+              % (opts.files, (len(_head) + len(_tail)
+                              + len(_line % 0) * opts.files) / 1048576.))
+        report("iter_results", count_streaming, url, opts.files)
+        report("read + minidom", count_minidom, url, opts.files)
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -453,6 +453,30 @@ GRANT SELECT,INSERT,UPDATE,DELETE ON testdb.dependencies to 'frontuser'@'localho
 """)
         os.unlink(o)
 
+    def test_generate_admin_mysql_script_result_cache(self):
+        """Test _generate_admin_mysql_script with the result cache"""
+        frontend = {'user': 'frontuser', 'passwd': 'frontpwd'}
+        backend = {'user': 'backuser', 'passwd': 'backpwd'}
+        conf = DummyConfig()
+        conf.track_hostname = False
+        conf.backend = {'track_disk_usage': False, 'result_cache': True}
+        conf.retry = {'max_attempts': 0}
+        o = saliweb.build._generate_admin_mysql_script('testdb', backend,
+                                                       frontend, conf)
+        contents = open(o).read()
+        os.unlink(o)
+        self.assert_(re.search('CREATE TABLE testdb.jobs \(.*, '
+                               'input_hash CHAR\(40\)\);\n'
+                               'CREATE INDEX state_index ON testdb.jobs '
+                               '\(state\);\n'
+                               'CREATE INDEX input_hash_index ON testdb.jobs '
+                               '\(input_hash\);\n', contents),
+                     'regex match failed on ' + contents)
+        self.assert_(contents.endswith(
+"""CREATE TABLE testdb.result_cache (input_hash CHAR(40) PRIMARY KEY NOT NULL DEFAULT '', name VARCHAR(40) NOT NULL DEFAULT '', disk_usage BIGINT, created DATETIME NOT NULL, last_used DATETIME NOT NULL, hits INTEGER NOT NULL DEFAULT '0');
+GRANT DELETE,INSERT,SELECT,UPDATE ON testdb.result_cache TO 'backuser'@'localhost';
+"""), contents)
+
     def test_check_mysql_schema(self):
         """Test _check_mysql_schema function"""
         class DummyConf:
@@ -462,6 +486,8 @@ GRANT SELECT,INSERT,UPDATE,DELETE ON testdb.dependencies to 'frontuser'@'localho
         dbfields = []
         conf = DummyConf()
         conf.track_hostname = False
+        conf.backend = {'track_disk_usage': False}
+        conf.retry = {'max_attempts': 0}
         ret, stderr = run_catch_stderr(
                          saliweb.build._check_mysql_schema, env, conf, dbfields,
                          'jobs')
@@ -526,6 +552,35 @@ GRANT SELECT,INSERT,UPDATE,DELETE ON testdb.dependencies to 'frontuser'@'localho
         self.assertEqual(ret, None)
         self.assertEqual(env.exitval, None)
 
+    def test_check_mysql_schema_result_cache(self):
+        """Test _check_mysql_schema function on the result cache table"""
+        conf = DummyConfig()
+        conf.track_hostname = False
+        conf.backend = {'track_disk_usage': False, 'result_cache': True}
+        conf.retry = {'max_attempts': 0}
+        dbfields = [('input_hash', 'char(40)', 'NO', 'PRI', '', ''),
+                    ('name', 'varchar(40)', 'NO', '', '', ''),
+                    ('disk_usage', 'bigint(20)', 'YES', '', None, ''),
+                    ('created', 'datetime', 'NO', '', None, ''),
+                    ('last_used', 'datetime', 'NO', '', None, ''),
+                    ('hits', 'int(11)', 'NO', '', '0', '')]
+        env = DummyEnv('testuser')
+        ret, stderr = run_catch_stderr(
+                         saliweb.build._check_mysql_schema, env, conf,
+                         dbfields[:-1], 'result_cache')
+        self.assertEqual(env.exitval, 1)
+        self.assert_(re.search("'result_cache' database table schema does "
+                               'not match.*it has 5 fields, while the backend '
+                               'has 6 fields', stderr, re.DOTALL),
+                     'regex match failed on ' + stderr)
+
+        env = DummyEnv('testuser')
+        ret, stderr = run_catch_stderr(
+                         saliweb.build._check_mysql_schema, env, conf,
+                         dbfields, 'result_cache')
+        self.assertEqual(stderr, '')
+        self.assertEqual(env.exitval, None)
+
     def test_get_sorted_grant(self):
         """Test _get_sorted_grant function"""
         self.assertEqual(saliweb.build._get_sorted_grant('test grant'),
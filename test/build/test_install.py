@@ -74,10 +74,11 @@ class InstallTest(unittest.TestCase):
         e['config'] = DummyConfig()
         e['service_name'] = 'testser'
         saliweb.build._install_directories(e)
-        self.assertEqual(len(e.command_target), 3)
+        self.assertEqual(len(e.command_target), 4)
         self.assertEqual(e.command_target[0][0], 'foo')
         self.assertEqual(e.command_target[1][0], 'testinc')
-        self.assertEqual(e.command_target[2][0], 'testinst/README')
+        self.assertEqual(e.command_target[2][0], 'testinst/var')
+        self.assertEqual(e.command_target[3][0], 'testinst/README')
 
     def test_install_config(self):
         """Check _install_config function"""
@@ -107,10 +108,11 @@ class InstallTest(unittest.TestCase):
             e['service_module'] = 'testser'
             e['pythondir'] = 'testpydir'
             e['version'] = 'r345'
+            e['vardir'] = 'testvar'
             return e
         e = make_env()
         saliweb.build._InstallAdminTools(e)
-        self.assertEqual(len(e.command_target), 7)
+        self.assertEqual(len(e.command_target), 10)
 
         e = make_env()
         saliweb.build._InstallAdminTools(e, ['myjob'])
@@ -88,9 +88,11 @@ class MakeTest(unittest.TestCase):
                                             [DummySource('mycfg'),
                                              DummySource('mymodname'),
                                              DummySource('mypydir'),
-                                             DummySource(ver)])
+                                             DummySource(ver),
+                                             DummySource('myvardir')])
             f = open('dummytgt').read()
             self.assert_(re.match("config = 'mycfg'.*pydir = 'mypydir'.*"
+                                  "Config\._cache_dir = 'myvardir'.*"
                                   "import mymodname.*ws = mymodname\.get_web.*"
                                   "ws\.%s" % expver, f, re.DOTALL),
                          'regex match failed on ' + f)
@@ -82,7 +82,8 @@ class SetupTest(unittest.TestCase):
                            ('htmldir', '/foo/bar/html'),
                            ('txtdir', '/foo/bar/txt'),
                            ('cgidir', '/foo/bar/cgi'),
-                           ('perldir', '/foo/bar/lib')):
+                           ('perldir', '/foo/bar/lib'),
+                           ('vardir', '/foo/bar/var')):
             self.assertEqual(env[key], value)
             del env[key]
         del env['config']